@@ -23,18 +23,22 @@ from aiogram.filters import Command
 from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile
+    ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile, FSInputFile
 )
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
 from core.config import Config
 from core.database import Database
+from core.fsm_storage import DatabaseStorage
 from core.models import User, Assignment, Tariff
 from services.user_service import UserService
 from services.assignment_service import AssignmentService
 from services.question_service import QuestionService
 from services.drive_content_sync import DriveContentSync
+from services import content_sync_job, lesson_loader
+from services.export_service import ExportService, EXPORT_DATASETS, EXPORT_FORMATS, RETAINED_DATASETS
+from utils.metrics import instrument_bot
 
 # Configure logging
 logging.basicConfig(
@@ -43,6 +47,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Max users per list view whose missing names are fetched from Telegram (get_chat)
+_NAME_REFRESH_LIMIT = 20
+
+# Questions shown per page in the admin question lists ("⬇️ Ещё" loads the next page)
+_QUESTIONS_PAGE_SIZE = 20
+
+# Telegram Bot API upload limit is 50 MB; bigger exports have to go through scripts/export_data.py
+_EXPORT_MAX_UPLOAD_BYTES = 49 * 1024 * 1024
+
+# Project costs (git stats) are recomputed in a thread this often; stats views read the cache
+_PROJECT_COSTS_REFRESH_SECONDS = 3600
+
 
 class AdminBot:
     """Admin Bot - Flight Control Center implementation."""
@@ -55,12 +71,17 @@ class AdminBot:
             token=Config.ADMIN_BOT_TOKEN,
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
-        self.dp = Dispatcher()
         self.db = Database()
+        # Persistent per-admin wizard state (survives restarts, bounded in memory)
+        self.state_storage = DatabaseStorage(self.db)
+        self.dp = Dispatcher(storage=self.state_storage)
         
         self.user_service = UserService(self.db)
         self.assignment_service = AssignmentService(self.db)
         self.question_service = QuestionService(self.db)
+        self.export_service = ExportService(self.db)
+        # One export at a time: they are long and CPU-heavy (gzip)
+        self._export_lock = asyncio.Lock()
         
         # Drive content sync (optional)
         try:
@@ -73,11 +94,11 @@ class AdminBot:
         self._pending_replies: dict[int, dict] = {}
 
         # Simple admin "state machine" for settings flows (prices/promos)
-        self._admin_state: dict[int, dict] = {}
+        self._admin_state = self.state_storage.user_map("admin:state")
 
         # Compose-reply state (lets admin answer without replying to the original message):
         # {admin_user_id: {"kind": "question"|"assignment", ...}}
-        self._compose_reply: dict[int, dict] = {}
+        self._compose_reply = self.state_storage.user_map("admin:compose_reply")
 
         # Cached bot clients for fast sends (same event loop only)
         self._bot_clients_loop: Optional[asyncio.AbstractEventLoop] = None
@@ -87,7 +108,17 @@ class AdminBot:
         # PIN authentication system
         self.ADMIN_PIN = "444444"  # PIN для доступа к ПУП
         self.authorized_users = set()  # Множество авторизованных chat_id
+
+        # Set by run_all_bots in webhook mode (utils.telegram_webhook.WebhookIntake); None = polling
+        self.webhook_intake = None
+
+        # Cached result of _calculate_project_costs (git subprocesses), with "computed_at"
+        self._project_costs: Optional[dict] = None
+        self._project_costs_task: Optional[asyncio.Task] = None
         
+        # Handler latency + Telegram API call metrics (/metrics)
+        instrument_bot("admin", self.bot, self.dp)
+
         # Register handlers
         self._register_handlers()
 
@@ -181,6 +212,7 @@ class AdminBot:
         self.dp.message.register(self.handle_users, Command("users"))
         self.dp.message.register(self.handle_settings, Command("settings"))
         self.dp.message.register(self.handle_sync_content, Command("sync_content"))
+        self.dp.message.register(self.handle_export, Command("export"))
         
         # PIN input handler (must be registered before other text handlers)
         # Check if message is 6 digits (potential PIN)
@@ -240,7 +272,7 @@ class AdminBot:
         self.dp.callback_query.register(self.handle_admin_promo_delete, F.data.startswith("admin:promo:delete:"))
         self.dp.callback_query.register(self.handle_admin_promo_send, F.data.startswith("admin:promo:send:"))
         # Questions list callbacks
-        self.dp.callback_query.register(self.handle_questions_unanswered, F.data == "admin:questions:unanswered")
+        self.dp.callback_query.register(self.handle_questions_unanswered, F.data.startswith("admin:questions:unanswered"))
         self.dp.callback_query.register(self.handle_questions_answered, F.data == "admin:questions:answered")
         self.dp.callback_query.register(self.handle_questions_answered_by_date, F.data.startswith("admin:questions:answered:date:"))
         self.dp.callback_query.register(self.handle_questions_back, F.data == "admin:questions:back")
@@ -336,7 +368,8 @@ class AdminBot:
             "/stats - Статистика системы\n"
             "/users - Список пользователей\n"
             "/settings - Настройки ботов\n"
-            "/sync_content - Обновить контент из Google Drive\n\n"
+            "/sync_content - Обновить контент из Google Drive\n"
+            "/export users|payments|questions|activity|activity_daily [csv|jsonl] - Выгрузка данных файлом\n\n"
             "💬 <b>Ответы на вопросы/задания:</b>\n"
             "Ответьте на сообщение с вопросом или заданием, чтобы отправить ответ пользователю."
         )
@@ -371,8 +404,28 @@ class AdminBot:
         )
         return keyboard
     
+    async def _project_costs_loop(self):
+        """Recompute project costs in a thread (git subprocesses must not block the event loop)."""
+        while True:
+            try:
+                costs = await asyncio.to_thread(self._calculate_project_costs)
+                costs["computed_at"] = datetime.now().strftime("%d.%m.%Y %H:%M")
+                self._project_costs = costs
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error calculating project costs: {e}", exc_info=True)
+            await asyncio.sleep(_PROJECT_COSTS_REFRESH_SECONDS)
+
+    def _get_cached_project_costs(self) -> Optional[dict]:
+        """Last computed project costs, None until the first background run finishes."""
+        if self._project_costs_task is None or self._project_costs_task.done():
+            # Not started (e.g. bot used without start()) or crashed: (re)start it
+            self._project_costs_task = asyncio.create_task(self._project_costs_loop())
+        return self._project_costs
+
     def _calculate_project_costs(self) -> dict:
-        """Рассчитывает затраты на проект."""
+        """Рассчитывает затраты на проект (блокирующий: git subprocess, вызывать в потоке)."""
         # Начало проекта
         project_start = datetime(2026, 1, 6)
         current_date = datetime.now()
@@ -631,6 +684,15 @@ class AdminBot:
                             paid_total = _money(row.get("paid_total"))
                             lines.append(f"  • {code}: {cnt} | скидки {disc_total} | оплачено {paid_total}")
                         sales_text += "\n\n🎟 <b>Топ промокодов:</b>\n" + "\n".join(lines)
+
+                    by_week = (sales or {}).get("by_week") or []
+                    if by_week:
+                        lines = []
+                        for row in by_week[-4:]:
+                            cnt = int(row.get("paid_events") or 0)
+                            paid_total = _money(row.get("paid_total"))
+                            lines.append(f"  • с {row.get('period')}: {cnt} оплат | {paid_total}")
+                        sales_text += "\n\n📈 <b>По неделям:</b>\n" + "\n".join(lines)
                 else:
                     sales_text = (
                         "\n\n💰 <b>Продажи и промокоды:</b>\n"
@@ -656,24 +718,28 @@ class AdminBot:
             if sales_text:
                 stats_text += sales_text
             
-            # Добавляем статистику затрат на проект
+            # Добавляем статистику затрат на проект (из кэша, считается в фоне)
             try:
-                costs = self._calculate_project_costs()
-                costs_text = (
-                    f"\n\n💰 <b>Затраты на проект:</b>\n"
-                    f"• Токены AI: {costs['tokens_total']:,} токенов\n"
-                    f"  └ Input: {costs['tokens_input']:,} | Output: {costs['tokens_output']:,}\n"
-                    f"  └ (стоимость включена в подписку Cursor и Codex пакеты)\n"
-                    f"• Подписка Cursor: {costs['cursor_cost']:.2f} $\n"
-                    f"  └ Время работы на проект: {costs['cursor_hours']:.1f} ч.\n"
-                    f"• OpenAI/Codex пакеты: {costs['openai_packages']:.2f} $\n"
-                    f"• Railway (хостинг): {costs['railway_cost']:.2f} $ ({costs['days_worked']/30:.2f} мес.)\n"
-                    f"• Итого: {costs['total_usd']:.2f} $ ({costs['total_rub']:.0f} ₽)\n"
-                    f"\n📅 Начало проекта: {costs['project_start']}\n"
-                    f"📅 Последний деплой: {costs['last_deployment']}\n"
-                    f"📝 Дней работы: {costs['days_worked']} | Коммитов: {costs['git_commits']} | Деплоев: {costs['deployments']}"
-                )
-                stats_text += costs_text
+                costs = self._get_cached_project_costs()
+                if costs is None:
+                    stats_text += "\n\n💰 <b>Затраты на проект:</b> ещё считаются, обновите статистику через минуту"
+                else:
+                    costs_text = (
+                        f"\n\n💰 <b>Затраты на проект:</b>\n"
+                        f"• Токены AI: {costs['tokens_total']:,} токенов\n"
+                        f"  └ Input: {costs['tokens_input']:,} | Output: {costs['tokens_output']:,}\n"
+                        f"  └ (стоимость включена в подписку Cursor и Codex пакеты)\n"
+                        f"• Подписка Cursor: {costs['cursor_cost']:.2f} $\n"
+                        f"  └ Время работы на проект: {costs['cursor_hours']:.1f} ч.\n"
+                        f"• OpenAI/Codex пакеты: {costs['openai_packages']:.2f} $\n"
+                        f"• Railway (хостинг): {costs['railway_cost']:.2f} $ ({costs['days_worked']/30:.2f} мес.)\n"
+                        f"• Итого: {costs['total_usd']:.2f} $ ({costs['total_rub']:.0f} ₽)\n"
+                        f"\n📅 Начало проекта: {costs['project_start']}\n"
+                        f"📅 Последний деплой: {costs['last_deployment']}\n"
+                        f"📝 Дней работы: {costs['days_worked']} | Коммитов: {costs['git_commits']} | Деплоев: {costs['deployments']}\n"
+                        f"🕒 Рассчитано: {costs['computed_at']}"
+                    )
+                    stats_text += costs_text
             except Exception as e:
                 logger.error(f"Error calculating project costs: {e}", exc_info=True)
              
@@ -1482,9 +1548,8 @@ class AdminBot:
         )
         
         try:
-            # sync_now is synchronous, run in executor to avoid blocking
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(None, self.drive_sync.sync_now)
+            # Runs sync_now in a thread, publishes lessons.json and reloads the lessons of this process
+            result = await content_sync_job.run_sync(self.drive_sync)
             
             # Check for warnings
             warnings_text = ""
@@ -2295,15 +2360,25 @@ class AdminBot:
             pass
         
         try:
+            # admin:questions:unanswered[:more:<last question_id of the previous page>]
+            parts = callback.data.split(":")
+            before_id = int(parts[4]) if len(parts) > 4 and parts[4].isdigit() else None
             await self.db.connect()
-            unanswered = await self.question_service.get_unanswered_questions(limit=100)
+            unanswered = await self.question_service.get_unanswered_questions(
+                limit=_QUESTIONS_PAGE_SIZE, before_id=before_id
+            )
             
             if not unanswered:
                 await callback.message.answer("⏳ Нет неотвеченных вопросов.")
                 return
             
-            # Отправляем заголовок
-            await callback.message.answer(f"⏳ <b>Неотвеченные вопросы ({len(unanswered)}):</b>", parse_mode="HTML")
+            # Отправляем заголовок (только для первой страницы)
+            if before_id is None:
+                stats = await self.question_service.get_questions_stats()
+                await callback.message.answer(
+                    f"⏳ <b>Неотвеченные вопросы ({stats.get('unanswered', len(unanswered))}):</b>",
+                    parse_mode="HTML",
+                )
             
             # Отправляем каждый неотвеченный вопрос отдельным сообщением с кнопкой
             for q in unanswered:
@@ -2345,11 +2420,17 @@ class AdminBot:
                 await callback.message.answer(question_message, reply_markup=question_keyboard, parse_mode="HTML")
                 await asyncio.sleep(0.1)  # Небольшая пауза между сообщениями
             
-            # Добавляем кнопку "Назад" в конце
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад к списку", callback_data="admin:questions:back")]
-            ])
-            await callback.message.answer("⬅️ <b>Назад к списку</b>", reply_markup=back_keyboard, parse_mode="HTML")
+            # Добавляем кнопки "Ещё" (если страница полная) и "Назад" в конце
+            buttons = []
+            if len(unanswered) == _QUESTIONS_PAGE_SIZE:
+                buttons.append([InlineKeyboardButton(
+                    text="⬇️ Ещё",
+                    callback_data=f"admin:questions:unanswered:more:{unanswered[-1]['question_id']}"
+                )])
+            buttons.append([InlineKeyboardButton(text="⬅️ Назад к списку", callback_data="admin:questions:back")])
+            await callback.message.answer(
+                "⬅️ <b>Назад к списку</b>", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML"
+            )
                 
         except Exception as e:
             logger.error(f"Error showing unanswered questions: {e}", exc_info=True)
@@ -2367,7 +2448,10 @@ class AdminBot:
         
         try:
             await self.db.connect()
-            dates = await self.question_service.get_answered_questions_dates()
+            # One grouped scan of the answered_at index instead of a query per date
+            date_counts = await self.question_service.get_answered_questions_counts_by_date()
+            dates = [date_str for date_str, _ in date_counts]
+            counts = dict(date_counts)
             
             if not dates:
                 await callback.message.answer("✅ Нет отвеченных вопросов.")
@@ -2381,9 +2465,7 @@ class AdminBot:
                 try:
                     from datetime import datetime
                     dt = datetime.strptime(date_str, "%Y-%m-%d")
-                    # Получаем количество вопросов за эту дату
-                    questions_for_date = await self.question_service.get_answered_questions_by_date(date_str)
-                    count = len(questions_for_date)
+                    count = counts[date_str]
                     
                     # Форматируем дату для отображения
                     date_display = dt.strftime("%d.%m.%Y")
@@ -2431,11 +2513,15 @@ class AdminBot:
             pass
         
         try:
-            # Извлекаем дату из callback_data: admin:questions:answered:date:YYYY-MM-DD
-            date_str = callback.data.split(":")[-1]
+            # Извлекаем дату из callback_data: admin:questions:answered:date:YYYY-MM-DD[:<last question_id>]
+            parts = callback.data.split(":")
+            date_str = parts[4]
+            before_id = int(parts[5]) if len(parts) > 5 and parts[5].isdigit() else None
             
             await self.db.connect()
-            questions = await self.question_service.get_answered_questions_by_date(date_str)
+            questions = await self.question_service.get_answered_questions_by_date(
+                date_str, limit=_QUESTIONS_PAGE_SIZE, before_id=before_id
+            )
             
             if not questions:
                 await callback.message.answer(f"✅ Нет отвеченных вопросов за {date_str}.")
@@ -2449,11 +2535,13 @@ class AdminBot:
             except:
                 date_display = date_str
             
-            # Отправляем заголовок
-            await callback.message.answer(
-                f"✅ <b>Отвеченные вопросы за {date_display} ({len(questions)}):</b>",
-                parse_mode="HTML"
-            )
+            # Отправляем заголовок (только для первой страницы)
+            if before_id is None:
+                total = await self.question_service.count_answered_questions_on_date(date_str)
+                await callback.message.answer(
+                    f"✅ <b>Отвеченные вопросы за {date_display} ({total}):</b>",
+                    parse_mode="HTML"
+                )
             
             # Отправляем каждый вопрос отдельным сообщением
             for q in questions:
@@ -2487,11 +2575,17 @@ class AdminBot:
                 await callback.message.answer(question_message, parse_mode="HTML")
                 await asyncio.sleep(0.1)  # Небольшая пауза между сообщениями
             
-            # Добавляем кнопку "Назад"
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад к датам", callback_data="admin:questions:answered")]
-            ])
-            await callback.message.answer("⬅️ <b>Назад к датам</b>", reply_markup=back_keyboard, parse_mode="HTML")
+            # Добавляем кнопки "Ещё" (если страница полная) и "Назад"
+            buttons = []
+            if len(questions) == _QUESTIONS_PAGE_SIZE:
+                buttons.append([InlineKeyboardButton(
+                    text="⬇️ Ещё",
+                    callback_data=f"admin:questions:answered:date:{date_str}:{questions[-1]['question_id']}"
+                )])
+            buttons.append([InlineKeyboardButton(text="⬅️ Назад к датам", callback_data="admin:questions:answered")])
+            await callback.message.answer(
+                "⬅️ <b>Назад к датам</b>", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML"
+            )
                 
         except Exception as e:
             logger.error(f"Error showing answered questions by date: {e}", exc_info=True)
@@ -2547,12 +2641,12 @@ class AdminBot:
             backup_info = f"📦 <b>Доступные бэкапы</b> (последние 5):\n\n"
             
             keyboard_buttons = []
-            for i, (backup_path, backup_time) in enumerate(recent_backups):
+            for i, (backup_id, backup_time) in enumerate(recent_backups):
                 backup_info += f"{i+1}. 📅 {backup_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
                 keyboard_buttons.append([
                     InlineKeyboardButton(
                         text=f"⏪ Откатить к {backup_time.strftime('%d.%m %H:%M')}",
-                        callback_data=f"admin:restore_confirm:{backup_path.name}"
+                        callback_data=f"admin:restore_confirm:{backup_id}"
                     )
                 ])
             
@@ -2586,30 +2680,23 @@ class AdminBot:
         try:
             backup_name = callback.data.split(":")[2]
             
-            # Find backup by name
+            # Find backup by version id
             backups = self.drive_sync.get_all_backups()
-            backup_path = None
-            for path, _ in backups:
-                if path.name == backup_name:
-                    backup_path = path
-                    break
-            
-            if not backup_path or not backup_path.exists():
+            if not any(backup_id == backup_name for backup_id, _ in backups):
                 await callback.message.answer("❌ Бэкап не найден.")
                 return
             
             await callback.message.answer("⏪ Выполняю откат...")
             
             # Restore from backup
-            import asyncio
-            loop = asyncio.get_event_loop()
-            success = await loop.run_in_executor(None, self.drive_sync.restore_from_backup, backup_path)
+            success = await asyncio.to_thread(self.drive_sync.restore_from_backup, backup_name)
             
             if success:
+                await lesson_loader.refresh_all(force=True)
                 await callback.message.answer(
                     f"✅ <b>Откат выполнен успешно</b>\n\n"
                     f"📦 Восстановлен бэкап: {backup_name}\n"
-                    f"💡 Курс-бот автоматически подхватит изменения при следующей загрузке уроков."
+                    f"💡 Уроки перезагружены; другие процессы подхватят их в течение {Config.LESSONS_RELOAD_CHECK_SECONDS:.0f} с."
                 )
             else:
                 await callback.message.answer("❌ Ошибка при откате. Проверьте логи.")
@@ -2688,35 +2775,33 @@ class AdminBot:
             for row in rows:
                 user = self.db._row_to_user(row)
                 if user:
-                    # Try to update user info from Telegram if missing
-                    if not user.first_name and not user.username:
-                        try:
-                            await self._update_user_from_telegram(user)
-                        except Exception as e:
-                            logger.debug(f"Could not update user {user.user_id} from Telegram: {e}")
                     users.append(user)
+
+        # Try to update user info from Telegram if missing: concurrently, with one shared client
+        nameless = [user for user in users if not user.first_name and not user.username]
+        if nameless:
+            semaphore = asyncio.Semaphore(5)
+
+            async def refresh(user: User):
+                async with semaphore:
+                    await self._update_user_from_telegram(user)
+
+            await asyncio.gather(*(refresh(user) for user in nameless[:_NAME_REFRESH_LIMIT]))
         return users
     
     async def _update_user_from_telegram(self, user: User):
         """Try to get user info from Telegram API and update in database."""
         try:
-            # Try to get user info from any available bot token
-            from core.config import Config
-            from aiogram import Bot
-            
-            # Try course bot first
+            # Users talk to the course bot, so it can see their chats
             if Config.COURSE_BOT_TOKEN:
-                bot = Bot(token=Config.COURSE_BOT_TOKEN)
-                try:
-                    chat_member = await bot.get_chat(user.user_id)
-                    if chat_member:
-                        user.first_name = getattr(chat_member, 'first_name', None) or user.first_name
-                        user.last_name = getattr(chat_member, 'last_name', None) or user.last_name
-                        user.username = getattr(chat_member, 'username', None) or user.username
-                        await self.db.update_user(user)
-                        logger.info(f"Updated user {user.user_id} info from Telegram")
-                finally:
-                    await bot.session.close()
+                bot = self._get_course_bot_client()
+                chat_member = await bot.get_chat(user.user_id)
+                if chat_member:
+                    user.first_name = getattr(chat_member, 'first_name', None) or user.first_name
+                    user.last_name = getattr(chat_member, 'last_name', None) or user.last_name
+                    user.username = getattr(chat_member, 'username', None) or user.username
+                    await self.db.update_user(user)
+                    logger.info(f"Updated user {user.user_id} info from Telegram")
         except Exception as e:
             logger.debug(f"Could not fetch user {user.user_id} from Telegram: {e}")
     
@@ -2736,21 +2821,71 @@ class AdminBot:
             logger.error(f"Error getting user stats: {e}", exc_info=True)
             await message.answer("❌ Ошибка при получении статистики пользователя.")
     
+    async def handle_export(self, message: Message):
+        """Handle /export DATASET [csv|jsonl] - send a gzip-compressed data export as a file."""
+        if not await self._check_authorization(message):
+            return
+        parts = (message.text or "").split()
+        dataset = parts[1].lower() if len(parts) > 1 else ""
+        fmt = parts[2].lower() if len(parts) > 2 else "csv"
+        if dataset not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS:
+            await message.answer(
+                "❌ Использование: /export DATASET [csv|jsonl]\n"
+                f"Доступно: {', '.join(EXPORT_DATASETS)}"
+            )
+            return
+        if self._export_lock.locked():
+            await message.answer("⏳ Уже выполняется другая выгрузка, попробуйте позже.")
+            return
+
+        async with self._export_lock:
+            status = await message.answer(f"⏳ Готовлю выгрузку <b>{dataset}</b> ({fmt}.gz)...")
+            path = None
+            try:
+                path, rows = await self.export_service.export_to_tempfile(dataset, fmt)
+                size = path.stat().st_size
+                if size > _EXPORT_MAX_UPLOAD_BYTES:
+                    await status.edit_text(
+                        f"⚠️ Выгрузка {dataset}: {rows} строк, {size / 1024 / 1024:.0f} МБ — больше лимита Telegram.\n"
+                        f"Используйте на сервере: <code>python scripts/export_data.py {dataset} --format {fmt}</code>"
+                    )
+                    return
+                caption = f"📤 {dataset}: {rows} строк ({size / 1024:.0f} КБ)"
+                days = ExportService.retention_days(dataset)
+                if days:
+                    caption += (
+                        f"\nℹ️ Только последние {days} дн. (более старые события сжаты в дневные итоги: "
+                        f"/export {RETAINED_DATASETS[dataset]})"
+                    )
+                await message.answer_document(
+                    FSInputFile(path, filename=ExportService.filename(dataset, fmt)),
+                    caption=caption,
+                )
+                await status.delete()
+            except Exception as e:
+                logger.error(f"Error exporting {dataset}: {e}", exc_info=True)
+                await message.answer("❌ Ошибка при выгрузке данных.")
+            finally:
+                if path is not None:
+                    path.unlink(missing_ok=True)
+
     async def handle_all_user_stats(self, callback: CallbackQuery):
         """Handle callback to show all users stats."""
         await callback.answer()
         try:
-            await self.db.connect()
             users = await self._get_recent_users(limit=200)  # Get all users (max 200)
             
             if not users:
                 await callback.message.answer("👥 Пользователи не найдены.")
                 return
             
+            # One set-based query batch for all users instead of 7 queries per user
+            all_stats = await self.db.get_users_statistics([user.user_id for user in users])
+
             # Send stats for each user (split into multiple messages if needed)
             text = "📊 <b>Статистика всех пользователей</b>\n\n"
             for user in users:
-                stats = await self.db.get_user_statistics(user.user_id)
+                stats = all_stats[user.user_id]
                 text += await self._format_user_stats_short(user, stats)
                 text += "\n" + "─" * 30 + "\n\n"
                 
@@ -2759,6 +2894,8 @@ class AdminBot:
                     await callback.message.answer(text, parse_mode="HTML")
                     text = ""
             
+            if len(users) >= 200:
+                text += "ℹ️ Показаны последние 200. Полная выгрузка: /export users\n"
             if text:
                 await callback.message.answer(text, parse_mode="HTML")
         except Exception as e:
@@ -2952,11 +3089,18 @@ class AdminBot:
         """Start the admin bot."""
         logger.info("Starting Admin Bot...")
         await self.db.connect()
-        await self.dp.start_polling(self.bot)
+        self._project_costs_task = asyncio.create_task(self._project_costs_loop())
+        if self.webhook_intake is not None:
+            await self.webhook_intake.serve("admin", self.dp, self.bot)
+        else:
+            await self.dp.start_polling(self.bot)
     
     async def stop(self):
         """Stop the admin bot."""
         logger.info("Stopping Admin Bot...")
-        await self.dp.stop_polling()
+        if self._project_costs_task is not None:
+            self._project_costs_task.cancel()
+        if self.webhook_intake is None:
+            await self.dp.stop_polling()
         await self.bot.session.close()
         await self.db.close()
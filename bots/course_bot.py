@@ -16,8 +16,6 @@ import logging
 import re
 import sys
 import aiohttp
-import subprocess
-import os
 from pathlib import Path
 from typing import Optional, Dict, Any
 from urllib.parse import parse_qs, urlparse
@@ -31,10 +29,14 @@ from aiogram.client.default import DefaultBotProperties
 from core.config import Config
 from core.database import Database
 from core.models import User, Tariff
+from core.cluster import get_membership
+from core.fsm_storage import DatabaseStorage
 from services.user_service import UserService
 from services.lesson_service import LessonService
 from services.lesson_loader import LessonLoader
 from services.drive_content_sync import DriveContentSync
+from services import content_sync_job, media_variants
+from services.media_gallery import MediaGallery
 from services.assignment_service import AssignmentService
 from services.community_service import CommunityService
 from services.question_service import QuestionService
@@ -42,7 +44,9 @@ from utils.telegram_helpers import create_lesson_keyboard, format_lesson_message
 from utils.scheduler import LessonScheduler
 from utils.mentor_scheduler import MentorReminderScheduler
 from utils.premium_ui import send_typing_action
-from utils.navigator import create_navigator_keyboard, format_navigator_message
+from utils.navigator import NavigatorKeyboards, format_navigator_message
+from utils.metrics import instrument_bot
+from utils import telegram_html
 
 # Configure logging
 logging.basicConfig(
@@ -54,7 +58,10 @@ logger = logging.getLogger(__name__)
 # Ширина мобильного экрана для медиа (в пикселях)
 # Telegram автоматически масштабирует медиа под ширину экрана пользователя
 # Используем стандартную ширину для мобильных устройств
-MOBILE_SCREEN_WIDTH = 720  # Стандартная ширина для мобильных устройств в Telegram
+MOBILE_SCREEN_WIDTH = media_variants.MOBILE_WIDTH  # Стандартная ширина для мобильных устройств в Telegram
+
+# How often raw statistics rows older than STATS_RAW_RETENTION_DAYS are compacted
+_STATS_COMPACTION_INTERVAL_SECONDS = 6 * 3600
 
 # Разделитель для медиафайлов - визуально расширяет блок медиа
 # Используется в caption медиафайлов для улучшения восприятия
@@ -67,11 +74,15 @@ class CourseBot:
     
     def __init__(self):
         self.bot = Bot(token=Config.COURSE_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-        self.dp = Dispatcher()
         self.db = Database()
+        # Persistent per-user state (survives restarts, bounded in memory)
+        self.state_storage = DatabaseStorage(self.db)
+        self.dp = Dispatcher(storage=self.state_storage)
         self.user_service = UserService(self.db)
         self.lesson_service = LessonService(self.db)
         self.lesson_loader = LessonLoader()  # Загрузчик уроков из JSON
+        self.gallery = MediaGallery(self.db)  # Колоды фото уроков (карточки, уровни) с кэшем file_id
+        self.navigator_keyboards = NavigatorKeyboards()  # Клавиатуры навигатора по текущему дню
         self.assignment_service = AssignmentService(self.db)
         self.community_service = CommunityService()
         self.question_service = QuestionService(self.db)
@@ -79,10 +90,13 @@ class CourseBot:
         self.mentor_scheduler = None
 
         # Per-user transient states for "send one message" flows
-        self._user_question_context: dict[int, dict] = {}
+        self._user_question_context = self.state_storage.user_map("course:question")
         # Per-user states for time input
-        self._user_time_input_context: dict[int, str] = {}  # user_id -> "lesson" | "reminder_start" | "reminder_end"
-        self._user_assignment_context: dict[int, dict] = {}
+        self._user_time_input_context = self.state_storage.user_map("course:time_input")  # user_id -> "lesson" | "reminder_start" | "reminder_end"
+        self._user_assignment_context = self.state_storage.user_map("course:assignment")
+
+        # Set by run_all_bots in webhook mode (utils.telegram_webhook.WebhookIntake); None = polling
+        self.webhook_intake = None
         
         # Проверяем, что уроки загружены
         if self.lesson_loader:
@@ -95,6 +109,9 @@ class CourseBot:
         else:
             logger.error("❌ LessonLoader failed to initialize!")
         
+        # Handler latency + Telegram API call metrics (/metrics)
+        instrument_bot("course", self.bot, self.dp)
+
         # Register handlers
         self._register_handlers()
     
@@ -183,17 +200,14 @@ class CourseBot:
         else:
             await message.answer("🔄 Синхронизирую контент из Google Drive…")
         
-        syncer = DriveContentSync()
         try:
-            result = await asyncio.to_thread(syncer.sync_now, clean_media=clean_media)
+            # Publishes lessons.json and reloads every LessonLoader of the process off the event loop
+            result = await content_sync_job.run_sync(DriveContentSync(), clean_media=clean_media)
         except Exception as e:
             await message.answer(f"❌ Sync failed: <code>{e}</code>")
             return
 
-        # Reload in-memory cache so new lessons take effect immediately
         try:
-            logger.info("🔄 Reloading lesson_loader after sync...")
-            self.lesson_loader.reload()
             # Verify that media_markers are loaded for day 0
             day0_data = self.lesson_loader.get_lesson(0)
             if day0_data:
@@ -216,7 +230,15 @@ class CourseBot:
 
         clean_info = ""
         if clean_media:
-            clean_info = "\n🧹 Медиафайлы очищены и загружены заново.\n"
+            clean_info = "\n🧹 Медиафайлы дней пересобраны (неизменившиеся файлы не скачивались заново).\n"
+
+        usage = result.media_usage
+        usage_text = ""
+        if usage:
+            usage_text = (
+                f"\n💾 Медиахранилище: <b>{usage['blob_bytes'] / 1048576:.1f} МБ</b> "
+                f"({usage['blobs']} файлов, без дедупликации {usage['logical_bytes'] / 1048576:.1f} МБ)"
+            )
 
         await message.answer(
             f"✅ Синхронизация завершена.{clean_info}\n\n"
@@ -225,6 +247,7 @@ class CourseBot:
             f"📎 Медиафайлов всего: <b>{result.total_media_files}</b>\n"
             f"⬇️ Медиафайлов загружено: <b>{result.media_files_downloaded}</b>\n"
             f"📁 Путь к урокам: <code>{result.lessons_path}</code>"
+            f"{usage_text}"
             f"{warn_text}"
         )
     
@@ -342,13 +365,8 @@ class CourseBot:
         # НАВИГАТОР КУРСА
         self.dp.message.register(self.handle_navigator, Command("navigator"))
         
-        logger.info("✅ Course bot handlers registered:")
-        logger.info(f"   - /start -> handle_start")
-        logger.info(f"   - /lesson -> handle_current_lesson")
-        logger.info(f"   - /progress -> handle_progress")
-        logger.info(f"   - /sync_content -> handle_sync_content")
-        logger.info(f"   - /test_lessons -> handle_test_lessons")
-        logger.info(f"   - /navigator -> handle_navigator")
+        logger.info("✅ Course bot handlers registered")
+        logger.debug("   /start, /lesson, /progress, /sync_content, /test_lessons, /navigator")
         
         # Callback handlers
         self.dp.callback_query.register(self.handle_test_lesson_select, F.data.startswith("test_lesson:"))
@@ -554,7 +572,8 @@ class CourseBot:
             # Проверяем кэш уроков
             if not self.lesson_loader._lessons_cache:
                 logger.error(f"   ❌ Lessons cache is empty! Reloading...")
-                self.lesson_loader.reload()
+                # Одно перечитывание на всех одновременно пришедших пользователей, не чаще раза в несколько секунд
+                await self.lesson_loader.refresh()
             
             cache_size = len(self.lesson_loader._lessons_cache) if self.lesson_loader._lessons_cache else 0
             logger.info(f"   Lessons cache size: {cache_size}")
@@ -839,37 +858,10 @@ class CourseBot:
         try:
             # Анимация перед отправкой карточки
             await send_typing_action(self.bot, user_id, 0.3)
-            file_id = card.get("file_id")
-            # Убираем разделители - caption должен браться из данных карточки или быть None
-            caption = None
-            if file_id:
-                await self.bot.send_photo(user_id, file_id, caption=caption, protect_content=True)
+            if await self.gallery.send_photo(self.bot, user_id, 21, card):
                 logger.info(f"   ✅ Sent card {card_number} for lesson 21 to user {user_id}")
             else:
-                # Fallback: загрузка с диска
-                from pathlib import Path
-                from aiogram.types import FSInputFile
-                import os
-                
-                file_path = card.get("path", "")
-                if file_path:
-                    normalized_path = file_path.replace('/', os.sep)
-                    project_root = Path.cwd()
-                    card_file = project_root / normalized_path
-                    
-                    if card_file.exists():
-                        # Обрабатываем изображение для мобильных устройств
-                        resized_path = await self._resize_image_for_mobile(card_file)
-                        image_path_to_use = resized_path if resized_path else card_file
-                        photo_file = FSInputFile(image_path_to_use)
-                        # Убираем разделители - caption должен браться из данных карточки или быть None
-                        caption = None
-                        await self.bot.send_photo(user_id, photo_file, caption=caption, protect_content=True)
-                        logger.info(f"   ✅ Sent card {card_number} (from file) for lesson 21 to user {user_id}")
-                    else:
-                        await callback.message.answer(f"❌ Файл карточки {card_number} не найден.")
-                else:
-                    await callback.message.answer(f"❌ Не удалось загрузить карточку {card_number}.")
+                await callback.message.answer(f"❌ Файл карточки {card_number} не найден.")
         except Exception as e:
             logger.error(f"   ❌ Ошибка при отправке карточки {card_number}: {e}", exc_info=True)
             await callback.message.answer(f"❌ Ошибка при отправке карточки {card_number}.")
@@ -899,64 +891,12 @@ class CourseBot:
             await callback.message.answer("❌ Карточки не найдены.")
             return
         
-        # Сортируем карточки по номеру
-        cards = sorted(cards, key=lambda x: x.get("number", 0))
-        
         try:
-            from aiogram.types import InputMediaPhoto
-            
-            # Telegram позволяет отправлять до 10 медиа в одной группе
-            # Разбиваем на группы по 10 карточек
-            MAX_MEDIA_PER_GROUP = 10
-            
-            for group_start in range(0, len(cards), MAX_MEDIA_PER_GROUP):
-                group_cards = cards[group_start:group_start + MAX_MEDIA_PER_GROUP]
-                media_group = []
-                
-                for card in group_cards:
-                    card_number = card.get("number", 0)
-                    file_id = card.get("file_id")
-                    
-                    if file_id:
-                        media_group.append(
-                            InputMediaPhoto(
-                                media=file_id
-                            )
-                        )
-                    else:
-                        # Fallback: загрузка с диска
-                        from pathlib import Path
-                        from aiogram.types import FSInputFile
-                        import os
-                        
-                        file_path = card.get("path", "")
-                        if file_path:
-                            normalized_path = file_path.replace('/', os.sep)
-                            project_root = Path.cwd()
-                            card_file = project_root / normalized_path
-                            
-                            if card_file.exists():
-                                # Обрабатываем изображение для мобильных устройств
-                                resized_path = await self._resize_image_for_mobile(card_file)
-                                image_path_to_use = resized_path if resized_path else card_file
-                                photo_file = FSInputFile(image_path_to_use)
-                                media_group.append(
-                                    InputMediaPhoto(
-                                        media=photo_file
-                                    )
-                                )
-                
-                if media_group:
-                    # Отправляем медиа-группу (защищенную от копирования)
-                    await self.bot.send_media_group(user_id, media_group, protect_content=True)
-                    logger.info(f"   ✅ Sent media group {group_start // MAX_MEDIA_PER_GROUP + 1} with {len(media_group)} cards to user {user_id}")
-                    
-                    # Небольшая пауза между группами
-                    if group_start + MAX_MEDIA_PER_GROUP < len(cards):
-                        await asyncio.sleep(0.5)
-            
-            logger.info(f"   ✅ All {len(cards)} cards sent to user {user_id}")
-            
+            # Колода заранее разбита на медиа-группы по 10, повторные отправки идут по file_id
+            sent, total = await self.gallery.send(self.bot, user_id, 21, "cards", cards)
+            if not sent:
+                raise RuntimeError(f"Не удалось отправить ни одной карточки из {total}")
+            logger.info(f"   ✅ All {sent} cards sent to user {user_id}")
         except Exception as e:
             logger.error(f"   ❌ Ошибка при отправке карточек: {e}", exc_info=True)
             await callback.message.answer("❌ Произошла ошибка при отправке карточек. Попробуйте позже.")
@@ -986,202 +926,18 @@ class CourseBot:
             await callback.message.answer("❌ Изображения уровней не найдены.")
             return
         
-        # Сортируем изображения по номеру
-        levels_images = sorted(levels_images, key=lambda x: x.get("number", 0))
-        
         try:
-            from aiogram.types import InputMediaPhoto, InputMediaGroup
-            from pathlib import Path
-            from aiogram.types import FSInputFile
-            import os
-            
-            logger.info(f"   📊 Начинаю оптимизированную отправку {len(levels_images)} изображений для урока 19")
-            
-            # Убираем дубликаты по file_id и path
-            seen_file_ids = set()
-            seen_paths = set()
-            unique_images = []
-            
-            for image in levels_images:
-                file_id = image.get("file_id")
-                file_path = image.get("path", "")
-                
-                # Проверяем дубликаты
-                is_duplicate = False
-                if file_id and file_id in seen_file_ids:
-                    is_duplicate = True
-                    logger.debug(f"   ⏭️ Пропускаю дубликат по file_id: {image.get('number', '?')}")
-                elif file_path and file_path in seen_paths:
-                    is_duplicate = True
-                    logger.debug(f"   ⏭️ Пропускаю дубликат по path: {image.get('number', '?')}")
-                
-                if not is_duplicate:
-                    if file_id:
-                        seen_file_ids.add(file_id)
-                    if file_path:
-                        seen_paths.add(file_path)
-                    unique_images.append(image)
-            
-            logger.info(f"   📊 После удаления дубликатов: {len(unique_images)} уникальных изображений")
-            
-            # Сортируем по номеру
-            unique_images = sorted(unique_images, key=lambda x: x.get("number", 0))
-            
-            # Определяем корень проекта
-            project_root = None
-            possible_roots = [Path.cwd(), Path(__file__).parent.parent]
-            for root in possible_roots:
-                if (root / "Photo" / "video_pic").exists() or (root / "Photo" / "video_pic_optimized").exists():
-                    project_root = root
-                    break
-            if not project_root:
-                project_root = Path.cwd()
-            
-            # Создаем медиа-группу для быстрой отправки (максимум 10 в группе)
-            media_groups = []
-            current_group = []
-            
-            for image in unique_images:
-                image_number = image.get("number", 0)
-                file_id = image.get("file_id")
-                file_path = image.get("path", "")
-                
-                try:
-                    if file_id:
-                        # Используем file_id (самый быстрый способ)
-                        media_item = InputMediaPhoto(media=file_id)
-                        current_group.append(media_item)
-                    elif file_path:
-                        # Загрузка с диска
-                        normalized_path = file_path.replace('/', os.sep)
-                        image_file = project_root / normalized_path
-                        
-                        if not image_file.exists():
-                            original_path = file_path.replace('video_pic_optimized', 'video_pic')
-                            image_file = project_root / original_path.replace('/', os.sep)
-                        
-                        if image_file.exists() and image_file.is_file():
-                            # Обрабатываем изображение для мобильных устройств
-                            resized_path = await self._resize_image_for_mobile(image_file)
-                            image_path_to_use = resized_path if resized_path else image_file
-                            photo_file = FSInputFile(image_path_to_use)
-                            media_item = InputMediaPhoto(media=photo_file)
-                            current_group.append(media_item)
-                        else:
-                            logger.warning(f"   ⚠️ Файл не найден: {file_path}")
-                            continue
-                    
-                    # Telegram ограничение: максимум 10 медиа в группе
-                    if len(current_group) >= 10:
-                        media_groups.append(current_group)
-                        current_group = []
-                        
-                except Exception as img_error:
-                    logger.error(f"   ❌ Ошибка при подготовке изображения {image_number}: {img_error}")
-                    continue
-            
-            # Добавляем последнюю группу, если она не пустая
-            if current_group:
-                media_groups.append(current_group)
-            
-            # Отправляем медиа-группы
-            total_sent = 0
-            for i, media_group in enumerate(media_groups):
-                try:
-                    if len(media_group) == 1:
-                        # Одно изображение отправляем отдельно
-                        media_item = media_group[0]
-                        if isinstance(media_item.media, str):
-                            # file_id
-                            await self.bot.send_photo(user_id, media_item.media, protect_content=True)
-                        else:
-                            # FSInputFile
-                            await self.bot.send_photo(user_id, media_item.media, protect_content=True)
-                        total_sent += 1
-                    else:
-                        # Медиа-группа (2-10 изображений) (защищенная от копирования)
-                        await self.bot.send_media_group(user_id, media_group, protect_content=True)
-                        total_sent += len(media_group)
-                    
-                    # Минимальная пауза между группами для стабильности API
-                    if i < len(media_groups) - 1:
-                        await asyncio.sleep(0.1)
-                        
-                except Exception as group_error:
-                    logger.error(f"   ❌ Ошибка при отправке медиа-группы {i+1}: {group_error}")
-                    # Пробуем отправить по одному
-                    for media_item in media_group:
-                        try:
-                            if isinstance(media_item.media, str):
-                                await self.bot.send_photo(user_id, media_item.media, protect_content=True)
-                            else:
-                                await self.bot.send_photo(user_id, media_item.media, protect_content=True)
-                            total_sent += 1
-                            await asyncio.sleep(0.1)
-                        except:
-                            continue
-            
-            if total_sent > 0:
-                logger.info(f"   ✅ Отправлено {total_sent} уникальных изображений")
-                if total_sent < len(unique_images):
-                    await callback.message.answer(f"✅ Отправлено {total_sent} из {len(unique_images)} изображений.")
-            else:
-                raise Exception(f"Не удалось отправить ни одного изображения из {len(unique_images)}")
-            
+            # Дубликаты (по file_id и path) убираются при сборке колоды, медиа-группы по 10
+            sent, total = await self.gallery.send(self.bot, user_id, 19, "levels_images", levels_images)
+            if not sent:
+                raise RuntimeError(f"Не удалось отправить ни одного изображения из {total}")
+            logger.info(f"   ✅ Отправлено {sent} уникальных изображений")
+            if sent < total:
+                await callback.message.answer(f"✅ Отправлено {sent} из {total} изображений.")
         except Exception as e:
             logger.error(f"   ❌ Ошибка при отправке уровней: {e}", exc_info=True)
             logger.error(f"   📊 Debug info: total_images={len(levels_images)}, user_id={user_id}")
-            
-            # Пробуем отправить изображения по одному, если медиа-группа не работает
-            try:
-                logger.info(f"   🔄 Пробую отправить изображения по одному...")
-                sent_count = 0
-                
-                for image in levels_images:
-                    file_id = image.get("file_id")
-                    file_path = image.get("path", "")
-                    
-                    try:
-                        if file_id:
-                            await self.bot.send_photo(user_id, file_id, protect_content=True)
-                            sent_count += 1
-                            await asyncio.sleep(0.3)
-                        elif file_path:
-                            from pathlib import Path
-                            from aiogram.types import FSInputFile
-                            import os
-                            
-                            normalized_path = file_path.replace('/', os.sep)
-                            project_root = Path.cwd()
-                            image_file = project_root / normalized_path
-                            
-                            # Если оптимизированный файл не найден, пробуем оригинальный
-                            if not image_file.exists():
-                                original_path = file_path.replace('video_pic_optimized', 'video_pic')
-                                original_file = project_root / original_path.replace('/', os.sep)
-                                if original_file.exists():
-                                    image_file = original_file
-                            
-                            if image_file.exists():
-                                # Обрабатываем изображение для мобильных устройств
-                                resized_path = await self._resize_image_for_mobile(image_file)
-                                image_path_to_use = resized_path if resized_path else image_file
-                                photo_file = FSInputFile(image_path_to_use)
-                                await self.bot.send_photo(user_id, photo_file, protect_content=True)
-                                sent_count += 1
-                                await asyncio.sleep(0.3)
-                            else:
-                                logger.warning(f"   ⚠️ Файл не найден: {file_path}")
-                    except Exception as single_error:
-                        logger.error(f"   ❌ Ошибка при отправке одного изображения: {single_error}")
-                
-                if sent_count > 0:
-                    await callback.message.answer(f"✅ Отправлено {sent_count} из {len(levels_images)} изображений.")
-                else:
-                    await callback.message.answer("❌ Не удалось отправить изображения. Проверьте логи.")
-            except Exception as fallback_error:
-                logger.error(f"   ❌ Ошибка в fallback режиме: {fallback_error}", exc_info=True)
-                await callback.message.answer("❌ Произошла ошибка при отправке уровней. Попробуйте позже.")
+            await callback.message.answer("❌ Произошла ошибка при отправке уровней. Попробуйте позже.")
     
     async def handle_final_message(self, callback: CallbackQuery):
         """Обработчик для финального сообщения урока 30."""
@@ -1656,6 +1412,7 @@ class CourseBot:
         
         # Получаем все доступные уроки
         all_lessons = self.lesson_loader.get_all_lessons()
+        persistent_keyboard = self._create_persistent_keyboard()
         
         if not all_lessons:
             # Проверяем тип объекта для отправки сообщения
@@ -1665,25 +1422,12 @@ class CourseBot:
                 await message_or_callback.answer("❌ Уроки не загружены.", reply_markup=persistent_keyboard)
             return
         
-        # Фильтруем уроки: показываем только те, которые уже были доставлены пользователю
-        # Показываем уроки от 0 до current_day включительно (т.е. уже пришедшие уроки)
-        available_lessons = {}
-        for day_str, lesson_data in all_lessons.items():
-            try:
-                day = int(day_str)
-                # Показываем только уроки, которые уже были доставлены (от 0 до current_day)
-                if day <= user.current_day:
-                    available_lessons[day_str] = lesson_data
-            except (ValueError, TypeError):
-                # Пропускаем нечисловые ключи
-                continue
-        
-        # Создаем клавиатуру навигатора только с доступными уроками
-        keyboard = create_navigator_keyboard(available_lessons, user.current_day)
+        # Только уже доставленные уроки (от 0 до current_day); клавиатуры готовы заранее
+        # для каждого дня и строятся заново только после перезагрузки уроков
+        keyboard = self.navigator_keyboards.get(all_lessons, user.current_day)
         navigator_text = format_navigator_message()
         
         # Отправляем сообщение в зависимости от типа объекта
-        persistent_keyboard = self._create_persistent_keyboard()
         if isinstance(message_or_callback, CallbackQuery):
             await message_or_callback.message.answer(navigator_text, reply_markup=keyboard)
             # Устанавливаем постоянную клавиатуру отдельным сообщением (используем пробел)
@@ -1894,192 +1638,23 @@ class CourseBot:
     
     async def _resize_image_for_mobile(self, image_path: Path) -> Optional[Path]:
         """
-        Изменяет размер изображения для мобильных устройств (ширина = MOBILE_SCREEN_WIDTH).
-        Сохраняет пропорции изображения.
-        
-        Args:
-            image_path: Путь к исходному изображению
+        Мобильная версия изображения (ширина MOBILE_SCREEN_WIDTH), подготовленная при синхронизации
+        контента (services/media_variants.py). Только поиск в манифесте — Pillow здесь не используется.
         
         Returns:
-            Path к обработанному изображению, или None если обработка не требуется или не удалась
+            Path к подготовленной версии, или None если отправлять оригинал
         """
-        try:
-            from PIL import Image
-        except ImportError:
-            logger.warning("   ⚠️ PIL/Pillow not available, skipping image resize")
-            return None
-        
-        if not image_path.exists():
-            logger.warning(f"   ⚠️ Image file not found: {image_path}")
-            return None
-        
-        try:
-            # Открываем изображение
-            with Image.open(image_path) as img:
-                original_width, original_height = img.size
-                
-                # Если изображение уже меньше или равно ширине мобильного экрана, не обрабатываем
-                if original_width <= MOBILE_SCREEN_WIDTH:
-                    logger.debug(f"   ✅ Image size OK: {original_width}x{original_height} (width <= {MOBILE_SCREEN_WIDTH})")
-                    return None
-                
-                # Вычисляем новую высоту с сохранением пропорций
-                aspect_ratio = original_height / original_width
-                new_width = MOBILE_SCREEN_WIDTH
-                new_height = int(MOBILE_SCREEN_WIDTH * aspect_ratio)
-                
-                logger.info(f"   📷 Resizing image: {original_width}x{original_height} -> {new_width}x{new_height}")
-                
-                # Изменяем размер изображения с высоким качеством
-                resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # Создаем путь для обработанного изображения
-                resized_dir = image_path.parent / "resized_mobile"
-                resized_dir.mkdir(exist_ok=True)
-                resized_path = resized_dir / f"mobile_{image_path.name}"
-                
-                # Сохраняем обработанное изображение
-                # Сохраняем в том же формате, что и оригинал
-                resized_img.save(resized_path, quality=95, optimize=True)
-                
-                logger.info(f"   ✅ Image resized and saved: {resized_path.name}")
-                return resized_path
-                
-        except Exception as e:
-            logger.error(f"   ❌ Error resizing image {image_path}: {e}", exc_info=True)
-            return None
+        return media_variants.delivery_path(image_path)
     
-    async def _compress_video_if_needed(self, video_path: Path, max_size_mb: float = 45.0) -> Optional[Path]:
+    async def _compress_video_if_needed(self, video_path: Path) -> Optional[Path]:
         """
-        Сжимает видео, если оно превышает максимальный размер.
-        
-        Args:
-            video_path: Путь к исходному видео
-            max_size_mb: Максимальный размер в МБ (по умолчанию 45 МБ, чтобы быть ниже лимита 50 МБ)
+        Сжатая версия видео (H.264, не больше media_variants.VIDEO_MAX_MB), подготовленная при
+        синхронизации контента. Только поиск в манифесте — ffmpeg здесь не запускается.
         
         Returns:
-            Path к сжатому видео, или None если сжатие не требуется или не удалось
+            Path к сжатому видео, или None если отправлять оригинал
         """
-        if not video_path.exists():
-            logger.warning(f"   ⚠️ Video file not found: {video_path}")
-            return None
-        
-        # Проверяем размер файла
-        file_size_mb = video_path.stat().st_size / (1024 * 1024)
-        
-        if file_size_mb <= max_size_mb:
-            logger.info(f"   ✅ Video size OK: {file_size_mb:.2f} MB (limit: {max_size_mb} MB)")
-            return None
-        
-        logger.info(f"   📹 Video too large: {file_size_mb:.2f} MB, compressing to {max_size_mb} MB...")
-        
-        # Создаем путь для сжатого видео
-        compressed_dir = video_path.parent / "compressed"
-        compressed_dir.mkdir(exist_ok=True)
-        compressed_path = compressed_dir / f"compressed_{video_path.name}"
-        
-        # Если сжатое видео уже существует и актуально, используем его
-        if compressed_path.exists():
-            compressed_size_mb = compressed_path.stat().st_size / (1024 * 1024)
-            if compressed_size_mb <= max_size_mb:
-                logger.info(f"   ✅ Using existing compressed video: {compressed_size_mb:.2f} MB")
-                return compressed_path
-        
-        # Проверяем наличие FFmpeg
-        try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True, timeout=5)
-        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-            logger.error(f"   ❌ FFmpeg not found or not working. Cannot compress video.")
-            return None
-        
-        try:
-            # Вычисляем битрейт для достижения целевого размера
-            # Примерная формула: bitrate = (target_size_mb * 8) / duration_seconds
-            # Для безопасности используем консервативный битрейт
-            target_bitrate = "2000k"  # 2 Мбит/с - хорошее качество для большинства видео
-            
-            # Команда FFmpeg для сжатия
-            # Используем H.264 кодек с оптимизацией для веб-потоков
-            cmd = [
-                "ffmpeg",
-                "-i", str(video_path),
-                "-c:v", "libx264",
-                "-preset", "medium",  # Баланс между скоростью и качеством
-                "-crf", "28",  # Качество (18-28, чем больше, тем меньше размер)
-                "-maxrate", target_bitrate,
-                "-bufsize", f"{int(target_bitrate[:-1]) * 2}k",
-                "-c:a", "aac",
-                "-b:a", "128k",  # Аудио битрейт
-                "-movflags", "+faststart",  # Оптимизация для стриминга
-                "-y",  # Перезаписать существующий файл
-                str(compressed_path)
-            ]
-            
-            logger.info(f"   🔄 Compressing video: {video_path.name} -> {compressed_path.name}")
-            logger.info(f"   📹 Command: {' '.join(cmd)}")
-            
-            # Запускаем сжатие
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"   ❌ FFmpeg compression failed: {stderr.decode()}")
-                return None
-            
-            # Проверяем размер сжатого файла
-            if compressed_path.exists():
-                compressed_size_mb = compressed_path.stat().st_size / (1024 * 1024)
-                logger.info(f"   ✅ Video compressed: {file_size_mb:.2f} MB -> {compressed_size_mb:.2f} MB")
-                
-                # Если все еще слишком большое, пробуем более агрессивное сжатие
-                if compressed_size_mb > max_size_mb:
-                    logger.warning(f"   ⚠️ Compressed video still too large: {compressed_size_mb:.2f} MB")
-                    # Пробуем более агрессивное сжатие
-                    cmd_aggressive = [
-                        "ffmpeg",
-                        "-i", str(video_path),
-                        "-c:v", "libx264",
-                        "-preset", "fast",
-                        "-crf", "32",  # Более высокое значение = меньше размер
-                        "-maxrate", "1500k",
-                        "-bufsize", "3000k",
-                        "-vf", "scale='min(1280,iw)':'min(720,ih)':force_original_aspect_ratio=decrease",  # Ограничиваем разрешение
-                        "-c:a", "aac",
-                        "-b:a", "96k",
-                        "-movflags", "+faststart",
-                        "-y",
-                        str(compressed_path)
-                    ]
-                    
-                    logger.info(f"   🔄 Trying aggressive compression...")
-                    process2 = await asyncio.create_subprocess_exec(
-                        *cmd_aggressive,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    
-                    stdout2, stderr2 = await process2.communicate()
-                    
-                    if process2.returncode == 0 and compressed_path.exists():
-                        compressed_size_mb = compressed_path.stat().st_size / (1024 * 1024)
-                        logger.info(f"   ✅ Aggressive compression result: {compressed_size_mb:.2f} MB")
-                
-                if compressed_size_mb <= max_size_mb:
-                    return compressed_path
-                else:
-                    logger.warning(f"   ⚠️ Video still too large after compression: {compressed_size_mb:.2f} MB")
-                    return None
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"   ❌ Error compressing video: {e}", exc_info=True)
-            return None
+        return media_variants.delivery_path(video_path)
     
     @staticmethod
     def _add_media_separator(caption: Optional[str] = None) -> Optional[str]:
@@ -2143,49 +1718,11 @@ class CourseBot:
             
             # Fallback: загрузка с диска (только если нет file_id)
             if file_path:
-                from pathlib import Path
                 from aiogram.types import FSInputFile
-                import os
-                
-                # Определяем корень проекта (кэшируем)
-                if not hasattr(self, '_project_root_cache'):
-                    possible_roots = [
-                        Path.cwd(),
-                        Path(__file__).parent.parent,
-                    ]
-                    self._project_root_cache = None
-                    for root in possible_roots:
-                        if (root / "Photo" / "video_pic").exists() or (root / "Photo" / "video_pic_optimized").exists():
-                            self._project_root_cache = root
-                            break
-                    if not self._project_root_cache:
-                        self._project_root_cache = Path.cwd()
-                
-                project_root = self._project_root_cache
-                normalized_path = file_path.replace('/', os.sep).replace('\\', os.sep)
-                
-                # Пробуем сначала оптимизированную версию, потом оригинальную
-                possible_paths = [
-                    project_root / normalized_path,  # Указанный путь
-                    project_root / normalized_path.replace('video_pic', 'video_pic_optimized'),  # Оптимизированная версия
-                ]
                 
-                media_file = None
-                video_path_to_use = None
-                
-                for test_path in possible_paths:
-                    if test_path.exists() and test_path.is_file():
-                        if media_type == "video":
-                            # Для видео проверяем размер и сжимаем при необходимости
-                            compressed_path = await self._compress_video_if_needed(test_path)
-                            video_path_to_use = compressed_path if compressed_path else test_path
-                            media_file = FSInputFile(video_path_to_use)
-                        else:
-                            # Для изображений изменяем размер для мобильных устройств
-                            resized_path = await self._resize_image_for_mobile(test_path)
-                            image_path_to_use = resized_path if resized_path else test_path
-                            media_file = FSInputFile(image_path_to_use)
-                        break
+                # Подготовленная при синхронизации версия (или найденный тогда же исходник)
+                path_to_send = media_variants.resolve(file_path)
+                media_file = FSInputFile(path_to_send) if path_to_send else None
                 
                 if media_file:
                     # Добавляем разделитель к caption для визуального расширения блока медиа
@@ -3197,6 +2734,13 @@ class CourseBot:
                 elif reply_markup:
                     return await self.bot.send_message(chat_id, "\u200B", reply_markup=reply_markup, **kwargs)
                 return None
+            elif "can't parse entities" in error_msg and (kwargs.get("parse_mode", ParseMode.HTML) or "").upper() == "HTML":
+                # Лишний "<" или неподдерживаемый тег в тексте урока: отправляем очищенный вариант
+                sanitized, removed = telegram_html.sanitize(text)
+                if sanitized == text:
+                    raise
+                logger.warning(f"⚠️ Telegram rejected HTML for {chat_id}, resending sanitized text ({', '.join(removed) or 'escaped'}): {error_msg}")
+                return await self.bot.send_message(chat_id, sanitized, reply_markup=reply_markup, **kwargs)
             else:
                 raise
     
@@ -3245,15 +2789,12 @@ class CourseBot:
                 logger.info(f"   🔍 DEBUG: media_markers type: {type(media_markers_raw)}, value: {media_markers_raw}")
             else:
                 logger.warning(f"   🔍 DEBUG: 'media_markers' key NOT FOUND in lesson_data!")
-                # Try to check if it's in the raw JSON by reloading
-                logger.warning(f"   🔍 DEBUG: Attempting to reload lesson_loader and check again...")
-                self.lesson_loader.reload()
-                lesson_data_reloaded = self.lesson_loader.get_lesson(day)
+                # Файл мог обновиться: перечитываем его не больше одного раза на версию уроков
+                # (у дня без медиа маркеров просто нет — это запоминается до следующей перезагрузки)
+                lesson_data_reloaded = await self.lesson_loader.get_lesson_with(day, "media_markers")
                 if lesson_data_reloaded and "media_markers" in lesson_data_reloaded:
                     logger.warning(f"   🔍 DEBUG: After reload, media_markers found! Updating lesson_data...")
                     lesson_data = lesson_data_reloaded
-                else:
-                    logger.warning(f"   🔍 DEBUG: After reload, media_markers still NOT found in lesson_data!")
             
             media_markers = lesson_data.get("media_markers", {})
             logger.info(f"   📎 Media markers in lesson_data for day {day}: {len(media_markers) if media_markers else 0} markers")
@@ -6818,6 +6359,11 @@ class CourseBot:
             except:
                 pass
     
+    async def _compact_statistics(self):
+        deleted = await self.db.compact_statistics()
+        if deleted:
+            logger.info(f"🧹 Compacted {deleted} raw statistics rows into daily rollups")
+
     async def start(self):
         """Start the bot and scheduler."""
         await self.db.connect()
@@ -6839,9 +6385,18 @@ class CourseBot:
         # Start schedulers in background
         scheduler_task = asyncio.create_task(self.scheduler.start())
         mentor_scheduler_task = asyncio.create_task(self.mentor_scheduler.start())
+        # lessons.json watcher + scheduled Drive content sync (leader only)
+        content_tasks = content_sync_job.start_background_tasks()
+        # Raw statistics rows -> daily rollups (one worker in multi-process mode)
+        stats_compaction_task = asyncio.create_task(
+            get_membership().run_singleton(
+                "stats compaction", _STATS_COMPACTION_INTERVAL_SECONDS, self._compact_statistics
+            )
+        )
         
         # Инициализируем закрепленное сообщение с кнопкой "Вопросы" в ПУП
-        if Config.PREMIUM_GROUP_ID:
+        # (в multi-process режиме — только лидер, чтобы не править сообщение N раз)
+        if Config.PREMIUM_GROUP_ID and get_membership().is_leader:
             try:
                 def parse_chat_id(raw: str) -> int:
                     s = (raw or "").strip()
@@ -6865,7 +6420,10 @@ class CourseBot:
         
         logger.info("Course Bot started")
         try:
-            await self.dp.start_polling(self.bot, skip_updates=True)
+            if self.webhook_intake is not None:
+                await self.webhook_intake.serve("course", self.dp, self.bot)
+            else:
+                await self.dp.start_polling(self.bot, skip_updates=True)
         finally:
             if self.scheduler:
                 self.scheduler.stop()
@@ -6873,6 +6431,9 @@ class CourseBot:
             if self.mentor_scheduler:
                 self.mentor_scheduler.stop()
                 mentor_scheduler_task.cancel()
+            stats_compaction_task.cancel()
+            for task in content_tasks:
+                task.cancel()
             await self.db.close()
             await self.bot.session.close()
     
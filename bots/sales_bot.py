@@ -24,6 +24,7 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
+from core.cluster import get_membership
 from core.config import Config
 from core.database import Database
 from core.models import Tariff
@@ -35,19 +36,13 @@ from services.community_service import CommunityService
 from services.question_service import QuestionService
 from services.lesson_loader import LessonLoader
 from utils.telegram_helpers import create_tariff_keyboard, create_programs_tariff_keyboard, format_tariff_description, create_persistent_keyboard
+from utils.metrics import instrument_bot
 from utils.premium_ui import (
     send_animated_message, send_typing_action,
     format_premium_header, format_premium_section, create_premium_separator,
     create_success_animation, format_price
 )
 
-# Try to import YooKassa processor (optional)
-try:
-    from payment.yookassa_payment import YooKassaPaymentProcessor
-    YOOKASSA_AVAILABLE = True
-except ImportError:
-    YOOKASSA_AVAILABLE = False
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -58,6 +53,9 @@ logger = logging.getLogger(__name__)
 
 class SalesBot:
     """Sales and Payment Bot implementation."""
+
+    # How long stop() waits for a payment reconciliation run in progress
+    RECONCILE_STOP_TIMEOUT_SECONDS = 30
     
     def __init__(self):
         self.bot = Bot(token=Config.SALES_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -71,6 +69,9 @@ class SalesBot:
         self.user_service = UserService(self.db)
         self.community_service = CommunityService()
         self.question_service = QuestionService(self.db)
+        self._reconcile_task: Optional[asyncio.Task] = None
+        # Current reconciliation run: finished on shutdown rather than cancelled mid-completion
+        self._reconcile_run: Optional[asyncio.Future] = None
 
         # In-memory contexts (good enough for sales flow; DB stores the resulting email)
         self._awaiting_email: dict[int, dict] = {}
@@ -84,6 +85,9 @@ class SalesBot:
         self._selected_program: dict[int, str] = {}
         # Test state: stores current test step and results
         self._test_state: dict[int, dict] = {}  # user_id -> {step: int, results: dict}
+
+        # Set by run_all_bots in webhook mode (utils.telegram_webhook.WebhookIntake); None = polling
+        self.webhook_intake = None
         
         # Initialize lesson loader with error handling
         try:
@@ -94,6 +98,9 @@ class SalesBot:
             logger.warning("⚠️ SalesBot will work, but lesson 0 won't be sent automatically")
             self.lesson_loader = None
         
+        # Handler latency + Telegram API call metrics (/metrics)
+        instrument_bot("sales", self.bot, self.dp)
+
         # Register handlers
         self._register_handlers()
     
@@ -102,6 +109,8 @@ class SalesBot:
         provider = Config.PAYMENT_PROVIDER.lower()
         
         if provider == "yookassa":
+            # Imported on demand: the YooKassa SDK (and its requests/pydantic deps) is slow to load
+            from payment.yookassa_payment import YOOKASSA_AVAILABLE, YooKassaPaymentProcessor
             if not YOOKASSA_AVAILABLE:
                 logger.warning("YooKassa library not installed. Falling back to mock payment.")
                 logger.warning("Install with: pip install yookassa")
@@ -116,7 +125,8 @@ class SalesBot:
                 processor = YooKassaPaymentProcessor(
                     shop_id=Config.YOOKASSA_SHOP_ID,
                     secret_key=Config.YOOKASSA_SECRET_KEY,
-                    return_url=Config.YOOKASSA_RETURN_URL
+                    return_url=Config.YOOKASSA_RETURN_URL,
+                    api_url=Config.YOOKASSA_API_URL,
                 )
                 logger.info("✅ YooKassa payment processor initialized")
                 return processor
@@ -1633,7 +1643,8 @@ class SalesBot:
         code = (await self.db.get_user_promo_code(user_id) or "").strip()
         if not code:
             return None
-        promo = await self.db.get_valid_promo_code(code)
+        # Snapshot check is enough here: payments re-validate the code with a point query
+        promo = await self.db.get_cached_promo_code(code)
         if not promo:
             try:
                 await self.db.clear_user_promo_code(user_id)
@@ -1647,7 +1658,7 @@ class SalesBot:
         out: dict[Tariff, float] = {}
         for t in [Tariff.BASIC, Tariff.FEEDBACK, Tariff.PRACTIC]:
             base = await self.payment_service.get_tariff_base_price(t)
-            amount, _ = await self.payment_service._apply_promo_to_amount(base, promo_code)
+            amount, _ = await self.payment_service._apply_promo_to_amount(base, promo_code, cached=True)
             out[t] = amount
         return out
 
@@ -1662,7 +1673,7 @@ class SalesBot:
         out: dict[str, float] = {}
         for k, default in defaults.items():
             base = await self.db.get_offline_tariff_price(k, default)
-            amount, _ = await self.payment_service._apply_promo_to_amount(base, promo_code)
+            amount, _ = await self.payment_service._apply_promo_to_amount(base, promo_code, cached=True)
             out[k] = amount
         return out
     
@@ -3425,7 +3436,7 @@ class SalesBot:
                     return
 
                 # Process payment completion
-                result = await self.payment_service.process_payment_completion(payment_id)
+                result = await self.payment_service.process_payment_completion(payment_id, status=status)
                 
                 if result:
                     logger.info(f"   Access granted/upgraded to user {result['user_id']}")
@@ -4072,6 +4083,38 @@ class SalesBot:
             except Exception:
                 pass
     
+    async def _reconcile_payments(self):
+        """Settle payments whose webhook never arrived and invite their users to continue."""
+        # Shielded: cancelling the schedule (stop) does not tear down a completion in progress
+        self._reconcile_run = asyncio.ensure_future(self._reconcile_payments_once())
+        await asyncio.shield(self._reconcile_run)
+
+    async def _reconcile_payments_once(self):
+        report = await self.payment_service.reconcile_pending_payments(
+            concurrency=Config.PAYMENT_RECONCILE_CONCURRENCY,
+            max_age_hours=Config.PAYMENT_RECONCILE_MAX_AGE_HOURS,
+        )
+        if not report["checked"]:
+            return
+        logger.info(
+            f"💳 Payment reconciliation: checked={report['checked']}, completed={len(report['completed'])}, "
+            f"cancelled={report['cancelled']}, pending={report['pending']}"
+        )
+        for result in report["completed"]:
+            # Access is already granted; the button runs the usual post-payment flow (handle_payment_check)
+            try:
+                await self.bot.send_message(
+                    int(result["user_id"]),
+                    "✅ <b>Оплата подтверждена!</b>\n\n"
+                    f"Тариф: <b>{result['tariff'].upper()}</b>\n\n"
+                    "Нажмите кнопку ниже, чтобы продолжить 👇",
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="🚀 Продолжить", callback_data=f"check_payment:{result['payment_id']}")]
+                    ]),
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Could not notify user {result['user_id']} about reconciled payment: {e}")
+
     async def start(self):
         """Start the bot."""
         try:
@@ -4100,14 +4143,16 @@ class SalesBot:
             logger.info("=" * 60)
             logger.info("РЕГИСТРАЦИЯ ОБРАБОТЧИКОВ:")
             logger.info(f"   Message handlers: {len(self.dp.message.handlers)}")
+            # Per-handler listing only with STARTUP_DIAGNOSTICS=1 (it's ~100 lines per start)
+            handler_log = logger.info if Config.STARTUP_DIAGNOSTICS else logger.debug
             for i, handler in enumerate(self.dp.message.handlers):
                 callback_name = handler.callback.__name__ if hasattr(handler, 'callback') else 'unknown'
-                logger.info(f"   [{i+1}] {callback_name}")
+                handler_log(f"   [{i+1}] {callback_name}")
             logger.info(f"   Callback query handlers: {len(self.dp.callback_query.handlers)}")
             for i, handler in enumerate(self.dp.callback_query.handlers):
                 callback_name = handler.callback.__name__ if hasattr(handler, 'callback') else 'unknown'
                 filters_info = str(handler.filters) if hasattr(handler, 'filters') else 'no filters'
-                logger.info(f"   [{i+1}] {callback_name} (filters: {filters_info[:50]})")
+                handler_log(f"   [{i+1}] {callback_name} (filters: {filters_info[:50]})")
             logger.info("=" * 60)
             logger.info("")
             
@@ -4119,13 +4164,33 @@ class SalesBot:
             logger.info("=" * 60)
             logger.info("")
             
-            await self.dp.start_polling(self.bot, skip_updates=True)
+            # Payments whose webhook was lost (one worker in multi-process mode)
+            self._reconcile_task = asyncio.create_task(
+                get_membership().run_singleton(
+                    "payment reconciliation", Config.PAYMENT_RECONCILE_INTERVAL_SECONDS, self._reconcile_payments
+                )
+            )
+
+            if self.webhook_intake is not None:
+                await self.webhook_intake.serve("sales", self.dp, self.bot)
+            else:
+                await self.dp.start_polling(self.bot, skip_updates=True)
         except Exception as e:
             logger.error(f"❌ Error starting bot: {e}", exc_info=True)
             raise
     
     async def stop(self):
         """Stop the bot."""
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            await asyncio.gather(self._reconcile_task, return_exceptions=True)
+        if self._reconcile_run is not None and not self._reconcile_run.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._reconcile_run), self.RECONCILE_STOP_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Payment reconciliation still running at shutdown, not waiting longer")
+            except Exception:
+                pass
         await self.db.close()
         await self.bot.session.close()
 
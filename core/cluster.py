@@ -0,0 +1,170 @@
+"""
+Cluster membership for multi-process mode.
+
+When run_all_bots is started with WORKER_PROCESSES > 1, the supervisor
+(core/supervisor.py) launches N worker processes. Each worker keeps a few
+leases in the shared database (table `leases`):
+
+- `worker:<i>`  heartbeat of worker i
+- `shard:<k>`   ownership of users with user_id % N == k (scheduler work)
+- `leader`      exactly one worker runs singleton jobs (Drive sync, pinned messages...)
+
+Worker i always claims its home shard i. If another worker's heartbeat expires,
+the survivors take over its shard until it comes back. Leases are acquired with
+a single atomic UPSERT, so this works with the plain SQLite backend.
+
+In the default single-process mode nothing touches the database: the process
+owns every user and is always the leader.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from typing import Awaitable, Callable, Optional
+
+from core.config import Config
+
+logger = logging.getLogger(__name__)
+
+LEADER_LEASE = "leader"
+
+
+class ClusterMembership:
+    """Tracks which shards this process owns and whether it is the leader."""
+
+    def __init__(
+        self,
+        db=None,
+        worker_index: int = 0,
+        worker_count: int = 1,
+        *,
+        lease_ttl_seconds: float = 30.0,
+        renew_interval_seconds: float = 10.0,
+    ):
+        self.db = db
+        self.worker_index = int(worker_index)
+        self.worker_count = max(int(worker_count), 1)
+        self.lease_ttl_seconds = lease_ttl_seconds
+        self.renew_interval_seconds = renew_interval_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{self.worker_index}"
+
+        # Single process: own everything, no DB round-trips at all.
+        self.owned_shards: set[int] = set(range(self.worker_count)) if not self.enabled else set()
+        self.is_leader: bool = not self.enabled
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_count > 1 and self.db is not None
+
+    @property
+    def is_primary_worker(self) -> bool:
+        """Worker 0 does once-per-deploy actions (e.g. setWebhook)."""
+        return self.worker_index == 0
+
+    def shard_of(self, user_id: int) -> int:
+        return int(user_id) % self.worker_count
+
+    def owns_user(self, user_id: int) -> bool:
+        """True if scheduler work for this user belongs to this process."""
+        return self.shard_of(user_id) in self.owned_shards
+
+    async def start(self):
+        """Acquire leases once (so ownership is known before bots start) and keep renewing them."""
+        if not self.enabled:
+            return
+        await self.tick()
+        self._task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        """Stop renewing and release held leases so peers can take over immediately."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not self.enabled:
+            return
+        names = [f"worker:{self.worker_index}"] + [f"shard:{k}" for k in self.owned_shards]
+        if self.is_leader:
+            names.append(LEADER_LEASE)
+        for name in names:
+            try:
+                await self.db.release_lease(name, self.owner)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not release lease {name}: {e}")
+        self.owned_shards = set()
+        self.is_leader = False
+
+    async def tick(self):
+        """One renewal round: heartbeat, shards, leader."""
+        ttl = self.lease_ttl_seconds
+        await self.db.try_acquire_lease(f"worker:{self.worker_index}", self.owner, ttl)
+        alive = await self.db.get_live_leases("worker:")
+
+        owned: set[int] = set()
+        for shard in range(self.worker_count):
+            name = f"shard:{shard}"
+            home_alive = f"worker:{shard}" in alive
+            if shard == self.worker_index or not home_alive:
+                if await self.db.try_acquire_lease(name, self.owner, ttl):
+                    owned.add(shard)
+            elif shard in self.owned_shards:
+                # Home worker is back: hand its shard over
+                await self.db.release_lease(name, self.owner)
+
+        if owned != self.owned_shards:
+            logger.info(f"🧩 Worker {self.worker_index}: owned shards {sorted(self.owned_shards)} -> {sorted(owned)}")
+        self.owned_shards = owned
+
+        was_leader = self.is_leader
+        self.is_leader = await self.db.try_acquire_lease(LEADER_LEASE, self.owner, ttl)
+        if self.is_leader != was_leader:
+            logger.info(f"👑 Worker {self.worker_index}: leader={self.is_leader}")
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.renew_interval_seconds)
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Leases simply expire if we can't renew; peers will take over.
+                logger.error(f"❌ Lease renewal failed: {e}", exc_info=True)
+
+    async def run_singleton(self, name: str, interval_seconds: float, job: Callable[[], Awaitable[None]]):
+        """Run `job` every `interval_seconds`, but only while this process is the leader."""
+        while True:
+            if self.is_leader:
+                try:
+                    await job()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Singleton job {name} failed: {e}", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+
+_membership: Optional[ClusterMembership] = None
+
+
+def get_membership() -> ClusterMembership:
+    """Membership of the current process (single-process default if not configured)."""
+    global _membership
+    if _membership is None:
+        _membership = ClusterMembership()
+    return _membership
+
+
+def set_membership(membership: ClusterMembership):
+    global _membership
+    _membership = membership
+
+
+def membership_from_config(db) -> ClusterMembership:
+    """Build membership for this process from WORKER_INDEX / WORKER_COUNT set by the supervisor."""
+    return ClusterMembership(db, Config.WORKER_INDEX, Config.WORKER_COUNT)
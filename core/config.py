@@ -76,6 +76,36 @@ class Config:
     # You can also use a web.telegram.org link, but it's less reliable on mobile clients.
     DISCUSSION_GROUP_URL: str = _get_env_value("DISCUSSION_GROUP_URL", "")
     
+    # Telegram update intake: "polling" (default) or "webhook".
+    # In webhook mode run_all_bots mounts /telegram/<bot>/<secret> on the PORT server.
+    TELEGRAM_UPDATE_MODE: str = _get_env_value("TELEGRAM_UPDATE_MODE", "polling")
+    # Public base URL Telegram should call, e.g. https://my-app.up.railway.app
+    # Empty in webhook mode = no setWebhook call (local runs with the fake update injector).
+    TELEGRAM_WEBHOOK_BASE_URL: str = _get_env_value("TELEGRAM_WEBHOOK_BASE_URL", "")
+    # Optional extra entropy for the per-bot secret path/token
+    TELEGRAM_WEBHOOK_SECRET: str = _get_env_value("TELEGRAM_WEBHOOK_SECRET", "")
+
+    # Multi-process mode (see core/cluster.py, core/supervisor.py)
+    # WORKER_PROCESSES > 1 makes run_all_bots a supervisor that launches N workers.
+    WORKER_PROCESSES: int = int(_get_env_value("WORKER_PROCESSES", "1") or "1")
+    # Set by the supervisor for each worker process (not meant to be set by hand)
+    WORKER_INDEX: int = int(_get_env_value("WORKER_INDEX", "0") or "0")
+    WORKER_COUNT: int = int(_get_env_value("WORKER_COUNT", "1") or "1")
+    # Internal ports of workers: WORKER_BASE_PORT + index (default: PORT + 1 + index)
+    WORKER_BASE_PORT: int = int(_get_env_value("WORKER_BASE_PORT", "0") or "0")
+
+    # Conversation state (core/fsm_storage.py): sliding TTL of "waiting for ..." flows
+    # and the max number of per-user records kept in memory per bot
+    FSM_STATE_TTL_HOURS: float = float(_get_env_value("FSM_STATE_TTL_HOURS", "24") or "24")
+    FSM_CACHE_MAX_ENTRIES: int = int(_get_env_value("FSM_CACHE_MAX_ENTRIES", "5000") or "5000")
+
+    # Raw user_sessions / user_activity rows older than this are compacted into the daily
+    # statistics rollups (0 = keep raw rows forever)
+    STATS_RAW_RETENTION_DAYS: int = int(_get_env_value("STATS_RAW_RETENTION_DAYS", "90") or "90")
+
+    # "1" = log full env/handler diagnostics at startup (slower, noisier logs)
+    STARTUP_DIAGNOSTICS: bool = _get_env_value("STARTUP_DIAGNOSTICS", "0") == "1"
+
     # Database
     DATABASE_PATH: str = _get_env_value("DATABASE_PATH", "./data/course_platform.db")
 
@@ -93,6 +123,14 @@ class Config:
     DRIVE_MEDIA_DIR: str = _get_env_value("DRIVE_MEDIA_DIR", "data/content_media")
     # Optional: auto-sync interval (minutes). 0 = disabled.
     DRIVE_AUTO_SYNC_MINUTES: int = int(_get_env_value("DRIVE_AUTO_SYNC_MINUTES", "0") or "0")
+    # How often every process checks lessons.json for a newly published version (seconds)
+    LESSONS_RELOAD_CHECK_SECONDS: float = float(_get_env_value("LESSONS_RELOAD_CHECK_SECONDS", "30") or "30")
+    # Parallel Drive API requests during a sync (halved automatically while Drive rate-limits)
+    DRIVE_SYNC_WORKERS: int = int(_get_env_value("DRIVE_SYNC_WORKERS", "8") or "8")
+    # lessons.json backup history (content_backups/): newest versions kept,
+    # plus the newest version of each of the last N days
+    CONTENT_BACKUP_KEEP_LATEST: int = int(_get_env_value("CONTENT_BACKUP_KEEP_LATEST", "20") or "20")
+    CONTENT_BACKUP_KEEP_DAILY: int = int(_get_env_value("CONTENT_BACKUP_KEEP_DAILY", "30") or "30")
     
     # Course Settings
     COURSE_DURATION_DAYS: int = int(os.getenv("COURSE_DURATION_DAYS", "30"))
@@ -115,6 +153,15 @@ class Config:
     YOOKASSA_SHOP_ID: str = _get_env_value("YOOKASSA_SHOP_ID", "")
     YOOKASSA_SECRET_KEY: str = _get_env_value("YOOKASSA_SECRET_KEY", "")
     YOOKASSA_RETURN_URL: str = _get_env_value("YOOKASSA_RETURN_URL", "https://t.me/StartNowQ_bot")
+    # API base URL override, e.g. a local stand-in (scripts/fake_yookassa.py); empty = SDK default
+    YOOKASSA_API_URL: str = _get_env_value("YOOKASSA_API_URL", "")
+
+    # Reconciliation of payments whose webhook never arrived (PaymentService.reconcile_pending_payments)
+    PAYMENT_RECONCILE_INTERVAL_SECONDS: int = int(_get_env_value("PAYMENT_RECONCILE_INTERVAL_SECONDS", "60") or "60")
+    # Parallel status requests to the payment provider
+    PAYMENT_RECONCILE_CONCURRENCY: int = int(_get_env_value("PAYMENT_RECONCILE_CONCURRENCY", "4") or "4")
+    # Unsettled payments older than this are no longer checked
+    PAYMENT_RECONCILE_MAX_AGE_HOURS: int = int(_get_env_value("PAYMENT_RECONCILE_MAX_AGE_HOURS", "24") or "24")
 
     # YooKassa receipt (54-FZ)
     # Some YooKassa shops require receipt data in every payment request.
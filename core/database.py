@@ -9,15 +9,54 @@ to switch to PostgreSQL or another database in the future.
 import aiosqlite
 import json
 import logging
+import sqlite3
+import time
+from aiosqlite.context import Result
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Dict, Optional, List
 from pathlib import Path
 
 from core.models import User, Tariff, Lesson, UserProgress, Referral, Assignment
 from core.config import Config
+from core.pricing_cache import PricingSnapshot, get_pricing_cache
+from core.sales_analytics import get_sales_analytics
+from utils.metrics import DB_QUERY_SECONDS, statement_label
 
 logger = logging.getLogger(__name__)
 
+# app_settings marker: rollup tables were built from the raw rows (bump to rebuild)
+_STATS_ROLLUP_SETTING = "stats_rollup_version"
+_STATS_ROLLUP_VERSION = "1"
+
+
+class _TimedConnection:
+    """
+    aiosqlite connection proxy that records per-statement latency (db_query_seconds).
+
+    Keeps the `await conn.execute(...)` / `async with conn.execute(...)` forms working;
+    everything else is delegated to the real connection.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql: str, parameters=None) -> Result:
+        return Result(self._timed(sql, self._conn.execute(sql, parameters)))
+
+    def executemany(self, sql: str, parameters) -> Result:
+        return Result(self._timed(sql, self._conn.executemany(sql, parameters)))
+
+    @staticmethod
+    async def _timed(sql: str, pending):
+        started = time.perf_counter()
+        try:
+            return await pending
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=statement_label(sql))
+
 
 class Database:
     """Database connection and query manager."""
@@ -29,8 +68,12 @@ class Database:
     
     async def connect(self):
         """Create database connection and initialize schema."""
-        self.conn = await aiosqlite.connect(self.db_path)
-        self.conn.row_factory = aiosqlite.Row
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        self.conn = _TimedConnection(conn)
+        if Config.WORKER_COUNT > 1:
+            # Several worker processes share the SQLite file: WAL lets readers run alongside a writer
+            await self.conn.execute("PRAGMA journal_mode=WAL")
         await self._init_schema()
     
     async def close(self):
@@ -271,6 +314,17 @@ class Database:
             CREATE INDEX IF NOT EXISTS idx_questions_answered_at
             ON questions(answered_at)
         """)
+        # Question lists (services/question_service.py): newest first, keyset-paginated.
+        # (answered_at, created_at): the unanswered backlog (answered_at IS NULL) comes
+        # ordered by creation time, so neither the filter nor the sort scans the table.
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_questions_answered_created
+            ON questions(answered_at, created_at)
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_questions_created_at
+            ON questions(created_at)
+        """)
 
         # Assignment intents ("user clicked submit assignment" flag)
         # Used to stop mentor reminders once the user has started submission flow,
@@ -284,6 +338,32 @@ class Database:
             )
         """)
 
+        # Leases (multi-process mode): worker heartbeats, user shard ownership, leader election.
+        # expires_at is a unix timestamp; an expired lease can be taken over by any worker.
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+        # Per-user conversation state (aiogram FSM + bots' "waiting for ..." contexts), see core/fsm_storage.py
+        # data is JSON; expires_at is a unix timestamp (sliding TTL, refreshed on every write).
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                state TEXT,
+                data TEXT,
+                expires_at REAL NOT NULL
+            )
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_fsm_state_user
+            ON fsm_state(user_id)
+        """)
+
         # Processed payments table (idempotency for webhooks)
         await self.conn.execute("""
             CREATE TABLE IF NOT EXISTS processed_payments (
@@ -292,6 +372,47 @@ class Database:
             )
         """)
 
+        # Payments created with the provider and not settled yet: checked by the
+        # reconciliation job (PaymentService.reconcile_pending_payments) in case the webhook never arrives
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_payments (
+                payment_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',  -- 'pending' | 'completed' | 'cancelled' | 'failed' | 'expired'
+                created_at TEXT NOT NULL,
+                check_count INTEGER NOT NULL DEFAULT 0,
+                next_check_at REAL NOT NULL,
+                checked_at TEXT
+            )
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pending_payments_due
+            ON pending_payments(status, next_check_at)
+        """)
+
+        # Durable inbox of payment provider webhooks (services/payment_inbox.py):
+        # the HTTP endpoint only inserts here, workers process with retries
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS payment_inbox (
+                inbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_key TEXT NOT NULL UNIQUE,  -- provider event + object id (dedup of provider retries)
+                payment_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',  -- 'pending' | 'done' | 'dead'
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                locked_by TEXT,
+                locked_until REAL,
+                last_error TEXT,
+                received_at TEXT NOT NULL,
+                processed_at TEXT
+            )
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_payment_inbox_due
+            ON payment_inbox(status, next_attempt_at)
+        """)
+
         # Payment events (sales / promo analytics)
         # NOTE: processed_payments only tracks idempotency; this table stores business metrics.
         await self.conn.execute("""
@@ -414,6 +535,66 @@ class Database:
             ON user_activity(user_id)
         """)
         
+        # Per-user, per-day rollups of user_sessions / user_activity (maintained by triggers);
+        # statistics read these, raw rows are compacted away after STATS_RAW_RETENTION_DAYS
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_session_daily (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                bot_type TEXT NOT NULL,
+                sessions INTEGER NOT NULL DEFAULT 0,
+                duration_seconds INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day, bot_type)
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_activity_daily (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                bot_type TEXT NOT NULL,
+                section TEXT NOT NULL DEFAULT '',
+                action_type TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day, bot_type, section, action_type)
+            ) WITHOUT ROWID
+        """)
+        # section NULL is stored as '' (NULLs never conflict in a primary key)
+        await self.conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_user_sessions_rollup_insert
+            AFTER INSERT ON user_sessions
+            BEGIN
+                INSERT INTO user_session_daily (user_id, day, bot_type, sessions, duration_seconds)
+                VALUES (NEW.user_id, COALESCE(date(NEW.session_start), substr(NEW.session_start, 1, 10)),
+                        NEW.bot_type, 1, COALESCE(NEW.duration_seconds, 0))
+                ON CONFLICT (user_id, day, bot_type) DO UPDATE SET
+                    sessions = sessions + 1,
+                    duration_seconds = duration_seconds + excluded.duration_seconds;
+            END
+        """)
+        await self.conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_user_sessions_rollup_duration
+            AFTER UPDATE OF duration_seconds ON user_sessions
+            BEGIN
+                UPDATE user_session_daily
+                SET duration_seconds = duration_seconds
+                    + COALESCE(NEW.duration_seconds, 0) - COALESCE(OLD.duration_seconds, 0)
+                WHERE user_id = OLD.user_id
+                  AND day = COALESCE(date(OLD.session_start), substr(OLD.session_start, 1, 10))
+                  AND bot_type = OLD.bot_type;
+            END
+        """)
+        await self.conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_user_activity_rollup_insert
+            AFTER INSERT ON user_activity
+            BEGIN
+                INSERT INTO user_activity_daily (user_id, day, bot_type, section, action_type, count)
+                VALUES (NEW.user_id, COALESCE(date(NEW.created_at), substr(NEW.created_at, 1, 10)),
+                        NEW.bot_type, COALESCE(NEW.section, ''), NEW.action_type, 1)
+                ON CONFLICT (user_id, day, bot_type, section, action_type) DO UPDATE SET
+                    count = count + 1;
+            END
+        """)
+        
         # Index for fast filtering users with access (used by schedulers)
         await self.conn.execute("""
             CREATE INDEX IF NOT EXISTS idx_users_tariff
@@ -427,6 +608,135 @@ class Database:
         """)
         
         await self.conn.commit()
+        await self._backfill_stats_rollups()
+
+    async def _backfill_stats_rollups(self):
+        """
+        One-time build of the rollup tables from the raw rows already in the database
+        (the triggers only see rows inserted after they were created).
+        """
+        async with self.conn.execute(
+            "SELECT value FROM app_settings WHERE key = ?", (_STATS_ROLLUP_SETTING,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row and row["value"] == _STATS_ROLLUP_VERSION:
+            return
+        try:
+            # IMMEDIATE: other workers' inserts wait, so the rebuilt rollups match the raw tables exactly
+            await self.conn.execute("BEGIN IMMEDIATE")
+            async with self.conn.execute(
+                "SELECT value FROM app_settings WHERE key = ?", (_STATS_ROLLUP_SETTING,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row and row["value"] == _STATS_ROLLUP_VERSION:
+                await self.conn.rollback()
+                return
+            await self.conn.execute("DELETE FROM user_session_daily")
+            await self.conn.execute("""
+                INSERT INTO user_session_daily (user_id, day, bot_type, sessions, duration_seconds)
+                SELECT user_id, COALESCE(date(session_start), substr(session_start, 1, 10)) AS d, bot_type,
+                       COUNT(*), COALESCE(SUM(duration_seconds), 0)
+                FROM user_sessions
+                GROUP BY user_id, d, bot_type
+            """)
+            await self.conn.execute("DELETE FROM user_activity_daily")
+            await self.conn.execute("""
+                INSERT INTO user_activity_daily (user_id, day, bot_type, section, action_type, count)
+                SELECT user_id, COALESCE(date(created_at), substr(created_at, 1, 10)) AS d, bot_type,
+                       COALESCE(section, '') AS s, action_type, COUNT(*)
+                FROM user_activity
+                GROUP BY user_id, d, bot_type, s, action_type
+            """)
+            await self.conn.execute("""
+                INSERT INTO app_settings (key, value, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+            """, (_STATS_ROLLUP_SETTING, _STATS_ROLLUP_VERSION, datetime.utcnow().isoformat()))
+            await self.conn.commit()
+            logger.info("📊 Statistics rollups built from existing sessions/activity")
+        except Exception:
+            try:
+                await self.conn.rollback()
+            except Exception:
+                pass
+            raise
+
+    # Leases (multi-process coordination, see core/cluster.py)
+    async def try_acquire_lease(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """
+        Acquire or renew lease `name` for `owner`.
+
+        Single statement, so it is atomic across processes: succeeds if the lease is free,
+        expired, or already held by `owner`. Returns True if `owner` holds the lease now.
+        """
+        await self._ensure_connection()
+        now = time.time()
+        cursor = await self.conn.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """,
+            (name, owner, now + float(ttl_seconds), now),
+        )
+        await self.conn.commit()
+        return cursor.rowcount == 1
+
+    async def release_lease(self, name: str, owner: str):
+        """Release lease `name` if it is held by `owner`."""
+        await self._ensure_connection()
+        await self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+        await self.conn.commit()
+
+    async def get_live_leases(self, prefix: str) -> dict[str, str]:
+        """Return {lease_name: owner} for unexpired leases whose name starts with `prefix`."""
+        await self._ensure_connection()
+        async with self.conn.execute(
+            "SELECT name, owner FROM leases WHERE name LIKE ? AND expires_at >= ?",
+            (f"{prefix}%", time.time()),
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return {row["name"]: row["owner"] for row in rows}
+
+    # Conversation state (see core/fsm_storage.py)
+    async def get_user_fsm_records(self, user_id: int) -> dict[str, tuple]:
+        """Return {key: (state, data_json, expires_at)} for all unexpired records of a user."""
+        await self._ensure_connection()
+        async with self.conn.execute(
+            "SELECT key, state, data, expires_at FROM fsm_state WHERE user_id = ? AND expires_at >= ?",
+            (int(user_id), time.time()),
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return {row["key"]: (row["state"], row["data"], row["expires_at"]) for row in rows}
+
+    async def write_fsm_records(self, upserts: List[tuple], deletes: List[str]):
+        """
+        Apply a batch of state changes in one transaction.
+
+        upserts: [(key, user_id, state, data_json, expires_at)]; deletes: [key].
+        """
+        if not upserts and not deletes:
+            return
+        await self._ensure_connection()
+        if upserts:
+            await self.conn.executemany(
+                """
+                INSERT INTO fsm_state (key, user_id, state, data, expires_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state=excluded.state, data=excluded.data, expires_at=excluded.expires_at
+                """,
+                upserts,
+            )
+        if deletes:
+            await self.conn.executemany("DELETE FROM fsm_state WHERE key = ?", [(k,) for k in deletes])
+        await self.conn.commit()
+
+    async def purge_expired_fsm_records(self) -> int:
+        """Delete expired state records. Returns number of deleted rows."""
+        await self._ensure_connection()
+        cursor = await self.conn.execute("DELETE FROM fsm_state WHERE expires_at < ?", (time.time(),))
+        await self.conn.commit()
+        return cursor.rowcount or 0
 
     # Payment operations (webhook idempotency)
     async def is_payment_processed(self, payment_id: str) -> bool:
@@ -465,9 +775,153 @@ class Database:
         await self.conn.commit()
         return cursor.rowcount == 1
 
+    # Pending payments (reconciliation of payments whose webhook never arrived)
+    async def add_pending_payment(self, payment_id: str, user_id: int, first_check_at: float):
+        await self._ensure_connection()
+        await self.conn.execute(
+            """
+            INSERT OR IGNORE INTO pending_payments (payment_id, user_id, created_at, next_check_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (payment_id, int(user_id), datetime.utcnow().isoformat(), float(first_check_at)),
+        )
+        await self.conn.commit()
+
+    async def get_due_pending_payments(self, limit: int, max_age_hours: float) -> List[dict]:
+        """
+        Pending payments due for a status check, oldest due first.
+
+        Payments older than `max_age_hours` are marked 'expired' first (the provider cancels
+        unpaid payments long before that); payments already processed are skipped.
+        """
+        await self._ensure_connection()
+        cutoff = (datetime.utcnow() - timedelta(hours=max_age_hours)).isoformat()
+        await self.conn.execute(
+            "UPDATE pending_payments SET status = 'expired' WHERE status = 'pending' AND created_at < ?",
+            (cutoff,),
+        )
+        await self.conn.commit()
+        async with self.conn.execute(
+            """
+            SELECT payment_id, user_id, check_count FROM pending_payments
+            WHERE status = 'pending' AND next_check_at <= ?
+              AND NOT EXISTS (SELECT 1 FROM processed_payments p WHERE p.payment_id = pending_payments.payment_id)
+            ORDER BY next_check_at
+            LIMIT ?
+            """,
+            (time.time(), int(limit)),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+    async def update_pending_payments(self, checks: List[tuple]):
+        """Record status checks: (payment_id, status, next_check_at) tuples, in one transaction."""
+        if not checks:
+            return
+        await self._ensure_connection()
+        now = datetime.utcnow().isoformat()
+        await self.conn.executemany(
+            """
+            UPDATE pending_payments
+            SET status = ?, next_check_at = ?, check_count = check_count + 1, checked_at = ?
+            WHERE payment_id = ? AND status = 'pending'
+            """,
+            [(status, float(next_check_at), now, payment_id) for payment_id, status, next_check_at in checks],
+        )
+        await self.conn.commit()
+
+    # Payment webhook inbox (see services/payment_inbox.py)
+    async def enqueue_payment_webhook(self, event_key: str, payment_id: str, payload: str) -> bool:
+        """Persist a raw webhook. Returns False if this event was already received."""
+        await self._ensure_connection()
+        cursor = await self.conn.execute(
+            """
+            INSERT OR IGNORE INTO payment_inbox (event_key, payment_id, payload, next_attempt_at, received_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (event_key, payment_id, payload, time.time(), datetime.utcnow().isoformat()),
+        )
+        await self.conn.commit()
+        return cursor.rowcount == 1
+
+    async def claim_payment_inbox(self, owner: str, limit: int, lock_seconds: float) -> List[dict]:
+        """
+        Lock up to `limit` due pending events for `owner` and return them.
+
+        The lock expires after `lock_seconds`, so events of a crashed worker are picked up again.
+        """
+        await self._ensure_connection()
+        now = time.time()
+        async with self.conn.execute(
+            """
+            UPDATE payment_inbox
+            SET locked_by = ?, locked_until = ?
+            WHERE inbox_id IN (
+                SELECT inbox_id FROM payment_inbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                  AND (locked_until IS NULL OR locked_until < ?)
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+            RETURNING inbox_id, event_key, payment_id, payload, attempts
+            """,
+            (owner, now + lock_seconds, now, now, int(limit)),
+        ) as cursor:
+            rows = [dict(row) for row in await cursor.fetchall()]
+        await self.conn.commit()
+        return rows
+
+    async def complete_payment_inbox(self, inbox_id: int):
+        await self._ensure_connection()
+        await self.conn.execute(
+            """
+            UPDATE payment_inbox
+            SET status = 'done', attempts = attempts + 1, processed_at = ?, locked_by = NULL, locked_until = NULL
+            WHERE inbox_id = ?
+            """,
+            (datetime.utcnow().isoformat(), inbox_id),
+        )
+        await self.conn.commit()
+
+    async def fail_payment_inbox(self, inbox_id: int, error: str, retry_at: Optional[float]):
+        """Record a failed attempt: retry at `retry_at` (unix time), or dead-letter if None."""
+        await self._ensure_connection()
+        await self.conn.execute(
+            """
+            UPDATE payment_inbox
+            SET status = ?, attempts = attempts + 1, next_attempt_at = COALESCE(?, next_attempt_at),
+                last_error = ?, locked_by = NULL, locked_until = NULL
+            WHERE inbox_id = ?
+            """,
+            ("pending" if retry_at is not None else "dead", retry_at, (error or "")[:1000], inbox_id),
+        )
+        await self.conn.commit()
+
+    async def get_payment_inbox_counts(self) -> dict:
+        """{status: count} plus 'oldest_pending_at' (unix time of the oldest due event, or None)."""
+        await self._ensure_connection()
+        counts = {"pending": 0, "done": 0, "dead": 0}
+        async with self.conn.execute("SELECT status, COUNT(*) FROM payment_inbox GROUP BY status") as cursor:
+            for status, count in await cursor.fetchall():
+                counts[status] = count
+        async with self.conn.execute(
+            "SELECT MIN(next_attempt_at) FROM payment_inbox WHERE status = 'pending'"
+        ) as cursor:
+            counts["oldest_pending_at"] = (await cursor.fetchone())[0]
+        return counts
+
+    async def purge_payment_inbox(self, older_than_days: int = 30) -> int:
+        """Delete processed events older than `older_than_days` (dead letters are kept)."""
+        await self._ensure_connection()
+        cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).isoformat()
+        cursor = await self.conn.execute(
+            "DELETE FROM payment_inbox WHERE status = 'done' AND processed_at < ?", (cutoff,)
+        )
+        await self.conn.commit()
+        return cursor.rowcount or 0
+
     # Payment analytics / sales events
-    async def record_payment_event(
-        self,
+    @staticmethod
+    def _payment_event_params(
         *,
         payment_id: Optional[str],
         user_id: int,
@@ -483,14 +937,14 @@ class Database:
         promo_discount_amount: Optional[float] = None,
         source: str = "payment",
         created_at: Optional[str] = None,
-    ) -> bool:
-        await self._ensure_connection()
+    ) -> Optional[tuple]:
+        """Normalized parameters of _PAYMENT_EVENT_INSERT (see record_payment_event); None without a tariff."""
         now = (created_at or datetime.utcnow().isoformat())
         pid = (payment_id or "").strip() or None
         program = (course_program or "online").strip().lower() or "online"
         tariff_norm = (tariff or "").strip().lower()
         if not tariff_norm:
-            return False
+            return None
 
         promo = (promo_code or "").strip() or None
         promo_type = (promo_discount_type or "").strip().lower() or None
@@ -512,97 +966,203 @@ class Database:
         except Exception:
             p = None
 
+        cur = (currency or "").strip().upper() or None
+        return (
+            pid,
+            int(user_id),
+            program,
+            tariff_norm,
+            1 if is_upgrade else 0,
+            b,
+            p,
+            cur,
+            promo,
+            promo_type,
+            promo_val,
+            promo_amt,
+            (source or "payment").strip().lower(),
+            now,
+        )
+
+    _PAYMENT_EVENT_INSERT = """
+        INSERT OR IGNORE INTO payment_events (
+            payment_id, user_id, course_program, tariff, is_upgrade,
+            base_amount, paid_amount, currency,
+            promo_code, promo_discount_type, promo_discount_value, promo_discount_amount,
+            source, created_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    async def record_payment_event(
+        self,
+        *,
+        payment_id: Optional[str],
+        user_id: int,
+        course_program: str,
+        tariff: str,
+        is_upgrade: bool,
+        base_amount: Optional[float],
+        paid_amount: Optional[float],
+        currency: Optional[str],
+        promo_code: Optional[str] = None,
+        promo_discount_type: Optional[str] = None,
+        promo_discount_value: Optional[float] = None,
+        promo_discount_amount: Optional[float] = None,
+        source: str = "payment",
+        created_at: Optional[str] = None,
+    ) -> bool:
+        await self._ensure_connection()
+        params = self._payment_event_params(
+            payment_id=payment_id, user_id=user_id, course_program=course_program, tariff=tariff,
+            is_upgrade=is_upgrade, base_amount=base_amount, paid_amount=paid_amount, currency=currency,
+            promo_code=promo_code, promo_discount_type=promo_discount_type,
+            promo_discount_value=promo_discount_value, promo_discount_amount=promo_discount_amount,
+            source=source, created_at=created_at,
+        )
+        if params is None:
+            return False
         try:
-            cur = (currency or "").strip().upper() or None
-            await self.conn.execute(
-                """
-                INSERT OR IGNORE INTO payment_events (
-                    payment_id, user_id, course_program, tariff, is_upgrade,
-                    base_amount, paid_amount, currency,
-                    promo_code, promo_discount_type, promo_discount_value, promo_discount_amount,
-                    source, created_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    pid,
-                    int(user_id),
-                    program,
-                    tariff_norm,
-                    1 if is_upgrade else 0,
-                    b,
-                    p,
-                    cur,
-                    promo,
-                    promo_type,
-                    promo_val,
-                    promo_amt,
-                    (source or "payment").strip().lower(),
-                    now,
-                ),
-            )
+            await self.conn.execute(self._PAYMENT_EVENT_INSERT, params)
             await self.conn.commit()
-            return True
         except Exception:
             return False
+        try:
+            await get_sales_analytics(self.db_path).sync(self.conn)
+        except Exception as e:
+            # Not fatal: the next get_sales_overview catches up from the watermark
+            logger.warning(f"⚠️ Sales analytics update failed: {e}")
+        return True
 
-    async def get_sales_overview(self, *, top_promos: int = 10, top_tariffs: int = 20) -> dict:
+    async def complete_payment(
+        self,
+        payment_id: str,
+        *,
+        user_id: int,
+        tariff: str,
+        is_upgrade: bool,
+        start_date: Optional[datetime] = None,
+        referral_partner_id: Optional[str] = None,
+        event: Optional[dict] = None,
+        promo_code: Optional[str] = None,
+    ) -> bool:
+        """
+        Claim `payment_id` and apply the payment in one transaction.
+
+        Inserting into processed_payments claims the payment: a concurrent or repeated
+        completion hits its primary key and changes nothing. In the same transaction:
+        - new access: the user (created if missing) gets `tariff`, `start_date`, current_day = 0
+          and the referral, unless they already have access (as UserService.grant_access);
+        - upgrade: the user's tariff is changed (LookupError if the user does not exist);
+        - the payment_events row `event` (keyword arguments of record_payment_event) is inserted;
+        - `promo_code` usage is counted and the user's promo binding cleared.
+
+        Runs on its own short-lived connection, so statements of other coroutines sharing
+        self.conn cannot end up in (or commit) this transaction.
+
+        Returns True if this call applied the payment, False if it was already processed.
+        """
         await self._ensure_connection()
+        now = datetime.utcnow().isoformat()
+        user_id = int(user_id)
+        event_params = self._payment_event_params(**event) if event else None
 
-        async with self.conn.execute(
-            """
-            SELECT
-                COUNT(*) AS total_events,
-                COUNT(DISTINCT user_id) AS users_total,
-                SUM(CASE WHEN COALESCE(paid_amount, 0) > 0.01 THEN 1 ELSE 0 END) AS paid_events,
-                SUM(CASE WHEN COALESCE(paid_amount, 0) > 0.01 THEN COALESCE(paid_amount, 0) ELSE 0 END) AS paid_total,
-                SUM(COALESCE(base_amount, 0)) AS base_total,
-                SUM(COALESCE(promo_discount_amount, 0)) AS promo_discount_total,
-                SUM(CASE WHEN promo_code IS NOT NULL AND promo_code != '' THEN 1 ELSE 0 END) AS promo_applied_events,
-                COUNT(DISTINCT CASE WHEN promo_code IS NOT NULL AND promo_code != '' THEN promo_code END) AS promo_unique_codes,
-                MIN(created_at) AS first_event_at,
-                MAX(created_at) AS last_event_at
-            FROM payment_events
-            """
-        ) as c:
-            row = await c.fetchone()
+        raw = await aiosqlite.connect(self.db_path, timeout=30.0, isolation_level=None)
+        tx = _TimedConnection(raw)
+        try:
+            await tx.execute("BEGIN IMMEDIATE")
+            try:
+                await tx.execute(
+                    "INSERT INTO processed_payments (payment_id, processed_at) VALUES (?, ?)",
+                    (payment_id, now),
+                )
+            except sqlite3.IntegrityError:
+                await tx.execute("ROLLBACK")
+                return False
+            try:
+                if is_upgrade:
+                    cursor = await tx.execute(
+                        "UPDATE users SET tariff = ?, updated_at = ? WHERE user_id = ?",
+                        (tariff, now, user_id),
+                    )
+                    if cursor.rowcount != 1:
+                        raise LookupError(f"User {user_id} not found for upgrade")
+                else:
+                    await tx.execute(
+                        """
+                        INSERT OR IGNORE INTO users (user_id, mentor_reminders, created_at, updated_at)
+                        VALUES (?, 0, ?, ?)
+                        """,
+                        (user_id, now, now),
+                    )
+                    cursor = await tx.execute(
+                        """
+                        UPDATE users
+                        SET tariff = ?, start_date = ?, current_day = 0, referral_partner_id = ?, updated_at = ?
+                        WHERE user_id = ? AND NOT (tariff IS NOT NULL AND COALESCE(is_blocked, 0) = 0)
+                        """,
+                        (tariff, start_date.isoformat() if start_date else None, referral_partner_id, now, user_id),
+                    )
+                    if cursor.rowcount == 1 and referral_partner_id:
+                        await tx.execute(
+                            """
+                            INSERT OR IGNORE INTO referrals (partner_id, referred_user_id, created_at)
+                            VALUES (?, ?, ?)
+                            """,
+                            (referral_partner_id, user_id, now),
+                        )
+                if event_params is not None:
+                    await tx.execute(self._PAYMENT_EVENT_INSERT, event_params)
+                await tx.execute(
+                    "UPDATE pending_payments SET status = 'completed', checked_at = ? WHERE payment_id = ?",
+                    (now, payment_id),
+                )
+                promo_code = (promo_code or "").strip()
+                if promo_code:
+                    await tx.execute(
+                        """
+                        UPDATE promo_codes
+                        SET used_count = used_count + 1
+                        WHERE code = ?
+                          AND active = 1
+                          AND (max_uses IS NULL OR used_count < max_uses)
+                          AND (expires_at IS NULL OR expires_at > ?)
+                        """,
+                        (promo_code, now),
+                    )
+                    await tx.execute("DELETE FROM user_promo_codes WHERE user_id = ?", (user_id,))
+                await tx.execute("COMMIT")
+            except BaseException:
+                await tx.execute("ROLLBACK")
+                raise
+        finally:
+            await raw.close()
 
-        async with self.conn.execute(
-            """
-            SELECT
-                course_program,
-                tariff,
-                COUNT(*) AS cnt,
-                COUNT(DISTINCT user_id) AS users,
-                SUM(COALESCE(paid_amount, 0)) AS paid_total,
-                SUM(COALESCE(base_amount, 0)) AS base_total,
-                SUM(COALESCE(promo_discount_amount, 0)) AS discount_total
-            FROM payment_events
-            GROUP BY course_program, tariff
-            ORDER BY paid_total DESC, cnt DESC
-            LIMIT ?
-            """,
-            (int(top_tariffs),),
-        ) as c:
-            by_tariff = [dict(r) for r in await c.fetchall()]
+        if promo_code:
+            get_pricing_cache(self.db_path).invalidate()
+        if event_params is not None:
+            try:
+                await get_sales_analytics(self.db_path).sync(self.conn)
+            except Exception as e:
+                logger.warning(f"⚠️ Sales analytics update failed: {e}")
+        return True
 
-        async with self.conn.execute(
-            """
-            SELECT
-                promo_code,
-                COUNT(*) AS cnt,
-                COUNT(DISTINCT user_id) AS users,
-                SUM(COALESCE(promo_discount_amount, 0)) AS discount_total,
-                SUM(COALESCE(paid_amount, 0)) AS paid_total
-            FROM payment_events
-            WHERE promo_code IS NOT NULL AND promo_code != ''
-            GROUP BY promo_code
-            ORDER BY cnt DESC, discount_total DESC
-            LIMIT ?
-            """,
-            (int(top_promos),),
-        ) as c:
-            promos = [dict(r) for r in await c.fetchall()]
+    async def get_sales_overview(self, *, top_promos: int = 10, top_tariffs: int = 20) -> dict:
+        """
+        Totals, per tariff and per promo code, plus day / week series ("by_day", "by_week").
+
+        Served from the in-memory aggregates of core/sales_analytics.py; only events added
+        since the previous call are read from payment_events.
+        """
+        await self._ensure_connection()
+        analytics = get_sales_analytics(self.db_path)
+        await analytics.sync(self.conn)
+        if analytics.verify_due():
+            await analytics.verify(self.conn)
+        aggregates = analytics.aggregates
+        result = aggregates.overview(top_promos=top_promos, top_tariffs=top_tariffs)
+        result["by_day"] = aggregates.series("day", 14)
+        result["by_week"] = aggregates.series("week", 8)
 
         # Promo codes table overview (may differ from events if events weren't recorded historically)
         async with self.conn.execute(
@@ -616,12 +1176,8 @@ class Database:
         ) as c:
             promo_table = await c.fetchone()
 
-        return {
-            "overview": dict(row) if row else {},
-            "by_tariff": by_tariff,
-            "top_promos": promos,
-            "promo_table": dict(promo_table) if promo_table else {},
-        }
+        result["promo_table"] = dict(promo_table) if promo_table else {}
+        return result
 
     async def reset_user_data(self, user_id: int):
         """
@@ -696,6 +1252,34 @@ class Database:
         )
         await self.conn.commit()
 
+    async def get_media_file_ids(self, day_number: int, prefix: str = "") -> Dict[str, str]:
+        """All cached Telegram file_ids of a lesson (markers starting with `prefix`), in one query."""
+        await self._ensure_connection()
+        async with self.conn.execute(
+            "SELECT marker_id, telegram_file_id FROM media_file_ids WHERE day_number = ? AND marker_id LIKE ? ESCAPE '\\'",
+            (day_number, prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"),
+        ) as cursor:
+            return {row["marker_id"]: row["telegram_file_id"] for row in await cursor.fetchall()}
+
+    async def save_media_file_ids(self, day_number: int, media_type: str, file_ids: Dict[str, str]):
+        """Save several marker -> Telegram file_id pairs of a lesson in one transaction."""
+        if not file_ids:
+            return
+        await self._ensure_connection()
+        now = datetime.utcnow().isoformat()
+        await self.conn.executemany(
+            """
+            INSERT INTO media_file_ids (marker_id, day_number, media_type, telegram_file_id, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(marker_id, day_number) DO UPDATE SET
+                telegram_file_id=excluded.telegram_file_id,
+                media_type=excluded.media_type,
+                updated_at=excluded.updated_at
+            """,
+            [(marker_id, day_number, media_type, file_id, now) for marker_id, file_id in file_ids.items()],
+        )
+        await self.conn.commit()
+
     # Pricing settings (stored in app_settings)
     @staticmethod
     def _online_price_key(tariff_value: str) -> str:
@@ -705,29 +1289,28 @@ class Database:
     def _offline_price_key(tariff_key: str) -> str:
         return f"price:offline:{(tariff_key or '').strip().lower()}"
 
+    async def _pricing(self) -> PricingSnapshot:
+        """Prices / promo codes snapshot (core/pricing_cache.py); no query while it is fresh."""
+        cache = get_pricing_cache(self.db_path)
+        snapshot = cache.fresh()
+        if snapshot is None:
+            await self._ensure_connection()
+            snapshot = await cache.load(self.conn)
+        return snapshot
+
     async def get_online_tariff_price(self, tariff: Tariff, default: float) -> float:
-        raw = await self.get_setting(self._online_price_key(tariff.value))
-        if raw is None:
-            return float(default)
-        try:
-            return float(str(raw).strip())
-        except Exception:
-            return float(default)
+        return (await self._pricing()).price(self._online_price_key(tariff.value), default)
 
     async def set_online_tariff_price(self, tariff: Tariff, price: float):
         await self.set_setting(self._online_price_key(tariff.value), str(float(price)))
+        get_pricing_cache(self.db_path).invalidate()
 
     async def get_offline_tariff_price(self, tariff_key: str, default: float) -> float:
-        raw = await self.get_setting(self._offline_price_key(tariff_key))
-        if raw is None:
-            return float(default)
-        try:
-            return float(str(raw).strip())
-        except Exception:
-            return float(default)
+        return (await self._pricing()).price(self._offline_price_key(tariff_key), default)
 
     async def set_offline_tariff_price(self, tariff_key: str, price: float):
         await self.set_setting(self._offline_price_key(tariff_key), str(float(price)))
+        get_pricing_cache(self.db_path).invalidate()
 
     # Promo codes
     async def create_promo_code(
@@ -758,8 +1341,10 @@ class Database:
             ),
         )
         await self.conn.commit()
+        get_pricing_cache(self.db_path).invalidate()
 
     async def get_valid_promo_code(self, code: str) -> Optional[dict]:
+        """Promo code if it can be used right now (point query; use this when a payment is created)."""
         await self._ensure_connection()
         code = (code or "").strip()
         if not code:
@@ -789,6 +1374,13 @@ class Database:
                 return None
             return dict(row)
 
+    async def get_cached_promo_code(self, code: str) -> Optional[dict]:
+        """Promo code from the pricing snapshot, for rendering menus; may lag other processes by pricing_cache.TTL_SECONDS."""
+        code = (code or "").strip()
+        if not code:
+            return None
+        return (await self._pricing()).valid_promo(code)
+
     async def increment_promo_code_use(self, code: str) -> bool:
         await self._ensure_connection()
         code = (code or "").strip()
@@ -806,6 +1398,7 @@ class Database:
             (code, datetime.utcnow().isoformat()),
         )
         await self.conn.commit()
+        get_pricing_cache(self.db_path).invalidate()
         return cursor.rowcount == 1
 
     async def list_promo_codes(self, limit: int = 20, *, active_only: bool = True) -> list[dict]:
@@ -835,6 +1428,7 @@ class Database:
             (code,),
         )
         await self.conn.commit()
+        get_pricing_cache(self.db_path).invalidate()
         return cursor.rowcount == 1
 
     # User promo codes
@@ -968,12 +1562,23 @@ class Database:
             logger.error(f"Error unblocking user {user_id}: {e}", exc_info=True)
             return False
     
-    async def get_users_with_access(self) -> List[User]:
-        """Get all users with active course access."""
+    async def get_users_with_access(self, shards: Optional[set] = None, shard_count: int = 1) -> List[User]:
+        """
+        Get all users with active course access.
+
+        In multi-process mode pass the shards owned by this worker: only users with
+        user_id % shard_count in `shards` are returned.
+        """
         await self._ensure_connection()
-        async with self.conn.execute(
-            "SELECT * FROM users WHERE tariff IS NOT NULL"
-        ) as cursor:
+        query = "SELECT * FROM users WHERE tariff IS NOT NULL"
+        params: list = []
+        if shards is not None and shard_count > 1:
+            if not shards:
+                return []
+            placeholders = ", ".join("?" for _ in shards)
+            query += f" AND ((user_id % ?) + ?) % ? IN ({placeholders})"
+            params = [shard_count, shard_count, shard_count, *sorted(shards)]
+        async with self.conn.execute(query, params) as cursor:
             rows = await cursor.fetchall()
             return [self._row_to_user(row) for row in rows]
     
@@ -1297,93 +1902,121 @@ class Database:
     
     async def get_user_statistics(self, user_id: int) -> dict:
         """Get detailed statistics for a user."""
+        return (await self.get_users_statistics([user_id]))[int(user_id)]
+
+    async def get_users_statistics(self, user_ids: List[int]) -> dict[int, dict]:
+        """
+        Statistics for many users at once: {user_id: stats} (same shape as get_user_statistics).
+
+        Three GROUP BY queries regardless of the number of users; ids are passed as a single
+        JSON array parameter (json_each), so there is no SQLite bound-variable limit to chunk around.
+        Sessions and activity come from the per-day rollups, so the cost depends on the number of
+        active days, not on the raw history (which is compacted, see compact_statistics).
+        """
         await self._ensure_connection()
-        
-        stats = {
-            "user_id": user_id,
-            "total_online_time_seconds": 0,
-            "total_bot_visits": 0,
-            "sales_bot_visits": 0,
-            "course_bot_visits": 0,
-            "questions_count": 0,
-            "assignments_submitted": 0,
-            "assignments_completed": 0,
-            "activity_by_section": {},
-            "activity_by_action": {}
+        ids = [int(uid) for uid in dict.fromkeys(user_ids)]
+        result = {
+            uid: {
+                "user_id": uid,
+                "total_online_time_seconds": 0,
+                "total_bot_visits": 0,
+                "sales_bot_visits": 0,
+                "course_bot_visits": 0,
+                "questions_count": 0,
+                "assignments_submitted": 0,
+                "assignments_completed": 0,
+                "activity_by_section": {},
+                "activity_by_action": {},
+            }
+            for uid in ids
         }
-        
-        # Total online time
-        async with self.conn.execute("""
-            SELECT SUM(duration_seconds) as total_time
-            FROM user_sessions
-            WHERE user_id = ? AND duration_seconds IS NOT NULL
-        """, (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            stats["total_online_time_seconds"] = row[0] if row and row[0] else 0
-        
-        # Bot visits
+        if not ids:
+            return result
+        ids_json = json.dumps(ids)
+
+        # Online time + visits per bot
         async with self.conn.execute("""
-            SELECT bot_type, COUNT(*) as count
-            FROM user_sessions
-            WHERE user_id = ?
-            GROUP BY bot_type
-        """, (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-            for row in rows:
-                count = row[1]
+            SELECT user_id, bot_type, SUM(sessions), SUM(duration_seconds)
+            FROM user_session_daily
+            WHERE user_id IN (SELECT value FROM json_each(?))
+            GROUP BY user_id, bot_type
+        """, (ids_json,)) as cursor:
+            for user_id, bot_type, count, duration in await cursor.fetchall():
+                stats = result[user_id]
+                stats["total_online_time_seconds"] += duration or 0
                 stats["total_bot_visits"] += count
-                if row[0] == "sales":
+                if bot_type == "sales":
                     stats["sales_bot_visits"] = count
-                elif row[0] == "course":
+                elif bot_type == "course":
                     stats["course_bot_visits"] = count
-        
-        # Questions count - we'll need to track this separately, for now estimate from activity
-        async with self.conn.execute("""
-            SELECT COUNT(*) FROM user_activity
-            WHERE user_id = ? AND action_type = 'question'
-        """, (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            stats["questions_count"] = row[0] if row else 0
-        
-        # Assignments
-        async with self.conn.execute("""
-            SELECT COUNT(*) FROM assignments WHERE user_id = ?
-        """, (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            stats["assignments_submitted"] = row[0] if row else 0
-        
-        async with self.conn.execute("""
-            SELECT COUNT(*) FROM assignments
-            WHERE user_id = ? AND admin_feedback IS NOT NULL AND admin_feedback != ''
-        """, (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            stats["assignments_completed"] = row[0] if row else 0
-        
-        # Activity by section
+
+        # Activity: sections, actions and questions from one pass
+        sections: dict[int, dict] = {uid: {} for uid in ids}
+        actions: dict[int, dict] = {uid: {} for uid in ids}
         async with self.conn.execute("""
-            SELECT section, COUNT(*) as count
-            FROM user_activity
-            WHERE user_id = ? AND section IS NOT NULL
-            GROUP BY section
-            ORDER BY count DESC
-        """, (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-            for row in rows:
-                stats["activity_by_section"][row[0]] = row[1]
-        
-        # Activity by action
+            SELECT user_id, NULLIF(section, ''), action_type, SUM(count)
+            FROM user_activity_daily
+            WHERE user_id IN (SELECT value FROM json_each(?))
+            GROUP BY user_id, section, action_type
+        """, (ids_json,)) as cursor:
+            for user_id, section, action_type, count in await cursor.fetchall():
+                if section is not None:
+                    sections[user_id][section] = sections[user_id].get(section, 0) + count
+                actions[user_id][action_type] = actions[user_id].get(action_type, 0) + count
+        for uid in ids:
+            # Most frequent first, like the per-user queries used to return them
+            result[uid]["activity_by_section"] = dict(sorted(sections[uid].items(), key=lambda kv: kv[1], reverse=True))
+            result[uid]["activity_by_action"] = dict(sorted(actions[uid].items(), key=lambda kv: kv[1], reverse=True))
+            result[uid]["questions_count"] = actions[uid].get("question", 0)
+
+        # Assignments: submitted / with feedback
         async with self.conn.execute("""
-            SELECT action_type, COUNT(*) as count
-            FROM user_activity
-            WHERE user_id = ?
-            GROUP BY action_type
-            ORDER BY count DESC
-        """, (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-            for row in rows:
-                stats["activity_by_action"][row[0]] = row[1]
-        
-        return stats
+            SELECT user_id, COUNT(*),
+                   SUM(CASE WHEN admin_feedback IS NOT NULL AND admin_feedback != '' THEN 1 ELSE 0 END)
+            FROM assignments
+            WHERE user_id IN (SELECT value FROM json_each(?))
+            GROUP BY user_id
+        """, (ids_json,)) as cursor:
+            for user_id, submitted, completed in await cursor.fetchall():
+                result[user_id]["assignments_submitted"] = submitted
+                result[user_id]["assignments_completed"] = completed or 0
+
+        return result
+
+    async def compact_statistics(self, retention_days: Optional[int] = None, batch_size: int = 5000) -> int:
+        """
+        Delete raw user_sessions / user_activity rows older than the retention window.
+
+        Their counts are already in the daily rollups, so statistics don't change. Rows go
+        in small batches (short write locks for the bots); freed pages are reused by new
+        rows, so the database file stops growing. Returns the number of deleted rows.
+        """
+        await self._ensure_connection()
+        days = Config.STATS_RAW_RETENTION_DAYS if retention_days is None else retention_days
+        if days <= 0:
+            return 0
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        deleted = 0
+        for table, id_column, time_column in (
+            ("user_sessions", "session_id", "session_start"),
+            ("user_activity", "activity_id", "created_at"),
+        ):
+            while True:
+                # Oldest rows have the lowest ids: the rowid scan stops right after the batch
+                cursor = await self.conn.execute(f"""
+                    DELETE FROM {table} WHERE {id_column} IN (
+                        SELECT {id_column} FROM {table}
+                        WHERE {time_column} < ?
+                        ORDER BY {id_column}
+                        LIMIT ?
+                    )
+                """, (cutoff, batch_size))
+                await self.conn.commit()
+                count = cursor.rowcount or 0
+                deleted += count
+                if count < batch_size:
+                    break
+        return deleted
     
     # Helper methods for row conversion
     def _row_to_user(self, row) -> User:
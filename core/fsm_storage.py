@@ -0,0 +1,359 @@
+"""
+Persistent conversation state for the bots.
+
+`DatabaseStorage` is an aiogram FSM storage backed by the `fsm_state` table,
+with an in-memory LRU front:
+
+- reads are served from memory; on the first update of a user all of that
+  user's records are loaded with one query (aiogram's FSM middleware reads the
+  state of every update, which is what triggers the warm-up);
+- writes only touch memory and are flushed to the database in batches every
+  couple of seconds (and on shutdown); a value read through `UserStateMap` is
+  written only if it changed in place since it was last saved;
+- every record has a sliding TTL, so abandoned "waiting for ..." flows expire
+  both in memory and in the database;
+- the LRU front holds at most FSM_CACHE_MAX_ENTRIES records; evicted records
+  are written out before they are dropped.
+
+Besides the standard FSM API, `user_map(namespace)` returns a dict-like
+`UserStateMap` (user_id -> JSON-serializable value), so the existing
+`self._user_..._context[user_id] = {...}` code keeps working unchanged.
+
+In multi-process mode all updates of a user go to the same worker (see
+core/supervisor.py), so the per-process cache never serves stale state.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Iterator, Optional
+
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from core.config import Config
+
+logger = logging.getLogger(__name__)
+
+_PURGE_INTERVAL_SECONDS = 600.0
+# A value read through UserStateMap is compared with its saved copy at the flushes this long after the read
+_WATCH_SECONDS = 60.0
+
+
+class _Entry:
+    __slots__ = ("user_id", "state", "data", "expires_at", "saved")
+
+    def __init__(self, user_id: int, state: Optional[str], data: Any, expires_at: float,
+                 saved: Optional[tuple[str, float]] = None):
+        self.user_id = user_id
+        self.state = state
+        self.data = data
+        self.expires_at = expires_at
+        # (data JSON, expires_at) as in the database; None: not written yet
+        self.saved = saved
+
+
+class DatabaseStorage(BaseStorage):
+    """aiogram FSM storage: LRU + TTL in memory, batched writes to the database."""
+
+    def __init__(
+        self,
+        db,
+        *,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        flush_interval_seconds: float = 2.0,
+    ):
+        self.db = db
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else Config.FSM_STATE_TTL_HOURS * 3600)
+        self.max_entries = max(int(max_entries if max_entries is not None else Config.FSM_CACHE_MAX_ENTRIES), 1)
+        self.flush_interval_seconds = flush_interval_seconds
+
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Cached keys whose value must be written on the next flush
+        self._dirty: set[str] = set()
+        # Keys read through UserStateMap (value may be changed in place) -> when last read
+        self._watched: dict[str, float] = {}
+        # Evicted (entry) or deleted (None) keys not yet written
+        self._pending: dict[str, Optional[_Entry]] = {}
+        # Users whose records are all in memory (a cache miss means "no state")
+        self._warm_users: "OrderedDict[int, None]" = OrderedDict()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+    # --- memory front -------------------------------------------------------
+
+    def _get_cached(self, key: str) -> Optional[_Entry]:
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._pending.get(key)
+            if entry is None:
+                return None
+            # Evicted but not flushed yet: bring it back
+            del self._pending[key]
+            self._cache[key] = entry
+            self._dirty.add(key)
+        if entry.expires_at < time.time():
+            self._cache.pop(key, None)
+            self._dirty.discard(key)
+            self._watched.pop(key, None)
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, user_id: int, state: Optional[str], data: Any):
+        self._cache[key] = _Entry(int(user_id), state, data, time.time() + self.ttl_seconds)
+        self._cache.move_to_end(key)
+        self._pending.pop(key, None)
+        self._dirty.add(key)
+        self._evict()
+        self._ensure_flush_task()
+
+    def _touch(self, key: str, entry: _Entry):
+        """Extend the TTL of a read value; it may be mutated in place, so flushes compare it with the saved copy."""
+        entry.expires_at = time.time() + self.ttl_seconds
+        self._watched[key] = time.monotonic()
+        self._ensure_flush_task()
+
+    def _changed(self, entry: _Entry) -> bool:
+        """The value differs from the database copy, or reads extended its TTL by over half a TTL."""
+        if entry.saved is None:
+            return True
+        data_json, expires_at = entry.saved
+        if entry.expires_at - expires_at > self.ttl_seconds / 2:
+            return True
+        try:
+            return json.dumps(entry.data, ensure_ascii=False) != data_json
+        except (TypeError, ValueError):
+            return False  # flush() could not write it anyway
+
+    def _delete(self, key: str):
+        self._cache.pop(key, None)
+        self._dirty.discard(key)
+        self._watched.pop(key, None)
+        self._pending[key] = None
+        self._ensure_flush_task()
+
+    def _evict(self):
+        while len(self._cache) > self.max_entries:
+            key, entry = self._cache.popitem(last=False)
+            watched = self._watched.pop(key, None) is not None
+            if key in self._dirty or (watched and self._changed(entry)):
+                self._dirty.discard(key)
+                self._pending[key] = entry
+            # The user is no longer fully in memory: reload on their next update
+            self._warm_users.pop(entry.user_id, None)
+
+    async def warm_user(self, user_id: int):
+        """Load all records of `user_id` into memory (no-op if already loaded)."""
+        user_id = int(user_id)
+        if user_id in self._warm_users:
+            self._warm_users.move_to_end(user_id)
+            return
+        rows = await self.db.get_user_fsm_records(user_id)
+        for key, (state, data_json, expires_at) in rows.items():
+            if key in self._cache or key in self._pending:
+                continue  # memory is newer than the database
+            try:
+                data = json.loads(data_json) if data_json is not None else None
+            except ValueError:
+                logger.warning(f"⚠️ Broken FSM record {key}, ignoring")
+                continue
+            saved = (json.dumps(data, ensure_ascii=False), expires_at)
+            self._cache[key] = _Entry(user_id, state, data, expires_at, saved)
+        self._evict()
+        self._warm_users[user_id] = None
+        while len(self._warm_users) > self.max_entries * 4:
+            self._warm_users.popitem(last=False)
+
+    async def _load(self, key: str, user_id: int) -> Optional[_Entry]:
+        entry = self._get_cached(key)
+        if entry is None and int(user_id) not in self._warm_users:
+            await self.warm_user(user_id)
+            entry = self._get_cached(key)
+        return entry
+
+    # --- batched writes -----------------------------------------------------
+
+    def _ensure_flush_task(self):
+        if self._flush_task is None and not self._closed:
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                pass  # no running loop (sync code path): the next async write starts it
+
+    async def _flush_loop(self):
+        last_purge = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+                if time.monotonic() - last_purge >= _PURGE_INTERVAL_SECONDS:
+                    last_purge = time.monotonic()
+                    purged = await self.db.purge_expired_fsm_records()
+                    if purged:
+                        logger.info(f"🧹 Purged {purged} expired FSM records")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ FSM state flush failed: {e}", exc_info=True)
+
+    async def flush(self):
+        """Write all pending changes to the database in one transaction."""
+        async with self._flush_lock:
+            batch: dict[str, Optional[_Entry]] = dict(self._pending)
+            for key in self._dirty:
+                if key in self._cache:
+                    batch[key] = self._cache[key]
+            watch_from = time.monotonic() - _WATCH_SECONDS
+            for key, read_at in list(self._watched.items()):
+                entry = self._cache.get(key)
+                if entry is None or read_at < watch_from:
+                    del self._watched[key]
+                if entry is not None and key not in batch and self._changed(entry):
+                    batch[key] = entry
+            self._pending.clear()
+            self._dirty.clear()
+            if not batch:
+                return
+
+            upserts, deletes, saved = [], [], []
+            for key, entry in batch.items():
+                if entry is None:
+                    deletes.append(key)
+                    continue
+                try:
+                    data_json = json.dumps(entry.data, ensure_ascii=False)
+                except (TypeError, ValueError) as e:
+                    # Keep it in memory only; it just won't survive a restart
+                    logger.warning(f"⚠️ FSM record {key} is not JSON-serializable: {e}")
+                    continue
+                upserts.append((key, entry.user_id, entry.state, data_json, entry.expires_at))
+                saved.append((entry, (data_json, entry.expires_at)))
+
+            try:
+                await self.db.write_fsm_records(upserts, deletes)
+            except Exception:
+                # Re-queue whatever was not changed again meanwhile
+                for key, entry in batch.items():
+                    if key not in self._dirty and key not in self._pending:
+                        if entry is not None and key in self._cache:
+                            self._dirty.add(key)
+                        else:
+                            self._pending[key] = entry
+                raise
+            for entry, copy in saved:
+                entry.saved = copy
+
+    # --- aiogram BaseStorage ------------------------------------------------
+
+    @staticmethod
+    def _fsm_key(key: StorageKey) -> str:
+        parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.business_connection_id or "", key.destiny]
+        return "fsm:" + ":".join(str(part) for part in parts)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = self._fsm_key(key)
+        entry = await self._load(skey, key.user_id)
+        value = state.state if hasattr(state, "state") else state
+        data = entry.data if entry is not None else {}
+        if value is None and not data:
+            if entry is not None:
+                self._delete(skey)
+            return
+        self._put(skey, key.user_id, value, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._load(self._fsm_key(key), key.user_id)
+        return entry.state if entry is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        skey = self._fsm_key(key)
+        entry = await self._load(skey, key.user_id)
+        state = entry.state if entry is not None else None
+        if state is None and not data:
+            if entry is not None:
+                self._delete(skey)
+            return
+        self._put(skey, key.user_id, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        entry = await self._load(self._fsm_key(key), key.user_id)
+        return dict(entry.data or {}) if entry is not None else {}
+
+    async def close(self) -> None:
+        """Stop the flush loop and write everything out (called on Dispatcher shutdown)."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Final FSM state flush failed: {e}", exc_info=True)
+
+    # --- dict facade ----------------------------------------------------------
+
+    def user_map(self, namespace: str) -> "UserStateMap":
+        return UserStateMap(self, namespace)
+
+
+class UserStateMap(MutableMapping):
+    """
+    `dict[user_id, value]` view of one namespace of a DatabaseStorage.
+
+    Synchronous, served from memory: relies on the user being warmed up by
+    the Dispatcher's FSM middleware before handlers run. Values must be
+    JSON-serializable. Reading a value extends its TTL without a write;
+    in-place changes of a read value are found by comparing it with the saved
+    copy at the flushes within _WATCH_SECONDS of the read, and persisted.
+    """
+
+    def __init__(self, storage: DatabaseStorage, namespace: str):
+        self.storage = storage
+        self.namespace = namespace
+        self._prefix = f"{namespace}:"
+
+    def _key(self, user_id: int) -> str:
+        return f"{self._prefix}{int(user_id)}"
+
+    def __getitem__(self, user_id: int) -> Any:
+        key = self._key(user_id)
+        entry = self.storage._get_cached(key)
+        if entry is None:
+            raise KeyError(user_id)
+        self.storage._touch(key, entry)
+        return entry.data
+
+    def __setitem__(self, user_id: int, value: Any):
+        self.storage._put(self._key(user_id), user_id, None, value)
+
+    def __delitem__(self, user_id: int):
+        key = self._key(user_id)
+        if self.storage._get_cached(key) is None:
+            raise KeyError(user_id)
+        self.storage._delete(key)
+
+    def __contains__(self, user_id: object) -> bool:
+        try:
+            return self.storage._get_cached(self._key(int(user_id))) is not None
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        # Only users currently in memory
+        keys = [k for k in self.storage._cache if k.startswith(self._prefix)]
+        for key in keys:
+            yield int(key[len(self._prefix):])
+
+    def __len__(self) -> int:
+        return sum(1 for k in self.storage._cache if k.startswith(self._prefix))
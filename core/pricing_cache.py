@@ -0,0 +1,113 @@
+"""
+In-memory snapshot of tariff prices and promo codes, for rendering menus.
+
+Every tariff menu used to read each price from app_settings and validate the
+user's promo code against promo_codes for every tariff: a dozen queries per
+render. Instead, one `PricingCache` per database file (shared by all
+Database instances of the process, like core/sales_analytics.py) holds:
+
+- the price overrides (app_settings keys 'price:online:*' / 'price:offline:*');
+- the active promo codes, validated at read time (expiry, max uses).
+
+The Database methods that change either invalidate the snapshot, and the next
+read reloads it with two queries (both tables are small). Writes by other
+worker processes are not seen until the snapshot is older than TTL_SECONDS,
+so the snapshot only decides what a menu shows: the user's applied promo code
+is a point query, and a payment is created with a promo code validated by a
+point query (Database.get_valid_promo_code).
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+# Upper bound on the staleness of changes made by other processes
+TTL_SECONDS = 60.0
+
+_PROMO_COLUMNS = "code, discount_type, discount_value, created_at, expires_at, max_uses, used_count, active"
+
+
+class PricingSnapshot:
+    """Prices and promo codes as of one load; read-only."""
+
+    __slots__ = ("prices", "promos")
+
+    def __init__(self, prices: dict[str, str], promos: dict[str, dict]):
+        self.prices = prices
+        self.promos = promos
+
+    def price(self, key: str, default: float) -> float:
+        raw = self.prices.get(key)
+        if raw is None:
+            return float(default)
+        try:
+            return float(str(raw).strip())
+        except Exception:
+            return float(default)
+
+    def valid_promo(self, code: str) -> Optional[dict]:
+        """Database.get_valid_promo_code checks (expiry, max uses) on the snapshot; may be up to TTL_SECONDS stale."""
+        row = self.promos.get(code)
+        if row is None:
+            return None
+        if row["expires_at"]:
+            try:
+                if datetime.fromisoformat(row["expires_at"]) < datetime.utcnow():
+                    return None
+            except Exception:
+                return None
+        max_uses = row["max_uses"]
+        if max_uses is not None and int(row["used_count"] or 0) >= int(max_uses):
+            return None
+        return dict(row)
+
+
+class PricingCache:
+    def __init__(self):
+        self._snapshot: Optional[PricingSnapshot] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def fresh(self) -> Optional[PricingSnapshot]:
+        """The current snapshot, or None if it has to be (re)loaded."""
+        if self._snapshot is not None and time.monotonic() - self._loaded_at < TTL_SECONDS:
+            return self._snapshot
+        return None
+
+    def invalidate(self):
+        self._snapshot = None
+        self._generation += 1
+
+    async def load(self, conn) -> PricingSnapshot:
+        async with self._lock:
+            snapshot = self.fresh()
+            if snapshot is not None:
+                return snapshot
+            generation = self._generation
+            async with conn.execute(
+                "SELECT key, value FROM app_settings WHERE key LIKE 'price:%'"
+            ) as cursor:
+                prices = {row[0]: row[1] for row in await cursor.fetchall()}
+            async with conn.execute(
+                f"SELECT {_PROMO_COLUMNS} FROM promo_codes WHERE active = 1"
+            ) as cursor:
+                promos = {row["code"]: dict(row) for row in await cursor.fetchall()}
+            snapshot = PricingSnapshot(prices, promos)
+            # Not cached if something changed while loading: the next read loads again
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+            return snapshot
+
+
+_instances: dict[str, PricingCache] = {}
+
+
+def get_pricing_cache(db_path: str) -> PricingCache:
+    """Process-wide pricing cache of one database file (shared by all Database instances)."""
+    cache = _instances.get(db_path)
+    if cache is None:
+        cache = _instances[db_path] = PricingCache()
+    return cache
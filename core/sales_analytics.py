@@ -0,0 +1,244 @@
+"""
+In-memory sales analytics over the `payment_events` table.
+
+`Database.get_sales_overview` used to re-aggregate the whole table (COUNT
+DISTINCT, SUM, GROUP BY tariff / promo) on every admin stats view. Instead,
+one `SalesAnalytics` per database file keeps running aggregates:
+
+- events are folded in by `event_id` watermark: `sync()` reads only the rows
+  added since the previous call (one indexed query, nothing if there are none),
+  so events written by other Database instances or worker processes are
+  picked up too; `record_payment_event` syncs right after its insert;
+- totals, per tariff, per promo code and day / week series are all served
+  from memory;
+- every few minutes `verify()` compares the aggregates with the raw table
+  and rebuilds them from scratch if anything was changed behind our back.
+
+payment_events rows are append-only (INSERT OR IGNORE), which is what makes
+the watermark sufficient.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# How often the aggregates are checked against payment_events
+VERIFY_INTERVAL_SECONDS = 600.0
+
+_EVENT_COLUMNS = (
+    "event_id, user_id, course_program, tariff, paid_amount, base_amount, "
+    "promo_code, promo_discount_amount, created_at"
+)
+
+
+class _Group:
+    """Running totals of a set of events (all / one tariff / one promo code / one period)."""
+
+    __slots__ = ("cnt", "users", "paid_events", "paid_total", "base_total", "discount_total")
+
+    def __init__(self):
+        self.cnt = 0
+        self.users: set[int] = set()
+        self.paid_events = 0
+        self.paid_total = 0.0
+        self.base_total = 0.0
+        self.discount_total = 0.0
+
+    def add(self, user_id: int, paid: float, base: float, discount: float):
+        self.cnt += 1
+        self.users.add(user_id)
+        if paid > 0.01:
+            self.paid_events += 1
+        self.paid_total += paid
+        self.base_total += base
+        self.discount_total += discount
+
+
+class SalesAggregates:
+    """Pure fold of payment_events rows; no I/O."""
+
+    def __init__(self):
+        self.total = _Group()
+        # Overview sums only positive payments (refund/free rows have paid_amount <= 0.01)
+        self.paid_total = 0.0
+        self.promo_applied_events = 0
+        self.first_event_at: Optional[str] = None
+        self.last_event_at: Optional[str] = None
+        self.by_tariff: dict[tuple[str, str], _Group] = {}
+        self.by_promo: dict[str, _Group] = {}
+        self.by_day: dict[str, _Group] = {}
+        self.by_week: dict[str, _Group] = {}
+
+    def add(self, row) -> None:
+        user_id = int(row["user_id"])
+        paid = float(row["paid_amount"] or 0)
+        base = float(row["base_amount"] or 0)
+        discount = float(row["promo_discount_amount"] or 0)
+        created_at = row["created_at"] or ""
+        promo = row["promo_code"] or None
+
+        self.total.add(user_id, paid, base, discount)
+        if paid > 0.01:
+            self.paid_total += paid
+        if promo:
+            self.promo_applied_events += 1
+            self.by_promo.setdefault(promo, _Group()).add(user_id, paid, base, discount)
+        if self.first_event_at is None or created_at < self.first_event_at:
+            self.first_event_at = created_at
+        if self.last_event_at is None or created_at > self.last_event_at:
+            self.last_event_at = created_at
+
+        tariff_key = (row["course_program"], row["tariff"])
+        self.by_tariff.setdefault(tariff_key, _Group()).add(user_id, paid, base, discount)
+
+        day = created_at[:10]
+        if day:
+            self.by_day.setdefault(day, _Group()).add(user_id, paid, base, discount)
+            try:
+                d = date.fromisoformat(day)
+                week = (d - timedelta(days=d.weekday())).isoformat()
+            except ValueError:
+                week = None
+            if week:
+                self.by_week.setdefault(week, _Group()).add(user_id, paid, base, discount)
+
+    def overview(self, *, top_promos: int = 10, top_tariffs: int = 20) -> dict:
+        """Same shape as the former SQL-based Database.get_sales_overview (without promo_table)."""
+        total = self.total
+        by_tariff = sorted(self.by_tariff.items(), key=lambda kv: (-kv[1].paid_total, -kv[1].cnt))
+        promos = sorted(self.by_promo.items(), key=lambda kv: (-kv[1].cnt, -kv[1].discount_total))
+        return {
+            "overview": {
+                "total_events": total.cnt,
+                "users_total": len(total.users),
+                "paid_events": total.paid_events,
+                "paid_total": self.paid_total,
+                "base_total": total.base_total,
+                "promo_discount_total": total.discount_total,
+                "promo_applied_events": self.promo_applied_events,
+                "promo_unique_codes": len(self.by_promo),
+                "first_event_at": self.first_event_at,
+                "last_event_at": self.last_event_at,
+            },
+            "by_tariff": [
+                {
+                    "course_program": program,
+                    "tariff": tariff,
+                    "cnt": g.cnt,
+                    "users": len(g.users),
+                    "paid_total": g.paid_total,
+                    "base_total": g.base_total,
+                    "discount_total": g.discount_total,
+                }
+                for (program, tariff), g in by_tariff[: max(int(top_tariffs), 0)]
+            ],
+            "top_promos": [
+                {
+                    "promo_code": code,
+                    "cnt": g.cnt,
+                    "users": len(g.users),
+                    "discount_total": g.discount_total,
+                    "paid_total": g.paid_total,
+                }
+                for code, g in promos[: max(int(top_promos), 0)]
+            ],
+        }
+
+    def series(self, bucket: str = "day", limit: int = 14) -> list[dict]:
+        """Most recent `limit` periods (oldest first); `bucket` is 'day' or 'week' (starting Monday)."""
+        groups = self.by_week if bucket == "week" else self.by_day
+        periods = sorted(groups)[-max(int(limit), 0):] if limit else []
+        return [
+            {
+                "period": period,
+                "cnt": groups[period].cnt,
+                "users": len(groups[period].users),
+                "paid_events": groups[period].paid_events,
+                "paid_total": groups[period].paid_total,
+                "discount_total": groups[period].discount_total,
+            }
+            for period in periods
+        ]
+
+
+class SalesAnalytics:
+    """SalesAggregates kept in step with payment_events through an event_id watermark."""
+
+    def __init__(self):
+        self.aggregates = SalesAggregates()
+        self.watermark = 0
+        self._lock = asyncio.Lock()
+        self._verified_at = 0.0
+
+    async def sync(self, conn) -> int:
+        """Fold in events added since the last call. Returns the number of new events."""
+        async with self._lock:
+            return await self._sync(conn)
+
+    async def _sync(self, conn) -> int:
+        async with conn.execute("SELECT MAX(event_id) FROM payment_events") as cursor:
+            row = await cursor.fetchone()
+        latest = row[0] or 0
+        if latest <= self.watermark:
+            return 0
+        if self.watermark == 0:
+            self._verified_at = time.monotonic()  # a full build is its own consistency check
+        async with conn.execute(
+            f"SELECT {_EVENT_COLUMNS} FROM payment_events WHERE event_id > ? ORDER BY event_id",
+            (self.watermark,),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        for r in rows:
+            self.aggregates.add(r)
+            self.watermark = max(self.watermark, int(r["event_id"]))
+        return len(rows)
+
+    async def verify(self, conn) -> bool:
+        """
+        Compare the aggregates with payment_events (up to the watermark); rebuild on mismatch.
+        Returns True if they matched.
+        """
+        async with self._lock:
+            self._verified_at = time.monotonic()
+            async with conn.execute(
+                """
+                SELECT COUNT(*), COUNT(DISTINCT user_id), SUM(COALESCE(paid_amount, 0))
+                FROM payment_events
+                WHERE event_id <= ?
+                """,
+                (self.watermark,),
+            ) as cursor:
+                count, users, paid_sum = await cursor.fetchone()
+            total = self.aggregates.total
+            if (
+                count == total.cnt
+                and users == len(total.users)
+                and abs(float(paid_sum or 0) - total.paid_total) < 0.01
+            ):
+                return True
+            logger.warning(
+                f"⚠️ Sales analytics out of sync with payment_events (events {total.cnt} vs {count}, "
+                f"paid {total.paid_total:.2f} vs {float(paid_sum or 0):.2f}), rebuilding"
+            )
+            self.aggregates = SalesAggregates()
+            self.watermark = 0
+            await self._sync(conn)
+            return False
+
+    def verify_due(self) -> bool:
+        return time.monotonic() - self._verified_at >= VERIFY_INTERVAL_SECONDS
+
+
+_instances: dict[str, SalesAnalytics] = {}
+
+
+def get_sales_analytics(db_path: str) -> SalesAnalytics:
+    """Process-wide analytics of one database file (shared by all Database instances)."""
+    analytics = _instances.get(db_path)
+    if analytics is None:
+        analytics = _instances[db_path] = SalesAnalytics()
+    return analytics
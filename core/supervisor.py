@@ -0,0 +1,181 @@
+"""
+Supervisor for multi-process mode (WORKER_PROCESSES > 1).
+
+The supervisor owns the public PORT and launches N copies of run_all_bots.py as
+worker processes, each with its own asyncio loop and an internal port. It:
+
+- answers /health itself, so healthchecks pass while workers boot;
+- routes Telegram webhook updates to worker `chat_id % N`, so every update of a
+  chat (and that user's scheduler shard, see core/cluster.py) lands on the same process;
+- forwards everything else (/payment/webhook, /version, ...) to the first live worker;
+- restarts crashed workers with backoff.
+
+Workers always run in webhook mode: N processes polling getUpdates would conflict.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+
+logger = logging.getLogger(__name__)
+
+# Headers that must not be copied between the two HTTP hops
+_HOP_HEADERS = {"host", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+def chat_id_of_update(update: dict) -> int:
+    """Best-effort chat id of a raw Telegram update (0 if the update has no chat)."""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post",
+                "business_message", "my_chat_member", "chat_member", "chat_join_request"):
+        obj = update.get(key)
+        if isinstance(obj, dict):
+            chat = obj.get("chat") or {}
+            if "id" in chat:
+                return int(chat["id"])
+    callback = update.get("callback_query")
+    if isinstance(callback, dict):
+        chat = (callback.get("message") or {}).get("chat") or {}
+        if "id" in chat:
+            return int(chat["id"])
+        return int((callback.get("from") or {}).get("id") or 0)
+    for key in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query",
+                "poll_answer", "message_reaction"):
+        obj = update.get(key)
+        if isinstance(obj, dict):
+            sender = obj.get("from") or obj.get("user") or {}
+            if "id" in sender:
+                return int(sender["id"])
+    return 0
+
+
+class WorkerSupervisor:
+    """Launches worker processes and routes HTTP traffic to them."""
+
+    def __init__(self, worker_count: int, port: int, base_port: Optional[int] = None,
+                 entry_script: Optional[str] = None):
+        self.worker_count = max(int(worker_count), 1)
+        self.port = int(port)
+        self.base_port = int(base_port) if base_port else self.port + 1
+        self.entry_script = entry_script or str(Path(__file__).resolve().parent.parent / "run_all_bots.py")
+        self._procs: dict[int, asyncio.subprocess.Process] = {}
+        self._session: Optional[ClientSession] = None
+        self._stopping = False
+
+    def worker_url(self, index: int) -> str:
+        return f"http://127.0.0.1:{self.base_port + index}"
+
+    def worker_env(self, index: int) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "WORKER_INDEX": str(index),
+            "WORKER_COUNT": str(self.worker_count),
+            "WORKER_PROCESSES": "1",  # a worker must never become a supervisor itself
+            "PORT": str(self.base_port + index),
+            "HTTP_HOST": "127.0.0.1",
+            "TELEGRAM_UPDATE_MODE": "webhook",
+        })
+        return env
+
+    async def _spawn(self, index: int):
+        proc = await asyncio.create_subprocess_exec(sys.executable, self.entry_script, env=self.worker_env(index))
+        self._procs[index] = proc
+        logger.info(f"🧩 Worker {index} started (pid={proc.pid}, port={self.base_port + index})")
+
+    async def _watch(self, index: int):
+        """Keep worker `index` alive, restarting it with exponential backoff."""
+        backoff = 1.0
+        while not self._stopping:
+            await self._spawn(index)
+            started = asyncio.get_running_loop().time()
+            code = await self._procs[index].wait()
+            if self._stopping:
+                return
+            uptime = asyncio.get_running_loop().time() - started
+            backoff = 1.0 if uptime > 60 else min(backoff * 2, 60.0)
+            logger.error(f"❌ Worker {index} exited with code {code}; restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+
+    async def _forward(self, index: int, request: web.Request, body: bytes) -> web.Response:
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+        async with self._session.request(
+            request.method, self.worker_url(index) + request.rel_url.path_qs, data=body, headers=headers
+        ) as resp:
+            payload = await resp.read()
+            out_headers = {k: v for k, v in resp.headers.items() if k.lower() not in _HOP_HEADERS}
+            return web.Response(status=resp.status, body=payload, headers=out_headers)
+
+    async def _handle_telegram(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except Exception:
+            return web.Response(status=400, text="Invalid JSON")
+        index = chat_id_of_update(update if isinstance(update, dict) else {}) % self.worker_count
+        try:
+            return await self._forward(index, request, body)
+        except (ClientError, asyncio.TimeoutError):
+            # Worker restarting: Telegram retries on non-2xx
+            return web.Response(status=503, text="Worker unavailable")
+
+    async def _handle_other(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        for index in range(self.worker_count):
+            try:
+                return await self._forward(index, request, body)
+            except (ClientError, asyncio.TimeoutError):
+                continue
+        return web.Response(status=503, text="No workers available")
+
+    @staticmethod
+    async def _handle_health(_: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    def _build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", self._handle_health)
+        app.router.add_get("/health", self._handle_health)
+        app.router.add_post("/telegram/{bot_name}/{secret}", self._handle_telegram)
+        app.router.add_route("*", "/{tail:.*}", self._handle_other)
+        return app
+
+    async def run(self):
+        """Serve the front HTTP port and keep workers running until cancelled."""
+        self._session = ClientSession(timeout=ClientTimeout(total=60))
+        runner = web.AppRunner(self._build_app())
+        await runner.setup()
+        await web.TCPSite(runner, host="0.0.0.0", port=self.port).start()
+        logger.info(f"🌐 Supervisor listening on port {self.port}, workers: {self.worker_count}")
+
+        watchers = [asyncio.create_task(self._watch(i)) for i in range(self.worker_count)]
+        try:
+            await asyncio.gather(*watchers)
+        finally:
+            self._stopping = True
+            for task in watchers:
+                task.cancel()
+            await self._terminate_workers()
+            await self._session.close()
+            await runner.cleanup()
+
+    async def _terminate_workers(self, timeout: float = 15.0):
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                try:
+                    proc.send_signal(signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for index, proc in self._procs.items():
+            if proc.returncode is None:
+                try:
+                    await asyncio.wait_for(proc.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"⚠️ Worker {index} did not stop in {timeout:.0f}s, killing")
+                    proc.kill()
+        logger.info("🧩 All workers stopped")
@@ -40,7 +40,7 @@ class YooKassaPaymentProcessor(PaymentProcessor):
     for YooKassa payment gateway.
     """
     
-    def __init__(self, shop_id: str, secret_key: str, return_url: str):
+    def __init__(self, shop_id: str, secret_key: str, return_url: str, api_url: str = ""):
         """
         Initialize YooKassa payment processor.
         
@@ -48,6 +48,7 @@ class YooKassaPaymentProcessor(PaymentProcessor):
             shop_id: YooKassa Shop ID
             secret_key: YooKassa Secret Key
             return_url: URL to redirect user after payment
+            api_url: API base URL override (e.g. a local stand-in); empty = SDK default
         """
         if not YOOKASSA_AVAILABLE:
             raise ImportError(
@@ -62,6 +63,8 @@ class YooKassaPaymentProcessor(PaymentProcessor):
         # Configure YooKassa
         Configuration.account_id = shop_id
         Configuration.secret_key = secret_key
+        if api_url:
+            Configuration.api_url = api_url.rstrip("/")
         
         logger.info("YooKassa payment processor initialized")
     
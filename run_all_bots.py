@@ -5,25 +5,36 @@
 """
 
 import asyncio
+import json
 import logging
+import signal
 import sys
 import os
 from pathlib import Path
-from typing import Optional, Any
+from typing import TYPE_CHECKING, Optional
 
+# Only light imports here: the HTTP server must bind before the bot modules
+# (aiogram types, ~15k lines of handlers, payment SDK) are loaded. See _import_bot_classes().
 from aiohttp import web
 import aiosqlite
-from bots.sales_bot import SalesBot
-from bots.course_bot import CourseBot
-from bots.admin_bot import AdminBot
 from core.config import Config
-from services.payment_service import PaymentService
-from core.models import Tariff
+from core.cluster import membership_from_config, set_membership
+from core.database import Database
+from utils.metrics import PAYMENT_INBOX_RECEIVED, monitor_event_loop_lag, render as render_metrics
+from utils.startup import StartupTimeline
+from utils.telegram_webhook import WebhookIntake, is_webhook_mode
+
+if TYPE_CHECKING:
+    from bots.admin_bot import AdminBot
+    from bots.course_bot import CourseBot
+    from bots.sales_bot import SalesBot
 
 # Настройка логирования
+# (в multi-process режиме добавляем номер воркера, чтобы различать строки в общем логе)
+_worker_tag = f"[w{Config.WORKER_INDEX}] " if Config.WORKER_COUNT > 1 else ""
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format=f'%(asctime)s - {_worker_tag}%(name)s - %(levelname)s - %(message)s',
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger(__name__)
@@ -43,15 +54,31 @@ def _get_port() -> int:
         return 8080
 
 
+def _import_bot_classes():
+    """Heavy imports, deferred until the HTTP server is up."""
+    import bots.sales_bot
+    import bots.course_bot
+    import bots.admin_bot
+    return bots.sales_bot.SalesBot, bots.course_bot.CourseBot, bots.admin_bot.AdminBot
+
+
 async def _handle_health(_: web.Request) -> web.Response:
     return web.Response(text="OK")
 
 
+async def _handle_metrics(_: web.Request) -> web.Response:
+    """Prometheus text format; in-process counters only (no DB queries)."""
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
 async def _handle_version(_: web.Request) -> web.Response:
     """
     Small debug endpoint to confirm what revision/config is actually running in Railway.
     Does NOT expose secrets.
     """
+    from core.models import Tariff
+    from services.payment_service import PaymentService
+
     possible_keys = [
         "RAILWAY_GIT_COMMIT_SHA",
         "RAILWAY_GIT_BRANCH",
@@ -137,67 +164,85 @@ def _extract_payment_id(payload: dict) -> Optional[str]:
 async def _handle_yookassa_webhook(request: web.Request) -> web.Response:
     """
     YooKassa webhook endpoint.
-    - returns 200 quickly for non-succeeded events
-    - uses DB idempotency to avoid duplicate processing
+    - validates the request and stores the raw event in payment_inbox (one short transaction)
+    - acknowledges right away; services/payment_inbox.PaymentInboxWorker grants access
+      in the background, with retries and dead-lettering
+    - duplicates (YooKassa retries) are acknowledged without being stored again
     """
     app = request.app
-    sales_bot: Optional[Any] = app.get("sales_bot")
-    if not sales_bot:
-        # App is up but bots not ready yet
-        return web.Response(status=503, text="Bots not ready")
+    inbox_db: Database = app["payment_inbox_db"]
+    if inbox_db.conn is None:
+        # App is up but the database is not open yet: YooKassa will retry
+        PAYMENT_INBOX_RECEIVED.inc(result="rejected")
+        return web.Response(status=503, text="Not ready")
 
     try:
-        payload = await request.json()
+        raw = await request.text()
+        payload = json.loads(raw)
     except Exception:
+        PAYMENT_INBOX_RECEIVED.inc(result="rejected")
         return web.Response(status=400, text="Invalid JSON")
 
-    payment_id = _extract_payment_id(payload)
+    payment_id = _extract_payment_id(payload) if isinstance(payload, dict) else None
     if not payment_id:
+        PAYMENT_INBOX_RECEIVED.inc(result="rejected")
         return web.Response(status=400, text="Missing payment id")
 
+    # One key per (event, payment): YooKassa re-sends the same notification until it gets 200
+    event_key = f"{payload.get('event') or ''}:{payment_id}"
     try:
-        # Idempotency: if already processed, acknowledge
-        if await sales_bot.db.is_payment_processed(payment_id):
-            return web.Response(text="OK")
-
-        # Let processor validate/parse webhook and grant access
-        result = await sales_bot.payment_service.process_payment_completion(
-            payment_id=payment_id,
-            webhook_data=payload,
-        )
-
-        # If not completed yet (or not a succeeded event), we still acknowledge
-        if not result:
-            return web.Response(text="OK")
-
-        await sales_bot.db.mark_payment_processed(payment_id)
-        logger.info(f"✅ Webhook processed: payment_id={payment_id}, user_id={result.get('user_id')}")
-        return web.Response(text="OK")
+        queued = await inbox_db.enqueue_payment_webhook(event_key, payment_id, raw)
     except Exception as e:
-        logger.error(f"❌ Error processing YooKassa webhook: {e}", exc_info=True)
+        logger.error(f"❌ Could not store YooKassa webhook: {e}", exc_info=True)
         # Return 500 so YooKassa can retry
         return web.Response(status=500, text="ERROR")
 
+    PAYMENT_INBOX_RECEIVED.inc(result="queued" if queued else "duplicate")
+    worker = app.get("payment_inbox_worker")
+    if queued and worker is not None:
+        worker.notify()
+    return web.Response(text="OK")
+
 
 async def start_web_server(app: web.Application) -> web.AppRunner:
     """Start aiohttp server (health + webhook) on PORT."""
     port = _get_port()
+    # Workers of the multi-process mode listen only on localhost (the supervisor owns the public port)
+    host = os.environ.get("HTTP_HOST", "").strip() or "0.0.0.0"
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, host="0.0.0.0", port=port)
+    site = web.TCPSite(runner, host=host, port=port)
     await site.start()
     logger.info(f"🌐 HTTP сервер запущен на порту {port}")
     logger.info(f"🌐 Healthcheck: http://0.0.0.0:{port}/health")
     logger.info(f"🌐 Webhook:     http://0.0.0.0:{port}/payment/webhook")
+    logger.info(f"🌐 Metrics:     http://0.0.0.0:{port}/metrics")
+    if app.get("webhook_intake") is not None:
+        logger.info(f"🌐 Telegram:    http://0.0.0.0:{port}/telegram/<bot>/<secret> (webhook mode)")
     return runner
 
 
 async def main():
     """Запуск обоих ботов и HTTP сервера."""
-    sales_bot: Optional[SalesBot] = None
-    course_bot: Optional[CourseBot] = None
-    admin_bot: Optional[AdminBot] = None
+    sales_bot: Optional["SalesBot"] = None
+    course_bot: Optional["CourseBot"] = None
+    admin_bot: Optional["AdminBot"] = None
+    timeline = StartupTimeline()
     web_runner: Optional[web.AppRunner] = None
+    loop_lag_task: Optional[asyncio.Task] = None
+    cluster_db: Optional[Database] = None
+    membership = None
+    # Own connection for the payment webhook inbox: the endpoint must not wait for the bots
+    payment_inbox_db = Database()
+    payment_inbox_worker = None
+
+    if Config.WORKER_COUNT > 1:
+        # Graceful stop on supervisor's SIGTERM: finally-блок освободит leases
+        main_task = asyncio.current_task()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
     
     logger.info("=" * 60)
     logger.info("🚀 Запуск платформы курсов")
@@ -208,14 +253,29 @@ async def main():
     web_app.router.add_get("/", _handle_health)
     web_app.router.add_get("/health", _handle_health)
     web_app.router.add_get("/version", _handle_version)
+    web_app.router.add_get("/metrics", _handle_metrics)
+    web_app["payment_inbox_db"] = payment_inbox_db
     web_app.router.add_post("/payment/webhook", _handle_yookassa_webhook)
+
+    # Telegram updates via webhook instead of 3 long-poll loops (TELEGRAM_UPDATE_MODE=webhook).
+    # The route must be mounted before the server starts: aiohttp freezes the router.
+    webhook_intake: Optional[WebhookIntake] = None
+    if is_webhook_mode():
+        # Worker 0 registers the webhook with Telegram; other workers only serve
+        webhook_intake = WebhookIntake(register_webhook=Config.WORKER_INDEX == 0)
+        webhook_intake.install(web_app)
+        logger.info("🪝 Telegram update mode: webhook")
+    else:
+        logger.info("🔁 Telegram update mode: polling")
     
     # КРИТИЧЕСКИ ВАЖНО: Запускаем HTTP сервер САМЫМ ПЕРВЫМ
     # Railway проверяет healthcheck сразу, даже если боты еще не готовы
     logger.info("🌐 Запуск HTTP сервера для healthcheck (приоритет #1)...")
     try:
-        web_runner = await start_web_server(web_app)
+        with timeline.stage("http server"):
+            web_runner = await start_web_server(web_app)
         logger.info("✅ HTTP сервер успешно запущен и готов отвечать на healthcheck/webhook")
+        loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
         logger.info(f"🌐 Healthcheck endpoint: http://0.0.0.0:{_get_port()}/health")
     except Exception as e:
         logger.error(f"❌ Критическая ошибка при запуске HTTP сервера: {e}", exc_info=True)
@@ -272,13 +332,15 @@ async def main():
     logger.info(f"   SALES_BOT_TOKEN из os.environ: {'✅ есть' if sales_token_raw else '❌ нет'} (длина: {len(sales_token_raw)})")
     logger.info(f"   COURSE_BOT_TOKEN из os.environ: {'✅ есть' if course_token_raw else '❌ нет'} (длина: {len(course_token_raw)})")
     
-    # Проверяем все переменные окружения (для полной диагностики)
+    # Проверяем все переменные окружения (полный список — только при STARTUP_DIAGNOSTICS=1)
     all_env_vars = dict(os.environ)
     logger.info(f"   Всего переменных окружения: {len(all_env_vars)}")
     
     # Проверяем все релевантные переменные
     relevant_vars = {k: v for k, v in all_env_vars.items() if any(prefix in k.upper() for prefix in ['BOT', 'SALES', 'COURSE', 'TOKEN', 'ADMIN', 'GROUP', 'DATABASE'])}
-    if relevant_vars:
+    if relevant_vars and not Config.STARTUP_DIAGNOSTICS:
+        logger.info(f"   Найдено {len(relevant_vars)} релевантных переменных окружения (подробно: STARTUP_DIAGNOSTICS=1)")
+    elif relevant_vars:
         logger.info(f"   Найдено {len(relevant_vars)} релевантных переменных окружения:")
         for key in sorted(relevant_vars.keys()):
             val = relevant_vars[key]
@@ -368,14 +430,40 @@ async def main():
         return
     
     try:
+        # Multi-process: join the cluster before bots start, so shard ownership/leadership is known
+        if Config.WORKER_COUNT > 1:
+            with timeline.stage("cluster join"):
+                cluster_db = Database()
+                await cluster_db.connect()
+                membership = membership_from_config(cluster_db)
+                set_membership(membership)
+                await membership.start()
+            logger.info(
+                f"🧩 Worker {Config.WORKER_INDEX}/{Config.WORKER_COUNT}: "
+                f"shards={sorted(membership.owned_shards)} leader={membership.is_leader}"
+            )
+
+        with timeline.stage("payment inbox"):
+            # Webhooks are accepted (and queued) from here on, even before the bots are ready
+            await payment_inbox_db.connect()
+
+        with timeline.stage("import bot modules"):
+            # In a thread, so /health keeps answering while aiogram & handlers load
+            sales_bot_cls, course_bot_cls, admin_bot_cls = await asyncio.to_thread(_import_bot_classes)
+
         # Инициализация ботов
         logger.info("Инициализация продающего бота...")
         sales_bot = None
         try:
-            sales_bot = SalesBot()
+            with timeline.stage("init sales bot"):
+                sales_bot = sales_bot_cls()
             logger.info("✅ Продающий бот инициализирован")
-            # Expose sales_bot to webhook app (payment_service/db are inside)
             web_app["sales_bot"] = sales_bot
+            # Queued payment webhooks are processed with the sales bot's payment service
+            from services.payment_inbox import PaymentInboxWorker
+            payment_inbox_worker = PaymentInboxWorker(payment_inbox_db, sales_bot.payment_service)
+            payment_inbox_worker.start()
+            web_app["payment_inbox_worker"] = payment_inbox_worker
         except Exception as e:
             logger.error(f"❌ Ошибка при инициализации продающего бота: {e}", exc_info=True)
             # Не падаем, продолжаем с другим ботом
@@ -384,7 +472,8 @@ async def main():
         
         logger.info("Инициализация курс-бота...")
         try:
-            course_bot = CourseBot()
+            with timeline.stage("init course bot"):
+                course_bot = course_bot_cls()
             logger.info("✅ Курс-бот инициализирован")
             web_app["course_bot"] = course_bot
         except Exception as e:
@@ -398,7 +487,8 @@ async def main():
         try:
             if Config.ADMIN_BOT_TOKEN:
                 try:
-                    admin_bot = AdminBot()
+                    with timeline.stage("init admin bot"):
+                        admin_bot = admin_bot_cls()
                     logger.info("✅ Админ-бот инициализирован")
                     web_app["admin_bot"] = admin_bot
                 except ValueError as ve:
@@ -416,6 +506,12 @@ async def main():
             logger.warning("⚠️ Продолжаем без админ-бота")
             admin_bot = None
         
+        # В webhook-режиме боты не запускают polling, а ждут апдейты от общего HTTP сервера
+        if webhook_intake is not None:
+            for bot_instance in (sales_bot, course_bot, admin_bot):
+                if bot_instance:
+                    bot_instance.webhook_intake = webhook_intake
+
         # Запуск ботов параллельно (если они были инициализированы)
         tasks = []
         if sales_bot:
@@ -432,6 +528,7 @@ async def main():
         
         if tasks:
             logger.info(f"✅ Запущено {len(tasks)} бот(ов). Все сервисы готовы к работе")
+            timeline.log_summary()
             # Ждем завершения всех задач
             try:
                 await asyncio.gather(*tasks, return_exceptions=True)
@@ -457,6 +554,13 @@ async def main():
             while True:
                 await asyncio.sleep(60)
     finally:
+        if webhook_intake is not None:
+            # Updates being handled finish before the bots close their sessions and the database
+            await webhook_intake.stop()
+
+        if payment_inbox_worker is not None:
+            await payment_inbox_worker.stop()
+
         if sales_bot:
             try:
                 await sales_bot.stop()
@@ -475,6 +579,18 @@ async def main():
             except Exception as e:
                 logger.error(f"Ошибка при остановке админ-бота: {e}")
         
+        if membership is not None:
+            try:
+                await membership.stop()
+            except Exception as e:
+                logger.error(f"Ошибка при выходе из кластера: {e}")
+        if cluster_db is not None:
+            await cluster_db.close()
+        await payment_inbox_db.close()
+
+        if loop_lag_task is not None:
+            loop_lag_task.cancel()
+
         # Stop aiohttp server
         if web_runner:
             try:
@@ -490,8 +606,16 @@ if __name__ == "__main__":
         logger.info("🚀 Запуск приложения...")
         logger.info("=" * 60)
         # Используем asyncio.run для правильного запуска
-        asyncio.run(main())
-    except KeyboardInterrupt:
+        if Config.WORKER_PROCESSES > 1:
+            # Supervisor mode: N worker processes behind one public port
+            from core.supervisor import WorkerSupervisor
+            supervisor = WorkerSupervisor(
+                Config.WORKER_PROCESSES, _get_port(), base_port=Config.WORKER_BASE_PORT or None
+            )
+            asyncio.run(supervisor.run())
+        else:
+            asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Завершение работы...")
     except Exception as e:
         logger.error(f"❌ Фатальная ошибка при запуске: {e}", exc_info=True)
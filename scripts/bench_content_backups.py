@@ -0,0 +1,126 @@
+"""
+Benchmark / self-check of the lessons.json backup history (services/content_backups.py).
+
+Starts from the real lessons.json and simulates --months of Drive auto-syncs
+(--per-day syncs a day, each editing one or two lessons, a few of them
+changing nothing), recording a backup before every write as
+DriveContentSync does. Reports the disk usage against the old full copies,
+the time to list the backups and to restore a version, then checks:
+  - the retention policy (newest versions + one per recent day);
+  - every kept version restores to exactly the lessons.json it was taken from;
+  - old-style lessons.YYYYMMDD-HHMMSS.json copies are imported and removed.
+
+Usage:
+  python scripts/bench_content_backups.py
+  python scripts/bench_content_backups.py --months 6 --per-day 48
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from services.content_backups import BackupHistory  # noqa: E402
+
+KEEP_LATEST = 20
+KEEP_DAILY = 30
+
+
+def _write(path: Path, lessons: dict):
+    path.write_text(json.dumps(lessons, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _run(lessons_path: Path, months: int, per_day: int) -> int:
+    lessons = json.loads(lessons_path.read_text(encoding="utf-8"))
+    rng = random.Random(0)
+    failures: list[str] = []
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / "lessons.json"
+        backups = Path(tmp) / "content_backups"
+        history = BackupHistory(backups, keep_latest=KEEP_LATEST, keep_daily=KEEP_DAILY)
+
+        # Old layout: two full copies already there
+        backups.mkdir()
+        _write(backups / "lessons.20250101-090000.json", lessons)
+        lessons["0"]["title"] = "old edit"
+        _write(backups / "lessons.20250102-090000.json", lessons)
+        imported = len(history.versions())
+        _check("old full copies imported and removed", imported == 2
+               and not list(backups.glob("lessons.*.json")), failures)
+
+        start = datetime(2026, 1, 1)
+        syncs = months * 30 * per_day
+        expected: dict[str, str] = {}
+        full_copies = 0
+        record_ms = []
+        _write(target, lessons)
+        for n in range(syncs):
+            now = start + timedelta(minutes=n * 24 * 60 // per_day)
+            started = time.perf_counter()
+            version = history.record(target, created=now)
+            record_ms.append((time.perf_counter() - started) * 1000)
+            expected[version.id] = target.read_text(encoding="utf-8")
+            full_copies += target.stat().st_size
+            if rng.random() < 0.8:
+                for day in rng.sample(sorted(lessons), rng.choice((1, 2))):
+                    lessons[day]["title"] = f"{lessons[day].get('title', '')[:40]} (правка {n})"
+            _write(target, lessons)
+
+        usage = history.usage()
+        print(f"{syncs} syncs over {months} months: {usage['versions']} versions kept, "
+              f"{usage['chunk_bytes'] / 1048576:.2f} MB on disk "
+              f"(old full copies: {full_copies / 1048576:.0f} MB, kept versions as copies: "
+              f"{usage['logical_bytes'] / 1048576:.1f} MB)")
+        print(f"record:  {sorted(record_ms)[len(record_ms) // 2]:.1f} ms median")
+
+        started = time.perf_counter()
+        listed = BackupHistory(backups).versions()
+        print(f"list:    {(time.perf_counter() - started) * 1000:.1f} ms ({len(listed)} versions)")
+        started = time.perf_counter()
+        for version in listed:
+            history.read_text(version.id)
+        print(f"restore: {(time.perf_counter() - started) * 1000 / len(listed):.1f} ms per version")
+
+        last = start + timedelta(minutes=(syncs - 1) * 24 * 60 // per_day)
+        recent_days = {v.created.date() for v in listed if v.created.date() > (last - timedelta(days=KEEP_DAILY)).date()}
+        _check("retention: newest versions + one per recent day",
+               KEEP_LATEST <= len(listed) <= KEEP_LATEST + KEEP_DAILY
+               and len(recent_days) == min(KEEP_DAILY, months * 30), failures)
+        _check("every kept version restores byte for byte",
+               all(history.read_text(v.id) == expected[v.id] for v in listed), failures)
+        _check("unchanged lessons.json adds no version",
+               history.record(target, created=last).id == history.record(target, created=last).id, failures)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--months", type=int, default=3)
+    parser.add_argument("--per-day", type=int, default=24, help="syncs per day (DRIVE_AUTO_SYNC_MINUTES=60 -> 24)")
+    args = parser.parse_args()
+    return _run(args.lessons, args.months, args.per_day)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
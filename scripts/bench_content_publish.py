@@ -0,0 +1,218 @@
+"""
+Benchmark / self-check of content publishing and lesson reloads
+(DriveContentSync._publish, services/lesson_loader.py, services/content_sync_job.py).
+
+Builds a lessons.json from the real one, with every text repeated --scale
+times (a large course), and measures the longest event-loop stall while
+--loaders LessonLoaders reload it: synchronously, as the sync handlers did,
+and with refresh_all() (parse in a thread, swap on the loop). Then checks:
+  - a reader never sees a partial lessons.json while versions are published;
+  - strict validation refuses content with a missing or empty day and leaves
+    the published file untouched, but accepts a day whose content is only in
+    intro_text (day 0 of the course);
+  - run_sync() runs one sync at a time and reloads every loader;
+  - watch() picks up a file published by another process.
+
+Usage:
+  python scripts/bench_content_publish.py
+  python scripts/bench_content_publish.py --scale 50 --loaders 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.config import Config  # noqa: E402
+from services import content_sync_job, lesson_loader  # noqa: E402
+from services.drive_content_sync import DriveContentSync, SyncResult  # noqa: E402
+from services.lesson_loader import LessonLoader  # noqa: E402
+
+
+def _scaled(lessons: dict, scale: int) -> dict:
+    out = copy.deepcopy(lessons)
+    for entry in out.values():
+        text = entry.get("text")
+        if isinstance(text, list):
+            entry["text"] = text * scale
+        elif isinstance(text, str):
+            entry["text"] = text * scale
+    return out
+
+
+async def _max_stall(work) -> float:
+    """Longest gap (ms) between ticks of a 1 ms ticker while `work()` runs."""
+    worst = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal worst
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            worst = max(worst, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await work()
+    done = True
+    await task
+    return worst * 1000
+
+
+class _FakeSync(DriveContentSync):
+    """sync_now publishes a prepared dict after `delay` seconds."""
+
+    def __init__(self, compiled: dict, delay: float = 0.0):
+        super().__init__()
+        self.compiled, self.delay = compiled, delay
+
+    def sync_now(self, clean_media: bool = False, strict: bool = False) -> SyncResult:
+        time.sleep(self.delay)
+        warnings: list[str] = []
+        target = self._publish(self.compiled, warnings, strict=strict)
+        return SyncResult(
+            days_synced=len(self.compiled), lessons_path=str(target), media_files_downloaded=0,
+            total_blocks=0, total_media_files=0, warnings=warnings,
+        )
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+async def _run(lessons_path: Path, scale: int, loaders_count: int, publishes: int) -> int:
+    logging.disable(logging.CRITICAL)
+    base = json.loads(lessons_path.read_text(encoding="utf-8"))
+    big = _scaled(base, scale)
+    failures: list[str] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Config.DATABASE_PATH = str(Path(tmp) / "bot.db")
+        # Media variants of the published lessons go to the temp dir too
+        Config.DRIVE_MEDIA_DIR = str(Path(tmp) / "content_media")
+        syncer = DriveContentSync()
+        target = syncer._target_lessons_path()
+        syncer._publish(big, [])
+        loaders = [LessonLoader(str(target)) for _ in range(loaders_count)]
+        print(f"lessons.json: {target.stat().st_size / 1048576:.1f} MB ({len(big)} days), {loaders_count} loaders")
+
+        async def sync_reload():
+            for loader in loaders:
+                loader.reload()
+
+        print(f"reload():       {await _max_stall(sync_reload):6.1f} ms longest event-loop stall")
+        print(f"refresh_all():  {await _max_stall(lambda: lesson_loader.refresh_all(force=True)):6.1f} ms longest event-loop stall")
+
+        # Readers vs publisher: every version has a "v" marker in each day's title
+        versions = []
+        for v in range(2):
+            lessons = copy.deepcopy(big)
+            for entry in lessons.values():
+                entry["title"] = f"v{v}"
+            versions.append(lessons)
+        syncer._publish(versions[1], [])
+        stop = threading.Event()
+        torn: list[set] = []
+        reads = 0
+
+        def reader():
+            nonlocal reads
+            probe = LessonLoader(str(target))
+            while not stop.is_set():
+                lessons, _ = probe._read()
+                reads += 1
+                seen = {entry.get("title") for entry in lessons.values()}
+                if len(lessons) != len(big) or len(seen) != 1:
+                    torn.append(seen)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        started = time.perf_counter()
+        for n in range(publishes):
+            syncer._publish(versions[n % 2], [])
+        publish_ms = (time.perf_counter() - started) * 1000 / publishes
+        stop.set()
+        thread.join()
+        print(f"publish:        {publish_ms:6.1f} ms per version (write, read back, backup, rename)")
+        _check(f"{reads} concurrent reads saw only whole versions", reads > 0 and not torn, failures)
+
+        before = target.read_bytes()
+        missing = {k: v for k, v in base.items() if k != "0"}
+        empty = copy.deepcopy(base)
+        for key in ("text", "intro_text", "about_me_text", "media", "media_markers"):
+            empty["1"].pop(key, None)
+        empty["1"]["text"] = ""
+        refused = 0
+        for compiled in (missing, empty):
+            try:
+                syncer._publish(compiled, [], strict=True)
+            except RuntimeError:
+                refused += 1
+        _check("strict mode refuses missing / empty days", refused == 2 and target.read_bytes() == before, failures)
+
+        # Day 0 of the course has text == "" and its content in intro_text (as the master doc sync builds it)
+        intro_only = copy.deepcopy(base)
+        intro_only["0"] = {"title": "intro", "text": "", "intro_text": "Добро пожаловать"}
+        try:
+            syncer._publish(intro_only, [], strict=True)
+            accepted = True
+        except RuntimeError:
+            accepted = False
+        _check("strict mode accepts a day with only intro_text", accepted, failures)
+
+        # One sync at a time; loaders of the process see the new content
+        fresh = copy.deepcopy(base)
+        fresh["0"]["title"] = "from run_sync"
+        results = await asyncio.gather(
+            content_sync_job.run_sync(_FakeSync(fresh, delay=0.2)),
+            content_sync_job.run_sync(_FakeSync(base)),
+            return_exceptions=True,
+        )
+        _check("concurrent run_sync: second one refused",
+               isinstance(results[0], SyncResult) and isinstance(results[1], content_sync_job.SyncInProgress), failures)
+        _check("run_sync reloaded every loader",
+               all(loader.get_lesson(0)["title"] == "from run_sync" for loader in loaders), failures)
+
+        # Another process publishes: the watcher picks it up
+        other = DriveContentSync()
+        fresh["0"]["title"] = "from another process"
+        watcher = asyncio.create_task(lesson_loader.watch(0.05))
+        other._publish(fresh, [])
+        await asyncio.sleep(0.3)
+        watcher.cancel()
+        _check("watch() reloads a file published elsewhere",
+               all(loader.get_lesson(0)["title"] == "from another process" for loader in loaders), failures)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--scale", type=int, default=20, help="repeat every lesson text this many times")
+    parser.add_argument("--loaders", type=int, default=3, help="LessonLoaders in the process (course, sales, scheduler)")
+    parser.add_argument("--publishes", type=int, default=20)
+    args = parser.parse_args()
+    return asyncio.run(_run(args.lessons, args.scale, args.loaders, args.publishes))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
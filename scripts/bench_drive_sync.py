@@ -0,0 +1,261 @@
+"""
+Benchmark / self-check of the parallel folder-mode Drive sync (services/drive_pool.py
++ DriveContentSync), against an in-memory Drive with simulated latency and quota.
+
+The fake course has --days day folders, each with a lesson Google Doc (with
+links to Drive photos and to a Drive folder of photos), a task doc,
+meta.json, a media/ subfolder and a photo. Every API round-trip (list, get,
+export, batch) sleeps --latency-ms; more than --quota requests in flight at
+once get 429 rateLimitExceeded, as Drive's per-user limit would. Reports the
+wall time, round-trips and 429 answers, then checks that lessons.json
+is complete and, with --compare REV, identical to what the sync of git
+revision REV (e.g. the serial one) produces.
+
+Usage:
+  python scripts/bench_drive_sync.py
+  python scripts/bench_drive_sync.py --latency-ms 80 --compare HEAD~1
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httplib2
+from PIL import Image
+from googleapiclient.errors import HttpError
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.config import Config  # noqa: E402
+from services import drive_pool  # noqa: E402
+from services.drive_content_sync import FOLDER_MIME, GOOGLE_DOC_MIME, DriveContentSync  # noqa: E402
+
+LINKED_PHOTOS = 4
+FOLDER_PHOTOS = 3
+
+
+class _FakeDrive:
+    """files().list / get / export and batch requests over in-memory metadata, with latency and a quota."""
+
+    def __init__(self, latency: float, quota: int):
+        self.latency = latency
+        self.quota = quota
+        self.children: dict[str, list[dict]] = {}
+        self.meta: dict[str, dict] = {}
+        self.content: dict[str, bytes] = {}
+        self.round_trips = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def add(self, parent: str, file_id: str, name: str, mime: str, data: bytes = b""):
+        meta = {"id": file_id, "name": name, "mimeType": mime, "modifiedTime": "2026-01-01T00:00:00.000Z"}
+        if mime not in (FOLDER_MIME, GOOGLE_DOC_MIME):
+            meta.update(size=str(len(data)), md5Checksum=hashlib.md5(data).hexdigest())
+        self.content[file_id] = data
+        self.meta[file_id] = meta
+        self.children.setdefault(parent, []).append(meta)
+
+    def round_trip(self, fn):
+        with self._lock:
+            self.round_trips += 1
+            self._in_flight += 1
+            over = self._in_flight > self.quota
+            if over:
+                self.throttled += 1
+        try:
+            time.sleep(self.latency)
+            if over:
+                raise HttpError(httplib2.Response({"status": 429}), b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')
+            return fn()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def files(self):
+        return self
+
+    def list(self, q: str, **kwargs):
+        parent = q.split("'")[1]
+        return _Request(self, lambda: {"files": [dict(m) for m in self.children.get(parent, [])]})
+
+    def get(self, fileId: str, **kwargs):
+        return _Request(self, lambda: dict(self.meta[fileId]), fileId)
+
+    def export(self, fileId: str, **kwargs):
+        return _Request(self, lambda: self.content[fileId])
+
+    def new_batch_http_request(self, callback):
+        return _Batch(self, callback)
+
+
+class _Request:
+    def __init__(self, drive: _FakeDrive, fn, file_id: str = ""):
+        self.drive, self.fn, self.file_id = drive, fn, file_id
+
+    def execute(self):
+        return self.drive.round_trip(self.fn)
+
+
+class _Batch:
+    def __init__(self, drive: _FakeDrive, callback):
+        self.drive, self.callback, self.requests = drive, callback, []
+
+    def add(self, request: _Request, request_id: str):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        responses = self.drive.round_trip(lambda: [(rid, r.fn()) for rid, r in self.requests])
+        for request_id, response in responses:
+            self.callback(request_id, response, None)
+
+
+def _sync_class(base):
+    class _Sync(base):
+        def __init__(self, drive: _FakeDrive):
+            super().__init__()
+            self.enabled = True
+            self.root_folder_id = "root"
+            self.drive = drive
+
+        def _admin_ready(self):
+            return True, "ok"
+
+        def _build_drive_client(self):
+            return self.drive
+
+        def _download_text_file(self, drive, file_id, mime_type):
+            return drive.files().export(fileId=file_id, mimeType="text/plain").execute().decode("utf-8")
+
+        def _download_binary_file(self, drive, file_id, dest_path):
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            dest_path.write_bytes(self.drive.content[file_id])
+
+    return _Sync
+
+
+def _jpeg(seed: str) -> bytes:
+    """A small valid JPEG, distinct per seed (media variants decode every photo)."""
+    digest = hashlib.md5(seed.encode()).digest()
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 24), tuple(digest[:3])).save(buf, "JPEG", comment=seed.encode())
+    return buf.getvalue()
+
+
+def _course(days: int, latency: float, quota: int) -> _FakeDrive:
+    drive = _FakeDrive(latency, quota)
+    for day in range(days):
+        folder = f"day{day}"
+        drive.add("root", folder, f"day_{day:02d}", FOLDER_MIME)
+        links = []
+        for k in range(LINKED_PHOTOS):
+            fid = f"linked-{day}-{k}".ljust(16, "x")
+            drive.add("elsewhere", fid, f"linked {day} {k}.jpg", "image/jpeg", _jpeg(f"{day}/{k}"))
+            links.append(f"https://drive.google.com/file/d/{fid}/view?usp=drive_link")
+        album = f"album-{day}".ljust(16, "x")
+        drive.add("elsewhere", album, f"album {day}", FOLDER_MIME)
+        for k in range(FOLDER_PHOTOS):
+            drive.add(album, f"a{day}-{k}", f"album {day} {k}.jpg", "image/jpeg", _jpeg(f"album {day}/{k}"))
+        links.append(f"https://drive.google.com/drive/folders/{album}?usp=sharing")
+        lesson = f"Урок {day}\n" + "\n\n".join(f"Абзац {i}\n{url}" for i, url in enumerate(links)) + "\n[POST]\nЕщё текст"
+        drive.add(folder, f"lesson{day}", "lesson", GOOGLE_DOC_MIME, lesson.encode())
+        drive.add(folder, f"task{day}", "task", GOOGLE_DOC_MIME, f"Задание {day}: {links[0]}".encode())
+        drive.add(folder, f"meta{day}", "meta.json", "application/json", json.dumps({"title": f"День {day}"}).encode())
+        drive.add(folder, f"photo{day}", f"photo {day}.jpg", "image/jpeg", _jpeg(f"photo {day}"))
+        drive.add(folder, f"media{day}", "media", FOLDER_MIME)
+        drive.add(f"media{day}", f"video{day}", "intro.mp4", "video/mp4", f"video {day}".encode())
+    return drive
+
+
+def _load_revision(rev: str):
+    source = subprocess.run(
+        ["git", "show", f"{rev}:services/drive_content_sync.py"],
+        cwd=_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    path = Path(tempfile.gettempdir()) / f"drive_content_sync_{rev.replace('~', '_').replace('/', '_')}.py"
+    path.write_text(source, encoding="utf-8")
+    spec = importlib.util.spec_from_file_location("drive_content_sync_rev", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.DriveContentSync
+
+
+def _timed_sync(base, days: int, latency: float, quota: int):
+    drive = _course(days, latency, quota)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        Config.DATABASE_PATH = str(Path(tmp) / "data" / "bot.db")
+        Config.DRIVE_MASTER_DOC_ID = ""
+        sync = _sync_class(base)(drive)
+        started = time.perf_counter()
+        result = sync.sync_now()
+        elapsed = time.perf_counter() - started
+        lessons = json.loads(Path(result.lessons_path).read_text(encoding="utf-8"))
+        os.chdir(_ROOT)
+    return elapsed, drive, result, lessons
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _run(days: int, latency_ms: float, quota: int, workers: int, compare: str | None) -> int:
+    logging.disable(logging.CRITICAL)
+    # Backoff scaled to the simulated latency so the run stays short
+    drive_pool.BACKOFF_BASE_SECONDS = max(latency_ms / 1000, 0.01)
+    Config.DRIVE_SYNC_WORKERS = workers
+    latency = latency_ms / 1000
+
+    elapsed, drive, result, lessons = _timed_sync(DriveContentSync, days, latency, quota)
+    print(f"parallel: {elapsed:.2f} s, {drive.round_trips} round-trips ({drive.throttled} answered 429), "
+          f"{workers} workers, quota {quota} in flight")
+
+    failures: list[str] = []
+    _check(f"all {days} days compiled", len(lessons) == days and not result.warnings, failures)
+    markers_ok = all(
+        len(entry.get("media_markers", {})) == LINKED_PHOTOS + FOLDER_PHOTOS
+        and "drive.google.com" not in json.dumps(entry["text"], ensure_ascii=False)
+        for entry in lessons.values()
+    )
+    _check("every link and linked folder file got a marker", markers_ok, failures)
+    _check("meta.json titles and day media applied", all(
+        entry["title"] == f"День {day}" and len(entry.get("media", [])) == 2 for day, entry in lessons.items()), failures)
+    if compare:
+        old_elapsed, old_drive, _, old_lessons = _timed_sync(_load_revision(compare), days, latency, quota)
+        print(f"{compare}: {old_elapsed:.2f} s, {old_drive.round_trips} round-trips")
+        _check(f"lessons.json identical to {compare}", old_lessons == lessons, failures)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--quota", type=int, default=6, help="requests in flight before Drive answers 429")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--compare", metavar="REV", help="also run the sync of this git revision")
+    args = parser.parse_args()
+    return _run(args.days, args.latency_ms, args.quota, args.workers, args.compare)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
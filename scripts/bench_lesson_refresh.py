@@ -0,0 +1,163 @@
+"""
+Benchmark / self-check of lesson re-reads on the delivery path
+(LessonLoader.refresh / get_lesson_with in services/lesson_loader.py).
+
+A scheduled cohort of --users users receives a day whose lesson has no
+media_markers. CourseBot._send_lesson_from_json used to re-read lessons.json
+(reload_async) for every one of them; now it calls get_lesson_with(). The
+lessons.json is the real one with every text repeated --scale times. Reports
+parses and wall time for the cohort both ways, then checks:
+  - concurrent refresh() calls share one read, and only a changed file is parsed;
+  - a day without markers is re-checked at most once per lessons version;
+  - markers published later are seen after the next reload;
+  - markers published while refresh() is rate-limited are not remembered
+    as missing, and are seen once the interval has passed;
+  - an empty cache is filled by a single read however many users arrive.
+
+Usage:
+  python scripts/bench_lesson_refresh.py
+  python scripts/bench_lesson_refresh.py --users 500 --scale 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from services import lesson_loader  # noqa: E402
+from services.lesson_loader import LessonLoader  # noqa: E402
+
+parses = 0
+_read = LessonLoader._read
+
+
+def _counting_read(self):
+    global parses
+    parses += 1
+    return _read(self)
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _write(path: Path, lessons: dict):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(lessons, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+async def _run(lessons_path: Path, users: int, scale: int) -> int:
+    global parses
+    logging.disable(logging.CRITICAL)
+    LessonLoader._read = _counting_read
+    lessons = json.loads(lessons_path.read_text(encoding="utf-8"))
+    for entry in lessons.values():
+        if isinstance(entry.get("text"), (list, str)):
+            entry["text"] = entry["text"] * scale
+    day = next((int(k) for k, v in lessons.items() if k.isdigit() and "media_markers" not in v), 0)
+    lessons[str(day)].pop("media_markers", None)
+    failures: list[str] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / "lessons.json"
+        _write(target, lessons)
+        loader = LessonLoader(str(target))
+        print(f"lessons.json {target.stat().st_size / 1048576:.1f} MB, day {day} without media_markers, {users} users")
+
+        async def old_delivery():
+            # What _send_lesson_from_json did for each recipient of such a day
+            if "media_markers" not in loader.get_lesson(day):
+                await loader.reload_async()
+
+        parses = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(old_delivery() for _ in range(users)))
+        print(f"reload per user:    {parses:4d} parses, {(time.perf_counter() - started) * 1000:7.0f} ms")
+
+        async def delivery():
+            lesson = loader.get_lesson(day)
+            if "media_markers" not in lesson:
+                await loader.get_lesson_with(day, "media_markers")
+
+        lesson_loader._last_refresh.clear()
+        parses = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(delivery() for _ in range(users)))
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"get_lesson_with():  {parses:4d} parses, {elapsed:7.0f} ms")
+        _check("unchanged file: the cohort parses nothing", parses == 0, failures)
+        _check("day without markers remembered for this version", (day, "media_markers") in loader._checked_missing,
+               failures)
+
+        # The file changes under a cohort: one shared read
+        changed = copy.deepcopy(lessons)
+        changed[str(day)]["title"] = "changed"
+        _write(target, changed)
+        lesson_loader._last_refresh.clear()
+        parses = 0
+        results = await asyncio.gather(*(loader.refresh() for _ in range(users)))
+        _check("changed file: concurrent refresh() parse it once", parses == 1 and all(results), failures)
+        parses = 0
+        await asyncio.gather(*(loader.refresh() for _ in range(users)))
+        _check("within the interval refresh() does nothing", parses == 0, failures)
+
+        # Markers published later: seen once the watcher / a sync reloads the file
+        changed[str(day)]["media_markers"] = {}
+        _write(target, changed)
+        await lesson_loader.refresh_all()
+        lesson = await loader.get_lesson_with(day, "media_markers")
+        _check("markers published later are seen after reload", lesson is not None and "media_markers" in lesson,
+               failures)
+
+        # Markers published while refresh() is rate-limited: the file was not checked, nothing remembered
+        changed[str(day)].pop("media_markers")
+        _write(target, changed)
+        await lesson_loader.refresh_all()
+        await loader.refresh()
+        changed[str(day)]["media_markers"] = {}
+        _write(target, changed)
+        lesson = await loader.get_lesson_with(day, "media_markers")
+        _check("rate-limited refresh(): missing key not remembered", "media_markers" not in lesson
+               and (day, "media_markers") not in loader._checked_missing, failures)
+        lesson_loader._last_refresh.clear()
+        lesson = await loader.get_lesson_with(day, "media_markers")
+        _check("markers seen once the interval has passed", "media_markers" in lesson, failures)
+
+        # A loader that came up without lessons: one read for everyone
+        empty = LessonLoader(str(target))
+        empty._swap({}, None)
+        lesson_loader._last_refresh.clear()
+        parses = 0
+        await asyncio.gather(*(empty.refresh() for _ in range(users)))
+        _check("empty cache filled by a single read", parses == 1 and bool(empty.get_all_lessons()), failures)
+
+    LessonLoader._read = _read
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--scale", type=int, default=10, help="repeat every lesson text this many times")
+    args = parser.parse_args()
+    return asyncio.run(_run(args.lessons, args.users, args.scale))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,256 @@
+"""
+Benchmark / self-check of the master-document sync (DRIVE_MASTER_DOC_ID mode,
+services/master_doc.py + DriveContentSync._sync_from_master_doc), against an
+in-memory stand-in for the Drive API.
+
+Builds a synthetic master document of about --mb megabytes: days 0..30, each
+with a title, lesson paragraphs split by [POST] markers, a task, intro and
+"about me" sections, and Drive links (photos, videos, folders of photos, a
+non-media Google Doc) repeated all over the text. Reports the parse time, the
+whole sync time and the number of Drive API calls, then checks that:
+  - every media link became a [MEDIA_...] marker and every marker is in media_markers;
+  - the lesson is split exactly at the [POST] markers;
+  - the non-media link is left in the text.
+
+--compare REV runs the same sync with services/drive_content_sync.py taken
+from git revision REV (e.g. HEAD~1) and prints both timings.
+
+Usage:
+  python scripts/bench_master_doc.py
+  python scripts/bench_master_doc.py --mb 10 --compare HEAD~1
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.config import Config  # noqa: E402
+from services import master_doc  # noqa: E402
+from services.drive_content_sync import FOLDER_MIME, GOOGLE_DOC_MIME, DriveContentSync  # noqa: E402
+
+MASTER_ID = "master-doc-id"
+PHOTOS = 40
+VIDEOS = 5
+FOLDERS = 5
+PHOTOS_PER_FOLDER = 3
+PARAGRAPH = (
+    "Сегодня разбираем, как рассказывать о себе так, чтобы это было интересно читать. "
+    "Пишите коротко, по делу и с примерами из жизни 🙂 "
+)
+
+
+def _file_id(kind: str, n: int) -> str:
+    return f"{kind}{n:03d}".ljust(24, "x")
+
+
+class _FakeDrive:
+    """files().get / files().list over in-memory metadata; counts the API calls."""
+
+    def __init__(self):
+        self.meta: dict[str, dict] = {}
+        self.children: dict[str, list[dict]] = {}
+        self.content: dict[str, bytes] = {}
+        self.calls = 0
+
+    def add(self, file_id: str, name: str, mime: str, data: bytes = b"", parent: str = ""):
+        meta = {"id": file_id, "name": name, "mimeType": mime, "modifiedTime": "2026-01-01T00:00:00.000Z"}
+        if mime != FOLDER_MIME:
+            meta.update(size=str(len(data)), md5Checksum=hashlib.md5(data).hexdigest())
+            self.content[file_id] = data
+        self.meta[file_id] = meta
+        if parent:
+            self.children.setdefault(parent, []).append(meta)
+
+    def files(self):
+        return self
+
+    def get(self, fileId: str, **kwargs):
+        self.calls += 1
+        return _Result(dict(self.meta[fileId]))
+
+    def list(self, q: str, **kwargs):
+        self.calls += 1
+        parent = q.split("'")[1]
+        return _Result({"files": [dict(m) for m in self.children.get(parent, [])]})
+
+
+class _Result:
+    def __init__(self, value):
+        self.value = value
+
+    def execute(self):
+        return self.value
+
+
+def _sync_class(base):
+    class _Sync(base):
+        def __init__(self, drive: _FakeDrive, text: str):
+            super().__init__()
+            self.enabled = True
+            self.root_folder_id = ""
+            self.drive = drive
+            self.text = text
+
+        def _admin_ready(self):
+            return True, "ok"
+
+        def _build_drive_client(self):
+            return self.drive
+
+        def _download_text_file(self, drive, file_id, mime_type):
+            return self.text
+
+        def _download_binary_file(self, drive, file_id, dest_path):
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            dest_path.write_bytes(self.drive.content[file_id])
+
+    return _Sync
+
+
+def _drive() -> tuple[_FakeDrive, list[str]]:
+    drive = _FakeDrive()
+    urls = []
+    for n in range(PHOTOS):
+        fid = _file_id("photo", n)
+        drive.add(fid, f"photo {n}.jpg", "image/jpeg", os.urandom(2000))
+        urls.append(f"https://drive.google.com/file/d/{fid}/view?usp=drive_link")
+    for n in range(VIDEOS):
+        fid = _file_id("video", n)
+        drive.add(fid, f"video {n}.mp4", "video/mp4", os.urandom(5000))
+        urls.append(f"https://drive.google.com/open?id={fid}")
+    for n in range(FOLDERS):
+        folder = _file_id("folder", n)
+        drive.add(folder, f"album {n}", FOLDER_MIME)
+        for k in range(PHOTOS_PER_FOLDER):
+            drive.add(_file_id(f"f{n}p", k), f"album {n} {k}.jpg", "image/jpeg", os.urandom(1000), parent=folder)
+        urls.append(f"https://drive.google.com/drive/folders/{folder}?usp=sharing")
+    drive.add(_file_id("doc", 0), "notes", GOOGLE_DOC_MIME)
+    return drive, urls
+
+
+def _document(urls: list[str], mb: float, seed: int) -> tuple[str, dict[int, int]]:
+    """The master document and the number of [POST] markers per day."""
+    rng = random.Random(seed)
+    doc_url = f"https://docs.google.com/document/d/{_file_id('doc', 0)}/edit"
+    per_day = int(mb * 1024 * 1024 / 31 / len(PARAGRAPH.encode("utf-8")))
+    parts, markers = [], {}
+    for day in range(31):
+        parts.append(f"День {day}: Тема дня {day}")
+        markers[day] = 0
+        for i in range(per_day):
+            parts.append(PARAGRAPH + (rng.choice(urls) if i % 5 == 0 else ""))
+            if i % 20 == 19:
+                parts.append("[POST]")
+                markers[day] += 1
+        parts.append(f"Полезное: {doc_url}")
+        parts.append(f"Задание: пришлите фото {rng.choice(urls)}")
+        parts.append(PARAGRAPH)
+        parts.append(f"Intro: привет {rng.choice(urls)}")
+        parts.append(f"Обо мне: {rng.choice(urls)}")
+        parts.append("")
+    return "\n".join(parts), markers
+
+
+def _load_revision(rev: str):
+    source = subprocess.run(
+        ["git", "show", f"{rev}:services/drive_content_sync.py"],
+        cwd=_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    path = Path(tempfile.gettempdir()) / f"drive_content_sync_{rev.replace('~', '_').replace('/', '_')}.py"
+    path.write_text(source, encoding="utf-8")
+    spec = importlib.util.spec_from_file_location("drive_content_sync_rev", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.DriveContentSync
+
+
+def _timed_sync(base, text: str) -> tuple[float, int, dict]:
+    drive, _ = _drive()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        Config.DATABASE_PATH = str(Path(tmp) / "data" / "bot.db")
+        Config.DRIVE_MASTER_DOC_ID = MASTER_ID
+        sync = _sync_class(base)(drive, text)
+        started = time.perf_counter()
+        result = sync.sync_now()
+        elapsed = time.perf_counter() - started
+        lessons = json.loads(Path(result.lessons_path).read_text(encoding="utf-8"))
+        os.chdir(_ROOT)
+    return elapsed, drive.calls, lessons
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _run(mb: float, compare: str | None) -> int:
+    logging.disable(logging.CRITICAL)
+    _, urls = _drive()
+    text, markers = _document(urls, mb, seed=1)
+    links = len(master_doc.find_links(text))
+    print(f"master doc: {len(text.encode('utf-8')) / 1048576:.1f} MB, 31 days, {links} Drive links "
+          f"({len(urls) + 1} distinct), {sum(markers.values())} [POST] markers")
+
+    started = time.perf_counter()
+    master_doc.parse(text)
+    print(f"parse:      {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    elapsed, calls, lessons = _timed_sync(DriveContentSync, text)
+    print(f"sync:       {elapsed * 1000:.0f} ms, {calls} Drive API calls")
+    if compare:
+        old_elapsed, old_calls, _ = _timed_sync(_load_revision(compare), text)
+        print(f"{compare}: {old_elapsed * 1000:.0f} ms, {old_calls} Drive API calls")
+
+    failures: list[str] = []
+    marker_re = re.compile(r"\[(MEDIA_[a-zA-Z0-9_-]+)\]")
+    media_url = re.compile("|".join(re.escape(u) for u in urls))
+    texts = {
+        day: "\n".join(entry["text"] if isinstance(entry["text"], list) else [entry["text"]])
+        + "\n".join(entry.get(k, "") for k in ("task", "intro_text", "about_me_text"))
+        for day, entry in lessons.items()
+    }
+    _check("all 31 days compiled", len(lessons) == 31, failures)
+    _check("every media link replaced by a marker",
+           not any(media_url.search(t) for t in texts.values()), failures)
+    _check("every marker is in media_markers", all(
+        set(marker_re.findall(texts[day])) <= set(entry.get("media_markers", {}))
+        for day, entry in lessons.items()), failures)
+    _check("one Drive API call per distinct link and day", calls <= 31 * (len(urls) + 1), failures)
+    _check("lesson split at every [POST] marker", all(
+        isinstance(entry["text"], list) and len(entry["text"]) == markers[int(day)] + 1
+        for day, entry in lessons.items()), failures)
+    _check("non-media link left in the text", all("docs.google.com" in t for t in texts.values()), failures)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=5.0, help="size of the synthetic master document")
+    parser.add_argument("--compare", metavar="REV", help="also run the sync of this git revision")
+    args = parser.parse_args()
+    return _run(args.mb, args.compare)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,188 @@
+"""
+Benchmark / self-check of photo deck delivery (services/media_gallery.py).
+
+Sends the lesson 21 cards and lesson 19 levels of lessons.json to --users
+users through a fake Bot (--latency-ms per request plus --upload-ms per MB
+uploaded) and a real Database, and reports requests, uploads and time per
+user with the file_id cache and without it (every photo lacking a file_id
+uploaded from disk for every user, as the handlers did). Then checks:
+  - groups have at most 10 photos, in deck order, duplicates dropped;
+  - after the first user no photo is uploaded again, also by a second
+    MediaGallery on the same database (another worker);
+  - a rejected (stale) file_id makes the group upload once, then the new
+    file_id is used;
+  - flood control (retry_after) is waited out instead of failing the deck.
+
+Usage:
+  python scripts/bench_media_gallery.py
+  python scripts/bench_media_gallery.py --users 20 --latency-ms 80
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter  # noqa: E402
+
+from core.config import Config  # noqa: E402
+from core.database import Database  # noqa: E402
+from services import media_gallery  # noqa: E402
+from services.media_gallery import MediaGallery  # noqa: E402
+
+DECKS = ((21, "cards"), (19, "levels_images"))
+
+
+class _FakeBot:
+    """send_photo / send_media_group with simulated latency; uploads get a file_id derived from the path."""
+
+    def __init__(self, latency: float, upload_per_mb: float):
+        self.latency, self.upload_per_mb = latency, upload_per_mb
+        self.requests = self.uploads = 0
+        self.uploaded_mb = 0.0
+        self.rejected_ids: set = set()
+        self.retry_after_next = 0
+        self.sent: list = []
+
+    def _media_id(self, media) -> str:
+        if isinstance(media, str):
+            if media in self.rejected_ids:
+                raise TelegramBadRequest(method=None, message="Bad Request: wrong file identifier")
+            return media
+        self.uploads += 1
+        mb = os.path.getsize(media.path) / 1048576
+        self.uploaded_mb += mb
+        self._upload_delay += mb * self.upload_per_mb
+        return f"id:{Path(media.path).name}"
+
+    async def _request(self, medias):
+        self.requests += 1
+        if self.retry_after_next:
+            self.retry_after_next -= 1
+            raise TelegramRetryAfter(method=None, message="Too Many Requests", retry_after=0)
+        self._upload_delay = 0.0
+        ids = [self._media_id(m) for m in medias]
+        await asyncio.sleep(self.latency + self._upload_delay)
+        self.sent.extend(ids)
+        return [SimpleNamespace(photo=[SimpleNamespace(file_id=i)]) for i in ids]
+
+    async def send_photo(self, chat_id, photo, protect_content=None):
+        return (await self._request([photo]))[0]
+
+    async def send_media_group(self, chat_id, media, protect_content=None):
+        if not 2 <= len(media) <= 10:
+            raise TelegramBadRequest(method=None, message="Bad Request: wrong number of media")
+        return await self._request([m.media for m in media])
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+async def _deliver(gallery: MediaGallery, bot: _FakeBot, lessons: dict, user_id: int):
+    for day, name in DECKS:
+        await gallery.send(bot, user_id, day, name, lessons[str(day)][name])
+
+
+async def _run(lessons_path: Path, users: int, latency: float, upload_per_mb: float) -> int:
+    logging.disable(logging.WARNING)
+    lessons = json.loads(lessons_path.read_text(encoding="utf-8"))
+    failures: list[str] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Config.DATABASE_PATH = str(Path(tmp) / "bot.db")
+        db = Database()
+        await db.connect()
+
+        # Without the cache: a fresh gallery and an empty media_file_ids for every user
+        class _NoCache:
+            async def get_media_file_ids(self, day, prefix=""):
+                return {}
+
+            async def save_media_file_ids(self, day, media_type, file_ids):
+                return None
+
+        bot = _FakeBot(latency, upload_per_mb)
+        started = time.perf_counter()
+        for user in range(users):
+            await _deliver(MediaGallery(_NoCache()), bot, lessons, user)
+        old = (time.perf_counter() - started) / users
+        print(f"no file_id cache: {old * 1000:6.0f} ms/user, {bot.requests / users:.1f} requests, "
+              f"{bot.uploads / users:.1f} uploads ({bot.uploaded_mb / users:.1f} MB) per user")
+
+        bot = _FakeBot(latency, upload_per_mb)
+        gallery = MediaGallery(db)
+        started = time.perf_counter()
+        await _deliver(gallery, bot, lessons, 0)
+        first = time.perf_counter() - started
+        first_uploads = bot.uploads
+        bot.uploads = bot.requests = 0
+        started = time.perf_counter()
+        for user in range(1, users):
+            await _deliver(gallery, bot, lessons, user)
+        later = (time.perf_counter() - started) / max(users - 1, 1)
+        print(f"gallery: first user {first * 1000:.0f} ms ({first_uploads} uploads), "
+              f"then {later * 1000:.0f} ms/user, {bot.requests / max(users - 1, 1):.1f} requests, {bot.uploads} uploads")
+
+        chunks = {name: gallery.deck(day, name, lessons[str(day)][name]) for day, name in DECKS}
+        sizes_ok = all(1 <= len(c) <= media_gallery.MEDIA_GROUP_LIMIT for deck in chunks.values() for c in deck)
+        levels = [p for c in chunks["levels_images"] for p in c]
+        ordered = all(a.number <= b.number for deck in chunks.values()
+                      for a, b in zip([p for c in deck for p in c], [p for c in deck for p in c][1:]))
+        _check("groups of <= 10 photos, in deck order", sizes_ok and ordered, failures)
+        _check("duplicate level images dropped", len({p.path for p in levels}) == len(levels), failures)
+        _check("no uploads after the first user", bot.uploads == 0, failures)
+
+        other = _FakeBot(latency, upload_per_mb)
+        await _deliver(MediaGallery(db), other, lessons, users)
+        _check("another worker reuses the saved file_ids", other.uploads == 0, failures)
+
+        # A file_id Telegram no longer accepts (e.g. recorded by another bot token)
+        stale = _FakeBot(0, 0)
+        stale.rejected_ids = {p.lesson_file_id for c in chunks["cards"] for p in c if p.lesson_file_id}
+        fresh = MediaGallery(db)
+        await db.conn.execute("DELETE FROM media_file_ids")
+        await db.conn.commit()
+        sent, total = await fresh.send(stale, 1, 21, "cards", lessons["21"]["cards"])
+        uploads = stale.uploads
+        await fresh.send(stale, 2, 21, "cards", lessons["21"]["cards"])
+        _check("stale file_id: uploaded once, then new file_id used",
+               sent == total and uploads == total and stale.uploads == uploads, failures)
+
+        flood = _FakeBot(0, 0)
+        flood.retry_after_next = 1
+        sent, total = await MediaGallery(db).send(flood, 3, 19, "levels_images", lessons["19"]["levels_images"])
+        _check("retry_after waited out, deck delivered", sent == total and flood.requests == len(chunks["levels_images"]) + 1,
+               failures)
+        await db.close()
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Bot API round-trip")
+    parser.add_argument("--upload-ms", type=float, default=400.0, help="extra time per MB uploaded")
+    args = parser.parse_args()
+    return asyncio.run(_run(args.lessons, args.users, args.latency_ms / 1000, args.upload_ms / 1000))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
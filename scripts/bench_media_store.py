@@ -0,0 +1,233 @@
+"""
+Self-check of the content-addressed media store (services/media_store.py) through
+DriveContentSync in folders mode, against an in-memory stand-in for the Drive API.
+
+The fake course has DAYS day folders; every day has its own photo, and one
+video sits in every day's media/ folder (a Drive file with several parents),
+plus a second Drive file with the same bytes as day 0's photo. Runs:
+  1. first sync, with one day_XX file left from the old per-day layout;
+  2. re-sync with nothing changed, then a strict re-sync that is refused
+     (a day folder gone) while one photo was replaced: the published
+     lessons.json must keep serving its own bytes;
+  3. re-sync after one photo was replaced and one removed from Drive
+     (the old bytes of both stay while the latest lessons.json backup uses them);
+  4. re-sync with nothing changed (both are collected);
+  5. /sync_content clean;
+and checks downloads, per-day links, reference counts and that GC removed
+exactly the blobs nothing references any more.
+
+Usage:
+  python scripts/bench_media_store.py
+  python scripts/bench_media_store.py --days 30 --video-mb 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.config import Config  # noqa: E402
+from services.drive_content_sync import FOLDER_MIME, DriveContentSync  # noqa: E402
+
+
+class _FakeDrive:
+    """files().list / files().get over an in-memory tree: folder id -> children metadata."""
+
+    def __init__(self):
+        self.children: dict[str, list[dict]] = {}
+        self.content: dict[str, bytes] = {}
+
+    def add(self, parent: str, file_id: str, name: str, mime: str, data: bytes = b""):
+        meta = {"id": file_id, "name": name, "mimeType": mime, "modifiedTime": "2026-01-01T00:00:00.000Z"}
+        if mime != FOLDER_MIME:
+            meta.update(size=str(len(data)), md5Checksum=hashlib.md5(data).hexdigest())
+            self.content[file_id] = data
+        self.children.setdefault(parent, []).append(meta)
+
+    def replace(self, file_id: str, data: bytes):
+        self.content[file_id] = data
+        for files in self.children.values():
+            for meta in files:
+                if meta["id"] == file_id:
+                    meta.update(size=str(len(data)), md5Checksum=hashlib.md5(data).hexdigest(),
+                                modifiedTime="2026-02-01T00:00:00.000Z")
+
+    def remove(self, parent: str, file_id: str):
+        self.children[parent] = [m for m in self.children[parent] if m["id"] != file_id]
+
+    def files(self):
+        return self
+
+    def list(self, q: str, **kwargs):
+        parent = q.split("'")[1]
+        return _Result({"files": [dict(m) for m in self.children.get(parent, [])]})
+
+
+class _Result:
+    def __init__(self, value):
+        self.value = value
+
+    def execute(self):
+        return self.value
+
+
+class _Sync(DriveContentSync):
+    def __init__(self, drive: _FakeDrive):
+        super().__init__()
+        self.enabled = True
+        self.root_folder_id = "root"
+        self.drive = drive
+        self.downloads = 0
+
+    def _admin_ready(self):
+        return True, "ok"
+
+    def _build_drive_client(self):
+        return self.drive
+
+    def _download_text_file(self, drive, file_id, mime_type):
+        return self.drive.content[file_id].decode("utf-8")
+
+    def _download_binary_file(self, drive, file_id, dest_path):
+        self.downloads += 1
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        dest_path.write_bytes(self.drive.content[file_id])
+
+
+def _course(days: int, video_mb: float) -> _FakeDrive:
+    drive = _FakeDrive()
+    video = os.urandom(int(video_mb * 1024 * 1024))
+    for day in range(days):
+        drive.add("root", f"day{day}", f"day_{day:02d}", FOLDER_MIME)
+        drive.add(f"day{day}", f"lesson{day}", "lesson.txt", "text/plain", f"Урок {day}".encode())
+        drive.add(f"day{day}", f"photo{day}", f"photo {day}.jpg", "image/jpeg", os.urandom(200_000))
+        drive.add(f"day{day}", f"media{day}", "media", FOLDER_MIME)
+        drive.add(f"media{day}", "video", "intro.mp4", "video/mp4", video)
+    # Another Drive file with the same bytes as day 0's photo
+    drive.add("day1", "photo0-copy", "copy.jpg", "image/jpeg", drive.content["photo0"])
+    return drive
+
+
+def _path(result, day: int, name: str) -> Path:
+    """Versioned per-day path of `name` in the published lessons.json, relative to the media root."""
+    lessons = json.loads(Path(result.lessons_path).read_text(encoding="utf-8"))
+    path = next(m["path"] for m in lessons[str(day)]["media"] if m["path"].endswith("/" + name))
+    return Path(path).relative_to("data/content_media")
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _run(days: int, video_mb: float) -> int:
+    drive = _course(days, video_mb)
+    failures: list[str] = []
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        Config.DATABASE_PATH = str(Path(tmp) / "data" / "bot.db")
+        media = Path(tmp) / "data" / "content_media"
+        sync = _Sync(drive)
+        references = days * 2 + 1
+
+        # Old layout: the file is already there as a plain copy
+        legacy = media / "day_00" / "photo_0.jpg"
+        legacy.parent.mkdir(parents=True)
+        legacy.write_bytes(drive.content["photo0"])
+
+        result = sync.sync_now()
+        usage = result.media_usage
+        print(f"1. first sync: {sync.downloads} downloads for {references} media references "
+              f"({usage['blob_bytes'] / 1048576:.1f} MB stored, {usage['logical_bytes'] / 1048576:.1f} MB without dedup)")
+        _check("video stored once, duplicate photo and old file reused", sync.downloads == days, failures)
+        _check("every reference is a link to a blob", usage["references"] == references
+               and all(p.is_symlink() for p in media.glob("day_*/*/*")), failures)
+        _check("per-day path serves the right bytes",
+               (media / _path(result, 1, "copy.jpg")).read_bytes() == drive.content["photo0"], failures)
+        lessons = json.loads(Path(result.lessons_path).read_text(encoding="utf-8"))
+        _check("lessons.json keeps per-day paths",
+               lessons["1"]["media"][0]["path"].startswith("data/content_media/day_01/"), failures)
+        _check("old-layout file adopted into the store", not (media / "day_00" / "photo_0.jpg").exists(), failures)
+
+        sync.downloads = 0
+        drive_photo1 = drive.content["photo1"]
+        result = sync.sync_now()
+        print(f"2. re-sync, nothing changed: {sync.downloads} downloads")
+        _check("nothing downloaded", sync.downloads == 0 and result.media_files_downloaded == 0, failures)
+
+        published = Path(result.lessons_path).read_bytes()
+        photo1 = media / _path(result, 1, "photo_1.jpg")
+        last_day = drive.children["root"][-1]
+        drive.remove("root", last_day["id"])
+        drive.replace("photo1", os.urandom(100_000))
+        try:
+            sync.sync_now(strict=True)
+            refused = False
+        except RuntimeError:
+            refused = True
+        _check("refused sync: published paths keep their bytes", refused
+               and Path(result.lessons_path).read_bytes() == published
+               and photo1.read_bytes() == drive_photo1, failures)
+        drive.children["root"].append(last_day)
+        drive.replace("photo1", drive_photo1)
+
+        sync.downloads = 0
+        blobs_before = result.media_usage["blobs"]
+        drive.replace("photo2", os.urandom(150_000))
+        drive.remove("day3", "photo3")
+        removed_photo = media / _path(result, 3, "photo_3.jpg")
+        result = sync.sync_now()
+        usage = result.media_usage
+        print(f"3. one photo replaced, one removed: {sync.downloads} downloads, "
+              f"{blobs_before} -> {usage['blobs']} blobs")
+        _check("only the new bytes downloaded", sync.downloads == 1, failures)
+        _check("replaced photo's old bytes kept for the backup", usage["blobs"] == blobs_before + 1
+               and usage["references"] == references - 1, failures)
+        _check("removed photo kept for the lessons.json backup", removed_photo.exists(), failures)
+        index = json.loads((media / "blobs" / "index.json").read_text(encoding="utf-8"))
+        video_md5 = hashlib.md5(drive.content["video"]).hexdigest()
+        _check("video refcount = days", index["refs"][video_md5]["count"] == days, failures)
+
+        sync.downloads = 0
+        result = sync.sync_now()
+        print(f"4. re-sync: {sync.downloads} downloads, {result.media_usage['blobs']} blobs")
+        _check("old bytes collected once out of the backup", result.media_usage["blobs"] == blobs_before - 1
+               and not removed_photo.exists(), failures)
+
+        sync.downloads = 0
+        (media / "day_00" / "compressed").mkdir()
+        (media / "day_00" / "compressed" / "compressed_intro.mp4").write_bytes(b"x" * 1000)
+        result = sync.sync_now(clean_media=True)
+        usage = result.media_usage
+        print(f"5. clean sync: {sync.downloads} downloads")
+        _check("clean sync reuses the blobs", sync.downloads == 0, failures)
+        _check("day directories rebuilt, compressed copies dropped",
+               usage["untracked_files"] == 0 and usage["references"] == references - 1, failures)
+        os.chdir(_ROOT)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--video-mb", type=float, default=4.0)
+    args = parser.parse_args()
+    return _run(args.days, args.video_mb)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,178 @@
+"""
+Benchmark / self-check of the sync-time media variants (services/media_variants.py).
+
+Runs the pipeline over every photo/video path of lessons.json (the repo's
+Photo/ files), then times what a lesson delivery costs per photo:
+  - now: a manifest lookup (delivery_path / resolve);
+  - before: CourseBot._resize_image_for_mobile of git revision --compare
+    (Pillow open + LANCZOS resize + save on every send).
+Then checks:
+  - photo variants are MOBILE_WIDTH-wide JPEGs, narrow photos are sent as is;
+  - a second sync prepares nothing again (only retries failures); identical bytes share one variant;
+  - an oversized video without ffmpeg falls back to the original;
+  - delivery lookups never import Pillow;
+  - commit() deletes variants no lesson uses.
+
+Usage:
+  python scripts/bench_media_variants.py
+  python scripts/bench_media_variants.py --compare <rev before the pipeline>
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from services import media_variants  # noqa: E402
+from services.media_variants import MediaVariants, media_paths  # noqa: E402
+
+SAMPLE = 12
+# Last revision whose CourseBot resized photos at delivery time (before services/media_variants.py)
+DELIVERY_RESIZE_REV = "49fdb95~1"
+
+
+def _old_resize(rev: str):
+    """CourseBot._resize_image_for_mobile of git revision `rev`, as a plain coroutine function."""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:bots/course_bot.py"], cwd=_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    tree = ast.parse(source)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.AsyncFunctionDef) and node.name == "_resize_image_for_mobile":
+            if "media_variants" in (ast.get_source_segment(source, node) or ""):
+                raise SystemExit(
+                    f"{rev}: _resize_image_for_mobile already delegates to media_variants; "
+                    f"pass --compare with a revision before the pipeline (e.g. {DELIVERY_RESIZE_REV})"
+                )
+            namespace = {"Path": Path, "Optional": Optional, "logger": logging.getLogger("old"), "MOBILE_SCREEN_WIDTH": 720}
+            exec(compile(ast.Module(body=[node], type_ignores=[]), "old_course_bot", "exec"), namespace)
+            return namespace["_resize_image_for_mobile"]
+    raise RuntimeError(f"_resize_image_for_mobile not found in {rev}")
+
+
+_NO_PIL_PROBE = """
+import sys
+sys.path.insert(0, {root!r})
+from services import media_variants
+paths = {paths!r}
+sent = [media_variants.resolve(p) for p in paths]
+print(int("PIL" not in sys.modules and all(sent)))
+"""
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _run(lessons_path: Path, compare: str) -> int:
+    from PIL import Image
+
+    resize = _old_resize(compare)
+    logging.disable(logging.WARNING)
+    lessons = json.loads(lessons_path.read_text(encoding="utf-8"))
+    failures: list[str] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        project = Path(tmp)
+        (project / "Photo").symlink_to(_ROOT / "Photo", target_is_directory=True)
+        os.chdir(project)
+        media_root = project / "data" / "content_media"
+
+        # Same bytes under a second name, and an oversized video (no ffmpeg needed to detect it)
+        photos = [p for p in media_paths(lessons) if media_variants.media_kind(p) == "photo" and (project / p).exists()]
+        (project / "extra").mkdir()
+        shutil.copy(project / photos[0], project / "extra" / "copy.jpg")
+        with open(project / "extra" / "big.mp4", "wb") as f:
+            f.truncate(int((media_variants.VIDEO_MAX_MB + 1) * 1024 * 1024))
+        lessons["extra"] = {"media": [{"type": "photo", "path": "extra/copy.jpg"}, {"type": "video", "path": "extra/big.mp4"}]}
+        paths = media_paths(lessons)
+
+        started = time.perf_counter()
+        report = MediaVariants(media_root).prepare(paths)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        again = MediaVariants(media_root).prepare(paths)
+        second = time.perf_counter() - started
+        print(f"{len(paths)} media paths: first sync {first:.1f} s {report}")
+        print(f"second sync: {second * 1000:.0f} ms, {again['unchanged']} unchanged")
+
+        sample = photos[:SAMPLE]
+        started = time.perf_counter()
+        for _ in range(100):
+            for rel in sample:
+                media_variants.resolve(project / rel)
+        lookup_us = (time.perf_counter() - started) / (100 * len(sample)) * 1e6
+        print(f"delivery now:  {lookup_us:.0f} µs per photo (manifest lookup)")
+
+        old_dir = project / "old"
+        old_dir.mkdir()
+        copies = [Path(shutil.copy(project / rel, old_dir / f"{n}{Path(rel).suffix}")) for n, rel in enumerate(sample)]
+        started = time.perf_counter()
+        for path in copies:
+            asyncio.run(resize(None, path))
+        old_ms = (time.perf_counter() - started) / len(copies) * 1000
+        print(f"delivery {compare}: {old_ms:.0f} ms per photo (Pillow resize on every send)")
+
+        entries = MediaVariants(media_root).entries()
+        variants_ok = True
+        for rel in photos:
+            entry = entries[rel]
+            with Image.open(project / entry["source"]) as src:
+                wide = src.size[0] > media_variants.MOBILE_WIDTH
+            if wide != bool(entry["variant"]):
+                variants_ok = False
+            elif wide:
+                with Image.open(project / entry["variant"]) as img:
+                    variants_ok &= img.format == "JPEG" and img.size[0] == media_variants.MOBILE_WIDTH
+        _check("wide photos -> 720 px JPEG, narrow ones as is", variants_ok, failures)
+        # Failures (here: no ffmpeg) are retried on the next sync, everything else is skipped
+        _check("second sync prepares nothing", again["created"] == again["reused"] == 0
+               and again["unchanged"] + again["failed"] == len(paths) - again["missing"], failures)
+        _check("identical bytes share one variant",
+               entries["extra/copy.jpg"]["variant"] == entries[photos[0]]["variant"], failures)
+        big = entries["extra/big.mp4"]
+        _check("oversized video without ffmpeg: original is sent",
+               (bool(big.get("error")) or bool(big.get("variant")))
+               and media_variants.resolve("extra/big.mp4") is not None, failures)
+
+        probe = _NO_PIL_PROBE.format(root=str(_ROOT), paths=photos)
+        out = subprocess.run([sys.executable, "-c", probe], cwd=project, capture_output=True, text=True)
+        _check("delivery lookups never import Pillow", out.stdout.strip() == "1", failures)
+
+        store = MediaVariants(media_root)
+        store.commit([p for p in paths if p != "extra/copy.jpg" and p != photos[0]])
+        dropped = entries[photos[0]]["variant"]
+        _check("commit() deletes variants no lesson uses", not dropped or not (project / dropped).exists(), failures)
+        os.chdir(_ROOT)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--compare", metavar="REV", default=DELIVERY_RESIZE_REV,
+                        help="git revision with the delivery-time resize")
+    args = parser.parse_args()
+    return _run(args.lessons, args.compare)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
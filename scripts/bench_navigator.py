@@ -0,0 +1,138 @@
+"""
+Benchmark / self-check of the course navigator keyboards (utils/navigator.py).
+
+Times opening the navigator the way CourseBot._show_navigator did (filter the
+lessons up to current_day, sort, look up names, truncate, build the markup on
+every click, with create_navigator_keyboard of git revision --compare) and
+with NavigatorKeyboards (markups prebuilt per current_day). Then checks:
+  - for every current_day the markup is identical to the old one;
+  - a repeated click returns the prebuilt markup without building anything;
+  - after LessonLoader reloads changed lessons, the markups show the change.
+
+Usage:
+  python scripts/bench_navigator.py
+  python scripts/bench_navigator.py --compare HEAD~1 --clicks 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from services.lesson_loader import LessonLoader  # noqa: E402
+from utils import navigator  # noqa: E402
+from utils.navigator import NavigatorKeyboards  # noqa: E402
+
+
+def _load_revision(rev: str):
+    source = subprocess.run(
+        ["git", "show", f"{rev}:utils/navigator.py"], cwd=_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    path = Path(tempfile.gettempdir()) / f"navigator_{rev.replace('~', '_').replace('/', '_')}.py"
+    path.write_text(source, encoding="utf-8")
+    spec = importlib.util.spec_from_file_location("navigator_rev", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _old_keyboard(module, all_lessons: dict, current_day: int):
+    """The filtering of the old CourseBot._show_navigator, then the old keyboard builder."""
+    available_lessons = {}
+    for day_str, lesson_data in all_lessons.items():
+        try:
+            if int(day_str) <= current_day:
+                available_lessons[day_str] = lesson_data
+        except (ValueError, TypeError):
+            continue
+    return module.create_navigator_keyboard(available_lessons, current_day)
+
+
+def _check(label: str, condition: bool, failures: list[str]):
+    print(f"  {label:<52} {'ok' if condition else 'FAILED'}")
+    if not condition:
+        failures.append(label)
+
+
+def _run(lessons_path: Path, compare: str, clicks: int) -> int:
+    old = _load_revision(compare)
+    failures: list[str] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / "lessons.json"
+        lessons = json.loads(lessons_path.read_text(encoding="utf-8"))
+        target.write_text(json.dumps(lessons, ensure_ascii=False), encoding="utf-8")
+        loader = LessonLoader(str(target))
+        all_lessons = loader.get_all_lessons()
+        days = sorted(int(k) for k in all_lessons if k.isdigit())
+        users = [days[i % len(days)] for i in range(clicks)]
+
+        started = time.perf_counter()
+        for current_day in users:
+            _old_keyboard(old, all_lessons, current_day)
+        old_us = (time.perf_counter() - started) / clicks * 1e6
+
+        keyboards = NavigatorKeyboards()
+        started = time.perf_counter()
+        keyboards.get(all_lessons, 0)
+        build_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        for current_day in users:
+            keyboards.get(all_lessons, current_day)
+        new_us = (time.perf_counter() - started) / clicks * 1e6
+        print(f"{compare}: {old_us:7.1f} µs per navigator open (build on every click)")
+        print(f"cached: {new_us:7.2f} µs per open, {build_ms:.1f} ms to prebuild {len(days)} keyboards per lessons version")
+
+        same = all(
+            keyboards.get(all_lessons, d).model_dump() == _old_keyboard(old, all_lessons, d).model_dump()
+            for d in range(-1, max(days) + 3)
+        )
+        _check(f"markups identical to {compare} for every current_day", same, failures)
+
+        calls = 0
+        build = navigator._build_keyboard
+
+        def counting(*args, **kwargs):
+            nonlocal calls
+            calls += 1
+            return build(*args, **kwargs)
+
+        navigator._build_keyboard = counting
+        first = keyboards.get(all_lessons, days[-1])
+        _check("repeated click: prebuilt markup, nothing built",
+               keyboards.get(all_lessons, days[-1]) is first and calls == 0, failures)
+
+        lessons[str(days[-1] + 1)] = {"title": f"День {days[-1] + 1} - Новый урок"}
+        target.write_text(json.dumps(lessons, ensure_ascii=False), encoding="utf-8")
+        loader.reload()
+        reloaded = keyboards.get(loader.get_all_lessons(), days[-1] + 1)
+        navigator._build_keyboard = build
+        texts = [button.text for row in reloaded.inline_keyboard for button in row]
+        _check("reloaded lessons rebuild the markups",
+               f"📍 {days[-1] + 1}. Новый урок" in texts and calls > 0, failures)
+
+    print("OK" if not failures else f"FAILED: {', '.join(failures)}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--compare", metavar="REV", default="HEAD", help="git revision with the per-click keyboard")
+    parser.add_argument("--clicks", type=int, default=2000)
+    args = parser.parse_args()
+    return _run(args.lessons, args.compare, args.clicks)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,176 @@
+"""
+Benchmark / self-check of payment reconciliation (PaymentService.reconcile_pending_payments)
+against the local YooKassa stand-in (scripts/fake_yookassa.py) through the real
+YooKassaPaymentProcessor and yookassa SDK.
+
+For each concurrency level: creates N payments over a fresh temporary database,
+settles most of them in the fake API without sending webhooks (some are
+cancelled, some stay pending), runs one reconciliation round and checks that:
+  - every paid payment was completed and its user has access, exactly once;
+  - cancelled payments are closed, pending ones are deferred with backoff
+    (an immediate second round checks nothing);
+  - at most `concurrency` status requests were in flight at a time.
+Then one round where a status check raises and a completion fails: the rest of
+the batch is still settled and both payments are deferred with backoff.
+
+Usage:
+  python scripts/bench_payment_reconcile.py
+  python scripts/bench_payment_reconcile.py --payments 200 --latency-ms 200 --concurrency 1 4 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.database import Database  # noqa: E402
+from core.models import Tariff  # noqa: E402
+from fake_yookassa import FakeYooKassa  # noqa: E402
+from payment.yookassa_payment import YooKassaPaymentProcessor  # noqa: E402
+from services.payment_service import PaymentService  # noqa: E402
+
+
+async def _round(n_payments: int, latency_ms: float, concurrency: int) -> bool:
+    fake = FakeYooKassa(latency_ms)
+    api_url = await fake.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(str(Path(tmp) / "bench.db"))
+            await db.connect()
+            try:
+                processor = YooKassaPaymentProcessor("fake", "fake", "https://t.me/test", api_url=api_url)
+                service = PaymentService(db, processor)
+                payment_ids = []
+                for i in range(n_payments):
+                    info = await service.initiate_payment(user_id=5000 + i, tariff=Tariff.BASIC)
+                    payment_ids.append(info["payment_id"])
+                # Due right away instead of a minute after creation
+                await db.conn.execute("UPDATE pending_payments SET next_check_at = 0")
+                await db.conn.commit()
+                paid, cancelled = payment_ids[: n_payments * 7 // 10], payment_ids[n_payments * 7 // 10: n_payments * 9 // 10]
+                for pid in paid:
+                    fake.settle(pid, "succeeded")
+                for pid in cancelled:
+                    fake.settle(pid, "canceled")
+                fake.requests["get"] = 0
+                fake.peak_in_flight = 0
+
+                started = time.perf_counter()
+                report = await service.reconcile_pending_payments(limit=n_payments, concurrency=concurrency)
+                elapsed = time.perf_counter() - started
+                again = await service.reconcile_pending_payments(limit=n_payments, concurrency=concurrency)
+
+                async with db.conn.execute("SELECT status, COUNT(*) FROM pending_payments GROUP BY status") as c:
+                    statuses = dict(await c.fetchall())
+                async with db.conn.execute("SELECT COUNT(*) FROM processed_payments") as c:
+                    processed = (await c.fetchone())[0]
+                with_access = 0
+                for i in range(n_payments):
+                    user = await db.get_user(5000 + i)
+                    with_access += bool(user and user.has_access())
+            finally:
+                await db.close()
+    finally:
+        await fake.stop()
+
+    n_pending = n_payments - len(paid) - len(cancelled)
+    print(
+        f"concurrency {concurrency:>2}: {report['checked']} payments reconciled in {elapsed:6.2f}s "
+        f"({fake.requests['get']} API requests, peak {fake.peak_in_flight} in flight) -> "
+        f"completed {len(report['completed'])}, cancelled {report['cancelled']}, pending {report['pending']}"
+    )
+    ok = (
+        len(report["completed"]) == len(paid) == processed == with_access
+        and report["cancelled"] == len(cancelled) and report["pending"] == n_pending
+        and statuses == {k: v for k, v in (("completed", len(paid)), ("cancelled", len(cancelled)),
+                                            ("pending", n_pending)) if v}
+        and again["checked"] == 0
+        and fake.peak_in_flight <= concurrency
+    )
+    if not ok:
+        print(f"  MISMATCH: statuses={statuses}, processed={processed}, with_access={with_access}, again={again}")
+    return ok
+
+
+async def _failure_round(latency_ms: float) -> bool:
+    """A raising status check and a failing completion do not abort the batch."""
+    fake = FakeYooKassa(latency_ms)
+    api_url = await fake.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(str(Path(tmp) / "bench.db"))
+            await db.connect()
+            try:
+                processor = YooKassaPaymentProcessor("fake", "fake", "https://t.me/test", api_url=api_url)
+                service = PaymentService(db, processor)
+                payment_ids = [(await service.initiate_payment(user_id=7000 + i, tariff=Tariff.BASIC))["payment_id"]
+                               for i in range(10)]
+                await db.conn.execute("UPDATE pending_payments SET next_check_at = 0")
+                await db.conn.commit()
+                for pid in payment_ids:
+                    fake.settle(pid, "succeeded")
+                broken_check, broken_completion = payment_ids[0], payment_ids[1]
+                check, complete = service.check_payment, service.process_payment_completion
+
+                async def flaky_check(payment_id):
+                    if payment_id == broken_check:
+                        raise ConnectionError("network down")
+                    return await check(payment_id)
+
+                async def flaky_completion(payment_id, **kwargs):
+                    if payment_id == broken_completion:
+                        raise RuntimeError("database busy")
+                    return await complete(payment_id, **kwargs)
+
+                service.check_payment, service.process_payment_completion = flaky_check, flaky_completion
+                started = time.time()
+                report = await service.reconcile_pending_payments(limit=10, concurrency=4)
+                async with db.conn.execute(
+                    "SELECT payment_id, status, next_check_at, check_count FROM pending_payments"
+                ) as c:
+                    rows = {row[0]: tuple(row[1:]) for row in await c.fetchall()}
+            finally:
+                await db.close()
+    finally:
+        await fake.stop()
+
+    deferred = all(
+        rows[pid][0] == "pending" and rows[pid][1] > started and rows[pid][2] == 1
+        for pid in (broken_check, broken_completion)
+    )
+    ok = len(report["completed"]) == 8 and report["pending"] == 2 and deferred
+    print(f"failing check + completion: completed {len(report['completed'])}, pending {report['pending']}, "
+          f"deferred with backoff: {deferred} -> {'ok' if ok else 'MISMATCH'}")
+    return ok
+
+
+async def _run(n_payments: int, latency_ms: float, levels: list[int]) -> int:
+    ok = True
+    for concurrency in levels:
+        ok = await _round(n_payments, latency_ms, concurrency) and ok
+    ok = await _failure_round(latency_ms) and ok
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Fake API latency per request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    return asyncio.run(_run(args.payments, args.latency_ms, args.concurrency))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,140 @@
+"""
+Benchmark / self-check of the YooKassa webhook inbox (services/payment_inbox.py).
+
+Serves run_all_bots._handle_yookassa_webhook on a local port over a temporary
+database, with a stand-in payment service that takes --process-ms per payment
+and fails the first attempts of some of them, then:
+  - posts N webhooks (plus every 10th one again, as YooKassa retries do) and
+    reports the acknowledgement latency, which must not depend on processing time;
+  - waits until the worker has drained the inbox and checks that every payment
+    was granted exactly once, flaky ones after retries, and that a payment
+    that always fails ends up dead-lettered.
+
+Usage:
+  python scripts/bench_payment_webhook.py
+  python scripts/bench_payment_webhook.py --webhooks 500 --process-ms 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+import run_all_bots  # noqa: E402
+from core.database import Database  # noqa: E402
+from services import payment_inbox  # noqa: E402
+from services.payment_inbox import PaymentInboxWorker  # noqa: E402
+
+
+class _FakePaymentService:
+    """Grants access after `delay`; 'flaky-*' payments fail twice, 'broken' always fails."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.granted: dict[str, int] = {}
+        self.failures: dict[str, int] = {}
+
+    async def process_payment_completion(self, payment_id: str, webhook_data=None):
+        await asyncio.sleep(self.delay)
+        if payment_id == "broken" or (payment_id.startswith("flaky-") and self.failures.get(payment_id, 0) < 2):
+            self.failures[payment_id] = self.failures.get(payment_id, 0) + 1
+            raise RuntimeError("payment API unavailable")
+        if webhook_data.get("event") != "payment.succeeded":
+            return None
+        self.granted[payment_id] = self.granted.get(payment_id, 0) + 1
+        return {"user_id": 1}
+
+
+def _webhook(payment_id: str) -> dict:
+    return {"type": "notification", "event": "payment.succeeded",
+            "object": {"id": payment_id, "status": "succeeded", "amount": {"value": "4900.00", "currency": "RUB"}}}
+
+
+async def _run(n_webhooks: int, process_ms: float) -> int:
+    # Fast retries for the check; the schedule itself is covered by retry_delay()
+    payment_inbox.RETRY_BASE_SECONDS = 0.05
+    payment_inbox.MAX_ATTEMPTS = 4
+    payment_inbox.POLL_INTERVAL_SECONDS = 0.05
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(str(Path(tmp) / "bench.db"))
+        await db.connect()
+        service = _FakePaymentService(process_ms / 1000)
+        worker = PaymentInboxWorker(db, service)
+        app = web.Application()
+        app["payment_inbox_db"] = db
+        app["payment_inbox_worker"] = worker
+        app.router.add_post("/payment/webhook", run_all_bots._handle_yookassa_webhook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/payment/webhook"
+        worker.start()
+
+        ids = [f"flaky-{i}" if i % 25 == 0 else f"pay-{i}" for i in range(n_webhooks)] + ["broken"]
+        bodies = [_webhook(pid) for pid in ids] + [_webhook(pid) for pid in ids[::10]]
+        bodies.append({**_webhook("pending-1"), "event": "payment.waiting_for_capture"})
+        latencies, statuses = [], []
+        try:
+            async with aiohttp.ClientSession() as session:
+                started = time.perf_counter()
+                for body in bodies:
+                    t0 = time.perf_counter()
+                    async with session.post(url, data=json.dumps(body)) as resp:
+                        statuses.append(resp.status)
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                async with session.post(url, data="not json") as resp:
+                    rejected = resp.status
+                ack_s = time.perf_counter() - started
+
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                counts = await db.get_payment_inbox_counts()
+                if counts["pending"] == 0:
+                    break
+                await asyncio.sleep(0.05)
+            drained_s = time.perf_counter() - started
+        finally:
+            await worker.stop()
+            await runner.cleanup()
+            await db.close()
+
+    latencies.sort()
+    print(f"{len(bodies)} webhooks acknowledged in {ack_s:.2f}s: "
+          f"p50 {statistics.median(latencies):.1f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms "
+          f"(processing {process_ms:.0f} ms each)")
+    print(f"inbox drained after {drained_s:.2f}s: {counts}")
+
+    expected = {pid for pid in ids if pid != "broken"}
+    ok = all(s == 200 for s in statuses) and rejected == 400
+    ok = ok and set(service.granted) == expected and all(v == 1 for v in service.granted.values())
+    ok = ok and counts["pending"] == 0 and counts["dead"] == 1 and counts["done"] == len(expected) + 1
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhooks", type=int, default=200)
+    parser.add_argument("--process-ms", type=float, default=200.0)
+    args = parser.parse_args()
+    return asyncio.run(_run(args.webhooks, args.process_ms))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
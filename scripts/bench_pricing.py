@@ -0,0 +1,134 @@
+"""
+Benchmark / self-check of the pricing cache (core/pricing_cache.py).
+
+Renders the sales bot's tariff price lists (online + offline, with the user's
+promo code applied, as SalesBot._get_online_prices_for_user /
+_get_offline_prices_for_user do) over a temporary database and reports the
+number of SQL statements and the time per render, first with a cold cache,
+then steady state (only the point query for the user's promo code). Then checks
+that changes made through another Database instance (the admin bot) are
+visible on the very next render: price change, new / deactivated promo code,
+promo code used up, user promo binding cleared; and that a promo code used up
+by another process, still valid in this process's snapshot, is refused when
+a payment amount is computed.
+
+Usage:
+  python scripts/bench_pricing.py
+  python scripts/bench_pricing.py --renders 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.database import Database  # noqa: E402
+from core.models import Tariff  # noqa: E402
+from payment.mock_payment import MockPaymentProcessor  # noqa: E402
+from services.payment_service import PaymentService  # noqa: E402
+from utils.metrics import DB_QUERY_SECONDS  # noqa: E402
+
+OFFLINE_DEFAULTS = {"slushatel": 6000.0, "aktivist": 12000.0, "media_persona": 22000.0, "glavnyi_geroi": 30000.0}
+USER_ID = 42
+
+
+def _queries() -> int:
+    return sum(sum(row[:-1]) for row in DB_QUERY_SECONDS._values.values())
+
+
+async def _render(db: Database, service: PaymentService) -> dict:
+    """Both price lists for USER_ID, the way the sales bot builds its tariff menus."""
+    code = await db.get_user_promo_code(USER_ID)
+    if code and not await db.get_cached_promo_code(code):
+        code = None
+    prices = {}
+    for t in (Tariff.BASIC, Tariff.FEEDBACK, Tariff.PRACTIC):
+        base = await service.get_tariff_base_price(t)
+        prices[t.value], _ = await service._apply_promo_to_amount(base, code, cached=True)
+    for key, default in OFFLINE_DEFAULTS.items():
+        base = await db.get_offline_tariff_price(key, default)
+        prices[key], _ = await service._apply_promo_to_amount(base, code, cached=True)
+    return prices
+
+
+async def _run(renders: int) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        sales_db, admin_db = Database(path), Database(path)
+        await sales_db.connect()
+        await admin_db.connect()
+        try:
+            service = PaymentService(sales_db, MockPaymentProcessor())
+            await admin_db.set_online_tariff_price(Tariff.BASIC, 4900)
+            await admin_db.set_offline_tariff_price("aktivist", 11000)
+            await admin_db.create_promo_code("SALE10", "percent", 10, max_uses=2)
+            await sales_db.set_user_promo_code(USER_ID, "SALE10")
+
+            before = _queries()
+            started = time.perf_counter()
+            first = await _render(sales_db, service)
+            cold = ((time.perf_counter() - started) * 1000, _queries() - before)
+
+            before = _queries()
+            times = []
+            for _ in range(renders):
+                started = time.perf_counter()
+                await _render(sales_db, service)
+                times.append((time.perf_counter() - started) * 1000)
+            steady_queries = (_queries() - before) / renders
+            print(f"cold render: {cold[0]:.2f} ms, {cold[1]} queries")
+            print(f"steady:      {statistics.median(times) * 1000:.0f} us median, {steady_queries:.2f} queries per render")
+
+            # The user's promo code: _ensure_connection's ping + the point query
+            ok = first["basic"] == 4410.0 and first["aktivist"] == 9900.0 and steady_queries == 2
+            checks = []
+            await admin_db.set_online_tariff_price(Tariff.BASIC, 5900)
+            checks.append(("price change", (await _render(sales_db, service))["basic"] == 5310.0))
+            await admin_db.increment_promo_code_use("SALE10")
+            await admin_db.increment_promo_code_use("SALE10")
+            checks.append(("promo used up", (await _render(sales_db, service))["basic"] == 5900.0))
+            await admin_db.create_promo_code("VIP500", "fixed", 500)
+            await sales_db.set_user_promo_code(USER_ID, "VIP500")
+            checks.append(("new promo", (await _render(sales_db, service))["basic"] == 5400.0))
+            await admin_db.deactivate_promo_code("VIP500")
+            checks.append(("deactivated promo", (await _render(sales_db, service))["basic"] == 5900.0))
+            await sales_db.set_user_promo_code(USER_ID, "SALE10")
+            await admin_db.clear_user_promo_code(USER_ID)
+            checks.append(("binding cleared", await sales_db.get_user_promo_code(USER_ID) is None))
+
+            # Another worker process uses the code up: this process's snapshot does not know yet
+            await admin_db.create_promo_code("ONCE", "fixed", 1000, max_uses=1)
+            await sales_db.set_user_promo_code(USER_ID, "ONCE")
+            stale_menu = (await _render(sales_db, service))["basic"]
+            await admin_db.conn.execute("UPDATE promo_codes SET used_count = 1 WHERE code = 'ONCE'")
+            await admin_db.conn.commit()
+            payment_amount, promo = await service._apply_promo_to_amount(5900.0, "ONCE")
+            checks.append(("payment re-checks", stale_menu == 4900.0 and payment_amount == 5900.0 and promo is None))
+            for name, passed in checks:
+                print(f"  {name:<18} {'ok' if passed else 'STALE'}")
+                ok = ok and passed
+        finally:
+            await sales_db.close()
+            await admin_db.close()
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=1000)
+    args = parser.parse_args()
+    return asyncio.run(_run(args.renders))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,190 @@
+"""
+Benchmark: SQL sales overview (full scans of payment_events) vs the in-memory
+aggregates behind Database.get_sales_overview (core/sales_analytics.py).
+
+Seeds a temporary database with N payment events (the first 200 through
+record_payment_event, the rest in bulk), then times:
+  - legacy: the former four-query aggregation (kept here for comparison only);
+  - cached: Database.get_sales_overview (steady state: no new events).
+Both results are compared, then a second Database instance (standing in for
+another bot / worker) writes more events and a row is changed directly in SQL
+to check that the watermark catch-up and the consistency check both work.
+
+Usage:
+  python scripts/bench_sales_overview.py                 # 1000, 10000, 100000 events
+  python scripts/bench_sales_overview.py --sizes 5000 --repeat 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.database import Database  # noqa: E402
+from core.sales_analytics import get_sales_analytics  # noqa: E402
+
+TARIFFS = [("online", "basic"), ("online", "feedback"), ("online", "premium"), ("offline", "group"), ("offline", "vip")]
+PROMOS = [None, None, None, "SPRING", "FRIEND10", "VIP50", "TEST"]
+
+
+async def _legacy_overview(db: Database, top_promos: int = 10, top_tariffs: int = 20) -> dict:
+    """The former SQL implementation of Database.get_sales_overview (without promo_table)."""
+    conn = db.conn
+    async with conn.execute("""
+        SELECT COUNT(*) AS total_events, COUNT(DISTINCT user_id) AS users_total,
+               SUM(CASE WHEN COALESCE(paid_amount, 0) > 0.01 THEN 1 ELSE 0 END) AS paid_events,
+               SUM(CASE WHEN COALESCE(paid_amount, 0) > 0.01 THEN COALESCE(paid_amount, 0) ELSE 0 END) AS paid_total,
+               SUM(COALESCE(base_amount, 0)) AS base_total,
+               SUM(COALESCE(promo_discount_amount, 0)) AS promo_discount_total,
+               SUM(CASE WHEN promo_code IS NOT NULL AND promo_code != '' THEN 1 ELSE 0 END) AS promo_applied_events,
+               COUNT(DISTINCT CASE WHEN promo_code IS NOT NULL AND promo_code != '' THEN promo_code END)
+                   AS promo_unique_codes,
+               MIN(created_at) AS first_event_at, MAX(created_at) AS last_event_at
+        FROM payment_events
+    """) as c:
+        row = await c.fetchone()
+    async with conn.execute("""
+        SELECT course_program, tariff, COUNT(*) AS cnt, COUNT(DISTINCT user_id) AS users,
+               SUM(COALESCE(paid_amount, 0)) AS paid_total, SUM(COALESCE(base_amount, 0)) AS base_total,
+               SUM(COALESCE(promo_discount_amount, 0)) AS discount_total
+        FROM payment_events GROUP BY course_program, tariff ORDER BY paid_total DESC, cnt DESC LIMIT ?
+    """, (top_tariffs,)) as c:
+        by_tariff = [dict(r) for r in await c.fetchall()]
+    async with conn.execute("""
+        SELECT promo_code, COUNT(*) AS cnt, COUNT(DISTINCT user_id) AS users,
+               SUM(COALESCE(promo_discount_amount, 0)) AS discount_total, SUM(COALESCE(paid_amount, 0)) AS paid_total
+        FROM payment_events WHERE promo_code IS NOT NULL AND promo_code != ''
+        GROUP BY promo_code ORDER BY cnt DESC, discount_total DESC LIMIT ?
+    """, (top_promos,)) as c:
+        promos = [dict(r) for r in await c.fetchall()]
+    async with conn.execute("SELECT COUNT(*) FROM promo_codes") as c:
+        await c.fetchone()
+    return {"overview": dict(row), "by_tariff": by_tariff, "top_promos": promos}
+
+
+def _close(a, b) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(float(a) - float(b)) < 0.01
+    return a == b
+
+
+def _same(legacy: dict, cached: dict) -> bool:
+    if not all(_close(v, cached["overview"][k]) for k, v in legacy["overview"].items()):
+        return False
+    for key, id_fields in (("by_tariff", ("course_program", "tariff")), ("top_promos", ("promo_code",))):
+        # Ties may be ordered differently: compare as sets keyed by the group
+        left = {tuple(r[f] for f in id_fields): r for r in legacy[key]}
+        right = {tuple(r[f] for f in id_fields): r for r in cached[key]}
+        if left.keys() != right.keys():
+            return False
+        if not all(_close(v, right[k][field]) for k, r in left.items() for field, v in r.items()):
+            return False
+    return True
+
+
+async def _seed(db: Database, n_events: int, rng: random.Random, start_id: int = 0):
+    started = datetime.utcnow() - timedelta(days=120)
+    for i in range(start_id, start_id + n_events):
+        program, tariff = rng.choice(TARIFFS)
+        base = rng.choice([4900.0, 9900.0, 19900.0])
+        promo = rng.choice(PROMOS)
+        discount = round(base * rng.choice([0.1, 0.2, 0.5]), 2) if promo else None
+        paid = rng.choice([base - (discount or 0), 0.0]) if promo == "TEST" else base - (discount or 0)
+        await db.record_payment_event(
+            payment_id=f"pay-{i}", user_id=rng.randint(1, max(n_events // 3, 1)), course_program=program,
+            tariff=tariff, is_upgrade=False, base_amount=base, paid_amount=paid, currency="RUB",
+            promo_code=promo, promo_discount_amount=discount,
+            created_at=(started + timedelta(minutes=i * 7)).isoformat(),
+        )
+
+
+async def _bench(n_events: int, repeat: int) -> bool:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        db = Database(path)
+        await db.connect()
+        try:
+            rng = random.Random(n_events)
+            # Bulk-seed through SQL; record_payment_event for every row would dominate the run
+            analytics = get_sales_analytics(path)
+            await _seed(db, min(n_events, 200), rng)
+            rows = []
+            for i in range(200, n_events):
+                program, tariff = rng.choice(TARIFFS)
+                promo = rng.choice(PROMOS)
+                base = rng.choice([4900.0, 9900.0, 19900.0])
+                discount = round(base * 0.2, 2) if promo else None
+                rows.append((f"pay-{i}", rng.randint(1, max(n_events // 3, 1)), program, tariff, base,
+                             base - (discount or 0), promo, discount,
+                             (datetime.utcnow() - timedelta(minutes=n_events - i)).isoformat()))
+            await db.conn.executemany("""
+                INSERT INTO payment_events (payment_id, user_id, course_program, tariff, base_amount, paid_amount,
+                                            promo_code, promo_discount_amount, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            await db.conn.commit()
+
+            legacy_times, cached_times = [], []
+            legacy = cached = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                legacy = await _legacy_overview(db)
+                legacy_times.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                cached = await db.get_sales_overview()
+                cached_times.append((time.perf_counter() - started) * 1000)
+            ok = _same(legacy, cached)
+            # The first cached call builds the aggregates; report the steady state separately
+            line = (f"{n_events:>7} events: legacy {statistics.median(legacy_times):8.2f} ms | "
+                    f"cached first {cached_times[0]:8.2f} ms, steady {statistics.median(cached_times[1:] or cached_times):6.2f} ms")
+
+            # Another Database instance (other bot / worker) records events: picked up via the watermark
+            other = Database(path)
+            await other.connect()
+            try:
+                await _seed(other, 50, rng, start_id=n_events)
+            finally:
+                await other.close()
+            ok = ok and _same(await _legacy_overview(db), await db.get_sales_overview())
+
+            # A change behind our back is caught by the consistency check and rebuilt
+            await db.conn.execute("UPDATE payment_events SET paid_amount = COALESCE(paid_amount, 0) + 1000 WHERE event_id = 1")
+            await db.conn.commit()
+            matched = await analytics.verify(db.conn)
+            ok = ok and not matched and _same(await _legacy_overview(db), await db.get_sales_overview())
+
+            print(line + ("" if ok else "  MISMATCH"))
+            return ok
+        finally:
+            await db.close()
+
+
+async def _run(sizes: list[int], repeat: int) -> int:
+    ok = True
+    for n in sizes:
+        ok = await _bench(n, repeat) and ok
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    return asyncio.run(_run(args.sizes, args.repeat))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
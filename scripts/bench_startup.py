@@ -0,0 +1,141 @@
+"""
+Startup regression benchmark for run_all_bots.py.
+
+Two measurements, each repeated and reported as the median:
+
+1. Import budget: `python -X importtime -c "import run_all_bots"`.
+   Everything imported here happens before the health server can bind, so
+   heavy modules (aiogram, bot handlers, YooKassa SDK, Google API client,
+   Pillow) must NOT show up, and the total must stay under --import-budget-ms.
+
+2. Time to healthy: launches `python run_all_bots.py` on a free port with
+   no bot tokens and a temporary database, and polls /health until it answers.
+
+Usage:
+  python scripts/bench_startup.py                   # both checks, default budgets
+  python scripts/bench_startup.py --repeat 5 --import-budget-ms 400 --ready-budget-ms 2000
+Exit code 1 if a budget is exceeded or a forbidden module is imported early.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+
+# Top-level packages that must only be loaded after the HTTP server is up
+FORBIDDEN_EARLY = ("aiogram", "bots", "yookassa", "googleapiclient", "google", "PIL", "services")
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_imports() -> tuple[float, dict[str, float]]:
+    """Return (total ms, {top-level package: cumulative ms}) for `import run_all_bots`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import run_all_bots"],
+        cwd=_ROOT, capture_output=True, text=True, env=_bench_env(),
+    )
+    packages: dict[str, float] = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        cumulative_us, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        if indent == 1:  # direct child of the top level: cumulative times don't overlap
+            total_us += cumulative_us
+        top = name.split(".")[0]
+        packages[top] = max(packages.get(top, 0.0), cumulative_us / 1000)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import run_all_bots failed:\n{proc.stderr[-2000:]}")
+    return total_us / 1000, packages
+
+
+def measure_time_to_healthy(timeout: float = 30.0) -> float:
+    """Milliseconds from process spawn to the first 200 from /health."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _bench_env()
+        env.update({"PORT": str(port), "DATABASE_PATH": str(Path(tmp) / "bench.db")})
+        started = time.monotonic()
+        proc = subprocess.Popen(
+            [sys.executable, "run_all_bots.py"], cwd=_ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            while time.monotonic() - started < timeout:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=0.5) as resp:
+                        if resp.status == 200:
+                            return (time.monotonic() - started) * 1000
+                except OSError:
+                    pass
+                if proc.poll() is not None:
+                    raise RuntimeError(f"run_all_bots exited early with code {proc.returncode}")
+                time.sleep(0.01)
+            raise RuntimeError(f"/health did not answer within {timeout:.0f}s")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def _bench_env() -> dict:
+    env = dict(os.environ)
+    # No tokens: bots stay down, only the startup path up to the HTTP server is exercised
+    for key in ("SALES_BOT_TOKEN", "COURSE_BOT_TOKEN", "ADMIN_BOT_TOKEN", "WORKER_PROCESSES", "TELEGRAM_UPDATE_MODE"):
+        env[key] = ""
+    return env
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--import-budget-ms", type=float, default=500.0)
+    parser.add_argument("--ready-budget-ms", type=float, default=2500.0)
+    parser.add_argument("--skip-ready", action="store_true", help="Only run the import-time check")
+    args = parser.parse_args()
+
+    ok = True
+    runs = [measure_imports() for _ in range(max(args.repeat, 1))]
+    import_ms = statistics.median(total for total, _ in runs)
+    packages = runs[-1][1]
+    top = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:8]
+    print(f"import run_all_bots: {import_ms:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+    for name, ms in top:
+        print(f"    {name:<24} {ms:7.1f} ms")
+    early = sorted(name for name in packages if name in FORBIDDEN_EARLY)
+    if early:
+        print(f"FAIL heavy modules imported before the health server: {', '.join(early)}")
+        ok = False
+    if import_ms > args.import_budget_ms:
+        print("FAIL import budget exceeded")
+        ok = False
+
+    if not args.skip_ready:
+        ready = statistics.median(measure_time_to_healthy() for _ in range(max(args.repeat, 1)))
+        print(f"time to healthy: {ready:.0f} ms (budget {args.ready_budget_ms:.0f} ms)")
+        if ready > args.ready_budget_ms:
+            print("FAIL time-to-healthy budget exceeded")
+            ok = False
+
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
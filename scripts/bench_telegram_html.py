@@ -0,0 +1,100 @@
+"""
+Benchmark / self-check of the Telegram HTML sanitizer (utils/telegram_html.py)
+on the real course content.
+
+Takes every text of lessons.json (lesson posts, task variants, intro and
+"about me" texts), i.e. what the Drive sync sanitizes on every run, and times:
+  1. the uncached sanitizer (what one text costs the first time);
+  2. a first sync (cold cache) and --syncs further syncs of unchanged content;
+then checks the cached output is identical to the uncached one. --compare REV
+also times DriveContentSync._sanitize_telegram_html from git revision REV.
+
+Usage:
+  python scripts/bench_telegram_html.py
+  python scripts/bench_telegram_html.py --lessons seed_data/lessons.json --compare HEAD~1
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from utils import telegram_html  # noqa: E402
+
+TEXT_KEYS = ("text", "task", "task_basic", "task_feedback", "intro_text", "about_me_text")
+
+
+def _texts(path: Path) -> list[str]:
+    lessons = json.loads(path.read_text(encoding="utf-8"))
+    texts = []
+    for entry in lessons.values():
+        for key in TEXT_KEYS:
+            value = entry.get(key)
+            if isinstance(value, list):
+                texts.extend(str(x) for x in value)
+            elif value:
+                texts.append(str(value))
+    return texts
+
+
+def _load_revision(rev: str):
+    source = subprocess.run(
+        ["git", "show", f"{rev}:services/drive_content_sync.py"],
+        cwd=_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    path = Path(tempfile.gettempdir()) / f"drive_content_sync_{rev.replace('~', '_').replace('/', '_')}.py"
+    path.write_text(source, encoding="utf-8")
+    spec = importlib.util.spec_from_file_location("drive_content_sync_rev", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module.DriveContentSync._sanitize_telegram_html
+
+
+def _time(sanitize, texts: list[str]) -> float:
+    started = time.perf_counter()
+    for text in texts:
+        sanitize(text)
+    return (time.perf_counter() - started) * 1000
+
+
+def _run(path: Path, syncs: int, compare: str | None) -> int:
+    texts = _texts(path)
+    print(f"{path}: {len(texts)} texts, {sum(len(t) for t in texts) / 1024:.0f} KB, "
+          f"{sum(1 for t in texts if '<' not in t and '&' not in t)} without '<' / '&'")
+
+    print(f"uncached:   {_time(telegram_html._sanitize, texts):.1f} ms per sync")
+    if compare:
+        print(f"{compare}: {_time(_load_revision(compare), texts):.1f} ms per sync")
+
+    telegram_html.clear_cache()
+    print(f"cold cache: {_time(telegram_html.sanitize, texts):.1f} ms")
+    warm = [_time(telegram_html.sanitize, texts) for _ in range(syncs)]
+    print(f"re-sync:    {min(warm):.2f} ms (best of {syncs}), {telegram_html.cache_info()}")
+
+    ok = all(telegram_html.sanitize(t) == telegram_html._sanitize(t) for t in texts)
+    print("OK" if ok else "FAILED: cached output differs")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=Path, default=_ROOT / "data" / "lessons.json")
+    parser.add_argument("--syncs", type=int, default=10)
+    parser.add_argument("--compare", metavar="REV", help="also time the sanitizer of this git revision")
+    args = parser.parse_args()
+    return _run(args.lessons, args.syncs, args.compare)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
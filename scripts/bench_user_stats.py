@@ -0,0 +1,194 @@
+"""
+Benchmark: per-user statistics (N+1) vs set-based Database.get_users_statistics.
+
+Seeds a temporary SQLite database with N users, their sessions, activity and
+assignments, then times:
+  - legacy: the old 7-queries-per-user loop (kept here for comparison only);
+  - batch:  Database.get_users_statistics(user_ids) (3 GROUP BY queries over the
+            daily rollups maintained by triggers).
+Both results are compared for equality. The rollups are then rebuilt from the raw
+rows (the one-time backfill) and the raw rows compacted away
+(Database.compact_statistics); statistics must not change in either step.
+
+Usage:
+  python scripts/bench_user_stats.py                 # 200, 2000, 20000 users
+  python scripts/bench_user_stats.py --sizes 200 2000 --legacy-max 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.database import Database  # noqa: E402
+
+SECTIONS = ["lesson", "navigator", "progress", "questions", "settings", None]
+ACTIONS = ["open", "click", "question", "submit", "view"]
+
+
+async def _seed(db: Database, n_users: int, rng: random.Random):
+    # Older than the default retention window, so compaction removes every raw row
+    now = datetime.utcnow() - timedelta(days=400)
+    users, sessions, activity, assignments = [], [], [], []
+    for uid in range(1, n_users + 1):
+        created = (now - timedelta(minutes=uid, days=uid % 7)).isoformat()
+        users.append((uid, f"user{uid}", f"Name{uid}", created, created))
+        for _ in range(rng.randint(0, 12)):
+            bot = rng.choice(["sales", "course"])
+            duration = rng.choice([None, rng.randint(10, 3600)])
+            sessions.append((uid, bot, created, duration))
+        for _ in range(rng.randint(0, 40)):
+            activity.append((uid, rng.choice(["sales", "course"]), rng.choice(ACTIONS), rng.choice(SECTIONS), created))
+        for day in range(rng.randint(0, 5)):
+            feedback = rng.choice([None, "", "ok"])
+            assignments.append((uid, day + 1, day + 1, "answer", feedback, created))
+
+    conn = db.conn
+    await conn.executemany(
+        "INSERT INTO users (user_id, username, first_name, created_at, updated_at) VALUES (?, ?, ?, ?, ?)", users
+    )
+    await conn.executemany(
+        "INSERT INTO user_sessions (user_id, bot_type, session_start, duration_seconds) VALUES (?, ?, ?, ?)", sessions
+    )
+    await conn.executemany(
+        "INSERT INTO user_activity (user_id, bot_type, action_type, section, created_at) VALUES (?, ?, ?, ?, ?)",
+        activity,
+    )
+    await conn.executemany(
+        "INSERT INTO assignments (user_id, lesson_id, day_number, submission_text, admin_feedback, submitted_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        assignments,
+    )
+    await conn.commit()
+    return len(sessions), len(activity), len(assignments)
+
+
+async def _legacy_user_statistics(db: Database, user_id: int) -> dict:
+    """The former Database.get_user_statistics: 7 queries per user."""
+    conn = db.conn
+    stats = {
+        "user_id": user_id, "total_online_time_seconds": 0, "total_bot_visits": 0,
+        "sales_bot_visits": 0, "course_bot_visits": 0, "questions_count": 0,
+        "assignments_submitted": 0, "assignments_completed": 0,
+        "activity_by_section": {}, "activity_by_action": {},
+    }
+    async with conn.execute(
+        "SELECT SUM(duration_seconds) FROM user_sessions WHERE user_id = ? AND duration_seconds IS NOT NULL", (user_id,)
+    ) as cur:
+        row = await cur.fetchone()
+        stats["total_online_time_seconds"] = row[0] if row and row[0] else 0
+    async with conn.execute(
+        "SELECT bot_type, COUNT(*) FROM user_sessions WHERE user_id = ? GROUP BY bot_type", (user_id,)
+    ) as cur:
+        for bot_type, count in await cur.fetchall():
+            stats["total_bot_visits"] += count
+            if bot_type == "sales":
+                stats["sales_bot_visits"] = count
+            elif bot_type == "course":
+                stats["course_bot_visits"] = count
+    async with conn.execute(
+        "SELECT COUNT(*) FROM user_activity WHERE user_id = ? AND action_type = 'question'", (user_id,)
+    ) as cur:
+        stats["questions_count"] = (await cur.fetchone())[0]
+    async with conn.execute("SELECT COUNT(*) FROM assignments WHERE user_id = ?", (user_id,)) as cur:
+        stats["assignments_submitted"] = (await cur.fetchone())[0]
+    async with conn.execute(
+        "SELECT COUNT(*) FROM assignments WHERE user_id = ? AND admin_feedback IS NOT NULL AND admin_feedback != ''",
+        (user_id,),
+    ) as cur:
+        stats["assignments_completed"] = (await cur.fetchone())[0]
+    async with conn.execute(
+        "SELECT section, COUNT(*) AS c FROM user_activity WHERE user_id = ? AND section IS NOT NULL "
+        "GROUP BY section ORDER BY c DESC", (user_id,)
+    ) as cur:
+        for section, count in await cur.fetchall():
+            stats["activity_by_section"][section] = count
+    async with conn.execute(
+        "SELECT action_type, COUNT(*) AS c FROM user_activity WHERE user_id = ? GROUP BY action_type ORDER BY c DESC",
+        (user_id,),
+    ) as cur:
+        for action, count in await cur.fetchall():
+            stats["activity_by_action"][action] = count
+    return stats
+
+
+def _same(a: dict, b: dict) -> bool:
+    # Breakdown dicts may list equal counts in a different order
+    return all(
+        (dict(a[k]) == dict(b[k])) if isinstance(a[k], dict) else a[k] == b[k]
+        for k in a
+    )
+
+
+async def _bench(n_users: int, legacy_max: int) -> bool:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(str(Path(tmp) / "bench.db"))
+        await db.connect()
+        try:
+            counts = await _seed(db, n_users, random.Random(n_users))
+            ids = list(range(1, n_users + 1))
+
+            started = time.perf_counter()
+            batch = await db.get_users_statistics(ids)
+            batch_ms = (time.perf_counter() - started) * 1000
+
+            line = f"{n_users:>6} users (sessions={counts[0]}, activity={counts[1]}, assignments={counts[2]}): " \
+                   f"batch {batch_ms:8.1f} ms"
+            ok = len(batch) == n_users
+            if n_users <= legacy_max:
+                started = time.perf_counter()
+                legacy = {uid: await _legacy_user_statistics(db, uid) for uid in ids}
+                legacy_ms = (time.perf_counter() - started) * 1000
+                ok = ok and all(_same(legacy[uid], batch[uid]) for uid in ids)
+                line += f" | legacy {legacy_ms:9.1f} ms ({7 * n_users} queries) | x{legacy_ms / max(batch_ms, 0.001):.0f}"
+            else:
+                line += " | legacy skipped"
+
+            # Rebuild from raw rows, as on the first start after upgrading
+            await db.conn.execute("DELETE FROM app_settings WHERE key = 'stats_rollup_version'")
+            await db.conn.commit()
+            await db._backfill_stats_rollups()
+            rebuilt = await db.get_users_statistics(ids)
+            ok = ok and all(_same(batch[uid], rebuilt[uid]) for uid in ids)
+
+            started = time.perf_counter()
+            deleted = await db.compact_statistics(retention_days=90)
+            compact_ms = (time.perf_counter() - started) * 1000
+            compacted = await db.get_users_statistics(ids)
+            ok = ok and deleted == counts[0] + counts[1]
+            ok = ok and all(_same(batch[uid], compacted[uid]) for uid in ids)
+            line += f" | compacted {deleted} rows in {compact_ms:.0f} ms"
+            print(line + ("" if ok else "  MISMATCH"))
+            return ok
+        finally:
+            await db.close()
+
+
+async def _run(sizes: list[int], legacy_max: int) -> int:
+    ok = True
+    for n in sizes:
+        ok = await _bench(n, legacy_max) and ok
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--legacy-max", type=int, default=20000, help="Skip the slow legacy loop above this size")
+    args = parser.parse_args()
+    return asyncio.run(_run(args.sizes, args.legacy_max))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,133 @@
+"""
+Self-check for multi-process lease coordination (core/cluster.py).
+
+Spawns N worker processes that contend on a temporary SQLite database with short
+lease TTLs, then verifies:
+- exactly one leader;
+- shards are partitioned (each shard owned by exactly one worker, its home worker);
+- after killing one worker, survivors take over its shard and leadership stays unique.
+
+Usage:
+  python scripts/check_cluster_leases.py [--workers 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+TTL = 1.5
+RENEW = 0.3
+
+
+async def _worker(db_path: str, index: int, count: int):
+    # WAL must be on before the first connection opens (see Database.connect)
+    os.environ["WORKER_COUNT"] = str(count)
+    from core.config import Config
+    Config.WORKER_COUNT = count
+    from core.cluster import ClusterMembership
+    from core.database import Database
+
+    db = Database(db_path)
+    await db.connect()
+    membership = ClusterMembership(db, index, count, lease_ttl_seconds=TTL, renew_interval_seconds=RENEW)
+    await membership.start()
+    try:
+        while True:
+            state = {"index": index, "shards": sorted(membership.owned_shards), "leader": membership.is_leader}
+            print(json.dumps(state), flush=True)
+            await asyncio.sleep(RENEW)
+    finally:
+        await membership.stop()
+        await db.close()
+
+
+async def _latest_states(procs: dict[int, asyncio.subprocess.Process], settle: float) -> dict[int, dict]:
+    """Read worker state lines for `settle` seconds and return the last state of each."""
+    states: dict[int, dict] = {}
+    deadline = time.monotonic() + settle
+
+    async def drain(index, proc):
+        while time.monotonic() < deadline:
+            try:
+                line = await asyncio.wait_for(proc.stdout.readline(), timeout=max(deadline - time.monotonic(), 0.01))
+            except asyncio.TimeoutError:
+                return
+            if not line:
+                return
+            try:
+                states[index] = json.loads(line)
+            except ValueError:
+                pass
+
+    await asyncio.gather(*(drain(i, p) for i, p in procs.items()))
+    return states
+
+
+def _check(title: str, states: dict[int, dict], count: int, alive: set[int]) -> bool:
+    leaders = [i for i in alive if states.get(i, {}).get("leader")]
+    owned = [s for i in alive for s in states.get(i, {}).get("shards", [])]
+    checks = {
+        f"{title}: exactly one leader": len(leaders) == 1,
+        f"{title}: every shard owned exactly once": sorted(owned) == list(range(count)),
+        f"{title}: live workers own their home shard": all(i in states.get(i, {}).get("shards", []) for i in alive),
+    }
+    for name, passed in checks.items():
+        print(f"{'OK  ' if passed else 'FAIL'} {name}")
+    print(f"     states: { {i: states.get(i) for i in sorted(alive)} }")
+    return all(checks.values())
+
+
+async def _run(count: int) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "leases.db")
+        procs: dict[int, asyncio.subprocess.Process] = {}
+        for i in range(count):
+            procs[i] = await asyncio.create_subprocess_exec(
+                sys.executable, __file__, "--worker", str(i), "--workers", str(count), "--db", db_path,
+                stdout=asyncio.subprocess.PIPE,
+            )
+        try:
+            ok = _check("steady", await _latest_states(procs, TTL * 2), count, set(procs))
+
+            victim = count - 1
+            procs[victim].kill()
+            await procs[victim].wait()
+            survivors = {i: p for i, p in procs.items() if i != victim}
+            ok = _check("after kill", await _latest_states(survivors, TTL * 3), count, set(survivors)) and ok
+        finally:
+            for proc in procs.values():
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--db", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        try:
+            asyncio.run(_worker(args.db, args.worker, args.workers))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    return asyncio.run(_run(max(args.workers, 2)))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
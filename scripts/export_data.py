@@ -0,0 +1,69 @@
+"""
+Export users / payments / questions / activity as gzip-compressed CSV or JSONL.
+
+Same streaming export as the admin bot's /export command (services/export_service.py),
+without the Telegram 50 MB upload limit. Memory use stays constant regardless of
+the table size. Raw activity covers the last STATS_RAW_RETENTION_DAYS only (the
+default file name says so); activity_daily has per-day counts for the whole history.
+
+Usage:
+  python scripts/export_data.py users                          # users_<timestamp>.csv.gz
+  python scripts/export_data.py activity --format jsonl -o activity.jsonl.gz
+  python scripts/export_data.py activity_daily                 # activity_daily_<timestamp>.csv.gz
+  python scripts/export_data.py payments -o - | zcat | head    # to stdout
+  python scripts/export_data.py questions --db /data/bot.db
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.database import Database  # noqa: E402
+from services.export_service import EXPORT_DATASETS, EXPORT_FORMATS, ExportService  # noqa: E402
+
+
+async def _run(dataset: str, fmt: str, output: str, db_path: str | None, chunk_size: int) -> int:
+    db = Database(db_path)
+    await db.connect()
+    try:
+        service = ExportService(db, chunk_size=chunk_size)
+        started = time.perf_counter()
+        if output == "-":
+            rows = await service.export(dataset, fmt, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            path = Path(output or ExportService.filename(dataset, fmt))
+            with path.open("wb") as out:
+                rows = await service.export(dataset, fmt, out)
+            size_kb = path.stat().st_size / 1024
+            print(f"{dataset}: {rows} rows -> {path} ({size_kb:.0f} KB) in {time.perf_counter() - started:.1f}s",
+                  file=sys.stderr)
+        days = ExportService.retention_days(dataset)
+        if days:
+            print(f"{dataset}: raw rows of the last {days} days only; older periods: activity_daily", file=sys.stderr)
+        return 0
+    finally:
+        await db.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", choices=list(EXPORT_DATASETS))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("-o", "--output", default="", help="File path, or '-' for stdout (default: <dataset>_<ts>.<fmt>.gz)")
+    parser.add_argument("--db", default=None, help="SQLite database path (default: Config.DATABASE_PATH)")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    args = parser.parse_args()
+    return asyncio.run(_run(args.dataset, args.format, args.output, args.db, args.chunk_size))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,158 @@
+"""
+Local stand-in for the YooKassa payments API (just what the bots use).
+
+Serves the endpoints the yookassa SDK calls for YooKassaPaymentProcessor:
+  POST /v3/payments          create a payment (status 'pending', honours Idempotence-Key)
+  GET  /v3/payments/{id}     payment object
+plus control endpoints for tests:
+  POST /_fake/payments/{id}/succeed | /cancel    settle a payment (no webhook is sent)
+  GET  /_fake/stats                              request counts, peak concurrent status requests
+
+Point the bots at it with:
+  YOOKASSA_API_URL=http://127.0.0.1:8099/v3 PAYMENT_PROVIDER=yookassa \
+  YOOKASSA_SHOP_ID=fake YOOKASSA_SECRET_KEY=fake python run_all_bots.py
+
+Usage:
+  python scripts/fake_yookassa.py --port 8099 --latency-ms 150
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+
+class FakeYooKassa:
+    """In-memory payments with optional per-request latency."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.payments: dict[str, dict] = {}
+        self._by_idempotency_key: dict[str, str] = {}
+        self.requests = {"create": 0, "get": 0}
+        self._in_flight = 0
+        self.peak_in_flight = 0
+        self.app = web.Application()
+        self.app.router.add_post("/v3/payments", self._create)
+        self.app.router.add_get("/v3/payments/{payment_id}", self._get)
+        self.app.router.add_post("/_fake/payments/{payment_id}/{action:succeed|cancel}", self._settle)
+        self.app.router.add_get("/_fake/stats", self._stats)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve in the running loop; returns the API base URL (for YOOKASSA_API_URL)."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/v3"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def settle(self, payment_id: str, status: str):
+        payment = self.payments[payment_id]
+        payment["status"] = status
+        payment["paid"] = status == "succeeded"
+        if status == "succeeded":
+            payment["captured_at"] = _now()
+
+    async def _delay(self):
+        self._in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+
+    async def _create(self, request: web.Request) -> web.Response:
+        self.requests["create"] += 1
+        await self._delay()
+        key = request.headers.get("Idempotence-Key", "")
+        if key in self._by_idempotency_key:
+            return web.json_response(self.payments[self._by_idempotency_key[key]])
+        body = await request.json()
+        payment_id = str(uuid.uuid4())
+        payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body["amount"],
+            "confirmation": {
+                "type": "redirect",
+                "confirmation_url": f"{request.scheme}://{request.host}/checkout/{payment_id}",
+            },
+            "created_at": _now(),
+            "description": body.get("description", ""),
+            "metadata": body.get("metadata") or {},
+            "recipient": {"account_id": "fake", "gateway_id": "fake"},
+            "refundable": False,
+            "test": True,
+        }
+        self.payments[payment_id] = payment
+        if key:
+            self._by_idempotency_key[key] = payment_id
+        return web.json_response(payment)
+
+    async def _get(self, request: web.Request) -> web.Response:
+        self.requests["get"] += 1
+        await self._delay()
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return web.json_response(
+                {"type": "error", "code": "not_found", "description": "Payment not found"}, status=404
+            )
+        return web.json_response(payment)
+
+    async def _settle(self, request: web.Request) -> web.Response:
+        payment_id = request.match_info["payment_id"]
+        if payment_id not in self.payments:
+            raise web.HTTPNotFound()
+        self.settle(payment_id, "succeeded" if request.match_info["action"] == "succeed" else "canceled")
+        return web.json_response(self.payments[payment_id])
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        statuses: dict[str, int] = {}
+        for payment in self.payments.values():
+            statuses[payment["status"]] = statuses.get(payment["status"], 0) + 1
+        return web.json_response(
+            {"requests": self.requests, "peak_in_flight": self.peak_in_flight, "statuses": statuses}
+        )
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+async def _serve(host: str, port: int, latency_ms: float):
+    fake = FakeYooKassa(latency_ms)
+    url = await fake.start(host, port)
+    print(f"Fake YooKassa API at {url} (latency {latency_ms:.0f} ms)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port, args.latency_ms))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+"""
+Inject fake Telegram updates into the webhook intake (TELEGRAM_UPDATE_MODE=webhook).
+
+Lets you drive the bots locally without Telegram: run
+  TELEGRAM_UPDATE_MODE=webhook python run_all_bots.py
+and then, from another terminal:
+  python scripts/inject_fake_update.py --bot course --chat 123456 --text "/start"
+  python scripts/inject_fake_update.py --bot sales --chat 123456 --callback "sales:about_course"
+
+Self-check (no running server, no real Telegram calls):
+  python scripts/inject_fake_update.py --selftest
+Starts an in-process aiohttp server with a WebhookIntake and a Dispatcher whose handlers
+only record what they got, injects updates, and verifies routing + secret checks, and
+that stop() lets an update in flight finish before the Dispatcher shuts down.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path when running as a script
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from utils.telegram_webhook import (  # noqa: E402
+    FakeTelegramInjector,
+    WebhookIntake,
+    fake_callback_update,
+    fake_message_update,
+    webhook_path_for,
+)
+
+
+async def _inject(args) -> int:
+    if args.callback:
+        update = fake_callback_update(args.chat, args.callback, user_id=args.user)
+    else:
+        update = fake_message_update(args.chat, args.text or "/start", user_id=args.user)
+    async with FakeTelegramInjector(args.server) as tg:
+        status = await tg.send(args.bot, update)
+    print(f"{args.bot}: update_id={update['update_id']} -> HTTP {status}")
+    return 0 if status == 200 else 1
+
+
+async def _selftest() -> int:
+    from aiohttp import web, ClientSession
+    from aiogram import Bot, Dispatcher, F
+    from aiogram.filters import CommandStart
+
+    token = "123456:selftest-token"
+    received: list[tuple[str, str]] = []
+    done = asyncio.Event()
+
+    dp = Dispatcher()
+
+    async def on_start(message):
+        received.append(("message", message.text))
+
+    async def on_callback(callback):
+        received.append(("callback", callback.data))
+        done.set()
+
+    async def on_slow(callback):
+        await asyncio.sleep(0.3)
+        received.append(("callback", callback.data))
+
+    async def on_shutdown():
+        received.append(("shutdown", ""))
+
+    dp.message.register(on_start, CommandStart())
+    dp.callback_query.register(on_callback, F.data == "ping")
+    dp.callback_query.register(on_slow, F.data == "slow")
+    dp.shutdown.register(on_shutdown)
+
+    intake = WebhookIntake(base_url="")
+    app = web.Application()
+    intake.install(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    server = f"http://127.0.0.1:{port}"
+
+    bot = Bot(token=token)
+    serve_task = asyncio.create_task(intake.serve("course", dp, bot))
+    await asyncio.sleep(0.05)
+
+    ok = True
+    try:
+        async with FakeTelegramInjector(server, tokens={"course": token}) as tg:
+            s1 = await tg.send("course", fake_message_update(42, "/start"))
+            s2 = await tg.send("course", fake_callback_update(42, "ping"))
+            s3 = await tg.send("sales", fake_message_update(42, "/start"))  # not registered
+        async with ClientSession() as session:
+            wrong = webhook_path_for("course", "other-token")
+            async with session.post(server + wrong, json=fake_message_update(42, "/start")) as resp:
+                s4 = resp.status
+        await asyncio.wait_for(done.wait(), timeout=5)
+        handled = list(received)
+
+        async with FakeTelegramInjector(server, tokens={"course": token}) as tg:
+            s5 = await tg.send("course", fake_callback_update(42, "slow"))
+            stopping = asyncio.create_task(intake.stop())
+            await asyncio.sleep(0.05)
+            s6 = await tg.send("course", fake_message_update(42, "/start"))
+        await stopping
+        await asyncio.wait_for(serve_task, timeout=5)
+
+        checks = {
+            "message accepted": s1 == 200,
+            "callback accepted": s2 == 200,
+            "unregistered bot -> 503": s3 == 503,
+            "wrong secret -> 404": s4 == 404,
+            "handlers received both updates": handled == [("message", "/start"), ("callback", "ping")],
+            "stop() finishes the update in flight, then shuts down": s5 == 200
+            and received[len(handled):] == [("callback", "slow"), ("shutdown", "")],
+            "update during stop() -> 503": s6 == 503,
+        }
+        for name, passed in checks.items():
+            print(f"{'OK  ' if passed else 'FAIL'} {name}")
+            ok = ok and passed
+    finally:
+        await intake.stop()
+        await serve_task
+        await bot.session.close()
+        await runner.cleanup()
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:8080", help="Base URL of run_all_bots HTTP server")
+    parser.add_argument("--bot", choices=["sales", "course", "admin"], default="course")
+    parser.add_argument("--chat", type=int, default=1, help="Chat id (private chat = user id)")
+    parser.add_argument("--user", type=int, default=None, help="Sender user id (defaults to --chat)")
+    parser.add_argument("--text", default=None, help="Message text, e.g. /start")
+    parser.add_argument("--callback", default=None, help="Callback data (sends a callback_query instead)")
+    parser.add_argument("--selftest", action="store_true", help="Run in-process intake check and exit")
+    args = parser.parse_args()
+
+    if args.selftest:
+        return asyncio.run(_selftest())
+    return asyncio.run(_inject(args))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
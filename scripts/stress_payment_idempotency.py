@@ -0,0 +1,153 @@
+"""
+Concurrency stress check of payment completion idempotency (Database.complete_payment).
+
+Completes every payment of a temporary database --copies times at once, from
+--instances Database/PaymentService pairs (standing in for the webhook inbox,
+the "check payment" button and other worker processes), with a stand-in
+processor that answers after a random delay so the completions overlap.
+Then checks that each payment was applied exactly once:
+  - exactly one call per payment reports it as applied, the others as already_processed;
+  - one processed_payments row and one payment_events row per payment;
+  - promo code usage counted once per payment, referrals recorded once;
+  - the user has the paid tariff (upgrades included).
+
+Usage:
+  python scripts/stress_payment_idempotency.py
+  python scripts/stress_payment_idempotency.py --payments 200 --copies 8 --instances 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from core.database import Database  # noqa: E402
+from core.models import Tariff  # noqa: E402
+from services.payment_service import PaymentService  # noqa: E402
+
+PROMO = "STRESS10"
+
+
+class _FakeProcessor:
+    """Returns the payment details of a webhook after a random delay (like the YooKassa API lookup)."""
+
+    def __init__(self, payments: dict[str, dict], rng: random.Random):
+        self.payments = payments
+        self.rng = rng
+
+    async def process_webhook(self, webhook_data: dict):
+        await asyncio.sleep(self.rng.random() * 0.01)
+        return self.payments[webhook_data["object"]["id"]]
+
+
+def _payments(n: int) -> dict[str, dict]:
+    payments = {}
+    for i in range(n):
+        user_id = 1000 + i
+        metadata = {"user_id": user_id, "tariff": Tariff.BASIC.value, "course_program": "online"}
+        amount = PaymentService.TARIFF_PRICES[Tariff.BASIC]
+        if i % 5 == 1:
+            metadata.update(promo_code=PROMO, promo_discount_type="percent", promo_discount_value=10,
+                            base_amount=amount)
+            amount = amount * 0.9
+        if i % 7 == 2:
+            metadata["referral_partner_id"] = f"partner-{i % 3}"
+        payments[f"pay-{i}"] = {"payment_id": f"pay-{i}", "amount": amount, "metadata": metadata}
+        if i % 10 == 3:
+            # Upgrade of the same user after the first payment
+            upgrade = {"user_id": user_id, "tariff": Tariff.FEEDBACK.value, "is_upgrade": True,
+                       "upgrade_price": 5000.0, "upgrade_from": Tariff.BASIC.value}
+            payments[f"pay-{i}-upgrade"] = {"payment_id": f"pay-{i}-upgrade", "amount": 5000.0, "metadata": upgrade}
+    return payments
+
+
+async def _run(n_payments: int, copies: int, instances: int) -> int:
+    rng = random.Random(n_payments)
+    payments = _payments(n_payments)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "stress.db")
+        dbs = [Database(path) for _ in range(instances)]
+        for db in dbs:
+            await db.connect()
+        await dbs[0].create_promo_code(PROMO, "percent", 10)
+        services = [PaymentService(db, _FakeProcessor(payments, rng)) for db in dbs]
+        try:
+            async def complete(payment_id: str):
+                service = rng.choice(services)
+                return payment_id, await service.process_payment_completion(
+                    payment_id=payment_id, webhook_data={"event": "payment.succeeded", "object": {"id": payment_id}}
+                )
+
+            started = time.perf_counter()
+            # First payments, then upgrades (an upgrade needs the user to have been granted access)
+            first = [pid for pid in payments if not pid.endswith("-upgrade")]
+            upgrades = [pid for pid in payments if pid.endswith("-upgrade")]
+            results = []
+            for batch in (first, upgrades):
+                calls = [complete(pid) for pid in batch for _ in range(copies)]
+                rng.shuffle(calls)
+                results += await asyncio.gather(*calls)
+            elapsed = time.perf_counter() - started
+
+            applied = Counter(pid for pid, r in results if r and not r.get("already_processed"))
+            failed = [pid for pid, r in results if not r]
+            conn = dbs[0].conn
+            async with conn.execute("SELECT payment_id, COUNT(*) FROM payment_events GROUP BY payment_id") as c:
+                events = dict(await c.fetchall())
+            async with conn.execute("SELECT COUNT(*) FROM processed_payments") as c:
+                processed = (await c.fetchone())[0]
+            async with conn.execute("SELECT used_count FROM promo_codes WHERE code = ?", (PROMO,)) as c:
+                promo_used = (await c.fetchone())[0]
+            async with conn.execute("SELECT COUNT(*) FROM referrals") as c:
+                referrals = (await c.fetchone())[0]
+            wrong_tariff = []
+            for pid, data in payments.items():
+                user = await dbs[0].get_user(int(data["metadata"]["user_id"]))
+                expected = Tariff.FEEDBACK if f"{pid}-upgrade" in payments or pid.endswith("-upgrade") else Tariff.BASIC
+                if user is None or user.tariff != expected:
+                    wrong_tariff.append(pid)
+        finally:
+            for db in dbs:
+                await db.close()
+
+    expected_promo = sum(1 for p in payments.values() if p["metadata"].get("promo_code"))
+    expected_referrals = sum(1 for p in payments.values() if p["metadata"].get("referral_partner_id"))
+    print(f"{len(results)} completions of {len(payments)} payments ({copies} concurrent copies, "
+          f"{instances} connections) in {elapsed:.2f}s")
+    print(f"applied once: {sum(1 for v in applied.values() if v == 1)}/{len(payments)}, "
+          f"applied twice or more: {sum(1 for v in applied.values() if v > 1)}, failed calls: {len(failed)}")
+    print(f"payment_events: {sum(events.values())} rows, processed_payments: {processed}, "
+          f"promo used: {promo_used}/{expected_promo}, referrals: {referrals}/{expected_referrals}, "
+          f"wrong tariff: {len(wrong_tariff)}")
+
+    ok = (
+        set(applied) == set(payments) and all(v == 1 for v in applied.values()) and not failed
+        and set(events) == set(payments) and all(v == 1 for v in events.values())
+        and processed == len(payments) and promo_used == expected_promo
+        and referrals == expected_referrals and not wrong_tariff
+    )
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=100)
+    parser.add_argument("--copies", type=int, default=5, help="Concurrent completions of each payment")
+    parser.add_argument("--instances", type=int, default=3, help="Database connections / PaymentService instances")
+    args = parser.parse_args()
+    return asyncio.run(_run(args.payments, args.copies, args.instances))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
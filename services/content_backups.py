@@ -0,0 +1,276 @@
+"""
+Version history of lessons.json (content_backups/ next to it).
+
+Every Drive sync and every restore used to copy the whole lessons.json into
+content_backups/, forever; listing the backups globbed the directory and
+parsed every file name. Instead a version is a list of (day key, digest):
+
+  content_backups/days/<digest[:2]>/<digest>.json.gz   one day entry, gzip, stored once
+  content_backups/index.json                           versions, oldest first
+
+A sync usually changes a few days, so a new version costs the index line plus
+the changed days; listing reads the index only; restoring a version reads its
+~31 day chunks and writes lessons.json the way the sync writes it.
+
+Retention: the CONTENT_BACKUP_KEEP_LATEST newest versions, plus the newest
+version of each of the last CONTENT_BACKUP_KEEP_DAILY days; the day chunks
+of dropped versions that no kept version uses are deleted.
+Old-style full copies (lessons.YYYYMMDD-HHMMSS.json) are imported into the
+history the first time it is opened.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.json"
+DAYS_DIR = "days"
+# Key of the single chunk of a file that is not a JSON object (stored as is)
+RAW_KEY = "\x00raw"
+_TS_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def _dump_lessons(lessons: Dict[str, Any]) -> str:
+    """lessons.json text, formatted as DriveContentSync writes it."""
+    return json.dumps(lessons, ensure_ascii=False, indent=2)
+
+
+@dataclass
+class BackupVersion:
+    id: str
+    created: datetime
+    reason: str
+    days: List[Tuple[str, str]]  # (day key, chunk digest) in file order
+    size: int  # bytes of lessons.json
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "created": self.created.isoformat(timespec="seconds"),
+            "reason": self.reason,
+            "days": [list(d) for d in self.days],
+            "size": self.size,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BackupVersion":
+        return cls(
+            id=str(data["id"]),
+            created=datetime.fromisoformat(data["created"]),
+            reason=str(data.get("reason") or ""),
+            days=[(str(k), str(d)) for k, d in data.get("days") or []],
+            size=int(data.get("size") or 0),
+        )
+
+
+class BackupHistory:
+    def __init__(self, backups_dir: Path, stem: str = "lessons", keep_latest: int = 20, keep_daily: int = 30):
+        self.root = Path(backups_dir)
+        self.stem = stem
+        self.keep_latest = max(int(keep_latest), 1)
+        self.keep_daily = max(int(keep_daily), 0)
+        self.index_path = self.root / INDEX_NAME
+        self.chunk_root = self.root / DAYS_DIR
+        self._versions: Optional[List[BackupVersion]] = None
+        self._index_mtime: Optional[float] = None
+
+    # --- index --------------------------------------------------------------
+
+    def _load(self) -> List[BackupVersion]:
+        """Versions, oldest first (re-read only if another process changed the index)."""
+        try:
+            mtime = self.index_path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if self._versions is not None and mtime == self._index_mtime:
+            return self._versions
+        versions: List[BackupVersion] = []
+        if mtime is not None:
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    versions = [BackupVersion.from_dict(v) for v in json.load(f).get("versions") or []]
+            except Exception as e:
+                logger.warning(f"⚠️ Backup index unreadable, starting a new one: {e}")
+        self._versions, self._index_mtime = versions, mtime
+        if mtime is None:
+            self._import_legacy()
+        return self._versions
+
+    def _save(self, versions: List[BackupVersion]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            # Compact: written on every sync (json.dumps without indent uses the C encoder)
+            f.write(json.dumps({"versions": [v.as_dict() for v in versions]}, ensure_ascii=False, separators=(",", ":")))
+        os.replace(tmp, self.index_path)
+        self._versions, self._index_mtime = versions, self.index_path.stat().st_mtime
+
+    def versions(self) -> List[BackupVersion]:
+        """Versions, newest first."""
+        return list(reversed(self._load()))
+
+    def latest(self) -> Optional[BackupVersion]:
+        versions = self._load()
+        return versions[-1] if versions else None
+
+    def get(self, version_id: str) -> Optional[BackupVersion]:
+        for version in self._load():
+            if version.id == version_id:
+                return version
+        return None
+
+    # --- chunks -------------------------------------------------------------
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self.chunk_root / digest[:2] / f"{digest}.json.gz"
+
+    def _put_chunk(self, data: bytes) -> str:
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._chunk_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(gzip.compress(data, compresslevel=6, mtime=0))
+            os.replace(tmp, path)
+        return digest
+
+    def _get_chunk(self, digest: str) -> bytes:
+        with open(self._chunk_path(digest), "rb") as f:
+            return gzip.decompress(f.read())
+
+    # --- versions -----------------------------------------------------------
+
+    def _new_id(self, created: datetime) -> str:
+        base = created.strftime(_TS_FORMAT)
+        taken = {v.id for v in self._load()}
+        version_id, n = base, 1
+        while version_id in taken:
+            n += 1
+            version_id = f"{base}-{n}"
+        return version_id
+
+    def _split(self, raw: bytes) -> List[Tuple[str, str]]:
+        try:
+            lessons = json.loads(raw.decode("utf-8"))
+        except Exception:
+            lessons = None
+        if not isinstance(lessons, dict):
+            return [(RAW_KEY, self._put_chunk(raw))]
+        return [
+            (str(key), self._put_chunk(json.dumps(entry, ensure_ascii=False).encode("utf-8")))
+            for key, entry in lessons.items()
+        ]
+
+    def record(self, path: Path, reason: str = "sync", created: Optional[datetime] = None) -> Optional[BackupVersion]:
+        """
+        Add the current contents of `path` as a new version (nothing is added if they
+        equal the latest version) and apply the retention policy.
+        """
+        raw = Path(path).read_bytes()
+        days = self._split(raw)
+        versions = self._load()
+        if versions and versions[-1].days == days:
+            logger.info(f"📦 Backup skipped: {path.name} is unchanged since {versions[-1].id}")
+            return versions[-1]
+        created = created or datetime.utcnow()
+        version = BackupVersion(self._new_id(created), created, reason, days, len(raw))
+        versions = versions + [version]
+        self._save(self._prune(versions, created))
+        logger.info(f"✅ Backup created: {version.id} ({len(days)} days, {len(raw) / 1024:.0f} KB)")
+        return version
+
+    def load(self, version_id: str) -> Optional[Any]:
+        """Contents of a version: the lessons dict (or raw text for a file that was not a JSON object)."""
+        text = self.read_text(version_id)
+        if text is None:
+            return None
+        return json.loads(text) if self._is_json(version_id) else text
+
+    def _is_json(self, version_id: str) -> bool:
+        version = self.get(version_id)
+        return bool(version) and not (len(version.days) == 1 and version.days[0][0] == RAW_KEY)
+
+    def read_text(self, version_id: str) -> Optional[str]:
+        """lessons.json of a version, as the sync would write it."""
+        version = self.get(version_id)
+        if version is None:
+            return None
+        if not self._is_json(version_id):
+            return self._get_chunk(version.days[0][1]).decode("utf-8", "replace")
+        lessons = {key: json.loads(self._get_chunk(digest).decode("utf-8")) for key, digest in version.days}
+        return _dump_lessons(lessons)
+
+    # --- retention ----------------------------------------------------------
+
+    def _prune(self, versions: List[BackupVersion], now: datetime) -> List[BackupVersion]:
+        """Keep the newest versions and the newest one of each recent day; delete unused chunks."""
+        newest_first = sorted(versions, key=lambda v: v.created, reverse=True)
+        keep = {v.id for v in newest_first[:self.keep_latest]}
+        since = (now - timedelta(days=self.keep_daily)).date()
+        seen_days = set()
+        for version in newest_first:
+            day = version.created.date()
+            if day > since and day not in seen_days:
+                seen_days.add(day)
+                keep.add(version.id)
+        kept = [v for v in versions if v.id in keep]
+        if len(kept) != len(versions):
+            logger.info(f"🗑️ Backup retention: {len(versions) - len(kept)} old versions dropped, {len(kept)} kept")
+            referenced = {digest for v in kept for _, digest in v.days}
+            for version in versions:
+                if version.id in keep:
+                    continue
+                for _, digest in version.days:
+                    if digest not in referenced:
+                        self._chunk_path(digest).unlink(missing_ok=True)
+                        referenced.add(digest)
+        return kept
+
+    # --- old layout ---------------------------------------------------------
+
+    def _import_legacy(self):
+        """Full copies lessons.YYYYMMDD-HHMMSS.json of the old layout become versions."""
+        legacy = []
+        for path in self.root.glob(f"{self.stem}.*.json"):
+            try:
+                created = datetime.strptime(path.name[len(self.stem) + 1:-len(".json")], _TS_FORMAT)
+            except ValueError:
+                created = datetime.utcfromtimestamp(path.stat().st_mtime)
+            legacy.append((created, path))
+        if not legacy:
+            return
+        versions: List[BackupVersion] = []
+        for created, path in sorted(legacy):
+            raw = path.read_bytes()
+            days = self._split(raw)
+            if versions and versions[-1].days == days:
+                continue
+            self._versions = versions
+            versions.append(BackupVersion(self._new_id(created), created, "import", days, len(raw)))
+        self._save(self._prune(versions, datetime.utcnow()))
+        for _, path in legacy:
+            path.unlink()
+        logger.info(f"📦 Imported {len(legacy)} old backup copies as {len(self._versions)} versions")
+
+    def usage(self) -> Dict[str, int]:
+        """Versions, stored chunks and their bytes, and the bytes the versions would take as full copies."""
+        report = {"versions": 0, "chunks": 0, "chunk_bytes": 0, "logical_bytes": 0}
+        versions = self._load()
+        report["versions"] = len(versions)
+        report["logical_bytes"] = sum(v.size for v in versions)
+        if self.chunk_root.is_dir():
+            for item in self.chunk_root.rglob("*.json.gz"):
+                report["chunks"] += 1
+                report["chunk_bytes"] += item.stat().st_size
+        return report
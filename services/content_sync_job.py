@@ -0,0 +1,136 @@
+"""
+Drive content sync runs: admin commands and the scheduled background sync.
+
+Every sync goes through `run_sync()`:
+- one sync at a time: an asyncio lock in the process and, in multi-process
+  mode, the `content_sync` lease in the shared database;
+- DriveContentSync.sync_now runs in a worker thread and publishes lessons.json
+  with an atomic rename after validating it (see DriveContentSync._publish);
+- then every LessonLoader of the process reloads off the event loop
+  (lesson_loader.refresh_all). Other worker processes pick the new file up
+  through lesson_loader.watch.
+
+The scheduled sync (DRIVE_AUTO_SYNC_MINUTES > 0) runs on the cluster leader
+only (ClusterMembership.run_singleton) in strict mode: content with empty days,
+or missing days compared to the published lessons.json, is not published.
+
+At startup the leader also prepares the media variants (services/media_variants.py)
+of the lessons already loaded, e.g. seed content that never went through a sync.
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from core.cluster import get_membership
+from core.config import Config
+from services import lesson_loader
+from services.drive_content_sync import DriveContentSync, SyncResult
+from services.media_variants import MediaVariants, media_paths
+
+logger = logging.getLogger(__name__)
+
+SYNC_LEASE = "content_sync"
+# A sync holding the lease longer than this is considered dead
+SYNC_LEASE_TTL_SECONDS = 30 * 60
+
+_sync_lock = asyncio.Lock()
+
+
+class SyncInProgress(RuntimeError):
+    """Another sync (in this process or another worker) is running."""
+
+
+async def _acquire_lease() -> bool:
+    membership = get_membership()
+    if not membership.enabled:
+        return True
+    return await membership.db.try_acquire_lease(SYNC_LEASE, membership.owner, SYNC_LEASE_TTL_SECONDS)
+
+
+async def _release_lease():
+    membership = get_membership()
+    if not membership.enabled:
+        return
+    try:
+        await membership.db.release_lease(SYNC_LEASE, membership.owner)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not release lease {SYNC_LEASE}: {e}")
+
+
+async def run_sync(
+    syncer: Optional[DriveContentSync] = None, *, clean_media: bool = False, strict: bool = False
+) -> SyncResult:
+    """Sync, publish and reload the lessons of this process. Raises SyncInProgress if a sync is running."""
+    if _sync_lock.locked():
+        raise SyncInProgress("Синхронизация контента уже выполняется")
+    async with _sync_lock:
+        if not await _acquire_lease():
+            raise SyncInProgress("Синхронизация контента уже выполняется в другом процессе")
+        try:
+            syncer = syncer or DriveContentSync()
+            result = await asyncio.to_thread(syncer.sync_now, clean_media=clean_media, strict=strict)
+        finally:
+            await _release_lease()
+    await lesson_loader.refresh_all(force=True)
+    return result
+
+
+async def scheduled_sync():
+    """Background sync job (leader only); skipped if lessons.json was published less than an interval ago."""
+    syncer = DriveContentSync()
+    ok, reason = syncer.is_ready()
+    if not ok:
+        logger.debug(f"Scheduled content sync skipped: {reason}")
+        return
+    interval = Config.DRIVE_AUTO_SYNC_MINUTES * 60
+    target = syncer.lessons_path()
+    try:
+        age = time.time() - target.stat().st_mtime
+    except OSError:
+        age = None
+    if age is not None and age < interval * 0.9:
+        logger.debug(f"Scheduled content sync skipped: lessons.json published {age:.0f}s ago")
+        return
+    try:
+        result = await run_sync(syncer, strict=True)
+    except SyncInProgress as e:
+        logger.info(f"⏭️ Scheduled content sync skipped: {e}")
+        return
+    logger.info(
+        f"✅ Scheduled content sync: {result.days_synced} days, {result.media_files_downloaded} media downloaded, "
+        f"{len(result.warnings)} warnings"
+    )
+
+
+async def prepare_loaded_media():
+    """Media variants for the lessons loaded in this process (in a thread, under the sync lock)."""
+    if _sync_lock.locked():
+        return
+    async with _sync_lock:
+        paths = [path for loader in list(lesson_loader._loaders) for path in media_paths(loader.get_all_lessons())]
+        if not paths:
+            return
+        try:
+            variants = MediaVariants(DriveContentSync()._media_root())
+            await asyncio.to_thread(variants.prepare, paths)
+        except Exception as e:
+            logger.error(f"❌ Media variants of the loaded lessons not prepared: {e}", exc_info=True)
+
+
+def start_background_tasks() -> List[asyncio.Task]:
+    """
+    Lessons watcher (every process); on the leader, media variants of the loaded lessons and,
+    if DRIVE_AUTO_SYNC_MINUTES > 0, the scheduled sync.
+    """
+    tasks = [asyncio.create_task(lesson_loader.watch(Config.LESSONS_RELOAD_CHECK_SECONDS))]
+    if get_membership().is_leader:
+        tasks.append(asyncio.create_task(prepare_loaded_media()))
+    minutes = Config.DRIVE_AUTO_SYNC_MINUTES
+    if minutes > 0 and str(Config.DRIVE_CONTENT_ENABLED).strip() == "1":
+        tasks.append(asyncio.create_task(
+            get_membership().run_singleton("drive content sync", minutes * 60, scheduled_sync)
+        ))
+        logger.info(f"🔄 Scheduled Drive content sync every {minutes} min (leader only)")
+    return tasks
@@ -26,21 +26,28 @@ import json
 import logging
 import os
 import re
-import html
-import shutil
-from datetime import datetime, timezone
-from html.parser import HTMLParser
-from dataclasses import dataclass
+import time
+from datetime import datetime
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Dict, Optional, List, Tuple
 
 from core.config import Config
+from services import master_doc
+from services.content_backups import BackupHistory
+from services.drive_pool import DrivePool
+from services.master_doc import Link
+from services.media_store import MediaStore
+from services.media_variants import MediaVariants, media_paths
+from utils import telegram_html
+from utils.metrics import DRIVE_SYNC_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
 GOOGLE_DOC_MIME = "application/vnd.google-apps.document"
 FOLDER_MIME = "application/vnd.google-apps.folder"
+FILE_FIELDS = "id,name,mimeType,modifiedTime,size,md5Checksum"
 
 
 @dataclass
@@ -51,6 +58,30 @@ class SyncResult:
     total_blocks: int  # Общее количество блоков (posts) во всех уроках
     total_media_files: int  # Общее количество медиафайлов (обработанных, не только загруженных)
     warnings: List[str]
+    media_usage: Dict[str, int] = field(default_factory=dict)  # MediaStore.usage() после GC
+
+
+@dataclass
+class _DriveLookups:
+    """Метаданные файлов и содержимое папок по Drive-ссылкам, полученные заранее (DrivePool)."""
+    meta: Dict[str, Any] = field(default_factory=dict)  # file_id -> metadata или исключение
+    children: Dict[str, Any] = field(default_factory=dict)  # folder_id -> список файлов или исключение
+
+
+@dataclass
+class _DayMedia:
+    """Медиа одного дня, собранные при замене Drive-ссылок маркерами."""
+    day: int
+    media_root: Path
+    project_root: Path
+    media_items: Optional[List[Dict[str, Any]]] = None  # None: список "media" не ведется (режим папок)
+    media_markers: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # marker_id -> media_info
+    markers_by_file: Dict[Tuple[str, str], str] = field(default_factory=dict)  # (file_id, path) -> marker_id
+    lookups: Optional[_DriveLookups] = None
+    downloaded: int = 0
+    processed: int = 0
+    skipped: int = 0
+    errors: int = 0
 
 
 class DriveContentSync:
@@ -68,6 +99,10 @@ class DriveContentSync:
             return False, "Google service account creds are missing (GOOGLE_SERVICE_ACCOUNT_JSON[_B64])"
         return True, "ok"
 
+    def is_ready(self) -> Tuple[bool, str]:
+        """Whether a sync can run (enabled, source configured, credentials present), and why not."""
+        return self._admin_ready()
+
     @staticmethod
     def _extract_drive_file_ids(text: str) -> List[str]:
         """
@@ -97,43 +132,10 @@ class DriveContentSync:
         Find all Drive links in text with their positions and file/folder IDs.
         Returns list of dicts with 'url' (original from text), 'file_id' (or 'folder_id'), 'start', 'end', 'is_folder'.
         """
-        if not text:
-            return []
-        
-        links = []
-        # Patterns to match various Google Drive URL formats
-        # Important: we capture the FULL original URL from text for replacement
-        patterns = [
-            # Folder link: https://drive.google.com/drive/folders/FOLDER_ID?usp=drive_link
-            (r"https?://drive\.google\.com/drive/folders/([a-zA-Z0-9_-]{10,})(?:/[^?\s]*)?(?:\?[^\s]*)?", lambda m: m.group(0), True),
-            # Standard file link: https://drive.google.com/file/d/FILE_ID/view?usp=drive_link
-            (r"https?://drive\.google\.com/file/d/([a-zA-Z0-9_-]{10,})(?:/[^?\s]*)?(?:\?[^\s]*)?", lambda m: m.group(0), False),
-            # Open link: https://drive.google.com/open?id=FILE_ID
-            (r"https?://drive\.google\.com/open\?id=([a-zA-Z0-9_-]{10,})(?:&[^\s]*)?", lambda m: m.group(0), False),
-            # UC link: https://drive.google.com/uc?id=FILE_ID
-            (r"https?://drive\.google\.com/uc\?id=([a-zA-Z0-9_-]{10,})(?:&[^\s]*)?", lambda m: m.group(0), False),
-            # Document link: https://docs.google.com/document/d/FILE_ID/...
-            (r"https?://docs\.google\.com/document/d/([a-zA-Z0-9_-]{10,})(?:/[^\s]*)?", lambda m: m.group(0), False),
-        ]
-        
-        for pattern, url_extractor, is_folder in patterns:
-            for match in re.finditer(pattern, text):
-                item_id = match.group(1)
-                # Use the FULL original URL from text (including /view?usp=drive_link etc.)
-                original_url = url_extractor(match)
-                links.append({
-                    "url": original_url,  # Original URL from text for exact replacement
-                    "file_id": item_id,  # For folders, this is actually folder_id
-                    "folder_id": item_id if is_folder else None,  # Explicit folder_id field
-                    "is_folder": is_folder,
-                    "start": match.start(),
-                    "end": match.end()
-                })
-        
         # IMPORTANT: do NOT dedupe occurrences here. The same Drive URL can appear multiple times
         # and must be replaced in every position to preserve exact placement. Downloading is
-        # deduped later by file_id/folder_id.
-        return links
+        # deduped later by URL (see _resolve_drive_links).
+        return [link.as_dict() for link in master_doc.find_links(text)]
 
     @staticmethod
     def _clean_text_markers(text: str) -> str:
@@ -148,7 +150,9 @@ class DriveContentSync:
         return text
     
     @staticmethod
-    def _split_lesson_into_posts(lesson_text: str, max_length: int = 4000) -> List[str]:
+    def _split_lesson_into_posts(
+        lesson_text: str, max_length: int = 4000, breaks: Optional[List[Tuple[int, int]]] = None
+    ) -> List[str]:
         """
         Разделяет текст урока на посты с сохранением форматирования.
         
@@ -162,6 +166,7 @@ class DriveContentSync:
         Args:
             lesson_text: Полный текст урока
             max_length: Максимальная длина поста (по умолчанию 4000, лимит Telegram 4096)
+            breaks: Позиции строк-маркеров (start, end) в lesson_text, если уже известны
         
         Returns:
             Список текстов постов
@@ -173,46 +178,22 @@ class DriveContentSync:
         # Поддерживаем: [POST], [ДОПОЛНЕНИЕ], [BLOCK], [БЛОК] на отдельной строке
         # ВАЖНО: Сохраняем все форматирование, включая пробелы и переносы строк
         
-        # Разбиваем на строки, сохраняя переносы строк
-        lines = lesson_text.split('\n')
+        # Строки-маркеры (их позиции в тексте; master_doc.parse находит их заранее)
+        if breaks is None:
+            breaks = master_doc.post_breaks(lesson_text)
         posts = []
-        current_post_lines = []
-        
-        for line in lines:
-            line_stripped = line.strip()
-            
-            # Проверяем, является ли строка медиа-маркером (не разделитель постов)
-            is_media_marker = re.match(r'^\s*\[MEDIA_[a-zA-Z0-9_-]+\]\s*$', line)
-            
-            # Проверяем, является ли строка маркером разделения постов
-            # Поддерживаем: [POST], [ДОПОЛНЕНИЕ], [BLOCK], [БЛОК] и их вариации
-            is_post_marker = False
-            if not is_media_marker:
-                # Проверяем маркеры на отдельной строке
-                post_marker_pattern = r'^\s*\[(POST|ДОПОЛНЕНИЕ|BLOCK|БЛОК|POST\d*|ДОПОЛНЕНИЕ\d*)\]\s*$'
-                if re.match(post_marker_pattern, line, re.IGNORECASE):
-                    is_post_marker = True
-            
-            if is_post_marker:
-                # Сохраняем текущий пост, если он не пустой
-                if current_post_lines:
-                    post_text = '\n'.join(current_post_lines)
-                    # Убираем только лишние пробелы в начале и конце, но сохраняем внутреннее форматирование
-                    post_text = post_text.rstrip()
-                    if post_text:
-                        posts.append(post_text)
-                    current_post_lines = []
-                # Маркер не включается в пост
-            else:
-                # Добавляем строку в текущий пост (сохраняем форматирование)
-                current_post_lines.append(line)
-        
-        # Добавляем последний пост, если он есть
-        if current_post_lines:
-            post_text = '\n'.join(current_post_lines)
-            post_text = post_text.rstrip()
-            if post_text:
-                posts.append(post_text)
+        start = 0
+        for break_start, break_end in breaks:
+            # Текст до строки маркера (без переноса перед ней); маркер не включается в пост
+            if break_start > start:
+                post_text = lesson_text[start:break_start - 1].rstrip()
+                if post_text:
+                    posts.append(post_text)
+            start = break_end + 1
+        # Последний пост
+        post_text = lesson_text[start:].rstrip()
+        if post_text:
+            posts.append(post_text)
         
         # Если нашли маркеры и разделили, возвращаем посты
         if len(posts) > 1:
@@ -328,138 +309,25 @@ class DriveContentSync:
         
         ВАЖНО: Сохраняет все форматирование (пробелы, отступы, пунктуацию, эмодзи)
         """
-        blocks: Dict[int, List[str]] = {}
-        current_day: Optional[int] = None
-
-        lines = (text or "").splitlines()
-        day_header_re = re.compile(r"^\s*(?:День|Day)\s+(\d{1,2})\s*(?::\s*(.*))?$", re.IGNORECASE)
-
-        for line in lines:
-            m = day_header_re.match(line)
-            if m:
-                day = int(m.group(1))
-                if 0 <= day <= 30:
-                    current_day = day
-                    blocks.setdefault(day, [])
-                    # Если заголовок имеет название после двоеточия, сохраняем его как первую строку
-                    title_hint = (m.group(2) or "").strip()
-                    if title_hint:
-                        blocks[day].append(f"Заголовок: {title_hint}")
-                    continue
-            if current_day is not None:
-                blocks[current_day].append(line)
-
         out: Dict[int, Dict[str, str]] = {}
-        for day, bl in blocks.items():
-            # Сохраняем оригинальный текст с форматированием
-            raw = "\n".join(bl)
-            if not raw.strip():
-                continue
-
-            title = ""
-            lesson = raw
-            task = ""
-            intro_text = ""
-            about_me_text = ""
-
-            # Извлекаем заголовок
-            for ln in bl[:10]:
-                mm = re.match(r"^\s*(?:Заголовок|Title)\s*:\s*(.+)\s*$", ln, re.IGNORECASE)
-                if mm:
-                    title = mm.group(1).strip()
-                    break
-
-            # Разделяем на секции: task, intro_text, about_me_text
-            # Поддерживаем оба формата:
-            #   "Задание:" (на отдельной строке)
-            #   "Задание: текст задания" (текст на той же строке)
-            task_re = re.compile(r"^\s*(?:Задание|Task)\s*:\s*(.*)$", re.IGNORECASE)
-            intro_re = re.compile(r"^\s*(?:Intro|Введение|Вводный текст)\s*:\s*(.*)$", re.IGNORECASE)
-            about_me_re = re.compile(r"^\s*(?:Обо мне|About me|About_me)\s*:\s*(.*)$", re.IGNORECASE)
-            
-            parts_lesson: List[str] = []
-            parts_task: List[str] = []
-            parts_intro: List[str] = []
-            parts_about_me: List[str] = []
-            
-            in_task = False
-            in_intro = False
-            in_about_me = False
-            
-            for ln in bl:
-                # Проверяем маркер задания
-                m_task = task_re.match(ln)
-                if m_task:
-                    in_task = True
-                    in_intro = False
-                    in_about_me = False
-                    task_text_on_line = (m_task.group(1) or "").strip()
-                    if task_text_on_line:
-                        parts_task.append(task_text_on_line)
-                    continue
-                
-                # Проверяем маркер вводного текста
-                m_intro = intro_re.match(ln)
-                if m_intro:
-                    in_intro = True
-                    in_task = False
-                    in_about_me = False
-                    intro_text_on_line = (m_intro.group(1) or "").strip()
-                    if intro_text_on_line:
-                        parts_intro.append(intro_text_on_line)
-                    continue
-                
-                # Проверяем маркер "Обо мне"
-                m_about_me = about_me_re.match(ln)
-                if m_about_me:
-                    in_about_me = True
-                    in_task = False
-                    in_intro = False
-                    about_me_text_on_line = (m_about_me.group(1) or "").strip()
-                    if about_me_text_on_line:
-                        parts_about_me.append(about_me_text_on_line)
-                    continue
-                
-                # Добавляем строку в соответствующую секцию
-                if in_task:
-                    parts_task.append(ln)
-                elif in_intro:
-                    parts_intro.append(ln)
-                elif in_about_me:
-                    parts_about_me.append(ln)
-                else:
-                    parts_lesson.append(ln)
-            
-            # Собираем текст секций, сохраняя форматирование
-            # Убираем только лишние пробелы в начале и конце, но сохраняем внутреннее форматирование
-            lesson = "\n".join(parts_lesson).rstrip()
-            task = "\n".join(parts_task).rstrip()
-            intro_text = "\n".join(parts_intro).rstrip()
-            about_me_text = "\n".join(parts_about_me).rstrip()
-
-            # Разделяем урок на посты:
-            # 1. По ручным маркерам: [POST], [ДОПОЛНЕНИЕ] и т.д.
-            # 2. Автоматически по длине (>4000 символов)
-            lesson_posts = DriveContentSync._split_lesson_into_posts(lesson)
+        for day, parsed in master_doc.parse(text).items():
+            # Урок делится на посты по маркерам [POST] и т.п. и по длине (>4000 символов)
+            lesson_posts = DriveContentSync._split_lesson_into_posts(parsed.sections["lesson"], breaks=parsed.breaks)
             
             # Если урок разделен на несколько постов, сохраняем как список; иначе как строку (обратная совместимость)
             lesson_data = {
-                "title": title, 
-                "lesson": lesson_posts if len(lesson_posts) > 1 else (lesson_posts[0] if lesson_posts else ""), 
-                "task": task
+                "title": parsed.title,
+                "lesson": lesson_posts if len(lesson_posts) > 1 else (lesson_posts[0] if lesson_posts else ""),
+                "task": parsed.sections["task"],
             }
-            
-            # Сохраняем intro_text и about_me_text, если они были извлечены
-            if intro_text:
-                lesson_data["intro_text"] = intro_text
-            if about_me_text:
-                lesson_data["about_me_text"] = about_me_text
-            
+            if parsed.sections["intro_text"]:
+                lesson_data["intro_text"] = parsed.sections["intro_text"]
+            if parsed.sections["about_me_text"]:
+                lesson_data["about_me_text"] = parsed.sections["about_me_text"]
             out[day] = lesson_data
-
         return out
     
-    def _sync_from_master_doc(self, drive, warnings: List[str]) -> Tuple[Dict[str, Any], int, int, int]:
+    def _sync_from_master_doc(self, drive, warnings: List[str], store: MediaStore) -> Tuple[Dict[str, Any], int, int, int]:
         master_id = (Config.DRIVE_MASTER_DOC_ID or "").strip()
         if not master_id:
             raise RuntimeError("DRIVE_MASTER_DOC_ID is empty")
@@ -470,300 +338,47 @@ class DriveContentSync:
         if w:
             warnings.extend([f"master_doc: {x}" for x in w])
 
-        day_map = self._split_master_doc(master_text)
-        if not day_map:
+        days = master_doc.parse(master_text)
+        if not days:
             raise RuntimeError("Could not find any 'День N' sections in master doc")
 
         project_root = Path.cwd()
         media_root = (project_root / self.media_dir).resolve()
         media_downloaded = 0
 
+        # Метаданные файлов и папок по всем ссылкам документа — несколькими параллельными волнами
+        with self._drive_pool() as pool:
+            lookups = self._prefetch_links(pool, [link for parsed in days.values() for _, link in parsed.all_links()])
+
         compiled: Dict[str, Any] = {}
         total_blocks = 0
         total_media_files = 0
-        for day, data in sorted(day_map.items(), key=lambda x: x[0]):
-            title = (data.get("title") or "").strip() or f"День {day}"
-            lesson_raw = data.get("lesson") or ""
-            # Поддерживаем много-постовые уроки, возвращаемые как список
-            # ВАЖНО: Если урок уже разделен на посты (через маркеры [POST]), сохраняем структуру постов
-            lesson_was_split = isinstance(lesson_raw, list)
-            if lesson_was_split:
-                lesson_posts_list = [str(x).rstrip() for x in lesson_raw if str(x).strip()]
-                lesson_text = "\n\n".join(lesson_posts_list)
-            else:
-                lesson_text = str(lesson_raw).rstrip()
-                lesson_posts_list = None
-            task_text = (data.get("task") or "").rstrip()
-            intro_text = (data.get("intro_text") or "").rstrip()
-            about_me_text = (data.get("about_me_text") or "").rstrip()
-
-            # Обрабатываем медиа, связанные с Drive, упомянутые в тексте/задании
-            # Заменяем ссылки на маркеры и скачиваем файлы
-            media_items: List[Dict[str, Any]] = []
-            media_markers: Dict[str, Dict[str, Any]] = {}  # marker_id -> media_info
-            
-            # Находим все Drive ссылки в lesson, task, intro_text, и about_me_text
-            # ВАЖНО: В режиме master doc intro_text и about_me_text извлекаются из самого текста урока
-            # Они уже извлечены в _split_master_doc, поэтому используем их здесь
-            combined_text = lesson_text + "\n" + task_text
-            if intro_text:
-                combined_text += "\n" + intro_text
-            if about_me_text:
-                combined_text += "\n" + about_me_text
-            
-            drive_links = self._find_drive_links_with_positions(combined_text)
-            
-            logger.info(f"   📎 Day {day}: Found {len(drive_links)} Drive links in text")
-            logger.info(f"   📎 Day {day}: Text lengths - lesson: {len(lesson_text)}, task: {len(task_text)}, intro: {len(intro_text)}, about_me: {len(about_me_text)}")
-            if drive_links:
-                for idx, link in enumerate(drive_links, 1):
-                    logger.info(f"   📎   [{idx}/{len(drive_links)}] Link: {link['url'][:80]}... (file_id: {link['file_id']}, is_folder: {link.get('is_folder', False)}, position: {link.get('start', '?')}-{link.get('end', '?')})")
-            else:
+        for day, parsed in sorted(days.items()):
+            title = parsed.title.strip() or f"День {day}"
+
+            # Обрабатываем медиа, связанные с Drive, упомянутые в тексте/задании/intro/about_me:
+            # каждая ссылка скачивается один раз, затем заменяется маркером одним проходом по каждой секции
+            links = [link for _, link in parsed.all_links()]
+            logger.info(f"   📎 Day {day}: Found {len(links)} Drive links in text")
+            if not links:
                 logger.warning(f"   ⚠️ Day {day}: No Drive links found in text! This may indicate a problem with link detection.")
-            
-            # Обрабатываем ссылки в обратном порядке, чтобы сохранить позиции при замене
-            drive_links.sort(key=lambda x: x["start"], reverse=True)
-            
-            processed_links = 0
-            skipped_links = 0
-            error_links = 0
-            
-            # ВАЖНО: Заменяем ссылки в тексте, сохраняя точные позиции
-            # Используем обратный порядок, чтобы позиции не сдвигались при замене
-            for link_info in drive_links:
-                fid = link_info["file_id"]
-                link_url = link_info["url"]
-                is_folder = link_info.get("is_folder", False)
-                
-                try:
-                    if is_folder:
-                        # Обрабатываем папку: получаем все файлы в папке и обрабатываем каждый как медиа
-                        folder_id = link_info.get("folder_id") or fid
-                        logger.info(f"   📁 Processing Drive folder: {link_url[:60]}... (folder_id: {folder_id})")
-                        
-                        # Получаем все файлы в папке
-                        folder_files = self._list_children(drive, folder_id)
-                        logger.info(f"   📁   Found {len(folder_files)} items in folder")
-                        
-                        if not folder_files:
-                            logger.warning(f"   ⚠️ Folder {folder_id} is empty or inaccessible")
-                            skipped_links += 1
-                            continue
-                        
-                        # Собираем все маркеры для файлов в этой папке
-                        folder_markers = []
-                        folder_media_count = 0
-                        
-                        for folder_file in folder_files:
-                            file_id = folder_file.get("id")
-                            file_name = folder_file.get("name", f"file_{file_id}").strip()
-                            file_mime = (folder_file.get("mimeType") or "").lower()
-                            
-                            logger.info(f"   📁   Processing folder item: {file_name} (MIME: {file_mime})")
-                            
-                            # Обрабатываем только медиа-файлы (изображения/видео)
-                            if file_mime.startswith("image/"):
-                                media_type = "photo"
-                            elif file_mime.startswith("video/"):
-                                media_type = "video"
-                            else:
-                                logger.info(f"   📁   Skipping non-media file in folder: {file_name} (MIME: {file_mime})")
-                                continue
-                            
-                            safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", file_name)
-                            dest = media_root / f"day_{day:02d}" / safe_name
-                            
-                            # Убеждаемся, что директория назначения существует
-                            dest.parent.mkdir(parents=True, exist_ok=True)
-                            
-                            should_skip = self._should_skip_download(dest, folder_file.get("size"), folder_file.get("modifiedTime"))
-                            file_exists = dest.exists()
-                            logger.info(f"   📁     Destination: {dest}, File exists: {file_exists}, Should skip: {should_skip}")
-                            
-                            if not should_skip or not file_exists:
-                                if not file_exists:
-                                    logger.info(f"   📁     File doesn't exist, downloading: {file_name} -> {dest}")
-                                else:
-                                    logger.info(f"   📁     File outdated or size mismatch, re-downloading: {file_name} -> {dest}")
-                                self._download_binary_file(drive, file_id, dest)
-                                media_downloaded += 1
-                                logger.info(f"   ✅ Downloaded media file from folder: {file_name} (total downloaded: {media_downloaded})")
-                            else:
-                                logger.info(f"   📁     File already exists and up-to-date, skipping download: {dest}")
-                            
-                            processed_links += 1
-                            rel_path = str(dest.relative_to(project_root)).replace("\\", "/")
-                            
-                            # КРИТИЧЕСКИ ВАЖНО: Проверяем, не был ли уже создан маркер для этого file_id
-                            # Если один и тот же файл встречается в папке несколько раз, используем один маркер
-                            marker_id = None
-                            for existing_marker_id, existing_info in media_markers.items():
-                                if existing_info.get("file_id") == file_id and existing_info.get("path") == rel_path:
-                                    marker_id = existing_marker_id
-                                    logger.info(f"   ♻️ Reusing existing marker: [{marker_id}] for file {file_name} (file_id: {file_id})")
-                                    break
-                            
-                            # Если маркер не найден, создаем новый
-                            if not marker_id:
-                                marker_id = f"MEDIA_{file_id}_{len(media_markers)}"
-                                media_markers[marker_id] = {
-                                    "type": media_type,
-                                    "path": rel_path,
-                                    "file_id": file_id,
-                                    "name": file_name
-                                }
-                                logger.info(f"   ✅ Created new media marker: [{marker_id}] for file {file_name} (path: {rel_path})")
-                            
-                            folder_markers.append(marker_id)
-                            folder_media_count += 1
-                            
-                            media_items.append({"type": media_type, "path": rel_path, "marker_id": marker_id})
-                        
-                        # Заменяем ссылку на папку всеми маркерами (по одному на строку или через запятую)
-                        if folder_markers:
-                            # Заменяем URL папки всеми маркерами, по одному на строку
-                            markers_text = "\n".join([f"[{m}]" for m in folder_markers])
-                            replaced_in_lesson = False
-                            replaced_in_task = False
-                            replaced_in_intro = False
-                            replaced_in_about_me = False
-                            
-                            # ВАЖНО: Заменяем точную ссылку в каждом поле текста
-                            if link_url in lesson_text:
-                                lesson_text = lesson_text.replace(link_url, markers_text)
-                                replaced_in_lesson = True
-                                logger.info(f"   ✅ Replaced Drive folder link in lesson_text with {len(folder_markers)} markers")
-                            if link_url in task_text:
-                                task_text = task_text.replace(link_url, markers_text)
-                                replaced_in_task = True
-                                logger.info(f"   ✅ Replaced Drive folder link in task_text with {len(folder_markers)} markers")
-                            if intro_text and link_url in intro_text:
-                                intro_text = intro_text.replace(link_url, markers_text)
-                                replaced_in_intro = True
-                                logger.info(f"   ✅ Replaced Drive folder link in intro_text with {len(folder_markers)} markers")
-                            if about_me_text and link_url in about_me_text:
-                                about_me_text = about_me_text.replace(link_url, markers_text)
-                                replaced_in_about_me = True
-                                logger.info(f"   ✅ Replaced Drive folder link in about_me_text with {len(folder_markers)} markers")
-                            
-                            if not replaced_in_lesson and not replaced_in_task and not replaced_in_intro and not replaced_in_about_me:
-                                logger.warning(f"   ⚠️ Drive folder link not found in any text field: {link_url[:60]}...")
-                            
-                            logger.info(f"   📁 Folder processed: {folder_media_count} media files, {len(folder_markers)} markers created")
-                        else:
-                            logger.warning(f"   ⚠️ No media files found in folder {folder_id}")
-                            skipped_links += 1
-                    else:
-                        # Обрабатываем одиночный файл (существующая логика)
-                        logger.info(f"   📎 Processing Drive link: {link_url[:60]}... (file_id: {fid})")
-                        
-                        meta = drive.files().get(fileId=fid, fields="id,name,mimeType,modifiedTime,size").execute()
-                        mt = (meta.get("mimeType") or "").lower()
-                        name = (meta.get("name") or f"file_{fid}").strip()
-                        
-                        logger.info(f"   📎   File name: {name}, MIME type: {mt}")
-                        
-                        if mt.startswith("image/"):
-                            media_type = "photo"
-                        elif mt.startswith("video/"):
-                            media_type = "video"
-                        else:
-                            logger.info(f"   📎   Skipping non-media file: {name} (MIME: {mt})")
-                            skipped_links += 1
-                            continue  # Пропускаем не-медиа файлы
-                        
-                        safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", name)
-                        dest = media_root / f"day_{day:02d}" / safe_name
-                        
-                        # Убеждаемся, что директория назначения существует
-                        dest.parent.mkdir(parents=True, exist_ok=True)
-                        
-                        should_skip = self._should_skip_download(dest, meta.get("size"), meta.get("modifiedTime"))
-                        file_exists = dest.exists()
-                        logger.info(f"   📎   Destination: {dest}, File exists: {file_exists}, Should skip: {should_skip}")
-                        
-                        if not should_skip or not file_exists:
-                            if not file_exists:
-                                logger.info(f"   📎   File doesn't exist, downloading: {name} -> {dest}")
-                            else:
-                                logger.info(f"   📎   File outdated or size mismatch, re-downloading: {name} -> {dest}")
-                            self._download_binary_file(drive, fid, dest)
-                            media_downloaded += 1
-                            logger.info(f"   ✅ Downloaded media file: {name} (total downloaded: {media_downloaded})")
-                        else:
-                            logger.info(f"   📎   File already exists and up-to-date, skipping download: {dest}")
-                            # Считаем существующие файлы как "обработанные" для отчетности
-                            skipped_links += 1
-                        
-                        processed_links += 1
-                        rel_path = str(dest.relative_to(project_root)).replace("\\", "/")
-                        
-                        # КРИТИЧЕСКИ ВАЖНО: Проверяем, не был ли уже создан маркер для этого file_id
-                        # Если один и тот же файл встречается в тексте несколько раз, используем один маркер
-                        marker_id = None
-                        for existing_marker_id, existing_info in media_markers.items():
-                            if existing_info.get("file_id") == fid and existing_info.get("path") == rel_path:
-                                marker_id = existing_marker_id
-                                logger.info(f"   ♻️ Reusing existing marker: [{marker_id}] for file {name} (file_id: {fid})")
-                                break
-                        
-                        # Если маркер не найден, создаем новый
-                        if not marker_id:
-                            marker_id = f"MEDIA_{fid}_{len(media_markers)}"
-                            media_markers[marker_id] = {
-                                "type": media_type,
-                                "path": rel_path,
-                                "file_id": fid,
-                                "name": name
-                            }
-                            logger.info(f"   ✅ Created new media marker: [{marker_id}] for file {name} (path: {rel_path})")
-                        
-                        # Заменяем ссылку в тексте на маркер
-                        # Используем оригинальный URL из текста (link_url) для точной замены
-                        marker_placeholder = f"[{marker_id}]"
-                        # Заменяем все вхождения ссылки URL в обоих текстах, intro_text, и about_me_text
-                        replaced_in_lesson = False
-                        replaced_in_task = False
-                        replaced_in_intro = False
-                        replaced_in_about_me = False
-                        
-                        # ВАЖНО: Заменяем точную ссылку в каждом поле текста
-                        if link_url in lesson_text:
-                            lesson_text = lesson_text.replace(link_url, marker_placeholder)
-                            replaced_in_lesson = True
-                            logger.info(f"   ✅ Replaced Drive link in lesson_text: {link_url[:60]}... -> [{marker_id}]")
-                        if link_url in task_text:
-                            task_text = task_text.replace(link_url, marker_placeholder)
-                            replaced_in_task = True
-                            logger.info(f"   ✅ Replaced Drive link in task_text: {link_url[:60]}... -> [{marker_id}]")
-                        if intro_text and link_url in intro_text:
-                            intro_text = intro_text.replace(link_url, marker_placeholder)
-                            replaced_in_intro = True
-                            logger.info(f"   ✅ Replaced Drive link in intro_text: {link_url[:60]}... -> [{marker_id}]")
-                        if about_me_text and link_url in about_me_text:
-                            about_me_text = about_me_text.replace(link_url, marker_placeholder)
-                            replaced_in_about_me = True
-                            logger.info(f"   ✅ Replaced Drive link in about_me_text: {link_url[:60]}... -> [{marker_id}]")
-                        
-                        if not replaced_in_lesson and not replaced_in_task and not replaced_in_intro and not replaced_in_about_me:
-                            logger.warning(f"   ⚠️ Drive link not found in any text field: {link_url[:60]}...")
-                            logger.warning(f"   ⚠️ This may indicate the link format changed or was already replaced")
-                        
-                        media_items.append({"type": media_type, "path": rel_path, "marker_id": marker_id})
-                except Exception as e:
-                    error_links += 1
-                    error_msg = f"day {day}: failed to download linked media ({fid}): {e}"
-                    logger.error(f"   ❌ {error_msg}")
-                    warnings.append(error_msg)
-            
-            if drive_links:
-                logger.info(f"   📎 Day {day} summary: {processed_links} processed, {skipped_links} skipped, {error_links} errors, {media_downloaded} downloaded")
-
-            # Разделяем урок на посты по квадратным скобкам (если еще не разделен)
-            # ВАЖНО: Если урок уже был разделен на посты в _split_master_doc, 
-            # нужно разделить его снова после замены ссылок на маркеры,
-            # чтобы маркеры медиа остались в правильных постах
-            lesson_posts = DriveContentSync._split_lesson_into_posts(lesson_text)
+            day_media = _DayMedia(day, media_root, project_root, media_items=[], lookups=lookups)
+            replacements = self._resolve_drive_links(drive, store, links, day_media, warnings)
+            media_downloaded += day_media.downloaded
+            media_items = day_media.media_items
+            media_markers = day_media.media_markers
+
+            lesson_text, lesson_breaks = master_doc.render(
+                parsed.sections["lesson"], parsed.links["lesson"], replacements, parsed.breaks
+            )
+            task_text, _ = master_doc.render(parsed.sections["task"], parsed.links["task"], replacements)
+            intro_text, _ = master_doc.render(parsed.sections["intro_text"], parsed.links["intro_text"], replacements)
+            about_me_text, _ = master_doc.render(
+                parsed.sections["about_me_text"], parsed.links["about_me_text"], replacements
+            )
+
+            # Разделяем урок на посты (маркеры [POST] и т.п. уже найдены парсером)
+            lesson_posts = DriveContentSync._split_lesson_into_posts(lesson_text, breaks=lesson_breaks)
             
             # Логируем информацию о блоках для диагностики
             logger.info(f"   📦 Day {day}: Split into {len(lesson_posts)} blocks")
@@ -771,15 +386,6 @@ class DriveContentSync:
                 post_preview = post[:100].replace('\n', ' ') if post else "(empty)"
                 logger.debug(f"   📦   Block {i}/{len(lesson_posts)}: {len(post)} chars, preview: {post_preview}...")
             
-            # Если урок был разделен на посты изначально, убеждаемся, что структура сохранена
-            if lesson_was_split and lesson_posts_list:
-                # Проверяем, что количество постов совпадает (или близко)
-                # Это гарантирует, что маркеры [POST] правильно обработаны
-                if len(lesson_posts) < len(lesson_posts_list):
-                    logger.warning(f"   ⚠️ Day {day}: Number of posts changed after link replacement ({len(lesson_posts_list)} -> {len(lesson_posts)}). This may indicate a problem with [POST] marker processing.")
-                elif len(lesson_posts) > len(lesson_posts_list):
-                    logger.info(f"   📎 Day {day}: Number of posts increased after link replacement ({len(lesson_posts_list)} -> {len(lesson_posts)}). This is normal if new [POST] markers were added.")
-            
             # Валидация блоков: проверяем, что нет пустых блоков
             valid_lesson_posts = [post for post in lesson_posts if post and post.strip()]
             if len(valid_lesson_posts) != len(lesson_posts):
@@ -829,7 +435,7 @@ class DriveContentSync:
                 for marker_id in media_markers.keys():
                     logger.info(f"   📎     - {marker_id}")
             else:
-                logger.warning(f"   ⚠️ No media_markers for day {day} (drive_links found: {len(drive_links)})")
+                logger.warning(f"   ⚠️ No media_markers for day {day} (drive links found: {len(links)})")
             compiled[str(day)] = entry
             
             # Собираем статистику
@@ -875,7 +481,7 @@ class DriveContentSync:
         while True:
             resp = drive.files().list(
                 q=f"'{parent_id}' in parents and trashed=false",
-                fields="nextPageToken, files(id,name,mimeType,modifiedTime,size)",
+                fields=f"nextPageToken, files({FILE_FIELDS})",
                 pageToken=page_token,
                 pageSize=1000,
             ).execute()
@@ -925,147 +531,179 @@ class DriveContentSync:
             f.write(fh.getvalue())
         os.replace(tmp, dest_path)
 
+    def _media_root(self) -> Path:
+        return (Path.cwd() / self.media_dir).resolve()
+
+    def _fetch_media(self, store: MediaStore, drive, meta: Dict[str, Any], dest: Path) -> Tuple[Path, bool]:
+        """Put the Drive file under `dest` through the media store; its versioned path and whether it was downloaded."""
+        return store.fetch(meta, dest, lambda path: self._download_binary_file(drive, meta["id"], path))
+
+    def _backup_media_paths(self) -> List[str]:
+        """Media paths (relative to the media root) of the latest lessons.json backup, kept alive by GC."""
+        backup = self.get_latest_backup()
+        if not backup:
+            return []
+        try:
+            lessons = self._backups().load(backup)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read backup {backup} for media GC: {e}")
+            return []
+        media_root = self._media_root()
+        paths = []
+        for entry in lessons.values() if isinstance(lessons, dict) else []:
+            if not isinstance(entry, dict):
+                continue
+            items = list(entry.get("media") or []) + list((entry.get("media_markers") or {}).values())
+            for item in items:
+                if not isinstance(item, dict) or not item.get("path"):
+                    continue
+                # Not resolve(): the per-day path is a symlink into blobs/
+                path = Path(os.path.normpath(Path.cwd() / str(item["path"])))
+                if path.is_relative_to(media_root) and path != media_root:
+                    paths.append(str(path.relative_to(media_root)).replace("\\", "/"))
+        return paths
+
+    def _commit_media(self, store: MediaStore) -> Dict[str, int]:
+        """GC of the media store once lessons.json points at the new paths; returns the disk-usage report."""
+        try:
+            store.commit(keep=self._backup_media_paths())
+        except Exception as e:
+            logger.error(f"❌ Media store GC failed: {e}", exc_info=True)
+        usage = store.usage()
+        logger.info(
+            f"💾 Media store: {usage['blobs']} blobs, {usage['blob_bytes'] / 1048576:.1f} MB on disk "
+            f"for {usage['references']} references ({usage['logical_bytes'] / 1048576:.1f} MB without dedup), "
+            f"{usage['untracked_files']} untracked files ({usage['untracked_bytes'] / 1048576:.1f} MB)"
+        )
+        return usage
+
+    def _drive_pool(self) -> DrivePool:
+        workers = int(getattr(Config, "DRIVE_SYNC_WORKERS", 8) or 8)
+        return DrivePool(self._build_drive_client, workers=workers)
+
+    def _prefetch_links(self, pool: DrivePool, links: List[Link]) -> _DriveLookups:
+        """Метаданные всех файлов по ссылкам (batch-запросами) и содержимое всех папок по ссылкам (параллельно)."""
+        folders = list(dict.fromkeys(link.file_id for link in links if link.is_folder))
+        lookups = _DriveLookups(meta=pool.metadata((link.file_id for link in links if not link.is_folder), FILE_FIELDS))
+        lookups.children = dict(zip(folders, pool.map(self._list_children, folders)))
+        if links:
+            logger.info(f"   📎 Prefetched {len(lookups.meta)} linked files and {len(folders)} linked folders")
+        return lookups
+
     @staticmethod
-    def _parse_rfc3339(value: str) -> Optional[datetime]:
-        if not value:
+    def _prefetched(values: Optional[Dict[str, Any]], key: str, fetch):
+        """Заранее полученное значение (исключение пробрасывается); если его нет — запрос к Drive."""
+        if values is None or key not in values:
+            return fetch()
+        value = values[key]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _resolve_drive_links(
+        self, drive, store: MediaStore, links: List[Link], ctx: _DayMedia, warnings: List[str]
+    ) -> Dict[str, Optional[str]]:
+        """
+        URL -> текст маркеров ([MEDIA_...], по одному на строку для папки) для ссылок дня.
+        Каждый URL обрабатывается один раз, сколько бы раз он ни встречался в тексте;
+        None — ссылка остается в тексте как есть (не медиа, пустая папка, ошибка).
+        Ссылки идут в обратном порядке документа, как раньше, поэтому marker_id не меняются.
+        """
+        replacements: Dict[str, Optional[str]] = {}
+        for link in reversed(links):
+            if link.url in replacements:
+                continue
+            try:
+                replacements[link.url] = self._resolve_drive_link(drive, store, link, ctx)
+            except Exception as e:
+                replacements[link.url] = None
+                ctx.errors += 1
+                error_msg = f"day {ctx.day}: failed to download linked media ({link.file_id}): {e}"
+                logger.error(f"   ❌ {error_msg}")
+                warnings.append(error_msg)
+        if links:
+            logger.info(
+                f"   📎 Day {ctx.day} summary: {len(replacements)} distinct links, {ctx.processed} processed, "
+                f"{ctx.skipped} skipped, {ctx.errors} errors, {ctx.downloaded} downloaded"
+            )
+        return replacements
+
+    def _resolve_drive_link(self, drive, store: MediaStore, link: Link, ctx: _DayMedia) -> Optional[str]:
+        if link.is_folder:
+            # Папка: каждый медиа-файл в ней получает свой маркер
+            logger.info(f"   📁 Processing Drive folder: {link.url[:60]}... (folder_id: {link.file_id})")
+            folder_files = self._prefetched(
+                ctx.lookups.children if ctx.lookups else None, link.file_id,
+                lambda: self._list_children(drive, link.file_id),
+            )
+            logger.info(f"   📁   Found {len(folder_files)} items in folder")
+            if not folder_files:
+                logger.warning(f"   ⚠️ Folder {link.file_id} is empty or inaccessible")
+                ctx.skipped += 1
+                return None
+            folder_markers = [m for m in (self._media_marker(drive, store, f, ctx) for f in folder_files) if m]
+            if not folder_markers:
+                logger.warning(f"   ⚠️ No media files found in folder {link.file_id}")
+                ctx.skipped += 1
+                return None
+            logger.info(f"   📁 Folder processed: {len(folder_markers)} markers")
+            return "\n".join(f"[{m}]" for m in folder_markers)
+
+        logger.info(f"   📎 Processing Drive link: {link.url[:60]}... (file_id: {link.file_id})")
+        meta = self._prefetched(
+            ctx.lookups.meta if ctx.lookups else None, link.file_id,
+            lambda: drive.files().get(fileId=link.file_id, fields=FILE_FIELDS).execute(),
+        )
+        marker_id = self._media_marker(drive, store, meta, ctx)
+        if not marker_id:
+            ctx.skipped += 1
             return None
-        try:
-            # Google Drive returns RFC3339, often with "Z"
-            v = value.replace("Z", "+00:00")
-            return datetime.fromisoformat(v)
-        except Exception:
+        return f"[{marker_id}]"
+
+    def _media_marker(self, drive, store: MediaStore, meta: Dict[str, Any], ctx: _DayMedia) -> Optional[str]:
+        """Скачивает (или берет из хранилища) медиа-файл дня и возвращает его marker_id; None — не медиа."""
+        file_id = meta.get("id")
+        name = (meta.get("name") or f"file_{file_id}").strip()
+        mt = (meta.get("mimeType") or "").lower()
+        if mt.startswith("image/"):
+            media_type = "photo"
+        elif mt.startswith("video/"):
+            media_type = "video"
+        else:
+            logger.info(f"   📎   Skipping non-media file: {name} (MIME: {mt})")
             return None
 
-    @classmethod
-    def _should_skip_download(cls, dest_path: Path, remote_size: Optional[str], remote_mtime: Optional[str]) -> bool:
-        if not dest_path.exists():
-            return False
-        try:
-            if remote_size:
-                size = int(remote_size)
-                if size > 0 and dest_path.stat().st_size != size:
-                    return False
-            remote_dt = cls._parse_rfc3339(remote_mtime)
-            if remote_dt:
-                local_dt = datetime.fromtimestamp(dest_path.stat().st_mtime, tz=timezone.utc)
-                if local_dt >= remote_dt:
-                    return True
-            # If size matches and no mtime, treat as cached
-            if remote_size:
-                return True
-        except Exception:
-            return False
-        return False
+        safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", name)
+        dest, downloaded = self._fetch_media(store, drive, meta, ctx.media_root / f"day_{ctx.day:02d}" / safe_name)
+        if downloaded:
+            ctx.downloaded += 1
+            logger.info(f"   ✅ Downloaded media file: {name}")
+        else:
+            logger.info(f"   📎   Content already in media store, skipping download: {dest}")
+        ctx.processed += 1
+        rel_path = str(dest.relative_to(ctx.project_root)).replace("\\", "/")
+
+        # Один и тот же файл (тот же file_id и путь) получает один маркер
+        marker_id = ctx.markers_by_file.get((file_id, rel_path))
+        if marker_id is None:
+            marker_id = f"MEDIA_{file_id}_{len(ctx.media_markers)}"
+            ctx.media_markers[marker_id] = {"type": media_type, "path": rel_path, "file_id": file_id, "name": name}
+            ctx.markers_by_file[(file_id, rel_path)] = marker_id
+            logger.info(f"   ✅ Created new media marker: [{marker_id}] for file {name} (path: {rel_path})")
+        if ctx.media_items is not None:
+            ctx.media_items.append({"type": media_type, "path": rel_path, "marker_id": marker_id})
+        return marker_id
 
     @staticmethod
     def _sanitize_telegram_html(text: str) -> Tuple[str, List[str]]:
         """
         Telegram HTML is a strict subset. Editors will type tags directly in Google Docs.
-        This sanitizer keeps only safe Telegram tags and escapes everything else.
-
-        Allowed tags (Telegram HTML): b/strong, i/em, u/ins, s/strike/del, code, pre,
-        a (href only), tg-spoiler, blockquote.
-        Also supports span class="tg-spoiler" (Telegram spoiler).
+        Keeps only safe Telegram tags and escapes everything else (see utils/telegram_html.py;
+        results are cached, so unchanged texts are not parsed again on the next sync).
         
         ВАЖНО: Сохраняет все форматирование (пробелы, отступы, пунктуацию, эмодзи)
         """
-        warnings: List[str] = []
-
-        allowed = {
-            "b", "strong",
-            "i", "em",
-            "u", "ins",
-            "s", "strike", "del",
-            "code", "pre",
-            "a",
-            "tg-spoiler",
-            "blockquote",
-            "span",
-        }
-
-        class _Sanitizer(HTMLParser):
-            def __init__(self):
-                super().__init__(convert_charrefs=False)
-                self.out: List[str] = []
-
-            def handle_data(self, data: str) -> None:
-                # Сохраняем данные как есть (включая пробелы, отступы, эмодзи)
-                self.out.append(data)
-
-            def handle_entityref(self, name: str) -> None:
-                self.out.append(f"&{name};")
-
-            def handle_charref(self, name: str) -> None:
-                self.out.append(f"&#{name};")
-
-            def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
-                tag_l = (tag or "").lower()
-                if tag_l not in allowed:
-                    warnings.append(f"removed tag <{tag}>")
-                    self.out.append(html.escape(f"<{tag}>"))
-                    return
-
-                if tag_l == "a":
-                    href = ""
-                    for k, v in attrs:
-                        if (k or "").lower() == "href" and v:
-                            href = v
-                            break
-                    if not href:
-                        warnings.append("a tag without href removed")
-                        self.out.append(html.escape("<a>"))
-                        return
-                    safe_href = href.replace("\"", "&quot;")
-                    self.out.append(f"<a href=\"{safe_href}\">")
-                    return
-
-                if tag_l == "span":
-                    # allow only spoiler span
-                    cls = ""
-                    for k, v in attrs:
-                        if (k or "").lower() == "class" and v:
-                            cls = v
-                            break
-                    if cls != "tg-spoiler":
-                        warnings.append("span tag without class=tg-spoiler removed")
-                        self.out.append(html.escape("<span>"))
-                        return
-                    self.out.append("<span class=\"tg-spoiler\">")
-                    return
-
-                # other allowed tags with no attrs
-                self.out.append(f"<{tag_l}>")
-
-            def handle_endtag(self, tag: str) -> None:
-                tag_l = (tag or "").lower()
-                if tag_l not in allowed:
-                    self.out.append(html.escape(f"</{tag}>"))
-                    return
-                if tag_l == "strong":
-                    tag_l = "b"
-                if tag_l == "em":
-                    tag_l = "i"
-                if tag_l == "ins":
-                    tag_l = "u"
-                if tag_l == "strike":
-                    tag_l = "s"
-                self.out.append(f"</{tag_l}>")
-
-        parser = _Sanitizer()
-        try:
-            parser.feed(text or "")
-            parser.close()
-        except Exception as e:
-            # If parsing fails, escape everything to avoid Telegram parse errors
-            return html.escape(text or ""), [f"html parse error: {e}"]
-
-        sanitized = "".join(parser.out)
-
-        # If someone typed "1 < 2" it could be interpreted as a tag start; best-effort fix:
-        # escape any remaining "<" that doesn't look like a tag start.
-        sanitized = re.sub(r"<(?!/?(?:b|strong|i|em|u|ins|s|strike|del|code|pre|a|tg-spoiler|blockquote|span)\b)", "&lt;", sanitized)
-
-        return sanitized, warnings
+        return telegram_html.sanitize(text)
 
     @staticmethod
     def _pick_named(files: List[Dict[str, Any]], base: str) -> Optional[Dict[str, Any]]:
@@ -1103,65 +741,54 @@ class DriveContentSync:
         db_path = Path(Config.DATABASE_PATH)
         return db_path.parent / "lessons.json"
 
-    def _backup_file_if_exists(self, target: Path) -> Optional[Path]:
+    def lessons_path(self) -> Path:
+        """Where the sync publishes lessons.json."""
+        return self._target_lessons_path()
+
+    def _backups(self) -> BackupHistory:
+        target = self._target_lessons_path()
+        return BackupHistory(
+            target.parent / "content_backups",
+            stem=target.stem,
+            keep_latest=int(getattr(Config, "CONTENT_BACKUP_KEEP_LATEST", 20) or 20),
+            keep_daily=int(getattr(Config, "CONTENT_BACKUP_KEEP_DAILY", 30) or 0),
+        )
+
+    def _backup_file_if_exists(self, target: Path, reason: str = "sync") -> Optional[str]:
         """
-        Create a timestamped backup copy next to the target, if it exists.
-        Returns backup path if created.
+        Add the current target to the backup history (services/content_backups.py), if it exists.
+        Returns the backup version id.
         """
         try:
             if not target.exists() or not target.is_file():
                 return None
-            backups_dir = target.parent / "content_backups"
-            backups_dir.mkdir(parents=True, exist_ok=True)
-            ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-            backup_path = backups_dir / f"{target.stem}.{ts}{target.suffix}"
-            shutil.copy2(target, backup_path)
-            logger.info(f"✅ Backup created: {backup_path}")
-            return backup_path
+            version = self._backups().record(target, reason=reason)
+            return version.id if version else None
         except Exception as e:
             logger.warning(f"⚠️ Failed to backup {target}: {e}")
             return None
     
-    def get_latest_backup(self) -> Optional[Path]:
-        """Get the most recent backup file path."""
-        target = self._target_lessons_path()
-        backups_dir = target.parent / "content_backups"
-        if not backups_dir.exists():
-            return None
-        backups = sorted(backups_dir.glob(f"{target.stem}.*{target.suffix}"), reverse=True)
-        return backups[0] if backups else None
+    def get_latest_backup(self) -> Optional[str]:
+        """Id of the most recent backup version."""
+        version = self._backups().latest()
+        return version.id if version else None
     
-    def get_all_backups(self) -> List[Tuple[Path, datetime]]:
-        """Get all backup files with their timestamps."""
-        target = self._target_lessons_path()
-        backups_dir = target.parent / "content_backups"
-        if not backups_dir.exists():
-            return []
-        backups = []
-        for backup_path in backups_dir.glob(f"{target.stem}.*{target.suffix}"):
-            try:
-                # Extract timestamp from filename: lessons.YYYYMMDD-HHMMSS.json
-                parts = backup_path.stem.split(".")
-                if len(parts) >= 2:
-                    ts_str = parts[-1]
-                    ts = datetime.strptime(ts_str, "%Y%m%d-%H%M%S")
-                    backups.append((backup_path, ts))
-            except Exception:
-                # If timestamp parsing fails, use file mtime
-                ts = datetime.fromtimestamp(backup_path.stat().st_mtime)
-                backups.append((backup_path, ts))
-        return sorted(backups, key=lambda x: x[1], reverse=True)
+    def get_all_backups(self) -> List[Tuple[str, datetime]]:
+        """All backup versions (id, UTC time), newest first."""
+        return [(v.id, v.created) for v in self._backups().versions()]
     
-    def restore_from_backup(self, backup_path: Optional[Path] = None) -> bool:
+    def restore_from_backup(self, backup_id: Optional[str] = None) -> bool:
         """
-        Restore lessons.json from a backup.
-        If backup_path is None, uses the latest backup.
+        Restore lessons.json from a backup version.
+        If backup_id is None, uses the latest backup.
         Returns True if successful.
         """
         try:
-            if backup_path is None:
-                backup_path = self.get_latest_backup()
-            if not backup_path or not backup_path.exists():
+            backups = self._backups()
+            if backup_id is None:
+                backup_id = self.get_latest_backup()
+            text = backups.read_text(backup_id) if backup_id else None
+            if text is None:
                 logger.error("No backup found to restore from")
                 return False
             
@@ -1170,80 +797,168 @@ class DriveContentSync:
             
             # Create a backup of current file before restoring
             if target.exists():
-                self._backup_file_if_exists(target)
+                self._backup_file_if_exists(target, reason="restore")
             
-            shutil.copy2(backup_path, target)
-            logger.info(f"✅ Restored lessons.json from backup: {backup_path}")
+            lessons = backups.load(backup_id)
+            if isinstance(lessons, dict):
+                self._prepare_media_variants(lessons, [])
+
+            tmp = target.with_suffix(".json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, target)
+            logger.info(f"✅ Restored lessons.json from backup: {backup_id}")
             return True
         except Exception as e:
             logger.error(f"❌ Failed to restore from backup: {e}", exc_info=True)
             return False
 
+    def _published_days(self, target: Path) -> List[str]:
+        try:
+            with open(target, "r", encoding="utf-8") as f:
+                lessons = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return list(lessons) if isinstance(lessons, dict) else []
+
+    @staticmethod
+    def _has_content(entry: Dict[str, Any]) -> bool:
+        """Урок не пустой: текст, intro_text / about_me_text (день 0 держит содержимое в intro_text) или медиа."""
+        text = entry.get("text", "")
+        blocks = text if isinstance(text, list) else [text]
+        if any((block or "").strip() for block in blocks if isinstance(block, str)):
+            return True
+        if any(str(entry.get(key) or "").strip() for key in ("intro_text", "about_me_text")):
+            return True
+        return bool(entry.get("media") or entry.get("media_markers"))
+
+    def _validate(self, compiled: Dict[str, Any], target: Path, warnings: List[str], strict: bool) -> None:
+        """Проверка собранных уроков перед публикацией: пустые дни и дни, пропавшие по сравнению с опубликованными."""
+        problems: List[str] = []
+        for k, v in compiled.items():
+            if not self._has_content(v):
+                problems.append(f"day {k}: empty lesson (no text, intro_text, about_me_text or media)")
+        missing = [k for k in self._published_days(target) if k not in compiled]
+        if missing:
+            problems.append(f"days missing compared to the published lessons.json: {', '.join(missing)}")
+        warnings.extend(problems)
+        if strict and problems:
+            raise RuntimeError(f"lessons.json not published ({len(problems)} problems): " + "; ".join(problems[:5]))
+
+    def _publish(self, compiled: Dict[str, Any], warnings: List[str], strict: bool = False) -> Path:
+        """
+        Validate the compiled lessons and publish them as lessons.json: the new content is
+        written to a staging file next to it, read back, and renamed over lessons.json, so
+        readers see either the previous file or the new one.
+        """
+        target = self._target_lessons_path()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self._validate(compiled, target, warnings, strict)
+        variants = self._prepare_media_variants(compiled, warnings)
+
+        staging = target.with_suffix(".json.tmp")
+        with open(staging, "w", encoding="utf-8") as f:
+            json.dump(compiled, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(staging, "r", encoding="utf-8") as f:
+            staged = json.load(f)
+        if not isinstance(staged, dict) or set(staged) != set(compiled):
+            staging.unlink(missing_ok=True)
+            raise RuntimeError(f"Staged lessons.json is incomplete ({staging}); not published")
+
+        self._backup_file_if_exists(target)
+        os.replace(staging, target)
+        if variants is not None:
+            try:
+                variants.commit(media_paths(compiled))
+            except Exception as e:
+                logger.error(f"❌ Media variants GC failed: {e}", exc_info=True)
+        return target
+
+    def _prepare_media_variants(self, lessons: Dict[str, Any], warnings: List[str]) -> Optional[MediaVariants]:
+        """Delivery-ready photo/video variants for every media path of the lessons (services/media_variants.py)."""
+        try:
+            variants = MediaVariants(self._media_root())
+            report = variants.prepare(media_paths(lessons))
+        except Exception as e:
+            logger.error(f"❌ Media variants preparation failed: {e}", exc_info=True)
+            warnings.append(f"media variants not prepared ({e}); originals will be sent")
+            return None
+        if report["failed"]:
+            warnings.append(f"{report['failed']} media variants failed; originals will be sent")
+        return variants
+
+    @staticmethod
+    def _log_saved(compiled: Dict[str, Any], total_blocks: int, target: Path) -> None:
+        """Проверяем, что все блоки сохранены корректно."""
+        total_saved_blocks = 0
+        total_saved_chars = 0
+        empty_blocks_found = 0
+        for entry in compiled.values():
+            text = entry.get("text", "")
+            if isinstance(text, list):
+                total_saved_blocks += len(text)
+                for block in text:
+                    if block and block.strip():
+                        total_saved_chars += len(block)
+                    else:
+                        empty_blocks_found += 1
+            elif text:
+                total_saved_blocks += 1
+                if text.strip():
+                    total_saved_chars += len(text)
+                else:
+                    empty_blocks_found += 1
+
+        logger.info(f"✅ Drive sync published {len(compiled)} lessons to {target}")
+        logger.info(f"   📦 Total blocks saved: {total_saved_blocks} (expected: {total_blocks})")
+        logger.info(f"   📝 Total characters saved: {total_saved_chars}")
+        if total_saved_blocks != total_blocks:
+            logger.warning(f"   ⚠️ Block count mismatch! Saved: {total_saved_blocks}, Expected: {total_blocks}")
+        if empty_blocks_found > 0:
+            logger.warning(f"   ⚠️ Found {empty_blocks_found} empty blocks in saved data!")
+
     def clean_media_files(self) -> int:
         """
-        Удаляет все медиафайлы из директории content_media.
+        Удаляет медиафайлы дней (ссылки, сжатые копии, файлы старой раскладки) из content_media.
+        Сами данные в blobs/ остаются: синхронизация заново свяжет неизменившиеся файлы без
+        повторной загрузки, а то, на что ничего не ссылается, удалит GC в конце синхронизации.
         Возвращает количество удаленных файлов.
         """
-        project_root = Path.cwd()
-        media_root = (project_root / self.media_dir).resolve()
-        
+        media_root = self._media_root()
         if not media_root.exists():
             logger.info(f"📁 Media directory does not exist: {media_root}")
             return 0
-        
-        deleted_count = 0
         try:
-            # Сначала собираем все файлы для удаления (чтобы избежать проблем с изменением структуры во время итерации)
-            files_to_delete = []
-            dirs_to_delete = []
-            
-            for item in media_root.iterdir():
-                if item.is_file():
-                    files_to_delete.append(item)
-                elif item.is_dir():
-                    # Собираем все файлы из поддиректорий
-                    for subitem in item.rglob("*"):
-                        if subitem.is_file():
-                            files_to_delete.append(subitem)
-                    dirs_to_delete.append(item)
-            
-            # Удаляем все файлы
-            for file_path in files_to_delete:
-                try:
-                    file_path.unlink()
-                    deleted_count += 1
-                    logger.debug(f"   🗑️ Deleted file: {file_path.relative_to(media_root)}")
-                except Exception as e:
-                    logger.warning(f"   ⚠️ Could not delete file {file_path}: {e}")
-            
-            # Удаляем все директории (shutil.rmtree удаляет рекурсивно, включая все файлы)
-            for dir_path in dirs_to_delete:
-                try:
-                    shutil.rmtree(dir_path)
-                    logger.debug(f"   🗑️ Deleted directory: {dir_path.relative_to(media_root)}")
-                except Exception as e:
-                    logger.warning(f"   ⚠️ Could not delete directory {dir_path}: {e}")
-                    # Пробуем удалить оставшиеся файлы вручную
-                    for remaining in dir_path.rglob("*"):
-                        if remaining.is_file():
-                            try:
-                                remaining.unlink()
-                                deleted_count += 1
-                            except Exception:
-                                pass
-                    # Пробуем удалить директорию снова
-                    try:
-                        dir_path.rmdir()
-                    except Exception:
-                        pass
-            
+            deleted_count = MediaStore(media_root).clear_links()
             logger.info(f"✅ Cleaned {deleted_count} media files from {media_root}")
             return deleted_count
         except Exception as e:
             logger.error(f"❌ Error cleaning media files: {e}", exc_info=True)
             raise
 
-    def sync_now(self, clean_media: bool = False) -> SyncResult:
+    def media_usage(self) -> Dict[str, int]:
+        """Отчет об использовании диска медиахранилищем (см. MediaStore.usage)."""
+        return MediaStore(self._media_root()).usage()
+
+    def sync_now(self, clean_media: bool = False, strict: bool = False) -> SyncResult:
+        """
+        Compile the lessons from Drive and publish lessons.json.
+
+        strict=True (scheduled syncs): refuse to publish if a day has empty text or a day
+        of the published lessons.json is missing, instead of only reporting it in warnings.
+        """
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = self._sync_now(clean_media=clean_media, strict=strict)
+            outcome = "ok"
+            return result
+        finally:
+            DRIVE_SYNC_SECONDS.observe(time.perf_counter() - started, result=outcome)
+
+    def _sync_now(self, clean_media: bool = False, strict: bool = False) -> SyncResult:
         ok, reason = self._admin_ready()
         if not ok:
             raise RuntimeError(f"Drive content sync not ready: {reason}")
@@ -1256,55 +971,14 @@ class DriveContentSync:
 
         drive = self._build_drive_client()
         warnings: List[str] = []
+        store = MediaStore(self._media_root())
 
         # Single-doc mode
         if (Config.DRIVE_MASTER_DOC_ID or "").strip():
-            compiled, media_downloaded, total_blocks, total_media_files = self._sync_from_master_doc(drive, warnings)
-            
-            # Basic validation: ensure each lesson has text
-            for k, v in compiled.items():
-                text = v.get("text", "")
-                if isinstance(text, list):
-                    if not text or all(not (block or "").strip() for block in text):
-                        warnings.append(f"day {k}: empty lesson text (all blocks are empty)")
-                elif not (text or "").strip():
-                    warnings.append(f"day {k}: empty lesson text")
+            compiled, media_downloaded, total_blocks, total_media_files = self._sync_from_master_doc(drive, warnings, store)
             
-            target = self._target_lessons_path()
-            target.parent.mkdir(parents=True, exist_ok=True)
-            self._backup_file_if_exists(target)
-            tmp = target.with_suffix(".json.tmp")
-            with open(tmp, "w", encoding="utf-8") as f:
-                json.dump(compiled, f, ensure_ascii=False, indent=2)
-            os.replace(tmp, target)
-            
-            # Проверяем, что все блоки сохранены корректно
-            total_saved_blocks = 0
-            total_saved_chars = 0
-            empty_blocks_found = 0
-            for day_key, entry in compiled.items():
-                text = entry.get("text", "")
-                if isinstance(text, list):
-                    total_saved_blocks += len(text)
-                    for block in text:
-                        if block and block.strip():
-                            total_saved_chars += len(block)
-                        else:
-                            empty_blocks_found += 1
-                elif text:
-                    total_saved_blocks += 1
-                    if text.strip():
-                        total_saved_chars += len(text)
-                    else:
-                        empty_blocks_found += 1
-            
-            logger.info(f"✅ Drive master-doc sync wrote {len(compiled)} lessons to {target}")
-            logger.info(f"   📦 Total blocks saved: {total_saved_blocks} (expected: {total_blocks})")
-            logger.info(f"   📝 Total characters saved: {total_saved_chars}")
-            if total_saved_blocks != total_blocks:
-                logger.warning(f"   ⚠️ Block count mismatch! Saved: {total_saved_blocks}, Expected: {total_blocks}")
-            if empty_blocks_found > 0:
-                logger.warning(f"   ⚠️ Found {empty_blocks_found} empty blocks in saved data!")
+            target = self._publish(compiled, warnings, strict=strict)
+            self._log_saved(compiled, total_blocks, target)
             return SyncResult(
                 days_synced=len(compiled),
                 lessons_path=str(target),
@@ -1312,6 +986,7 @@ class DriveContentSync:
                 total_blocks=total_blocks,
                 total_media_files=total_media_files,
                 warnings=warnings,
+                media_usage=self._commit_media(store),
             )
 
         root_children = self._list_children(drive, self.root_folder_id)
@@ -1336,204 +1011,94 @@ class DriveContentSync:
         total_blocks = 0
         total_media_files = 0
 
-        for day, folder in day_folders:
-            folder_id = folder["id"]
-            children = self._list_children(drive, folder_id)
-
-            # If there's a "media" subfolder, include its contents too.
-            media_folder = None
-            for c in children:
-                if c.get("mimeType") == FOLDER_MIME and (c.get("name") or "").lower() == "media":
-                    media_folder = c
-                    break
-            media_children = self._list_children(drive, media_folder["id"]) if media_folder else []
-
-            lesson_file = self._pick_named(children, "lesson")
-            task_file = self._pick_named(children, "task")
-            meta_file = self._pick_named(children, "meta")
-
-            if not lesson_file:
-                warnings.append(f"day {day}: missing lesson file")
-                continue
-
-            lesson_text = self._download_text_file(drive, lesson_file["id"], lesson_file.get("mimeType", ""))
-            task_text = ""
-            if task_file:
-                task_text = self._download_text_file(drive, task_file["id"], task_file.get("mimeType", ""))
-
-            # Telegram HTML sanitizer (editors type tags directly in Google Docs)
-            lesson_text, w1 = self._sanitize_telegram_html(lesson_text or "")
-            if w1:
-                warnings.extend([f"day {day}: {w}" for w in w1])
-            if task_text:
-                task_text, w2 = self._sanitize_telegram_html(task_text or "")
-                if w2:
-                    warnings.extend([f"day {day}: {w}" for w in w2])
+        # Drive calls go in parallel waves (services/drive_pool.py) instead of one by one per day:
+        # 1) day folders; 2) media/ subfolders and lesson / task / meta.json texts; 3) linked files and folders
+        with self._drive_pool() as pool:
+            listings = pool.map(self._list_children, [folder["id"] for _, folder in day_folders])
+            day_plans: List[Tuple[int, List[Dict[str, Any]], Dict[str, Any]]] = []
+            jobs: Dict[Tuple[int, str], Any] = {}
+            for (day, _), children in zip(day_folders, listings):
+                if isinstance(children, Exception):
+                    raise children
+                # If there's a "media" subfolder, include its contents too.
+                files: Dict[str, Any] = {}
+                for c in children:
+                    if c.get("mimeType") == FOLDER_MIME and (c.get("name") or "").lower() == "media":
+                        files["media"] = c
+                        break
+                for kind in ("lesson", "task", "meta"):
+                    files[kind] = self._pick_named(children, kind)
+                if not files["lesson"]:
+                    warnings.append(f"day {day}: missing lesson file")
+                    continue
+                if not (files["meta"] and (files["meta"].get("name") or "").lower().endswith(".json")):
+                    files["meta"] = None
+                day_plans.append((day, children, files))
+                for kind, f in files.items():
+                    if f:
+                        jobs[(day, kind)] = f
+
+            def run_job(drive, job):
+                kind, f = job
+                if kind == "media":
+                    return self._list_children(drive, f["id"])
+                return self._download_text_file(drive, f["id"], f.get("mimeType", ""))
+
+            fetched = dict(zip(jobs, pool.map(run_job, [(kind, f) for (_, kind), f in jobs.items()])))
+
+            day_texts: Dict[int, Tuple[str, str]] = {}
+            all_links: List[Link] = []
+            for day, _, files in day_plans:
+                for kind in ("media", "lesson", "task"):
+                    if isinstance(fetched.get((day, kind)), Exception):
+                        raise fetched[(day, kind)]
+                lesson_text = fetched[(day, "lesson")]
+                task_text = fetched.get((day, "task")) or ""
+
+                # Telegram HTML sanitizer (editors type tags directly in Google Docs)
+                lesson_text, w1 = self._sanitize_telegram_html(lesson_text or "")
+                if w1:
+                    warnings.extend([f"day {day}: {w}" for w in w1])
+                if task_text:
+                    task_text, w2 = self._sanitize_telegram_html(task_text or "")
+                    if w2:
+                        warnings.extend([f"day {day}: {w}" for w in w2])
+                day_texts[day] = (lesson_text, task_text)
+                all_links += master_doc.find_links(lesson_text) + master_doc.find_links(task_text)
+
+            lookups = self._prefetch_links(pool, all_links)
+        logger.info(f"   📡 Drive API: {pool.stats['calls']} calls, {pool.stats['batches']} batches, {pool.stats['retries']} retries")
+
+        for day, children, files in day_plans:
+            media_children = fetched.get((day, "media")) or []
+            lesson_text, task_text = day_texts[day]
             
             # Process Drive-linked media referenced in the text/task (same as in _sync_from_master_doc)
             # Replace links with markers and download files
-            media_markers: Dict[str, Dict[str, Any]] = {}  # marker_id -> media_info
-            
-            # Find all Drive links in lesson and task text
-            combined_text = (lesson_text or "") + "\n" + (task_text or "")
-            drive_links = self._find_drive_links_with_positions(combined_text)
-            
-            logger.info(f"   📎 Day {day}: Found {len(drive_links)} Drive links in text")
-            logger.info(f"   📎 Day {day}: Text lengths - lesson: {len(lesson_text or '')}, task: {len(task_text or '')}")
-            if drive_links:
-                for idx, link in enumerate(drive_links, 1):
-                    logger.info(f"   📎   [{idx}/{len(drive_links)}] Link: {link['url'][:80]}... (file_id: {link['file_id']}, is_folder: {link.get('is_folder', False)}, position: {link.get('start', '?')}-{link.get('end', '?')})")
-            else:
-                logger.warning(f"   ⚠️ Day {day}: No Drive links found in text! This may indicate a problem with link detection.")
-            
-            # Process links in reverse order to preserve positions when replacing
-            drive_links.sort(key=lambda x: x["start"], reverse=True)
-            
-            processed_links = 0
-            skipped_links = 0
-            error_links = 0
-            
-            for link_info in drive_links:
-                fid = link_info["file_id"]
-                link_url = link_info["url"]
-                is_folder = link_info.get("is_folder", False)
-                
-                try:
-                    if is_folder:
-                        # Handle folder: get all files in folder and process each as media
-                        folder_id = link_info.get("folder_id") or fid
-                        logger.info(f"   📁 Processing Drive folder: {link_url[:60]}... (folder_id: {folder_id})")
-                        
-                        folder_files = self._list_children(drive, folder_id)
-                        logger.info(f"   📁   Found {len(folder_files)} items in folder")
-                        
-                        if not folder_files:
-                            logger.warning(f"   ⚠️ Folder {folder_id} is empty or inaccessible")
-                            skipped_links += 1
-                            continue
-                        
-                        folder_markers = []
-                        for folder_file in folder_files:
-                            file_id = folder_file.get("id")
-                            file_name = folder_file.get("name", f"file_{file_id}").strip()
-                            file_mime = (folder_file.get("mimeType") or "").lower()
-                            
-                            if file_mime.startswith("image/"):
-                                media_type = "photo"
-                            elif file_mime.startswith("video/"):
-                                media_type = "video"
-                            else:
-                                continue
-                            
-                            safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", file_name)
-                            dest = media_root / f"day_{day:02d}" / safe_name
-                            dest.parent.mkdir(parents=True, exist_ok=True)
-                            
-                            should_skip = self._should_skip_download(dest, folder_file.get("size"), folder_file.get("modifiedTime"))
-                            if not should_skip or not dest.exists():
-                                self._download_binary_file(drive, file_id, dest)
-                                media_downloaded += 1
-                            
-                        processed_links += 1
-                        rel_path = str(dest.relative_to(project_root)).replace("\\", "/")
-                        
-                        # КРИТИЧЕСКИ ВАЖНО: Проверяем, не был ли уже создан маркер для этого file_id
-                        marker_id = None
-                        for existing_marker_id, existing_info in media_markers.items():
-                            if existing_info.get("file_id") == file_id and existing_info.get("path") == rel_path:
-                                marker_id = existing_marker_id
-                                logger.info(f"   ♻️ Reusing existing marker: [{marker_id}] for file {file_name} (file_id: {file_id})")
-                                break
-                        
-                        # Если маркер не найден, создаем новый
-                        if not marker_id:
-                            marker_id = f"MEDIA_{file_id}_{len(media_markers)}"
-                            media_markers[marker_id] = {
-                                "type": media_type,
-                                "path": rel_path,
-                                "file_id": file_id,
-                                "name": file_name
-                            }
-                            logger.info(f"   ✅ Created new media marker: [{marker_id}] for file {file_name} (path: {rel_path})")
-                        
-                        folder_markers.append(marker_id)
-                        
-                        if folder_markers:
-                            markers_text = "\n".join([f"[{m}]" for m in folder_markers])
-                            if link_url in lesson_text:
-                                lesson_text = lesson_text.replace(link_url, markers_text)
-                            if link_url in task_text:
-                                task_text = task_text.replace(link_url, markers_text)
-                    else:
-                        # Handle single file
-                        logger.info(f"   📎 Processing Drive link: {link_url[:60]}... (file_id: {fid})")
-                        meta = drive.files().get(fileId=fid, fields="id,name,mimeType,modifiedTime,size").execute()
-                        mt = (meta.get("mimeType") or "").lower()
-                        name = (meta.get("name") or f"file_{fid}").strip()
-                        
-                        if mt.startswith("image/"):
-                            media_type = "photo"
-                        elif mt.startswith("video/"):
-                            media_type = "video"
-                        else:
-                            skipped_links += 1
-                            continue
-                        
-                        safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", name)
-                        dest = media_root / f"day_{day:02d}" / safe_name
-                        dest.parent.mkdir(parents=True, exist_ok=True)
-                        
-                        should_skip = self._should_skip_download(dest, meta.get("size"), meta.get("modifiedTime"))
-                        if not should_skip or not dest.exists():
-                            self._download_binary_file(drive, fid, dest)
-                            media_downloaded += 1
-                        
-                        processed_links += 1
-                        rel_path = str(dest.relative_to(project_root)).replace("\\", "/")
-                        
-                        # КРИТИЧЕСКИ ВАЖНО: Проверяем, не был ли уже создан маркер для этого file_id
-                        marker_id = None
-                        for existing_marker_id, existing_info in media_markers.items():
-                            if existing_info.get("file_id") == fid and existing_info.get("path") == rel_path:
-                                marker_id = existing_marker_id
-                                logger.info(f"   ♻️ Reusing existing marker: [{marker_id}] for file {name} (file_id: {fid})")
-                                break
-                        
-                        # Если маркер не найден, создаем новый
-                        if not marker_id:
-                            marker_id = f"MEDIA_{fid}_{len(media_markers)}"
-                            media_markers[marker_id] = {
-                                "type": media_type,
-                                "path": rel_path,
-                                "file_id": fid,
-                                "name": name
-                            }
-                            logger.info(f"   ✅ Created new media marker: [{marker_id}] for file {name} (path: {rel_path})")
-                        
-                        marker_placeholder = f"[{marker_id}]"
-                        if link_url in lesson_text:
-                            lesson_text = lesson_text.replace(link_url, marker_placeholder)
-                        if link_url in task_text:
-                            task_text = task_text.replace(link_url, marker_placeholder)
-                except Exception as e:
-                    error_links += 1
-                    error_msg = f"day {day}: failed to download linked media ({fid}): {e}"
-                    logger.error(f"   ❌ {error_msg}")
-                    warnings.append(error_msg)
-            
-            if drive_links:
-                logger.info(f"   📎 Day {day} summary: {processed_links} processed, {skipped_links} skipped, {error_links} errors, {media_downloaded} downloaded")
+            lesson_links = master_doc.find_links(lesson_text or "")
+            task_links = master_doc.find_links(task_text or "")
+            links = lesson_links + task_links
+            logger.info(f"   📎 Day {day}: Found {len(links)} Drive links in text")
+            day_media = _DayMedia(day, media_root, project_root, lookups=lookups)
+            replacements = self._resolve_drive_links(drive, store, links, day_media, warnings)
+            media_downloaded += day_media.downloaded
+            media_markers = day_media.media_markers
+            lesson_text, _ = master_doc.render(lesson_text or "", lesson_links, replacements)
+            task_text, _ = master_doc.render(task_text or "", task_links, replacements)
+
             logger.info(f"   📎 Day {day} media_markers created: {len(media_markers)}")
             if media_markers:
                 for marker_id, marker_info in media_markers.items():
                     logger.info(f"   📎   - {marker_id}: {marker_info.get('type')}, path={marker_info.get('path')}, name={marker_info.get('name')}")
-            elif drive_links:
-                logger.warning(f"   ⚠️ Day {day}: Found {len(drive_links)} drive_links but created 0 media_markers! This may indicate a problem.")
+            elif links:
+                logger.warning(f"   ⚠️ Day {day}: Found {len(links)} drive links but created 0 media_markers! This may indicate a problem.")
 
             meta: Dict[str, Any] = {}
-            if meta_file and (meta_file.get("name") or "").lower().endswith(".json"):
+            if files["meta"]:
                 try:
-                    meta_raw = self._download_text_file(drive, meta_file["id"], meta_file.get("mimeType", ""))
+                    meta_raw = fetched[(day, "meta")]
+                    if isinstance(meta_raw, Exception):
+                        raise meta_raw
                     meta = json.loads(meta_raw)
                 except Exception as e:
                     warnings.append(f"day {day}: meta.json invalid ({e})")
@@ -1555,10 +1120,9 @@ class DriveContentSync:
                     continue
 
                 safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", name)
-                dest = media_root / f"day_{day:02d}" / safe_name
                 try:
-                    if not self._should_skip_download(dest, m.get("size"), m.get("modifiedTime")):
-                        self._download_binary_file(drive, m["id"], dest)
+                    dest, downloaded = self._fetch_media(store, drive, m, media_root / f"day_{day:02d}" / safe_name)
+                    if downloaded:
                         media_downloaded += 1
                     # Store path relative to project root, because CourseBot resolves it that way
                     rel_path = str(dest.relative_to(project_root)).replace("\\", "/")
@@ -1630,50 +1194,8 @@ class DriveContentSync:
         if not compiled:
             raise RuntimeError("No lessons compiled (check Drive folder contents)")
 
-        # Basic validation: ensure each lesson has text
-        for k, v in compiled.items():
-            text = v.get("text", "")
-            if isinstance(text, list):
-                if not text or all(not (block or "").strip() for block in text):
-                    warnings.append(f"day {k}: empty lesson text (all blocks are empty)")
-            elif not (text or "").strip():
-                warnings.append(f"day {k}: empty lesson text")
-
-        target = self._target_lessons_path()
-        target.parent.mkdir(parents=True, exist_ok=True)
-        self._backup_file_if_exists(target)
-        tmp = target.with_suffix(".json.tmp")
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(compiled, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, target)
-
-        # Проверяем, что все блоки сохранены корректно
-        total_saved_blocks = 0
-        total_saved_chars = 0
-        empty_blocks_found = 0
-        for day_key, entry in compiled.items():
-            text = entry.get("text", "")
-            if isinstance(text, list):
-                total_saved_blocks += len(text)
-                for block in text:
-                    if block and block.strip():
-                        total_saved_chars += len(block)
-                    else:
-                        empty_blocks_found += 1
-            elif text:
-                total_saved_blocks += 1
-                if text.strip():
-                    total_saved_chars += len(text)
-                else:
-                    empty_blocks_found += 1
-        
-        logger.info(f"✅ Drive sync wrote {len(compiled)} lessons to {target}")
-        logger.info(f"   📦 Total blocks saved: {total_saved_blocks} (expected: {total_blocks})")
-        logger.info(f"   📝 Total characters saved: {total_saved_chars}")
-        if total_saved_blocks != total_blocks:
-            logger.warning(f"   ⚠️ Block count mismatch! Saved: {total_saved_blocks}, Expected: {total_blocks}")
-        if empty_blocks_found > 0:
-            logger.warning(f"   ⚠️ Found {empty_blocks_found} empty blocks in saved data!")
+        target = self._publish(compiled, warnings, strict=strict)
+        self._log_saved(compiled, total_blocks, target)
         return SyncResult(
             days_synced=len(compiled),
             lessons_path=str(target),
@@ -1681,4 +1203,5 @@ class DriveContentSync:
             total_blocks=total_blocks,
             total_media_files=total_media_files,
             warnings=warnings,
+            media_usage=self._commit_media(store),
         )
@@ -0,0 +1,210 @@
+"""
+Concurrent, quota-aware access to the Drive API for the content sync.
+
+The sync used to make every Drive call in sequence: list a day folder, list
+its media/ subfolder, export the lesson, the task, meta.json, get the
+metadata of every linked file... hundreds of round-trips for a 31-day
+course. `DrivePool` runs them in waves instead:
+
+- `map(fn, items)` runs `fn(drive, item)` for all items on a thread pool
+  (googleapiclient's httplib2 transport is not thread-safe, so every worker
+  thread builds its own client with `client_factory`);
+- `metadata(file_ids, fields)` gets files().get metadata through batch HTTP
+  requests, up to BATCH_LIMIT calls per round-trip;
+- every call goes through an AIMD throttle: rate-limit answers (429, 403
+  rateLimitExceeded / userRateLimitExceeded) and 5xx halve the number of
+  requests in flight and pause all workers for a truncated exponential
+  backoff with jitter; successes raise the limit back one step at a time.
+
+Do not call `map` / `metadata` from inside a function run by the pool.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Drive batch requests accept at most 100 calls
+BATCH_LIMIT = 100
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Rate limiting or a transient server / network error (googleapiclient HttpError or socket errors)."""
+    resp = getattr(exc, "resp", None)
+    status = getattr(resp, "status", None)
+    if status is None:
+        return isinstance(exc, (ConnectionError, TimeoutError))
+    status = int(status)
+    if status == 429 or status >= 500:
+        return True
+    if status == 403:
+        content = getattr(exc, "content", b"") or b""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        return "ratelimitexceeded" in content.lower()
+    return False
+
+
+def backoff_seconds(attempt: int) -> float:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) + random.uniform(0, BACKOFF_BASE_SECONDS)
+
+
+class _Throttle:
+    """Additive-increase / multiplicative-decrease limit of concurrent requests, with a shared pause."""
+
+    def __init__(self, limit: int):
+        self.max_limit = max(int(limit), 1)
+        self.limit = self.max_limit
+        self._active = 0
+        self._successes = 0
+        self._resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._resume_at - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self._active < self.limit:
+                    self._active += 1
+                    return
+                else:
+                    self._cond.wait()
+
+    def release(self, pause: float = 0.0):
+        """`pause` > 0: the request was throttled; back off for that long."""
+        with self._cond:
+            self._active -= 1
+            if pause > 0:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+                self._resume_at = max(self._resume_at, time.monotonic() + pause)
+            else:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class DrivePool:
+    def __init__(self, client_factory: Callable[[], Any], workers: int = 8, max_retries: int = MAX_RETRIES):
+        self._factory = client_factory
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="drive-sync")
+        self._throttle = _Throttle(workers)
+        self.max_retries = max_retries
+        self._stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "batches": 0, "batched_calls": 0, "retries": 0}
+
+    def __enter__(self) -> "DrivePool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def client(self):
+        """Drive client of the current thread."""
+        drive = getattr(self._local, "drive", None)
+        if drive is None:
+            drive = self._local.drive = self._factory()
+        return drive
+
+    def call(self, fn: Callable[..., Any], *args) -> Any:
+        """`fn(drive, *args)` with throttling and retries of rate-limit / transient errors."""
+        attempt = 0
+        while True:
+            self._throttle.acquire()
+            try:
+                result = fn(self.client(), *args)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._throttle.release()
+                    raise
+                pause = backoff_seconds(attempt)
+                self._throttle.release(pause)
+                attempt += 1
+                self._count("retries")
+                logger.warning(f"⏳ Drive API throttled/unavailable ({e}); retry {attempt}/{self.max_retries} in {pause:.1f}s")
+                continue
+            self._throttle.release()
+            self._count("calls")
+            return result
+
+    def map(self, fn: Callable[..., Any], items: Iterable[Any]) -> List[Any]:
+        """`fn(drive, item)` for every item, concurrently; a failed item's result is its exception."""
+
+        def run(item):
+            try:
+                return self.call(fn, item)
+            except Exception as e:
+                return e
+
+        return list(self._executor.map(run, list(items)))
+
+    def metadata(self, file_ids: Iterable[str], fields: str) -> Dict[str, Any]:
+        """file id -> files().get metadata (or the exception) for all ids, in batch HTTP requests."""
+        ids = list(dict.fromkeys(fid for fid in file_ids if fid))
+        if not ids:
+            return {}
+        if not hasattr(self.client(), "new_batch_http_request"):
+            # Client without batch support: one request per file, still concurrent
+            results = self.map(lambda drive, fid: drive.files().get(fileId=fid, fields=fields).execute(), ids)
+            return dict(zip(ids, results))
+
+        out: Dict[str, Any] = {}
+        pending = ids
+        attempt = 0
+        while pending:
+            chunks = [pending[i:i + BATCH_LIMIT] for i in range(0, len(pending), BATCH_LIMIT)]
+            retry: List[str] = []
+            results = self.map(lambda drive, chunk: self._batch_get(drive, chunk, fields), chunks)
+            for chunk, chunk_result in zip(chunks, results):
+                if isinstance(chunk_result, Exception):
+                    # The whole batch failed: every file of it gets the error
+                    chunk_result = dict.fromkeys(chunk, chunk_result)
+                for fid, value in chunk_result.items():
+                    if isinstance(value, Exception) and is_retryable(value) and attempt < self.max_retries:
+                        retry.append(fid)
+                    else:
+                        out[fid] = value
+            if retry:
+                pause = backoff_seconds(attempt)
+                attempt += 1
+                self._count("retries", len(retry))
+                logger.warning(f"⏳ {len(retry)} Drive metadata requests throttled; retry {attempt}/{self.max_retries} in {pause:.1f}s")
+                self._throttle.acquire()
+                self._throttle.release(pause)
+            pending = retry
+        return out
+
+    def _batch_get(self, drive, file_ids: List[str], fields: str) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+
+        def callback(request_id: str, response: Optional[Dict[str, Any]], exception: Optional[Exception]):
+            results[request_id] = exception if exception is not None else response
+
+        batch = drive.new_batch_http_request(callback=callback)
+        for fid in file_ids:
+            batch.add(drive.files().get(fileId=fid, fields=fields), request_id=fid)
+        batch.execute()
+        self._count("batches")
+        self._count("batched_calls", len(file_ids))
+        return results
@@ -0,0 +1,143 @@
+"""
+Export service: users, payments, questions and activity as gzip-compressed CSV / JSONL.
+
+Raw activity rows are kept for Config.STATS_RAW_RETENTION_DAYS only (see
+Database.compact_statistics), so the "activity" export covers that window and
+says so in its file name; "activity_daily" exports the per-user, per-day
+rollup (user_activity_daily), which keeps the whole history.
+
+Rows are streamed in keyset-paginated chunks (`WHERE pk > ? ORDER BY pk LIMIT n`):
+every chunk is a short statement, so exporting millions of activity rows
+neither holds a read lock for minutes (the other bots keep writing) nor keeps
+more than one chunk in memory. Compression and file writes run in a worker
+thread, so the event loop only waits for SQLite.
+
+Used by the admin bot (/export) and by scripts/export_data.py.
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, List, Optional
+
+from core.config import Config
+from core.database import Database
+
+# dataset -> (table, primary key columns used for keyset pagination)
+EXPORT_DATASETS = {
+    "users": ("users", ("user_id",)),
+    "payments": ("payment_events", ("event_id",)),
+    "questions": ("questions", ("question_id",)),
+    "activity": ("user_activity", ("activity_id",)),
+    "activity_daily": ("user_activity_daily", ("user_id", "day", "bot_type", "section", "action_type")),
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+# Datasets whose raw rows are compacted after Config.STATS_RAW_RETENTION_DAYS, and their full-history rollup
+RETAINED_DATASETS = {"activity": "activity_daily"}
+
+
+class _GzipRowWriter:
+    """Writes row chunks as CSV (with header) or JSONL into a gzip stream. Not async: call from a thread."""
+
+    def __init__(self, out: BinaryIO, fmt: str):
+        self.fmt = fmt
+        self._gzip = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6)
+        # utf-8-sig: Excel opens Cyrillic CSV correctly only with a BOM
+        encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+        self._text = io.TextIOWrapper(self._gzip, encoding=encoding, newline="")
+        self._csv = csv.writer(self._text) if fmt == "csv" else None
+        self._header_written = False
+
+    def write(self, columns: List[str], rows: List[tuple]):
+        if self._csv is not None:
+            if not self._header_written:
+                self._csv.writerow(columns)
+                self._header_written = True
+            self._csv.writerows(rows)
+        else:
+            self._text.write(
+                "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n" for row in rows)
+            )
+
+    def close(self):
+        # Closes the gzip member (writes the trailer) but not the underlying file
+        self._text.close()
+
+
+class ExportService:
+    """Streaming export of database tables."""
+
+    def __init__(self, db: Database, chunk_size: int = 2000):
+        self.db = db
+        self.chunk_size = chunk_size
+
+    async def iter_chunks(self, dataset: str) -> AsyncIterator[tuple[List[str], List[tuple]]]:
+        """Yield (columns, rows) chunks of a dataset in primary key order."""
+        if dataset not in EXPORT_DATASETS:
+            raise ValueError(f"Unknown dataset: {dataset}")
+        table, pk = EXPORT_DATASETS[dataset]
+        order = ", ".join(pk)
+        await self.db._ensure_connection()
+        last_key: Optional[tuple] = None
+        while True:
+            if last_key is None:
+                sql, params = f"SELECT * FROM {table} ORDER BY {order} LIMIT ?", (self.chunk_size,)
+            else:
+                # Row-value comparison: keyset pagination over a composite primary key too
+                placeholders = ", ".join("?" * len(pk))
+                sql = f"SELECT * FROM {table} WHERE ({order}) > ({placeholders}) ORDER BY {order} LIMIT ?"
+                params = (*last_key, self.chunk_size)
+            async with self.db.conn.execute(sql, params) as cursor:
+                columns = [d[0] for d in cursor.description]
+                rows = await cursor.fetchall()
+            if not rows:
+                if last_key is None:
+                    yield columns, []  # empty table: CSV still gets its header
+                return
+            last_key = tuple(rows[-1][column] for column in pk)
+            yield columns, [tuple(row) for row in rows]
+            if len(rows) < self.chunk_size:
+                return
+
+    async def export(self, dataset: str, fmt: str, out: BinaryIO) -> int:
+        """Write `dataset` to the binary stream `out` as gzip-compressed `fmt`. Returns the row count."""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format: {fmt}")
+        writer = _GzipRowWriter(out, fmt)
+        count = 0
+        try:
+            async for columns, rows in self.iter_chunks(dataset):
+                await asyncio.to_thread(writer.write, columns, rows)
+                count += len(rows)
+        finally:
+            await asyncio.to_thread(writer.close)
+        return count
+
+    async def export_to_tempfile(self, dataset: str, fmt: str) -> tuple[Path, int]:
+        """Export into a temporary file (caller deletes it). Returns (path, row count)."""
+        handle = tempfile.NamedTemporaryFile(prefix=f"export_{dataset}_", suffix=f".{fmt}.gz", delete=False)
+        path = Path(handle.name)
+        try:
+            with handle:
+                count = await self.export(dataset, fmt, handle)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return path, count
+
+    @staticmethod
+    def retention_days(dataset: str) -> Optional[int]:
+        """Days of raw rows a dataset covers, or None if it has the whole history."""
+        days = int(Config.STATS_RAW_RETENTION_DAYS or 0)
+        return days if dataset in RETAINED_DATASETS and days > 0 else None
+
+    @staticmethod
+    def filename(dataset: str, fmt: str) -> str:
+        days = ExportService.retention_days(dataset)
+        window = f"_last{days}d" if days else ""
+        return f"{dataset}{window}_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}.gz"
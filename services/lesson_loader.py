@@ -3,16 +3,93 @@
 
 Загружает структуру уроков из data/lessons.json и предоставляет
 интерфейс для доступа к урокам.
+
+Обновление контента (Drive sync, откат из бэкапа) публикует новый lessons.json
+атомарным rename. Загрузчики процесса регистрируются в `_loaders`:
+`refresh_all()` перечитывает файл в потоке (один разбор на файл для всех
+загрузчиков) и подменяет кэш одним присваиванием, поэтому обработчик видит
+либо старые уроки целиком, либо новые. `watch()` делает то же по изменению
+файла — так новые уроки подхватывают и другие процессы (WORKER_PROCESSES > 1).
+
+Код доставки, которому урок кажется устаревшим (пустой кэш, у дня нет
+media_markers), вызывает `refresh()`: одно перечитывание на файл для всех
+одновременных вызовов, не чаще REFRESH_MIN_INTERVAL_SECONDS, и только если
+файл изменился. `get_lesson_with()` к тому же запоминает до следующей
+перезагрузки, что у дня такого ключа действительно нет, — рассылка урока
+N пользователям приводит максимум к одному разбору файла, а не к N.
 """
 
+import asyncio
 import json
 import logging
+import os
+import re
+import time
+import weakref
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from core.models import Lesson, Tariff
 
 logger = logging.getLogger(__name__)
 
+# Все загрузчики процесса (CourseBot, SalesBot, LessonService...), для refresh_all()
+_loaders: "weakref.WeakSet[LessonLoader]" = weakref.WeakSet()
+
+# refresh() из кода доставки: не чаще одной проверки файла за этот интервал
+REFRESH_MIN_INTERVAL_SECONDS = 5.0
+# Файл уроков -> идущее перечитывание / время последней проверки (общие для всех загрузчиков файла)
+_refreshing: Dict[str, "asyncio.Task[bool]"] = {}
+_last_refresh: Dict[str, float] = {}
+
+
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+def _loads_by_day(text: str) -> Any:
+    """
+    json.loads, but a top-level object is decoded one value (day) per decoder call.
+
+    The C decoder holds the GIL for a whole call, so parsing a multi-megabyte
+    lessons.json in one call from a thread would still stall the event loop for
+    the entire parse; between per-day calls the interpreter can switch back to it.
+    """
+    decoder = json.JSONDecoder()
+    idx = _WS.match(text, 0).end()
+    if not text.startswith("{", idx):
+        return json.loads(text)
+    result: Dict[str, Any] = {}
+    idx = _WS.match(text, idx + 1).end()
+    if text.startswith("}", idx):
+        idx += 1
+    else:
+        while True:
+            if not text.startswith('"', idx):
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, idx)
+            key, idx = json.decoder.scanstring(text, idx + 1)
+            idx = _WS.match(text, idx).end()
+            if not text.startswith(":", idx):
+                raise json.JSONDecodeError("Expecting ':' delimiter", text, idx)
+            result[key], idx = decoder.raw_decode(text, _WS.match(text, idx + 1).end())
+            idx = _WS.match(text, idx).end()
+            if text.startswith("}", idx):
+                idx += 1
+                break
+            if not text.startswith(",", idx):
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, idx)
+            idx = _WS.match(text, idx + 1).end()
+    if _WS.match(text, idx).end() != len(text):
+        raise json.JSONDecodeError("Extra data", text, idx)
+    return result
+
+
+def _file_signature(path: Path) -> Optional[Tuple[int, int, int]]:
+    """(inode, size, mtime_ns): меняется при каждой публикации через os.replace."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
 
 class LessonLoader:
     """Загрузчик уроков из JSON файла."""
@@ -34,7 +111,11 @@ class LessonLoader:
             lessons_file = project_root / "data" / "lessons.json"
         self.lessons_file = Path(lessons_file)
         self._lessons_cache: Optional[Dict[str, Any]] = None
+        self._signature: Optional[Tuple[int, int, int]] = None
+        # (день, ключ), которых нет в текущей версии уроков и после refresh(); сбрасывается в _swap
+        self._checked_missing: set = set()
         self._load_lessons()
+        _loaders.add(self)
     
     def _load_lessons(self):
         """Загружает уроки из JSON файла."""
@@ -77,19 +158,92 @@ class LessonLoader:
                 return
         
         try:
-            with open(self.lessons_file, "r", encoding="utf-8") as f:
-                self._lessons_cache = json.load(f)
-            logger.info(f"✅ Загружено {len(self._lessons_cache)} уроков из {self.lessons_file.absolute()}")
-            if self._lessons_cache:
-                available_days = sorted([int(k) for k in self._lessons_cache.keys() if k.isdigit()])
-                logger.info(f"   Доступные дни: {available_days[:20]}...")
+            lessons, signature = self._read()
         except Exception as e:
             logger.error(f"❌ Ошибка при загрузке уроков: {e}", exc_info=True)
-            self._lessons_cache = {}
+            # Битый файл не должен оставить бота без уроков: оставляем загруженные ранее
+            if self._lessons_cache is None:
+                self._lessons_cache = {}
+            return
+        self._swap(lessons, signature)
+
+    def _read(self) -> Tuple[Dict[str, Any], Optional[Tuple[int, int, int]]]:
+        """Читает и разбирает файл уроков (без изменения кэша; можно вызывать из потока)."""
+        signature = _file_signature(self.lessons_file)
+        with open(self.lessons_file, "r", encoding="utf-8") as f:
+            lessons = _loads_by_day(f.read())
+        if not isinstance(lessons, dict):
+            raise ValueError(f"{self.lessons_file}: expected a JSON object, got {type(lessons).__name__}")
+        return lessons, signature
+
+    def _swap(self, lessons: Dict[str, Any], signature: Optional[Tuple[int, int, int]]):
+        # Одно присваивание: обработчики видят либо старый словарь уроков, либо новый
+        self._lessons_cache = lessons
+        self._signature = signature
+        self._checked_missing = set()
+        logger.info(f"✅ Загружено {len(lessons)} уроков из {self.lessons_file.absolute()}")
+        if lessons:
+            available_days = sorted([int(k) for k in lessons.keys() if k.isdigit()])
+            logger.info(f"   Доступные дни: {available_days[:20]}...")
     
     def reload(self):
-        """Перезагружает уроки из файла."""
+        """Перезагружает уроки из файла (синхронно; в обработчиках используйте reload_async)."""
         self._load_lessons()
+
+    def is_stale(self) -> bool:
+        """Файл уроков изменился с последней загрузки."""
+        return _file_signature(self.lessons_file) != self._signature
+
+    async def reload_async(self, force: bool = True) -> bool:
+        """
+        Перечитывает уроки в потоке и подменяет кэш на event loop.
+        force=False: только если файл изменился. Возвращает True, если кэш обновлен.
+        """
+        if not force and not self.is_stale():
+            return False
+        try:
+            lessons, signature = await asyncio.to_thread(self._read)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при перезагрузке уроков (оставлены прежние): {e}", exc_info=True)
+            return False
+        self._swap(lessons, signature)
+        return True
+    
+    async def refresh(self) -> bool:
+        """
+        Перечитывание по запросу кода доставки: одно на файл для всех одновременных
+        вызовов и не чаще REFRESH_MIN_INTERVAL_SECONDS; файл разбирается, только если
+        он изменился (или уроки не загружены). Возвращает True, если кэш обновлен.
+        """
+        key = str(self.lessons_file.absolute())
+        task = _refreshing.get(key)
+        if task is None:
+            now = time.monotonic()
+            if now - _last_refresh.get(key, float("-inf")) < REFRESH_MIN_INTERVAL_SECONDS:
+                return False
+            _last_refresh[key] = now
+            task = asyncio.ensure_future(_refresh_file(key, force=not self._lessons_cache))
+            _refreshing[key] = task
+            task.add_done_callback(lambda _t: _refreshing.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def get_lesson_with(self, day: int, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Урок, у которого ожидается ключ `key` (например, media_markers). Если ключа нет,
+        один раз на версию уроков пробует refresh(); отсутствие ключа запоминается до
+        следующей перезагрузки, только если загруженные уроки совпадают с файлом.
+        """
+        lesson = self.get_lesson(day)
+        if lesson is not None and key in lesson:
+            return lesson
+        if (day, key) in self._checked_missing:
+            return lesson
+        if await self.refresh():
+            lesson = self.get_lesson(day)
+        # refresh(), ограниченный по частоте, файл не проверял: тогда сверяем подпись файла
+        if (lesson is None or key not in lesson) and not self.is_stale():
+            self._checked_missing.add((day, key))
+        return lesson
     
     def get_lesson(self, day: int) -> Optional[Dict[str, Any]]:
         """
@@ -218,3 +372,54 @@ class LessonLoader:
             assignment_text=lesson_data.get("task", ""),
             created_at=datetime.utcnow(),
         )
+
+
+async def _reload_group(path: str, loaders: List[LessonLoader]) -> bool:
+    """Один разбор файла в потоке, затем подмена кэша у всех его загрузчиков."""
+    try:
+        lessons, signature = await asyncio.to_thread(loaders[0]._read)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при перезагрузке уроков из {path} (оставлены прежние): {e}", exc_info=True)
+        return False
+    for loader in loaders:
+        loader._swap(lessons, signature)
+    return True
+
+
+async def _refresh_file(path: str, force: bool) -> bool:
+    """Загрузчики файла `path`, чей файл изменился (force: все), перечитываются одним разбором."""
+    loaders = [
+        loader for loader in list(_loaders)
+        if str(loader.lessons_file.absolute()) == path and (force or loader.is_stale())
+    ]
+    return bool(loaders) and await _reload_group(path, loaders)
+
+
+async def refresh_all(force: bool = False) -> int:
+    """
+    Перезагружает загрузчики процесса (force=False: только те, чей файл изменился).
+    Файл разбирается в потоке один раз для всех загрузчиков, читающих его.
+    """
+    groups: Dict[str, List[LessonLoader]] = {}
+    for loader in list(_loaders):
+        if force or loader.is_stale():
+            groups.setdefault(str(loader.lessons_file.absolute()), []).append(loader)
+    refreshed = 0
+    for path, loaders in groups.items():
+        if await _reload_group(path, loaders):
+            refreshed += len(loaders)
+    if refreshed:
+        logger.info(f"🔄 Lessons reloaded in {refreshed} loader(s)")
+    return refreshed
+
+
+async def watch(interval_seconds: float):
+    """Подхватывает lessons.json, опубликованный другим процессом (проверка stat раз в interval_seconds)."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await refresh_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Lessons watch failed: {e}", exc_info=True)
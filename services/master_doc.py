@@ -0,0 +1,330 @@
+"""
+Single-pass parser of the Drive master document (DRIVE_MASTER_DOC_ID mode).
+
+Two compiled patterns, one for line tokens and one for Drive links, walk the
+plain-text export once and are merged into one stream, in document order, of
+day headers, section headers (Задание / Intro / Обо мне), title lines, post
+markers ([POST], [БЛОК], ...) and links. The text
+itself is never split into lines: every section is assembled from slices of
+the document, with the positions of its links and post markers already
+translated into section offsets, so link replacement is one join per
+section (`render`) and the post split needs no second scan.
+
+The format is the one documented in DriveContentSync._split_master_doc.
+"""
+
+from __future__ import annotations
+
+import itertools
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAX_DAY = 30
+# The title is looked for in the first lines of a day block
+TITLE_LINES = 10
+
+SECTIONS = ("lesson", "task", "intro_text", "about_me_text")
+
+_WS = r"[^\S\n]"  # whitespace within a line
+
+_DRIVE_ID = r"([a-zA-Z0-9_-]{10,})"
+# Drive URL forms; the whole match (with /view?usp=... etc.) is what gets replaced
+_LINK_ALTERNATIVES = (
+    (r"https?://drive\.google\.com/drive/folders/" + _DRIVE_ID + r"(?:/[^?\s]*)?(?:\?[^\s]*)?", True),
+    (r"https?://drive\.google\.com/file/d/" + _DRIVE_ID + r"(?:/[^?\s]*)?(?:\?[^\s]*)?", False),
+    (r"https?://drive\.google\.com/open\?id=" + _DRIVE_ID + r"(?:&[^\s]*)?", False),
+    (r"https?://drive\.google\.com/uc\?id=" + _DRIVE_ID + r"(?:&[^\s]*)?", False),
+    (r"https?://docs\.google\.com/document/d/" + _DRIVE_ID + r"(?:/[^\s]*)?", False),
+)
+LINK_RE = re.compile("|".join(p for p, _ in _LINK_ALTERNATIVES))
+# Index of the id group of every alternative -> is_folder
+_LINK_GROUPS = tuple((i + 1, is_folder) for i, (_, is_folder) in enumerate(_LINK_ALTERNATIVES))
+
+_POST_MARKER = rf"{_WS}*(?i:\[(?:POST\d*|ДОПОЛНЕНИЕ\d*|BLOCK|БЛОК)\]){_WS}*$"
+POST_MARKER_RE = re.compile(rf"^{_POST_MARKER}", re.MULTILINE)
+
+# Line tokens; the group that matched names the token (the title line is only looked at)
+_LINE_TOKENS = "|".join((
+    rf"{_WS}*(?i:День|Day){_WS}+(?P<day>\d{{1,2}}){_WS}*(?::{_WS}*(?P<day_title>.*))?$",
+    rf"{_WS}*(?i:Задание|Task){_WS}*:{_WS}*(?P<task>)",
+    rf"{_WS}*(?i:Intro|Введение|Вводный текст){_WS}*:{_WS}*(?P<intro_text>)",
+    rf"{_WS}*(?i:Обо мне|About me|About_me){_WS}*:{_WS}*(?P<about_me_text>)",
+    rf"(?P<post>{_POST_MARKER})",
+    rf"(?={_WS}*(?i:Заголовок|Title){_WS}*:{_WS}*(?P<title>.+))",
+))
+# The first line, and every other line through its leading "\n": a literal prefix
+# lets the regex engine jump from line to line instead of trying each position
+_FIRST_LINE_RE = re.compile(rf"(?:{_LINE_TOKENS})", re.MULTILINE)
+_NEXT_LINE_RE = re.compile(rf"\n(?:{_LINE_TOKENS})", re.MULTILINE)
+
+# str.splitlines() boundaries other than "\n"
+_OTHER_LINE_BREAKS_RE = re.compile("[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+@dataclass
+class Link:
+    url: str
+    file_id: str
+    is_folder: bool
+    start: int
+    end: int
+
+    def as_dict(self) -> Dict[str, object]:
+        """Shape of DriveContentSync._find_drive_links_with_positions."""
+        return {
+            "url": self.url,
+            "file_id": self.file_id,
+            "folder_id": self.file_id if self.is_folder else None,
+            "is_folder": self.is_folder,
+            "start": self.start,
+            "end": self.end,
+        }
+
+
+def _link(match: re.Match, delta: int = 0) -> Link:
+    for index, is_folder in _LINK_GROUPS:
+        file_id = match.group(index)
+        if file_id is not None:
+            break
+    start = match.start() + delta
+    return Link(match.group(0), file_id, is_folder, start, start + len(match.group(0)))
+
+
+def find_links(text: str) -> List[Link]:
+    """All Drive links of `text` in order (repeated URLs included: each occurrence is replaced)."""
+    return [_link(m) for m in LINK_RE.finditer(text or "")]
+
+
+def post_breaks(text: str) -> List[Tuple[int, int]]:
+    """Spans of the post marker lines of `text`."""
+    return [m.span() for m in POST_MARKER_RE.finditer(text or "")]
+
+
+def render(
+    text: str, links: List[Link], replacements: Dict[str, Optional[str]], breaks: List[Tuple[int, int]] = (),
+) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    `text` with every link whose URL has a replacement substituted, in one join;
+    `breaks` (post marker spans) are moved to the new offsets.
+    """
+    parts: List[str] = []
+    pos = 0
+    shifts: List[Tuple[int, int]] = []  # (old end of a replaced link, total delta after it)
+    delta = 0
+    for link in links:
+        new = replacements.get(link.url)
+        if new is None:
+            continue
+        parts.append(text[pos:link.start])
+        parts.append(new)
+        pos = link.end
+        delta += len(new) - (link.end - link.start)
+        shifts.append((link.end, delta))
+    if not parts:
+        return text, list(breaks)
+    parts.append(text[pos:])
+
+    moved = []
+    i, current = 0, 0
+    for start, end in breaks:
+        while i < len(shifts) and shifts[i][0] <= start:
+            current = shifts[i][1]
+            i += 1
+        moved.append((start + current, end + current))
+    return "".join(parts), moved
+
+
+class _Section:
+    __slots__ = ("pieces", "length", "links", "breaks")
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.length = 0
+        self.links: List[Link] = []
+        self.breaks: List[Tuple[int, int]] = []
+
+    def next_offset(self) -> int:
+        """Offset of the next piece (after the joining newline)."""
+        return self.length + 1 if self.pieces else 0
+
+    def add(self, piece: str):
+        self.length = self.next_offset() + len(piece)
+        self.pieces.append(piece)
+
+
+@dataclass
+class MasterDocDay:
+    day: int
+    title: str = ""
+    sections: Dict[str, str] = field(default_factory=dict)
+    links: Dict[str, List[Link]] = field(default_factory=dict)
+    # Post marker spans in sections["lesson"]
+    breaks: List[Tuple[int, int]] = field(default_factory=list)
+
+    def all_links(self) -> Iterator[Tuple[str, Link]]:
+        for name in SECTIONS:
+            for link in self.links.get(name, ()):
+                yield name, link
+
+
+class _DayState:
+    __slots__ = ("day", "sections", "current", "lines", "title", "has_header")
+
+    def __init__(self, day: int):
+        self.day = day
+        self.sections = {name: _Section() for name in SECTIONS}
+        self.current = "lesson"
+        self.lines = 0  # lines of the block so far (day header lines are not part of it)
+        self.title: Optional[str] = None
+        self.has_header = False  # a section header line: the block is not blank even if the sections are
+
+    def add_line(self, line: str, links: List[Link]):
+        """A line that is not a slice of the document (title hint, text after a section header)."""
+        section = self.sections[self.current]
+        offset = section.next_offset()
+        section.links.extend(Link(l.url, l.file_id, l.is_folder, l.start + offset, l.end + offset) for l in links)
+        section.add(line)
+
+
+def _tokens(text: str) -> Iterator[Tuple[str, int, int, re.Match]]:
+    """(kind, start, end, match) in document order; line tokens start at their line start."""
+    links = LINK_RE.finditer(text)
+    link = next(links, None)
+    first = _FIRST_LINE_RE.match(text)
+    line_tokens = _NEXT_LINE_RE.finditer(text)
+    if first is not None:
+        line_tokens = itertools.chain(((first, 0),), ((m, 1) for m in line_tokens))
+    else:
+        line_tokens = ((m, 1) for m in line_tokens)
+    for m, skip in line_tokens:
+        start = m.start() + skip
+        while link is not None and link.start() < start:
+            yield "link", link.start(), link.end(), link
+            link = next(links, None)
+        kind = m.lastgroup
+        if kind == "day_title":
+            kind = "day"
+        yield kind, start, m.end(), m
+        if kind == "day":
+            # Links of a day header line are handled with the header
+            while link is not None and link.start() < m.end():
+                link = next(links, None)
+    while link is not None:
+        yield "link", link.start(), link.end(), link
+        link = next(links, None)
+
+
+def parse(text: str) -> Dict[int, MasterDocDay]:
+    """Days of the master document (plain-text export), by day number."""
+    text = text or ""
+    if _OTHER_LINE_BREAKS_RE.search(text):
+        text = "\n".join(text.splitlines())
+    size = len(text)
+
+    days: Dict[int, _DayState] = {}
+    cur: Optional[_DayState] = None
+    run_start = 0  # start of the run of plain lines of the current section
+    run_offset = 0  # its offset in the section
+    head_start, head_end, head_offset = 0, 0, 0  # text after the last section header (same line)
+
+    def close_run(line_start: int):
+        """Lines [run_start, line_start) go to the current section."""
+        if line_start > run_start:
+            piece = text[run_start:line_start - 1]
+            cur.sections[cur.current].add(piece)
+            cur.lines += piece.count("\n") + 1
+
+    def open_run(line_end: int):
+        nonlocal run_start, run_offset
+        run_start = line_end + 1 if line_end < size else size + 1
+        run_offset = cur.sections[cur.current].next_offset()
+
+    for kind, start, end, m in _tokens(text):
+        if kind == "link":
+            if cur is None:
+                continue
+            if start < head_end:
+                # Inside the text after a section header
+                link = _link(m, head_offset - head_start)
+            else:
+                link = _link(m, run_offset - run_start)
+            cur.sections[cur.current].links.append(link)
+            continue
+
+        if kind == "day":
+            day = int(m.group("day"))
+            if day > MAX_DAY:
+                # Not a header: an ordinary line (its links were skipped with the token)
+                if cur is not None:
+                    cur.sections[cur.current].links.extend(
+                        _link(l, run_offset - run_start) for l in LINK_RE.finditer(text, start, end)
+                    )
+                continue
+            if cur is not None:
+                close_run(start)
+            cur = days.get(day)
+            if cur is None:
+                cur = days[day] = _DayState(day)
+            title_hint = (m.group("day_title") or "").strip()
+            if title_hint:
+                line = f"Заголовок: {title_hint}"
+                hint_offset = len(line) - len(title_hint)
+                if cur.title is None and cur.lines < TITLE_LINES:
+                    cur.title = title_hint
+                cur.add_line(line, [_link(l, hint_offset) for l in LINK_RE.finditer(title_hint)])
+                cur.lines += 1
+            open_run(end)
+            continue
+
+        if cur is None:
+            continue
+
+        if kind == "title":
+            if cur.title is None:
+                line_no = cur.lines + text.count("\n", run_start, start)
+                if line_no < TITLE_LINES:
+                    cur.title = m.group("title").strip()
+            continue
+
+        if kind == "post":
+            if cur.current == "lesson":
+                offset = run_offset - run_start
+                cur.sections["lesson"].breaks.append((start + offset, end + offset))
+            continue
+
+        # Section header: the rest of its line (if any) is the first line of the section
+        close_run(start)
+        cur.current = kind
+        cur.lines += 1
+        cur.has_header = True
+        line_end = text.find("\n", end)
+        if line_end < 0:
+            line_end = size
+        rest = text[end:line_end].rstrip()
+        head_start, head_end = end, end + len(rest)
+        head_offset = cur.sections[kind].next_offset()
+        if rest:
+            cur.sections[kind].add(rest)
+        open_run(line_end)
+
+    if cur is not None and run_start < size:
+        piece = text[run_start:]
+        if piece.endswith("\n"):
+            piece = piece[:-1]
+        cur.sections[cur.current].add(piece)
+
+    out: Dict[int, MasterDocDay] = {}
+    for day, state in days.items():
+        sections = {name: "\n".join(s.pieces).rstrip() for name, s in state.sections.items()}
+        if not state.has_header and not any(s.strip() for s in sections.values()):
+            continue
+        out[day] = MasterDocDay(
+            day=day,
+            title=state.title or "",
+            sections=sections,
+            links={name: s.links for name, s in state.sections.items()},
+            # The lesson is rstripped: a trailing marker line may have lost its trailing spaces
+            breaks=[(a, min(b, len(sections["lesson"]))) for a, b in state.sections["lesson"].breaks],
+        )
+    return out
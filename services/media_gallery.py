@@ -0,0 +1,200 @@
+"""
+Photo decks of a lesson (lesson 21 cards, lesson 19 emotional levels) sent as
+Telegram media groups.
+
+A deck is resolved once per lessons.json version: items sorted by number,
+duplicates (same file_id or path) dropped and the rest pre-chunked into groups
+of MEDIA_GROUP_LIMIT. Every photo has a `media_file_ids` marker
+("gallery:<md5 of the file>", or the path before the first sync prepared it),
+so the Telegram file_id of the first upload is reused by every later user and
+by every worker process: after that a deck is sent with file_ids only.
+
+Groups are sent one after another (Telegram shows them in request order)
+without fixed pauses; new file_ids are saved in the background while the next
+group is being sent, and flood control (retry_after) is waited out.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import FSInputFile, InputMediaPhoto
+
+from services import media_variants
+
+logger = logging.getLogger(__name__)
+
+# Telegram: 2-10 items per media group
+MEDIA_GROUP_LIMIT = 10
+MARKER_PREFIX = "gallery:"
+# Re-read the file_ids of a lesson (uploaded by other workers) at most this often
+FILE_IDS_REFRESH_SECONDS = 60.0
+
+
+@dataclass(frozen=True)
+class DeckPhoto:
+    number: Any
+    path: str
+    marker: str
+    # file_id recorded in lessons.json (may belong to another bot token)
+    lesson_file_id: Optional[str]
+
+
+def _photo(item: Dict[str, Any]) -> DeckPhoto:
+    path = str(item.get("path") or "").replace("\\", "/")
+    key = (media_variants.content_id(path) if path else None) or path or str(item.get("file_id") or "")
+    return DeckPhoto(item.get("number", 0), path, MARKER_PREFIX + key, item.get("file_id") or None)
+
+
+def build_deck(items: List[Dict[str, Any]]) -> List[List[DeckPhoto]]:
+    """Deck items sorted by number, without duplicates, chunked into media groups."""
+    seen = set()
+    photos = []
+    for item in sorted(items, key=lambda x: x.get("number", 0)):
+        photo = _photo(item)
+        keys = {k for k in (photo.lesson_file_id, photo.path, photo.marker) if k and k != MARKER_PREFIX}
+        if not keys or keys & seen:
+            continue
+        seen |= keys
+        photos.append(photo)
+    return [photos[i:i + MEDIA_GROUP_LIMIT] for i in range(0, len(photos), MEDIA_GROUP_LIMIT)]
+
+
+async def _call(request):
+    """Bot API call, retried once after Telegram's flood-control pause."""
+    try:
+        return await request()
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(float(e.retry_after or 1))
+        return await request()
+
+
+class MediaGallery:
+    """Sends photo decks of lessons with cached Telegram file_ids."""
+
+    def __init__(self, db):
+        self.db = db
+        # (day, deck name) -> (the lessons.json list it was built from, chunks)
+        self._decks: Dict[Tuple[int, str], Tuple[list, List[List[DeckPhoto]]]] = {}
+        # day -> marker -> Telegram file_id, and when it was read from the database
+        self._file_ids: Dict[int, Dict[str, str]] = {}
+        self._file_ids_loaded: Dict[int, float] = {}
+
+    def deck(self, day: int, name: str, items: List[Dict[str, Any]]) -> List[List[DeckPhoto]]:
+        """Chunks of a deck, rebuilt only when the lessons were reloaded."""
+        cached = self._decks.get((day, name))
+        if cached is None or cached[0] is not items:
+            cached = (items, build_deck(items))
+            self._decks[(day, name)] = cached
+        return cached[1]
+
+    async def _cached_ids(self, day: int, photos: List[DeckPhoto]) -> Dict[str, str]:
+        ids = self._file_ids.get(day)
+        stale = time.monotonic() - self._file_ids_loaded.get(day, float("-inf")) > FILE_IDS_REFRESH_SECONDS
+        if ids is None or (stale and any(p.marker not in ids for p in photos)):
+            try:
+                loaded = await self.db.get_media_file_ids(day, MARKER_PREFIX)
+            except Exception as e:
+                logger.warning(f"⚠️ Cached file_ids of lesson {day} not loaded: {e}")
+                loaded = {}
+            ids = {**(ids or {}), **loaded}
+            self._file_ids[day] = ids
+            self._file_ids_loaded[day] = time.monotonic()
+        return ids
+
+    @staticmethod
+    def _media(photo: DeckPhoto, ids: Dict[str, str], upload: bool):
+        """file_id to reuse, or the file to upload (prepared variant), or None if there is neither."""
+        if not upload or not photo.path:
+            file_id = ids.get(photo.marker) or photo.lesson_file_id
+            if file_id:
+                return file_id
+        path = media_variants.resolve(photo.path) if photo.path else None
+        return FSInputFile(path) if path else None
+
+    async def _send_group(self, bot, user_id: int, photos: List[DeckPhoto], ids: Dict[str, str], upload: bool,
+                          protect_content: bool) -> Tuple[int, Dict[str, str]]:
+        """Send one group; returns (photos sent, file_ids of the uploaded ones)."""
+        items = []
+        for photo in photos:
+            media = self._media(photo, ids, upload)
+            if media is None:
+                logger.warning(f"   ⚠️ Файл не найден: {photo.path or photo.number}")
+                continue
+            items.append((photo, media))
+        if not items:
+            return 0, {}
+        if len(items) == 1:
+            message = await _call(lambda: bot.send_photo(user_id, items[0][1], protect_content=protect_content))
+            messages = [message]
+        else:
+            group = [InputMediaPhoto(media=media) for _, media in items]
+            messages = await _call(lambda: bot.send_media_group(user_id, group, protect_content=protect_content))
+        uploaded = {}
+        for (photo, media), message in zip(items, messages):
+            if not isinstance(media, str) and getattr(message, "photo", None):
+                uploaded[photo.marker] = message.photo[-1].file_id
+        return len(items), uploaded
+
+    async def _send_chunk(self, bot, user_id: int, photos: List[DeckPhoto], ids: Dict[str, str],
+                          protect_content: bool) -> Tuple[int, Dict[str, str]]:
+        reuses_ids = any(ids.get(photo.marker) or photo.lesson_file_id for photo in photos)
+        try:
+            return await self._send_group(bot, user_id, photos, ids, False, protect_content)
+        except TelegramAPIError as e:
+            if not (reuses_ids and isinstance(e, TelegramBadRequest)):
+                logger.error(f"   ❌ Media group failed ({e}), sending the photos one by one")
+            else:
+                # A stale file_id fails the whole group: upload the files once, their new ids replace it
+                logger.warning(f"   ⚠️ Media group with cached file_ids rejected ({e}), uploading the files")
+                for photo in photos:
+                    ids.pop(photo.marker, None)
+                try:
+                    return await self._send_group(bot, user_id, photos, ids, True, protect_content)
+                except TelegramAPIError as upload_error:
+                    logger.error(f"   ❌ Media group failed ({upload_error}), sending the photos one by one")
+        sent, uploaded = 0, {}
+        for photo in photos:
+            try:
+                count, new_ids = await self._send_group(bot, user_id, [photo], ids, True, protect_content)
+            except TelegramAPIError as single_error:
+                logger.error(f"   ❌ Ошибка при отправке изображения {photo.number}: {single_error}")
+                continue
+            sent += count
+            uploaded.update(new_ids)
+        return sent, uploaded
+
+    async def _send_chunks(self, bot, user_id: int, day: int, chunks: List[List[DeckPhoto]],
+                           protect_content: bool) -> Tuple[int, int]:
+        total = sum(len(chunk) for chunk in chunks)
+        ids = await self._cached_ids(day, [photo for chunk in chunks for photo in chunk])
+        sent = 0
+        saves = []
+        for chunk in chunks:
+            count, uploaded = await self._send_chunk(bot, user_id, chunk, ids, protect_content)
+            sent += count
+            if uploaded:
+                ids.update(uploaded)
+                saves.append(asyncio.create_task(self.db.save_media_file_ids(day, "photo", uploaded)))
+        for result in await asyncio.gather(*saves, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.warning(f"⚠️ file_ids of lesson {day} not saved: {result}")
+        return sent, total
+
+    async def send(self, bot, user_id: int, day: int, name: str, items: List[Dict[str, Any]],
+                   protect_content: bool = True) -> Tuple[int, int]:
+        """Send a deck of lesson `day` as media groups; returns (photos sent, photos in the deck)."""
+        chunks = self.deck(day, name, items)
+        sent, total = await self._send_chunks(bot, user_id, day, chunks, protect_content)
+        logger.info(f"   ✅ Deck {name} of lesson {day}: {sent}/{total} photos to user {user_id} in {len(chunks)} groups")
+        return sent, total
+
+    async def send_photo(self, bot, user_id: int, day: int, item: Dict[str, Any], protect_content: bool = True) -> bool:
+        """Send one deck photo (e.g. a single card) through the same file_id cache."""
+        sent, _ = await self._send_chunks(bot, user_id, day, [[_photo(item)]], protect_content)
+        return sent > 0
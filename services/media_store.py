@@ -0,0 +1,297 @@
+"""
+Content-addressed store for the media files of the Drive content sync.
+
+Layout under DRIVE_MEDIA_DIR (data/content_media by default):
+
+  blobs/<md5[:2]>/<md5>      file bytes, stored once however many days / Drive files use them
+  blobs/index.json           Drive file id -> md5/size/modifiedTime, blob -> referencing paths
+  day_XX/<md5[:12]>/<safe name>  symlink to the blob (hard link or copy where symlinks are unavailable)
+
+The per-day paths are what lessons.json keeps in media / media_markers, so
+CourseBot keeps sending FSInputFile(path) as before. They carry the content
+version (md5 prefix): a sync never repoints a path the published lessons.json
+uses, so if the new lessons.json is rejected (validation, strict mode) the old
+one keeps serving its own bytes, and a restored backup finds its files.
+
+A sync goes through `fetch()` for every media file: if the Drive md5Checksum
+(or, without one, size + modifiedTime of the same Drive file) matches a blob
+the store already has, nothing is downloaded; bytes are only fetched for new
+content. `commit()` at the end of a sync records the reference count of every
+blob (the per-day paths pointing at it), removes per-day links the sync no
+longer produced and sweeps (mark-and-sweep) the blobs nothing references.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIR = "blobs"
+INDEX_NAME = "index.json"
+# Leftover temp files of an interrupted download are swept after this long
+TMP_GRACE_SECONDS = 3600
+# Length of the md5 prefix naming the version directory of a per-day path
+VERSION_CHARS = 12
+
+
+def file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    def __init__(self, media_root: Path):
+        self.root = Path(media_root)
+        self.blob_root = self.root / BLOBS_DIR
+        self.index_path = self.blob_root / INDEX_NAME
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._refs: Dict[str, Set[str]] = {}
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._files = dict(data.get("files") or {})
+        except FileNotFoundError:
+            self._files = {}
+        except Exception as e:
+            # The index only saves downloads; blobs are still found by md5
+            logger.warning(f"⚠️ Media store index unreadable, starting a new one: {e}")
+            self._files = {}
+
+    def blob_path(self, md5: str) -> Path:
+        return self.blob_root / md5[:2] / md5
+
+    def _known_blob(self, drive_id: str, md5: Optional[str], size: Optional[str], modified: Optional[str]) -> Optional[str]:
+        """md5 of a stored blob holding the current bytes of the Drive file, if any."""
+        if md5:
+            return md5 if self.blob_path(md5).is_file() else None
+        # No checksum from Drive: trust the last download of the same file if it did not change
+        known = self._files.get(drive_id)
+        if known and known.get("size") == size and known.get("modified") == modified:
+            if self.blob_path(known["md5"]).is_file():
+                return known["md5"]
+        return None
+
+    def _adopt(self, path: Path, md5: Optional[str]) -> Optional[str]:
+        """
+        Move a plain file left by the old per-day layout into the store if it has the expected
+        bytes; `path` becomes a link to the blob, so the published lessons.json still finds it.
+        """
+        if not md5 or path.is_symlink() or not path.is_file():
+            return None
+        try:
+            if file_md5(path) != md5:
+                return None
+            blob = self.blob_path(md5)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            if blob.exists():
+                path.unlink()
+            else:
+                os.replace(path, blob)
+            self._link(md5, path)
+            return md5
+        except OSError as e:
+            logger.warning(f"   ⚠️ Could not adopt {path} into media store: {e}")
+            return None
+
+    def _store(self, download: Callable[[Path], None], expected_md5: Optional[str]) -> str:
+        self.blob_root.mkdir(parents=True, exist_ok=True)
+        tmp = self.blob_root / f".download-{os.getpid()}-{time.monotonic_ns()}.tmp"
+        try:
+            download(tmp)
+            md5 = file_md5(tmp)
+            if expected_md5 and md5 != expected_md5:
+                raise IOError(f"checksum mismatch: Drive says {expected_md5}, downloaded {md5}")
+            blob = self.blob_path(md5)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, blob)
+            return md5
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def _link(self, md5: str, dest: Path):
+        blob = self.blob_path(md5)
+        if dest.exists() and os.path.samefile(dest, blob):
+            return
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".link")
+        if tmp.is_symlink() or tmp.exists():
+            tmp.unlink()
+        try:
+            os.symlink(os.path.relpath(blob, dest.parent), tmp)
+        except OSError:
+            try:
+                os.link(blob, tmp)
+            except OSError:
+                shutil.copy2(blob, tmp)
+        os.replace(tmp, dest)
+
+    def versioned(self, dest: Path, md5: str) -> Path:
+        """Per-day path of the content `md5` for `dest` (day_XX/<safe name>)."""
+        return dest.parent / md5[:VERSION_CHARS] / dest.name
+
+    def fetch(self, meta: Dict[str, Any], dest: Path, download: Callable[[Path], None]) -> Tuple[Path, bool]:
+        """
+        Link the bytes of the Drive file described by `meta` (id, size, modifiedTime,
+        md5Checksum) under `dest` (day_XX/<safe name>), at its versioned path.
+        `download(path)` writes the file bytes to `path` and is called only if no
+        stored blob has them. Returns the versioned path and whether the bytes were downloaded.
+        """
+        drive_id = meta.get("id") or ""
+        expected = (meta.get("md5Checksum") or "").lower() or None
+        size, modified = meta.get("size"), meta.get("modifiedTime")
+
+        md5 = self._known_blob(drive_id, expected, size, modified) or self._adopt(dest, expected)
+        downloaded = md5 is None
+        if downloaded:
+            md5 = self._store(download, expected)
+        path = self.versioned(dest, md5)
+        self._link(md5, path)
+        self._files[drive_id] = {"md5": md5, "size": size, "modified": modified}
+        self._refs.setdefault(md5, set()).add(self._rel(path))
+        return path, downloaded
+
+    def _rel(self, path: Path) -> str:
+        return str(path.relative_to(self.root)).replace("\\", "/")
+
+    def commit(self, keep: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        End of a sync: drop per-day links the sync did not produce, delete the blobs
+        nothing references (mark-and-sweep) and save the index with reference counts.
+        `keep` are further per-day paths (relative to the media root) to treat as
+        referenced, e.g. those of the lessons.json backup a restore would bring back.
+        """
+        stats = {"links_removed": 0, "blobs_removed": 0, "bytes_freed": 0}
+        blob_root = os.path.realpath(self.blob_root)
+        referenced = set().union(*self._refs.values()) if self._refs else set()
+        marked = set(self._refs)
+        for rel in keep:
+            path = self.root / rel
+            if rel in referenced or not path.exists():
+                continue
+            target = os.path.realpath(path)
+            if target.startswith(blob_root + os.sep):
+                referenced.add(rel)
+                marked.add(os.path.basename(target))
+
+        # Links into the store that this sync no longer produced (renamed / removed media)
+        for day_dir in self._day_dirs():
+            for item in sorted(day_dir.rglob("*"), reverse=True):
+                if self._rel(item) in referenced:
+                    continue
+                if item.is_symlink():
+                    stale = os.path.realpath(item).startswith(blob_root + os.sep)
+                elif item.is_dir():
+                    # Version directory whose links are all gone
+                    if not any(item.iterdir()):
+                        item.rmdir()
+                    continue
+                else:
+                    # Hard-link fallback
+                    stale = item.is_file() and item.stat().st_nlink > 1
+                if stale:
+                    item.unlink()
+                    stats["links_removed"] += 1
+
+        # Mark: blobs referenced by this sync. Sweep: everything else in blobs/
+        if self.blob_root.is_dir():
+            now = time.time()
+            for item in self.blob_root.rglob("*"):
+                if not item.is_file() or item == self.index_path:
+                    continue
+                if item.name.endswith(".tmp"):
+                    if now - item.stat().st_mtime < TMP_GRACE_SECONDS:
+                        continue
+                elif item.name in marked:
+                    continue
+                stats["bytes_freed"] += item.stat().st_size
+                item.unlink()
+                stats["blobs_removed"] += 1
+            for sub in self.blob_root.iterdir():
+                if sub.is_dir() and not any(sub.iterdir()):
+                    sub.rmdir()
+
+        self._files = {fid: info for fid, info in self._files.items() if info.get("md5") in marked}
+        self._save_index()
+        if stats["blobs_removed"] or stats["links_removed"]:
+            logger.info(
+                f"🗑️ Media store GC: {stats['blobs_removed']} blobs ({stats['bytes_freed'] / 1048576:.1f} MB), "
+                f"{stats['links_removed']} stale links removed"
+            )
+        return stats
+
+    def _save_index(self):
+        self.blob_root.mkdir(parents=True, exist_ok=True)
+        data = {
+            "files": self._files,
+            "refs": {md5: {"count": len(paths), "paths": sorted(paths)} for md5, paths in sorted(self._refs.items())},
+        }
+        tmp = self.index_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def _day_dirs(self):
+        if not self.root.is_dir():
+            return []
+        return [p for p in self.root.iterdir() if p.is_dir() and p.name.startswith("day_")]
+
+    def clear_links(self) -> int:
+        """Remove the per-day directories (links, compressed copies, old-layout files); blobs stay."""
+        removed = 0
+        for day_dir in self._day_dirs():
+            removed += sum(1 for p in day_dir.rglob("*") if p.is_file() or p.is_symlink())
+            shutil.rmtree(day_dir)
+        return removed
+
+    def usage(self) -> Dict[str, int]:
+        """
+        Disk usage: blobs and their bytes, how many of them the last committed sync
+        references, the bytes the per-day paths would take without deduplication,
+        and plain files in the day directories (old layout, compressed videos).
+        """
+        report = {
+            "blobs": 0, "blob_bytes": 0, "referenced_blobs": 0, "references": 0,
+            "logical_bytes": 0, "untracked_files": 0, "untracked_bytes": 0,
+        }
+        refs: Dict[str, Any] = {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                refs = json.load(f).get("refs") or {}
+        except Exception:
+            pass
+        if self.blob_root.is_dir():
+            for item in self.blob_root.rglob("*"):
+                if not item.is_file() or item == self.index_path or item.name.endswith(".tmp"):
+                    continue
+                size = item.stat().st_size
+                report["blobs"] += 1
+                report["blob_bytes"] += size
+                count = int((refs.get(item.name) or {}).get("count") or 0)
+                if count:
+                    report["referenced_blobs"] += 1
+                    report["references"] += count
+                    report["logical_bytes"] += size * count
+        for day_dir in self._day_dirs():
+            for item in day_dir.rglob("*"):
+                if item.is_file() and not item.is_symlink():
+                    # Hard-linked blobs are counted once, as blobs
+                    if item.stat().st_nlink > 1:
+                        continue
+                    report["untracked_files"] += 1
+                    report["untracked_bytes"] += item.stat().st_size
+        return report
@@ -0,0 +1,333 @@
+"""
+Delivery-ready variants of lesson media, prepared at content sync time.
+
+CourseBot used to resize photos (Pillow) and re-encode large videos (ffmpeg)
+while a learner was receiving a lesson, and guessed Photo/video_pic ->
+Photo/video_pic_optimized paths on every send. Instead, DriveContentSync
+runs `MediaVariants.prepare()` over every media path of the lessons it is
+about to publish:
+
+- a photo wider than MOBILE_WIDTH gets a MOBILE_WIDTH-wide JPEG;
+- a video over VIDEO_MAX_MB gets an H.264/AAC re-encode under the limit;
+- anything else is delivery-ready as it is.
+
+Layout under DRIVE_MEDIA_DIR (data/content_media by default):
+
+  variants/<md5[:2]>/<md5>.mobile.jpg   photo variant, keyed by the source bytes
+  variants/<md5[:2]>/<md5>.h264.mp4     video variant
+  variants/manifest.json                lessons.json path -> source file, its size/mtime/md5, variant
+
+Variants are keyed by the md5 of the source, so a file used by several
+lessons (or a re-synced, unchanged file) is processed once. At delivery
+`resolve()` / `delivery_path()` only read the manifest and stat files.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.media_store import file_md5
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = "variants"
+MANIFEST_NAME = "manifest.json"
+# Standard width of a photo in the Telegram mobile client
+MOBILE_WIDTH = 720
+JPEG_QUALITY = 90
+# Bot API uploads are limited to 50 MB
+VIDEO_MAX_MB = 45.0
+
+PHOTO_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+VIDEO_EXTS = {".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v"}
+
+# First a quality-preserving encode; if still too large, a smaller one capped at 720p
+_FFMPEG_PASSES = (
+    ["-c:v", "libx264", "-preset", "medium", "-crf", "28", "-maxrate", "2000k", "-bufsize", "4000k",
+     "-c:a", "aac", "-b:a", "128k"],
+    ["-c:v", "libx264", "-preset", "fast", "-crf", "32", "-maxrate", "1500k", "-bufsize", "3000k",
+     "-vf", "scale='min(1280,iw)':'min(720,ih)':force_original_aspect_ratio=decrease",
+     "-c:a", "aac", "-b:a", "96k"],
+)
+
+
+def media_kind(path: str) -> Optional[str]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PHOTO_EXTS:
+        return "photo"
+    if ext in VIDEO_EXTS:
+        return "video"
+    return None
+
+
+def media_paths(lessons: Dict[str, Any]) -> List[str]:
+    """Every photo/video path of lessons.json ("path" / "*_path" values: media, media_markers, cards, intro photos...)."""
+    found: Dict[str, None] = {}
+
+    def walk(value: Any):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if isinstance(item, str) and (key == "path" or key.endswith("_path")) and media_kind(item):
+                    found[item.replace("\\", "/")] = None
+                else:
+                    walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(lessons)
+    return list(found)
+
+
+def _source_candidates(rel: str) -> List[str]:
+    # Old content keeps both Photo/video_pic and Photo/video_pic_optimized copies; either will do
+    candidates = [rel]
+    if "/video_pic/" in f"/{rel}":
+        candidates.append(rel.replace("video_pic/", "video_pic_optimized/", 1))
+    elif "/video_pic_optimized/" in f"/{rel}":
+        candidates.append(rel.replace("video_pic_optimized/", "video_pic/", 1))
+    return candidates
+
+
+class MediaVariants:
+    def __init__(self, media_root: Path, project_root: Optional[Path] = None):
+        self.project_root = Path(project_root or Path.cwd())
+        self.root = Path(media_root) / VARIANTS_DIR
+        self.manifest_path = self.root / MANIFEST_NAME
+        self._entries: Dict[str, Dict[str, Any]] = load_manifest(self.manifest_path)
+
+    def _abs(self, rel: str) -> Path:
+        return self.project_root / rel
+
+    def _rel(self, path: Path) -> str:
+        return os.path.relpath(path, self.project_root).replace("\\", "/")
+
+    def _resolve_source(self, rel: str) -> Optional[Tuple[str, os.stat_result]]:
+        for candidate in _source_candidates(rel):
+            try:
+                st = os.stat(self._abs(candidate))
+            except OSError:
+                continue
+            return candidate, st
+        return None
+
+    def _variant_path(self, md5: str, kind: str) -> Path:
+        suffix = ".mobile.jpg" if kind == "photo" else ".h264.mp4"
+        return self.root / md5[:2] / f"{md5}{suffix}"
+
+    # --- preparation ----------------------------------------------------------
+
+    def prepare(self, paths: Iterable[str]) -> Dict[str, int]:
+        """Make sure every path has its variant (or is known to need none); saves the manifest."""
+        report = {"unchanged": 0, "created": 0, "reused": 0, "as_is": 0, "missing": 0, "failed": 0}
+        for rel in dict.fromkeys(paths):
+            outcome = self._prepare_one(rel)
+            report[outcome] += 1
+        self._save()
+        logger.info(
+            f"🖼️ Media variants: {report['created']} created, {report['reused']} reused, "
+            f"{report['unchanged']} unchanged, {report['as_is']} delivered as is, "
+            f"{report['missing']} missing, {report['failed']} failed"
+        )
+        return report
+
+    def _prepare_one(self, rel: str) -> str:
+        kind = media_kind(rel)
+        resolved = self._resolve_source(rel)
+        if kind is None or resolved is None:
+            self._entries.pop(rel, None)
+            return "missing"
+        source, st = resolved
+        old = self._entries.get(rel) or {}
+        same_source = old.get("source") == source and old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns
+        if same_source and not old.get("error"):
+            variant = old.get("variant")
+            if variant is None or self._abs(variant).exists():
+                return "unchanged"
+
+        md5 = old["md5"] if same_source and old.get("md5") else file_md5(self._abs(source))
+        entry = {"kind": kind, "source": source, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "md5": md5, "variant": None}
+        self._entries[rel] = entry
+        dest = self._variant_path(md5, kind)
+        if dest.exists():
+            entry["variant"] = self._rel(dest)
+            return "reused"
+        try:
+            make = self._make_photo if kind == "photo" else self._make_video
+            if not make(self._abs(source), dest):
+                return "as_is"
+        except Exception as e:
+            entry["error"] = str(e)[:200]
+            logger.warning(f"⚠️ Media variant for {rel} failed, the original will be sent: {e}")
+            return "failed"
+        entry["variant"] = self._rel(dest)
+        return "created"
+
+    @staticmethod
+    def _make_photo(src: Path, dest: Path) -> bool:
+        """MOBILE_WIDTH-wide JPEG of a wider photo; False if the photo is narrow enough already."""
+        from PIL import Image
+
+        with Image.open(src) as img:
+            width, height = img.size
+            if width <= MOBILE_WIDTH:
+                return False
+            new_size = (MOBILE_WIDTH, max(1, int(MOBILE_WIDTH * height / width)))
+            img = img.convert("RGBA") if img.mode in ("P", "LA") else img
+            if img.mode == "RGBA":
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            resized = img.resize(new_size, Image.Resampling.LANCZOS)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".tmp.jpg")
+        resized.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, dest)
+        logger.info(f"   📷 {src.name}: {width}x{height} -> {new_size[0]}x{new_size[1]} JPEG")
+        return True
+
+    @staticmethod
+    def _make_video(src: Path, dest: Path) -> bool:
+        """H.264 re-encode of a video over VIDEO_MAX_MB; False if it fits already."""
+        size_mb = src.stat().st_size / (1024 * 1024)
+        if size_mb <= VIDEO_MAX_MB:
+            return False
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            raise RuntimeError("ffmpeg not found")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".tmp.mp4")
+        for args in _FFMPEG_PASSES:
+            cmd = [ffmpeg, "-i", str(src), *args, "-movflags", "+faststart", "-y", str(tmp)]
+            proc = subprocess.run(cmd, capture_output=True)
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg failed: {proc.stderr.decode('utf-8', 'replace')[-300:]}")
+            out_mb = tmp.stat().st_size / (1024 * 1024)
+            logger.info(f"   📹 {src.name}: {size_mb:.1f} MB -> {out_mb:.1f} MB")
+            if out_mb <= VIDEO_MAX_MB:
+                os.replace(tmp, dest)
+                return True
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"still over {VIDEO_MAX_MB:.0f} MB after compression")
+
+    # --- manifest -------------------------------------------------------------
+
+    def _save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self._entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def commit(self, paths: Iterable[str]):
+        """After publishing: forget paths the lessons no longer use and delete variants nothing references."""
+        keep = set(paths)
+        self._entries = {rel: e for rel, e in self._entries.items() if rel in keep}
+        self._save()
+        used = {e["variant"] for e in self._entries.values() if e.get("variant")}
+        removed = 0
+        if self.root.is_dir():
+            for item in self.root.glob("*/*"):
+                if item.is_file() and self._rel(item) not in used:
+                    item.unlink()
+                    removed += 1
+        if removed:
+            logger.info(f"🗑️ Media variants: {removed} unused files deleted")
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._entries)
+
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return dict(json.load(f).get("entries") or {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"⚠️ Media variants manifest unreadable ({path}): {e}")
+        return {}
+
+
+# --- delivery ---------------------------------------------------------------
+
+_manifest_cache: Dict[str, Any] = {"path": None, "signature": None, "entries": {}}
+
+
+def _manifest_entries(media_root: Optional[Path] = None) -> Dict[str, Dict[str, Any]]:
+    """The manifest, re-read only when the sync has written a new one."""
+    if media_root is None:
+        from core.config import Config
+
+        media_root = Path.cwd() / (getattr(Config, "DRIVE_MEDIA_DIR", "") or "data/content_media")
+    path = Path(media_root) / VARIANTS_DIR / MANIFEST_NAME
+    try:
+        st = os.stat(path)
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        signature = None
+    if _manifest_cache["path"] != path or _manifest_cache["signature"] != signature:
+        entries = load_manifest(path) if signature else {}
+        # Delivery code passes either the lessons.json path or the file it found on disk
+        for rel, entry in list(entries.items()):
+            entries.setdefault(entry.get("source") or rel, entry)
+        _manifest_cache.update(path=path, signature=signature, entries=entries)
+    return _manifest_cache["entries"]
+
+
+def _key(path) -> str:
+    text = str(path).replace("\\", "/")
+    if os.path.isabs(text):
+        rel = os.path.relpath(text, Path.cwd()).replace("\\", "/")
+        if not rel.startswith("../"):
+            return rel
+    return text
+
+
+def _entry(path, media_root: Optional[Path]) -> Optional[Dict[str, Any]]:
+    entry = _manifest_entries(media_root).get(_key(path))
+    if not entry:
+        return None
+    try:
+        st = os.stat(Path.cwd() / entry["source"])
+    except OSError:
+        return None
+    if (st.st_size, st.st_mtime_ns) != (entry.get("size"), entry.get("mtime_ns")):
+        # Source changed after the last sync: send it as is until the next one
+        return None
+    return entry
+
+
+def delivery_path(path, media_root: Optional[Path] = None) -> Optional[Path]:
+    """Prepared variant to send instead of `path`, or None to send the original."""
+    entry = _entry(path, media_root)
+    if not entry or not entry.get("variant"):
+        return None
+    variant = Path.cwd() / entry["variant"]
+    return variant if variant.is_file() else None
+
+
+def content_id(path, media_root: Optional[Path] = None) -> Optional[str]:
+    """md5 of the source recorded at the last sync, if it is still unchanged on disk."""
+    entry = _entry(path, media_root)
+    return entry.get("md5") if entry else None
+
+
+def resolve(path, media_root: Optional[Path] = None) -> Optional[Path]:
+    """File to send for a lessons.json media path: its variant, the source found at sync time, or the path itself."""
+    variant = delivery_path(path, media_root)
+    if variant:
+        return variant
+    entry = _entry(path, media_root)
+    if entry:
+        return Path.cwd() / entry["source"]
+    candidate = Path(path) if os.path.isabs(str(path)) else Path.cwd() / str(path)
+    return candidate if candidate.is_file() else None
@@ -0,0 +1,164 @@
+"""
+Durable processing of YooKassa webhooks.
+
+The HTTP endpoint (run_all_bots._handle_yookassa_webhook) only validates the
+request, stores the raw event in the `payment_inbox` table and answers 200:
+YooKassa gets its acknowledgement in milliseconds no matter how slow granting
+access, the payment API or Telegram are. `PaymentInboxWorker` then processes
+the inbox in the background:
+
+- events are claimed with a time-limited lock (`locked_until`), so several
+  worker processes can share the inbox and the events of a crashed process
+  are picked up again once the lock expires;
+- processing is PaymentService.process_payment_completion, which claims the
+  payment id and grants access in one transaction (a replayed event is a no-op);
+- a failed attempt is retried with exponential backoff; after
+  MAX_ATTEMPTS the event is dead-lettered (status 'dead', kept for manual
+  replay) and logged as an error;
+- the endpoint wakes the worker via notify(); a slow poll covers events
+  inserted by other processes and due retries.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Optional
+
+from core.database import Database
+from utils.metrics import (
+    PAYMENT_INBOX_DEAD,
+    PAYMENT_INBOX_LAG_SECONDS,
+    PAYMENT_INBOX_PENDING,
+    PAYMENT_INBOX_PROCESSED,
+    PAYMENT_INBOX_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Events claimed (and processed concurrently) per round
+BATCH_SIZE = 10
+# A claimed event is re-offered to other workers if not finished within this time
+LOCK_SECONDS = 300.0
+# Fallback poll for due retries and events received by other processes
+POLL_INTERVAL_SECONDS = 5.0
+# Retry schedule: 5s, 10s, 20s, ... capped at 1h; dead-lettered after MAX_ATTEMPTS
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 3600.0
+MAX_ATTEMPTS = 12
+# Queue gauges refresh / cleanup of processed events
+STATS_INTERVAL_SECONDS = 30.0
+PURGE_INTERVAL_SECONDS = 6 * 3600.0
+PURGE_AFTER_DAYS = 30
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff before the next attempt, after `attempts` failed ones."""
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+class PaymentInboxWorker:
+    """Background processor of the payment_inbox table."""
+
+    def __init__(self, db: Database, payment_service):
+        self.db = db
+        self.payment_service = payment_service
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stats_at = 0.0
+        self._purged_at = time.monotonic()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("📥 Payment inbox worker started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """A new event was enqueued: process it now instead of at the next poll."""
+        self._wake.set()
+
+    async def run_once(self) -> int:
+        """Claim and process one batch of due events. Returns the number of events processed."""
+        batch = await self.db.claim_payment_inbox(self.owner, BATCH_SIZE, LOCK_SECONDS)
+        if batch:
+            await asyncio.gather(*(self._process(event) for event in batch))
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                if await self.run_once():
+                    continue
+                await self._housekeeping()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Payment inbox worker error: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, event: dict):
+        inbox_id, payment_id = event["inbox_id"], event["payment_id"]
+        started = time.perf_counter()
+        try:
+            result = await self.payment_service.process_payment_completion(
+                payment_id=payment_id,
+                webhook_data=json.loads(event["payload"]),
+            )
+            # None: not a succeeded payment (or not completed yet) — nothing to grant
+            if result and not result.get("already_processed"):
+                logger.info(f"✅ Webhook processed: payment_id={payment_id}, user_id={result.get('user_id')}")
+        except Exception as e:
+            attempts = event["attempts"] + 1
+            error = f"{type(e).__name__}: {e}"
+            if attempts >= MAX_ATTEMPTS:
+                logger.error(
+                    f"❌ Payment webhook dead-lettered after {attempts} attempts: "
+                    f"inbox_id={inbox_id}, payment_id={payment_id}, error={error}",
+                    exc_info=True,
+                )
+                await self.db.fail_payment_inbox(inbox_id, error, None)
+                PAYMENT_INBOX_PROCESSED.inc(result="dead")
+            else:
+                delay = retry_delay(attempts)
+                logger.warning(
+                    f"⚠️ Payment webhook failed (attempt {attempts}/{MAX_ATTEMPTS}), retry in {delay:.0f}s: "
+                    f"payment_id={payment_id}, error={error}"
+                )
+                await self.db.fail_payment_inbox(inbox_id, error, time.time() + delay)
+                PAYMENT_INBOX_PROCESSED.inc(result="retry")
+        else:
+            await self.db.complete_payment_inbox(inbox_id)
+            PAYMENT_INBOX_PROCESSED.inc(result="done")
+        finally:
+            PAYMENT_INBOX_SECONDS.observe(time.perf_counter() - started)
+
+    async def _housekeeping(self):
+        now = time.monotonic()
+        if now - self._stats_at >= STATS_INTERVAL_SECONDS:
+            self._stats_at = now
+            counts = await self.db.get_payment_inbox_counts()
+            PAYMENT_INBOX_PENDING.set(counts["pending"])
+            PAYMENT_INBOX_DEAD.set(counts["dead"])
+            oldest = counts["oldest_pending_at"]
+            PAYMENT_INBOX_LAG_SECONDS.set(max(time.time() - oldest, 0.0) if oldest else 0.0)
+        if now - self._purged_at >= PURGE_INTERVAL_SECONDS:
+            self._purged_at = now
+            purged = await self.db.purge_payment_inbox(PURGE_AFTER_DAYS)
+            if purged:
+                logger.info(f"🧹 Purged {purged} processed payment webhooks older than {PURGE_AFTER_DAYS} days")
@@ -5,6 +5,9 @@ Coordinates between payment processor and user service to grant access
 after successful payment.
 """
 
+import asyncio
+import logging
+import time
 from decimal import Decimal, InvalidOperation
 from typing import Optional, Dict, Any, Tuple
 
@@ -13,6 +16,8 @@ from core.models import Tariff
 from payment.base import PaymentProcessor, PaymentStatus
 from services.user_service import UserService
 
+logger = logging.getLogger(__name__)
+
 
 class PaymentService:
     """Service for payment processing operations."""
@@ -25,6 +30,11 @@ class PaymentService:
         Tariff.PRACTIC: 20000.0,   # Всё из Basic + Feedback + 3 онлайн интервью с разбором
     }
     
+    # Reconciliation schedule of pending payments: first check 1 min after creation,
+    # then with exponential backoff up to every 30 min
+    RECONCILE_FIRST_CHECK_SECONDS = 60.0
+    RECONCILE_MAX_DELAY_SECONDS = 1800.0
+
     def __init__(self, db: Database, payment_processor: PaymentProcessor):
         self.db = db
         self.payment_processor = payment_processor
@@ -34,11 +44,17 @@ class PaymentService:
         """Return current base price for tariff (can be overridden via DB settings)."""
         return await self.db.get_online_tariff_price(tariff, self.TARIFF_PRICES[tariff])
 
-    async def _apply_promo_to_amount(self, base_amount: float, promo_code: Optional[str]) -> Tuple[float, Optional[dict]]:
+    async def _apply_promo_to_amount(
+        self, base_amount: float, promo_code: Optional[str], *, cached: bool = False
+    ) -> Tuple[float, Optional[dict]]:
+        """Amount after the promo code; `cached` validates it on the pricing snapshot (menus only, never payments)."""
         code = (promo_code or "").strip()
         if not code:
             return float(base_amount), None
-        promo = await self.db.get_valid_promo_code(code)
+        if cached:
+            promo = await self.db.get_cached_promo_code(code)
+        else:
+            promo = await self.db.get_valid_promo_code(code)
         if not promo:
             return float(base_amount), None
 
@@ -138,27 +154,95 @@ class PaymentService:
             description=description,
             metadata=metadata
         )
+
+        # Tracked for reconciliation in case the webhook never arrives (best-effort)
+        try:
+            await self.db.add_pending_payment(
+                payment_info["payment_id"], user_id, time.time() + self.RECONCILE_FIRST_CHECK_SECONDS
+            )
+        except Exception:
+            logger.warning("   Failed to record pending payment", exc_info=True)
         
         return payment_info
     
     async def check_payment(self, payment_id: str) -> PaymentStatus:
         """Check payment status."""
         return await self.payment_processor.check_payment_status(payment_id)
+
+    async def reconcile_pending_payments(
+        self,
+        *,
+        limit: int = 100,
+        concurrency: int = 4,
+        max_age_hours: float = 24,
+    ) -> Dict[str, Any]:
+        """
+        Settle payments whose webhook never arrived.
+
+        Checks the status of up to `limit` due pending payments with the provider, at most
+        `concurrency` requests at a time, completes the paid ones (granting access exactly
+        once, see Database.complete_payment) and records the rest in one batch:
+        cancelled payments are closed, still pending ones (and failed checks) are re-checked
+        later with exponential backoff.
+
+        Returns {"checked": n, "completed": [completion results], "cancelled": n, "pending": n}.
+        """
+        due = await self.db.get_due_pending_payments(limit, max_age_hours)
+        report = {"checked": len(due), "completed": [], "cancelled": 0, "pending": 0}
+        if not due:
+            return report
+
+        semaphore = asyncio.Semaphore(max(int(concurrency), 1))
+
+        async def _check(row: dict):
+            # One failing payment must not abort the batch: it is re-checked later with backoff
+            async with semaphore:
+                try:
+                    status = await self.check_payment(row["payment_id"])
+                except Exception as e:
+                    logger.warning(f"   Status check of pending payment {row['payment_id']} failed: {e}")
+                    return row, None, None
+                result = None
+                if status == PaymentStatus.COMPLETED:
+                    try:
+                        result = await self.process_payment_completion(row["payment_id"], status=status)
+                    except Exception:
+                        logger.error(f"   Completion of paid payment {row['payment_id']} failed", exc_info=True)
+                return row, status, result
+
+        now = time.time()
+        checks = []
+        for row, status, result in await asyncio.gather(*(_check(row) for row in due)):
+            if result:
+                # Database.complete_payment closed the pending row
+                if not result.get("already_processed"):
+                    report["completed"].append(result)
+                continue
+            if status == PaymentStatus.CANCELLED:
+                report["cancelled"] += 1
+                checks.append((row["payment_id"], "cancelled", now))
+            else:
+                # Still pending, the check failed (the processor reports errors as FAILED, or it raised)
+                # or the completion failed
+                report["pending"] += 1
+                delay = min(self.RECONCILE_FIRST_CHECK_SECONDS * 2 ** row["check_count"], self.RECONCILE_MAX_DELAY_SECONDS)
+                checks.append((row["payment_id"], "pending", now + delay))
+        await self.db.update_pending_payments(checks)
+        return report
     
     async def process_payment_completion(
         self,
         payment_id: str,
-        webhook_data: Optional[Dict[str, Any]] = None
+        webhook_data: Optional[Dict[str, Any]] = None,
+        status: Optional[PaymentStatus] = None,
     ) -> Optional[Dict[str, Any]]:
         """
         Process completed payment and grant access.
         
         This should be called when payment webhook is received or
         when checking payment status shows completion.
+        `status` is a status the caller has just fetched (the status request is skipped).
         """
-        import logging
-        logger = logging.getLogger(__name__)
-        
         logger.info(f"🔄 Processing payment completion for: {payment_id}")
         
         # Get payment info from webhook or check status
@@ -166,7 +250,8 @@ class PaymentService:
             payment_data = await self.payment_processor.process_webhook(webhook_data)
         else:
             # First check if payment is completed
-            status = await self.check_payment(payment_id)
+            if status is None:
+                status = await self.check_payment(payment_id)
             logger.info(f"   Payment status check: {status.value}")
             
             if status != PaymentStatus.COMPLETED:
@@ -220,23 +305,7 @@ class PaymentService:
             logger.error(f"   Invalid tariff in payment metadata: {tariff_str}")
             return None
 
-        # Idempotency: skip if already processed (still report success)
         processed_payment_id = payment_data.get("payment_id") or payment_id
-        if processed_payment_id:
-            try:
-                if await self.db.is_payment_processed(processed_payment_id):
-                    logger.info(f"   Payment {processed_payment_id} already processed; skipping.")
-                    existing_user = await self.user_service.get_user(int(user_id))
-                    return {
-                        "user_id": user_id,
-                        "tariff": tariff.value,
-                        "user": existing_user,
-                        "is_upgrade": bool(metadata.get("is_upgrade", False)),
-                        "already_processed": True
-                    }
-            except Exception:
-                # If idempotency check fails, continue to avoid blocking access
-                logger.warning("   Failed to check payment idempotency; continuing.", exc_info=True)
 
         # Validate amount to prevent underpayment or tampered metadata
         def _to_decimal(value) -> Optional[Decimal]:
@@ -305,97 +374,86 @@ class PaymentService:
         # Grant access to user
         logger.info(f"   Granting access to user {user_id} with tariff {tariff.value}")
         # Проверяем, это апгрейд или новый доступ
-        is_upgrade = metadata.get("is_upgrade", False)
-        
-        if is_upgrade:
-            # Это апгрейд - обновляем тариф пользователя
-            user = await self.user_service.get_user(user_id)
-            if user:
-                user.tariff = tariff
-                await self.db.update_user(user)
-                logger.info(f"   ✅ User {user_id} upgraded to {tariff.value.upper()}")
-            else:
-                logger.error(f"   ❌ User {user_id} not found for upgrade")
-                return None
-        else:
-            # Это новый доступ
-            user = await self.user_service.grant_access(
-                user_id=user_id,
-                tariff=tariff,
-                referral_partner_id=referral_partner_id
-            )
-        
-        logger.info(f"   ✅ Access granted successfully to user {user_id}")
-
-        # Record sales event (best-effort; should not block granting access)
-        try:
-            from core.config import Config
+        is_upgrade = bool(metadata.get("is_upgrade", False))
+        start_date = None
+        if not is_upgrade:
+            # Это новый доступ: курс начинается завтра (см. UserService.grant_access)
+            start_date = self.user_service.access_start_date(await self.user_service.get_user(int(user_id)))
 
-            course_program = (metadata.get("course_program") or "online").strip().lower()
-            currency = (metadata.get("currency") or Config.PAYMENT_CURRENCY or "").strip().upper() or None
+        # Sales event row, written in the same transaction as the access
+        from core.config import Config
 
-            base_amount_meta = metadata.get("base_amount")
-            if base_amount_meta is None and metadata.get("is_upgrade", False):
-                base_amount_meta = metadata.get("upgrade_base_amount") or metadata.get("base_amount")
+        course_program = (metadata.get("course_program") or "online").strip().lower()
+        currency = (metadata.get("currency") or Config.PAYMENT_CURRENCY or "").strip().upper() or None
 
-            try:
-                base_amount_f = float(base_amount_meta) if base_amount_meta is not None else None
-            except Exception:
-                base_amount_f = None
+        base_amount_meta = metadata.get("base_amount")
+        if base_amount_meta is None and is_upgrade:
+            base_amount_meta = metadata.get("upgrade_base_amount") or metadata.get("base_amount")
 
-            try:
-                paid_amount_f = float(payment_data.get("amount")) if payment_data.get("amount") is not None else None
-            except Exception:
-                paid_amount_f = None
+        try:
+            base_amount_f = float(base_amount_meta) if base_amount_meta is not None else None
+        except Exception:
+            base_amount_f = None
 
-            promo_code = (metadata.get("promo_code") or "").strip() or None
-            promo_discount_type = metadata.get("promo_discount_type")
-            promo_discount_value = metadata.get("promo_discount_value")
+        try:
+            paid_amount_f = float(payment_data.get("amount")) if payment_data.get("amount") is not None else None
+        except Exception:
+            paid_amount_f = None
 
-            promo_discount_amount = None
-            if promo_code and base_amount_f is not None and paid_amount_f is not None:
-                promo_discount_amount = max(0.0, float(base_amount_f) - float(paid_amount_f))
+        promo_code = (metadata.get("promo_code") or "").strip() or None
+        promo_discount_amount = None
+        if promo_code and base_amount_f is not None and paid_amount_f is not None:
+            promo_discount_amount = max(0.0, float(base_amount_f) - float(paid_amount_f))
 
-            await self.db.record_payment_event(
-                payment_id=processed_payment_id,
+        # Claim the payment id, grant access, record the sale and use the promo code atomically:
+        # a repeated or concurrent completion of the same payment is rejected by the primary key
+        try:
+            applied = await self.db.complete_payment(
+                processed_payment_id,
                 user_id=int(user_id),
-                course_program=course_program,
                 tariff=tariff.value,
-                is_upgrade=bool(metadata.get("is_upgrade", False)),
-                base_amount=base_amount_f,
-                paid_amount=paid_amount_f,
-                currency=currency,
+                is_upgrade=is_upgrade,
+                start_date=start_date,
+                referral_partner_id=referral_partner_id,
+                event=dict(
+                    payment_id=processed_payment_id,
+                    user_id=int(user_id),
+                    course_program=course_program,
+                    tariff=tariff.value,
+                    is_upgrade=is_upgrade,
+                    base_amount=base_amount_f,
+                    paid_amount=paid_amount_f,
+                    currency=currency,
+                    promo_code=promo_code,
+                    promo_discount_type=metadata.get("promo_discount_type"),
+                    promo_discount_value=metadata.get("promo_discount_value"),
+                    promo_discount_amount=promo_discount_amount,
+                    source="payment",
+                ),
                 promo_code=promo_code,
-                promo_discount_type=promo_discount_type,
-                promo_discount_value=promo_discount_value,
-                promo_discount_amount=promo_discount_amount,
-                source="payment",
             )
-        except Exception:
-            pass
-        
-        if processed_payment_id:
-            try:
-                await self.db.try_mark_payment_processed(processed_payment_id)
-            except Exception:
-                logger.warning(
-                    f"   Failed to mark payment {processed_payment_id} as processed",
-                    exc_info=True
-                )
+        except LookupError:
+            logger.error(f"   ❌ User {user_id} not found for upgrade")
+            return None
 
-        # Mark promo code as used (best-effort) and clear user promo binding
-        promo_code = metadata.get("promo_code")
-        if promo_code:
-            try:
-                await self.db.increment_promo_code_use(str(promo_code))
-            except Exception:
-                logger.warning("   Failed to increment promo usage", exc_info=True)
-            try:
-                await self.db.clear_user_promo_code(int(user_id))
-            except Exception:
-                logger.warning("   Failed to clear user promo code", exc_info=True)
+        user = await self.user_service.get_user(int(user_id))
+        if not applied:
+            logger.info(f"   Payment {processed_payment_id} already processed; skipping.")
+            return {
+                "payment_id": processed_payment_id,
+                "user_id": user_id,
+                "tariff": tariff.value,
+                "user": user,
+                "is_upgrade": is_upgrade,
+                "already_processed": True
+            }
+
+        if is_upgrade:
+            logger.info(f"   ✅ User {user_id} upgraded to {tariff.value.upper()}")
+        logger.info(f"   ✅ Access granted successfully to user {user_id}")
 
         return {
+            "payment_id": processed_payment_id,
             "user_id": user_id,
             "tariff": tariff.value,
             "user": user,
@@ -4,12 +4,17 @@ Question service for managing user questions.
 Handles question routing, FAQ, and question tracking.
 """
 
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from html import escape
 from typing import Optional, List, Dict
 from core.database import Database
 from core.models import User
 
+# Question counters, shared by the bots' QuestionService instances: db_path -> (monotonic ts, stats)
+_STATS_CACHE: Dict[str, tuple] = {}
+_STATS_CACHE_TTL_SECONDS = 30.0
+
 
 class QuestionService:
     """Service for question management."""
@@ -41,6 +46,7 @@ class QuestionService:
         """, (user_id, lesson_id, day_number, question_text, question_voice_file_id, created_at))
         await self.db.conn.commit()
         question_id = cursor.lastrowid
+        self._invalidate_stats()
         
         return {
             "question_id": question_id,
@@ -66,80 +72,128 @@ class QuestionService:
                 return dict(row)
         return None
     
-    async def get_unanswered_questions(self, limit: int = 50) -> List[Dict]:
-        """Get list of unanswered questions."""
+    async def get_unanswered_questions(self, limit: int = 50, before_id: Optional[int] = None) -> List[Dict]:
+        """
+        Get list of unanswered questions, newest first.
+
+        Keyset pagination: pass the question_id of the last question of the previous page as
+        `before_id` (served by idx_questions_answered_created, no sort).
+        """
         await self.db._ensure_connection()
-        async with self.db.conn.execute("""
+        where, params = self._keyset("q.created_at", "created_at", before_id)
+        async with self.db.conn.execute(f"""
             SELECT q.*, u.first_name, u.last_name, u.username
             FROM questions q
             LEFT JOIN users u ON q.user_id = u.user_id
-            WHERE q.answered_at IS NULL
-            ORDER BY q.created_at DESC
+            WHERE q.answered_at IS NULL{where}
+            ORDER BY q.created_at DESC, q.question_id DESC
             LIMIT ?
-        """, (limit,)) as cursor:
+        """, (*params, limit)) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
-    async def get_all_questions(self, limit: int = 50, offset: int = 0) -> List[Dict]:
-        """Get all questions with pagination."""
+    async def get_all_questions(self, limit: int = 50, before_id: Optional[int] = None) -> List[Dict]:
+        """Get all questions, newest first, with keyset pagination (see get_unanswered_questions)."""
         await self.db._ensure_connection()
-        async with self.db.conn.execute("""
+        where, params = self._keyset("q.created_at", "created_at", before_id)
+        async with self.db.conn.execute(f"""
             SELECT q.*, u.first_name, u.last_name, u.username
             FROM questions q
             LEFT JOIN users u ON q.user_id = u.user_id
-            ORDER BY q.created_at DESC
-            LIMIT ? OFFSET ?
-        """, (limit, offset)) as cursor:
+            WHERE 1 = 1{where}
+            ORDER BY q.created_at DESC, q.question_id DESC
+            LIMIT ?
+        """, (*params, limit)) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
+
+    @staticmethod
+    def _keyset(column: str, raw_column: str, before_id: Optional[int]) -> tuple[str, tuple]:
+        """`AND (column, question_id) < (that of before_id)` for DESC keyset pages ('' for the first page)."""
+        if before_id is None:
+            return "", ()
+        return (
+            f" AND ({column}, q.question_id) < "
+            f"(SELECT {raw_column}, question_id FROM questions WHERE question_id = ?)",
+            (int(before_id),),
+        )
     
-    async def get_questions_stats(self) -> Dict:
-        """Get statistics about questions."""
+    async def get_questions_stats(self, max_age: float = _STATS_CACHE_TTL_SECONDS) -> Dict:
+        """
+        Get statistics about questions.
+
+        Cached per database for `max_age` seconds (0 = always fresh); creating or answering
+        a question in this process drops the cache immediately.
+        """
+        cached = _STATS_CACHE.get(self.db.db_path)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return dict(cached[1])
+
         await self.db._ensure_connection()
-        
-        async with self.db.conn.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN answered_at IS NULL THEN 1 ELSE 0 END) as unanswered
-            FROM questions
-        """) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return {
-                    "total": row["total"] or 0,
-                    "unanswered": row["unanswered"] or 0,
-                    "answered": (row["total"] or 0) - (row["unanswered"] or 0)
-                }
-        return {"total": 0, "unanswered": 0, "answered": 0}
+        async with self.db.conn.execute("SELECT COUNT(*) FROM questions") as cursor:
+            total = (await cursor.fetchone())[0] or 0
+        # Index range: proportional to the backlog, not to the whole table
+        async with self.db.conn.execute("SELECT COUNT(*) FROM questions WHERE answered_at IS NULL") as cursor:
+            unanswered = (await cursor.fetchone())[0] or 0
+        stats = {"total": total, "unanswered": unanswered, "answered": total - unanswered}
+        _STATS_CACHE[self.db.db_path] = (time.monotonic(), stats)
+        return dict(stats)
+
+    def _invalidate_stats(self):
+        _STATS_CACHE.pop(self.db.db_path, None)
     
     async def get_answered_questions_dates(self) -> List[str]:
         """Get list of unique dates (YYYY-MM-DD) when questions were answered, sorted descending."""
+        return [day for day, _ in await self.get_answered_questions_counts_by_date()]
+
+    async def get_answered_questions_counts_by_date(self, limit: Optional[int] = None) -> List[tuple]:
+        """[(YYYY-MM-DD, answered count)] newest first, from one scan of idx_questions_answered_at."""
         await self.db._ensure_connection()
+        # answered_at is an ISO string: its first 10 chars are the date (same as DATE())
         async with self.db.conn.execute("""
-            SELECT DISTINCT DATE(answered_at) as answer_date
+            SELECT substr(answered_at, 1, 10) AS answer_date, COUNT(*) AS cnt
             FROM questions
             WHERE answered_at IS NOT NULL
+            GROUP BY answer_date
             ORDER BY answer_date DESC
-        """) as cursor:
+            LIMIT ?
+        """, (-1 if limit is None else int(limit),)) as cursor:
             rows = await cursor.fetchall()
-            dates = []
-            for row in rows:
-                if row["answer_date"]:
-                    # SQLite DATE() возвращает строку в формате YYYY-MM-DD
-                    dates.append(row["answer_date"])
-            return dates
+            return [(row["answer_date"], row["cnt"]) for row in rows if row["answer_date"]]
     
-    async def get_answered_questions_by_date(self, date_str: str) -> List[Dict]:
-        """Get answered questions for a specific date (YYYY-MM-DD format)."""
+    async def count_answered_questions_on_date(self, date_str: str) -> int:
+        """Questions answered on one date (YYYY-MM-DD): a range count on idx_questions_answered_at."""
         await self.db._ensure_connection()
-        # Используем DATE() для сравнения, так как answered_at хранится в ISO формате
-        async with self.db.conn.execute("""
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+        next_day = (day + timedelta(days=1)).strftime("%Y-%m-%d")
+        async with self.db.conn.execute(
+            "SELECT COUNT(*) FROM questions WHERE answered_at >= ? AND answered_at < ?",
+            (date_str, next_day),
+        ) as cursor:
+            row = await cursor.fetchone()
+            return int(row[0] or 0)
+
+    async def get_answered_questions_by_date(
+        self, date_str: str, limit: Optional[int] = None, before_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Get answered questions for a specific date (YYYY-MM-DD format), latest answers first.
+
+        Half-open range on answered_at instead of DATE(answered_at) = ?, so the index is used;
+        keyset pagination by `before_id` like get_unanswered_questions.
+        """
+        await self.db._ensure_connection()
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+        next_day = (day + timedelta(days=1)).strftime("%Y-%m-%d")
+        where, params = self._keyset("q.answered_at", "answered_at", before_id)
+        async with self.db.conn.execute(f"""
             SELECT q.*, u.first_name, u.last_name, u.username
             FROM questions q
             LEFT JOIN users u ON q.user_id = u.user_id
-            WHERE DATE(q.answered_at) = ?
-            ORDER BY q.answered_at DESC
-        """, (date_str,)) as cursor:
+            WHERE q.answered_at >= ? AND q.answered_at < ?{where}
+            ORDER BY q.answered_at DESC, q.question_id DESC
+            LIMIT ?
+        """, (date_str, next_day, *params, -1 if limit is None else int(limit))) as cursor:
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
     
@@ -160,6 +214,7 @@ class QuestionService:
             WHERE question_id = ?
         """, (answered_at, answer_text, answer_voice_file_id, answered_by_user_id, question_id))
         await self.db.conn.commit()
+        self._invalidate_stats()
         return True
     
     async def update_pup_message_id(self, question_id: int, pup_message_id: int) -> bool:
@@ -69,22 +69,7 @@ class UserService:
         # Only grant access if user doesn't already have it
         if not user.has_access():
             user.tariff = tariff
-            # Set start_date to tomorrow at user's lesson_delivery_time_local or LESSON_DELIVERY_TIME_LOCAL
-            # in configured timezone (default: Europe/Moscow), stored as naive UTC datetime for backwards compatibility.
-            now_utc = datetime.now(timezone.utc)
-            tz = get_schedule_timezone()
-            now_local = now_utc.astimezone(tz)
-            tomorrow_local_date = (now_local + timedelta(days=1)).date()
-            # Use user's custom time if set, otherwise use config default
-            delivery_time_str = getattr(user, "lesson_delivery_time_local", None) or Config.LESSON_DELIVERY_TIME_LOCAL
-            # Parse "HH:MM" (fallback to 08:30)
-            try:
-                hh, mm = (delivery_time_str or "").strip().split(":", 1)
-                delivery_t = time(hour=int(hh), minute=int(mm))
-            except Exception:
-                delivery_t = time(8, 30)
-            start_local = datetime.combine(tomorrow_local_date, delivery_t, tzinfo=tz)
-            user.start_date = start_local.astimezone(timezone.utc).replace(tzinfo=None)
+            user.start_date = self.access_start_date(user)
             user.current_day = 0  # Lesson 0 will be sent immediately
             user.referral_partner_id = referral_partner_id
             
@@ -96,6 +81,28 @@ class UserService:
         
         return user
     
+    @staticmethod
+    def access_start_date(user: Optional[User]) -> datetime:
+        """
+        Start of the course for access granted now: tomorrow at the user's lesson_delivery_time_local
+        (or LESSON_DELIVERY_TIME_LOCAL) in the configured timezone (default: Europe/Moscow),
+        as naive UTC datetime for backwards compatibility.
+        """
+        now_utc = datetime.now(timezone.utc)
+        tz = get_schedule_timezone()
+        now_local = now_utc.astimezone(tz)
+        tomorrow_local_date = (now_local + timedelta(days=1)).date()
+        # Use user's custom time if set, otherwise use config default
+        delivery_time_str = getattr(user, "lesson_delivery_time_local", None) or Config.LESSON_DELIVERY_TIME_LOCAL
+        # Parse "HH:MM" (fallback to 08:30)
+        try:
+            hh, mm = (delivery_time_str or "").strip().split(":", 1)
+            delivery_t = time(hour=int(hh), minute=int(mm))
+        except Exception:
+            delivery_t = time(8, 30)
+        start_local = datetime.combine(tomorrow_local_date, delivery_t, tzinfo=tz)
+        return start_local.astimezone(timezone.utc).replace(tzinfo=None)
+
     async def update_user_day(self, user_id: int, day_number: int):
         """Update user's current lesson day."""
         user = await self.db.get_user(user_id)
@@ -13,7 +13,9 @@ from typing import Callable
 from core.database import Database
 from core.models import User
 from core.config import Config
+from core.cluster import get_membership
 from utils.schedule_timezone import get_schedule_timezone, format_tz
+from utils.metrics import SCHEDULER_DUE, SCHEDULER_SENT, SCHEDULER_TICK_SECONDS, SCHEDULER_USERS
 
 logger = logging.getLogger(__name__)
 
@@ -57,10 +59,11 @@ class MentorReminderScheduler:
             pass
         
         while self.running:
-            try:
-                await self._check_and_send_reminders()
-            except Exception as e:
-                logger.error(f"Error in mentor reminder scheduler: {e}", exc_info=True)
+            with SCHEDULER_TICK_SECONDS.time(scheduler="mentor_reminders"):
+                try:
+                    await self._check_and_send_reminders()
+                except Exception as e:
+                    logger.error(f"Error in mentor reminder scheduler: {e}", exc_info=True)
             
             await asyncio.sleep(check_interval_seconds)
     
@@ -71,7 +74,11 @@ class MentorReminderScheduler:
     
     async def _check_and_send_reminders(self):
         """Проверяет всех пользователей и отправляет напоминания тем, кому нужно."""
-        users = await self.db.get_users_with_access()
+        # In multi-process mode each worker only handles users of the shards it owns
+        membership = get_membership()
+        users = await self.db.get_users_with_access(
+            shards=membership.owned_shards, shard_count=membership.worker_count
+        )
         now_utc = datetime.now(timezone.utc)
 
         # Prepare timezone + daily window (local time)
@@ -246,6 +253,9 @@ class MentorReminderScheduler:
                 errors += 1
                 logger.error(f"Error processing mentor reminder for user {user.user_id}: {e}", exc_info=True)
         
+        SCHEDULER_USERS.inc(len(users), scheduler="mentor_reminders")
+        SCHEDULER_DUE.inc(len(users_ready_for_reminder), scheduler="mentor_reminders")
+
         # Batch check assignment activity for all users at once (optimization)
         if users_to_check_activity:
             try:
@@ -276,6 +286,7 @@ class MentorReminderScheduler:
                 )
                 await self.reminder_callback(user)
                 sent += 1
+                SCHEDULER_SENT.inc(scheduler="mentor_reminders")
                 
             except Exception as e:
                 errors += 1
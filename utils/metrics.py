@@ -0,0 +1,299 @@
+"""
+In-process metrics with a Prometheus text exposition (served at /metrics by run_all_bots).
+
+Everything here is a cheap in-memory counter/histogram updated on the hot
+path; rendering /metrics never touches the database. Kept dependency-free
+(no prometheus_client, no aiogram at import time) so run_all_bots can import
+it before the bot modules are loaded.
+
+In multi-process mode every worker keeps its own numbers; the supervisor
+forwards /metrics to the first live worker.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# Seconds; tuned for Telegram handlers / API calls (ms..tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # Drive sync etc. run in executor threads
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        row = self._values.get(self._key(labels))
+        return sum(row[:-1]) if row else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            cumulative += row[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {row[-1]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# --- Metrics of this app ----------------------------------------------------
+
+HANDLER_SECONDS = histogram("bot_handler_seconds", "aiogram handler latency", ("bot", "handler"))
+HANDLER_ERRORS = counter("bot_handler_errors_total", "Handlers that raised", ("bot", "handler"))
+
+TELEGRAM_REQUESTS = counter("telegram_api_requests_total", "Telegram Bot API calls", ("bot", "method"))
+TELEGRAM_ERRORS = counter("telegram_api_errors_total", "Failed Telegram Bot API calls", ("bot", "method", "error"))
+TELEGRAM_SECONDS = histogram("telegram_api_seconds", "Telegram Bot API call latency", ("bot", "method"))
+TELEGRAM_RETRY_AFTER = counter("telegram_api_retry_after_total", "RetryAfter (flood control) responses", ("bot", "method"))
+TELEGRAM_RETRY_AFTER_SECONDS = counter(
+    "telegram_api_retry_after_seconds_total", "Seconds Telegram asked us to wait", ("bot", "method")
+)
+
+DB_QUERY_SECONDS = histogram(
+    "db_query_seconds", "SQLite statement latency", ("statement",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+SCHEDULER_TICK_SECONDS = histogram(
+    "scheduler_tick_seconds", "Duration of one scheduler pass", ("scheduler",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+SCHEDULER_USERS = counter("scheduler_users_checked_total", "Users examined by scheduler passes", ("scheduler",))
+SCHEDULER_DUE = counter("scheduler_due_total", "Users found due (lesson / reminder)", ("scheduler",))
+SCHEDULER_SENT = counter("scheduler_sent_total", "Lessons / reminders actually sent", ("scheduler",))
+
+DRIVE_SYNC_SECONDS = histogram(
+    "drive_sync_seconds", "Google Drive content sync duration", ("result",),
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+
+PAYMENT_INBOX_RECEIVED = counter(
+    "payment_inbox_received_total", "Payment webhooks received", ("result",)  # queued | duplicate | rejected
+)
+PAYMENT_INBOX_PROCESSED = counter(
+    "payment_inbox_processed_total", "Payment inbox processing attempts", ("result",)  # done | retry | dead
+)
+PAYMENT_INBOX_SECONDS = histogram("payment_inbox_process_seconds", "Processing time of one inbox event")
+PAYMENT_INBOX_PENDING = gauge("payment_inbox_pending", "Payment inbox events waiting to be processed")
+PAYMENT_INBOX_DEAD = gauge("payment_inbox_dead", "Dead-lettered payment inbox events")
+PAYMENT_INBOX_LAG_SECONDS = gauge("payment_inbox_lag_seconds", "Age of the oldest due pending event")
+
+LOOP_LAG_SECONDS = histogram(
+    "event_loop_lag_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+LOOP_LAG_LAST = gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+_STARTED_AT = time.time()
+_UPTIME = gauge("process_uptime_seconds", "Seconds since the process started")
+
+
+def render() -> str:
+    _UPTIME.set(time.time() - _STARTED_AT)
+    return REGISTRY.render()
+
+
+# --- Instrumentation helpers -----------------------------------------------
+
+_SQL_TARGET = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE|INDEX)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """Low-cardinality label for a SQL statement: 'SELECT users', 'INSERT assignments', ..."""
+    text = " ".join(sql.split())
+    if not text:
+        return "empty"
+    verb = text.split(" ", 1)[0].upper()
+    if verb == "PRAGMA":
+        parts = text.split(" ")
+        return f"PRAGMA {parts[1].split('=')[0]}" if len(parts) > 1 else "PRAGMA"
+    match = _SQL_TARGET.search(text)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Measure how late a periodic sleep wakes up: a direct view of event loop blocking."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - expected, 0.0)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG_LAST.set(lag)
+        if lag > 1.0:
+            logger.warning(f"⚠️ Event loop was blocked for {lag:.2f}s")
+
+
+def instrument_bot(bot_name: str, bot, dp):
+    """Attach handler latency and Telegram API call metrics to a bot and its Dispatcher."""
+    from aiogram.exceptions import TelegramRetryAfter
+
+    async def handler_middleware(handler, event, data):
+        handler_obj = data.get("handler")
+        callback = getattr(handler_obj, "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(bot=bot_name, handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, bot=bot_name, handler=name)
+
+    for observer_name, observer in dp.observers.items():
+        if observer_name not in ("update", "error"):
+            observer.middleware(handler_middleware)
+
+    async def request_middleware(make_request, bot_, method):
+        method_name = type(method).__name__
+        TELEGRAM_REQUESTS.inc(bot=bot_name, method=method_name)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot_, method)
+        except TelegramRetryAfter as e:
+            TELEGRAM_RETRY_AFTER.inc(bot=bot_name, method=method_name)
+            TELEGRAM_RETRY_AFTER_SECONDS.inc(float(e.retry_after or 0), bot=bot_name, method=method_name)
+            TELEGRAM_ERRORS.inc(bot=bot_name, method=method_name, error="TelegramRetryAfter")
+            raise
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(bot=bot_name, method=method_name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, bot=bot_name, method=method_name)
+
+    bot.session.middleware(request_middleware)
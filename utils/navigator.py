@@ -2,7 +2,7 @@
 Навигатор курса - создание меню для перехода между уроками
 """
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import Dict, Any
+from typing import Any, Dict, List, Optional, Tuple
 
 # Названия уроков для навигатора
 LESSON_NAMES = {
@@ -40,63 +40,55 @@ LESSON_NAMES = {
 }
 
 
-def create_navigator_keyboard(available_lessons: Dict[int, Dict[str, Any]], current_day: int = None) -> InlineKeyboardMarkup:
-    """
-    Создает клавиатуру навигатора курса.
-    
-    Args:
-        available_lessons: Словарь с доступными уроками {day: lesson_data}
-        current_day: Текущий день пользователя (для выделения)
-    
-    Returns:
-        InlineKeyboardMarkup с кнопками навигатора
-    """
+def _short_name(day: int, lesson_data: Dict[str, Any]) -> str:
+    """Название урока для кнопки навигатора."""
+    # Получаем название урока из LESSON_NAMES или из данных урока
+    short_name = LESSON_NAMES.get(day)
+    if not short_name:
+        # Если нет в LESSON_NAMES, берем из данных урока
+        title = lesson_data.get("title", f"День {day}")
+        # Упрощаем название для кнопки (убираем "День X - ")
+        if title.startswith(f"День {day}"):
+            short_name = title.replace(f"День {day} - ", "").replace(f"День {day}", "").strip()
+        else:
+            short_name = title
+
+    # Обрезаем длинные названия для кнопки (максимум 35 символов для 2 кнопок в ряд)
+    if len(short_name) > 35:
+        short_name = short_name[:32] + "..."
+    return short_name
+
+
+def _lesson_entries(lessons: Dict[str, Dict[str, Any]]) -> List[Tuple[int, str]]:
+    """(день, название для кнопки) уроков, отсортированные по номеру дня."""
+    sorted_days = sorted([int(k) for k in lessons.keys() if k.isdigit()])
+    return [(day, _short_name(day, lessons[str(day)])) for day in sorted_days if lessons.get(str(day))]
+
+
+def _build_keyboard(entries: List[Tuple[int, str]], current_day: Optional[int]) -> InlineKeyboardMarkup:
     buttons = []
     row = []
-    
-    # Сортируем уроки по номеру дня
-    sorted_days = sorted([int(k) for k in available_lessons.keys() if k.isdigit()])
-    
-    for day in sorted_days:
-        lesson_data = available_lessons.get(str(day))
-        if not lesson_data:
-            continue
-        
-        # Получаем название урока из LESSON_NAMES или из данных урока
-        short_name = LESSON_NAMES.get(day)
-        if not short_name:
-            # Если нет в LESSON_NAMES, берем из данных урока
-            title = lesson_data.get("title", f"День {day}")
-            # Упрощаем название для кнопки (убираем "День X - ")
-            if title.startswith(f"День {day}"):
-                short_name = title.replace(f"День {day} - ", "").replace(f"День {day}", "").strip()
-            else:
-                short_name = title
-        
-        # Обрезаем длинные названия для кнопки (максимум 35 символов для 2 кнопок в ряд)
-        if len(short_name) > 35:
-            short_name = short_name[:32] + "..."
-        
+    for day, short_name in entries:
         # Добавляем эмодзи для текущего урока
         if current_day is not None and day == current_day:
             button_text = f"📍 {day}. {short_name}"
         else:
             button_text = f"{day}. {short_name}"
-        
+
         row.append(InlineKeyboardButton(
             text=button_text,
             callback_data=f"navigator:lesson:{day}"
         ))
-        
+
         # По 2 кнопки в ряд (так как названия могут быть длинными)
         if len(row) == 2:
             buttons.append(row)
             row = []
-    
+
     # Добавляем оставшиеся кнопки
     if row:
         buttons.append(row)
-    
+
     # Добавляем кнопку "Закрыть" в конце
     buttons.append([
         InlineKeyboardButton(
@@ -104,10 +96,59 @@ def create_navigator_keyboard(available_lessons: Dict[int, Dict[str, Any]], curr
             callback_data="navigator:close"
         )
     ])
-    
+
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def create_navigator_keyboard(available_lessons: Dict[int, Dict[str, Any]], current_day: int = None) -> InlineKeyboardMarkup:
+    """
+    Создает клавиатуру навигатора курса.
+    
+    Args:
+        available_lessons: Словарь с доступными уроками {day: lesson_data}
+        current_day: Текущий день пользователя (для выделения)
+    
+    Returns:
+        InlineKeyboardMarkup с кнопками навигатора
+    """
+    return _build_keyboard(_lesson_entries(available_lessons), current_day)
+
+
+class NavigatorKeyboards:
+    """
+    Готовые клавиатуры навигатора по текущему дню пользователя.
+
+    Навигатор показывает уроки от 0 до current_day, поэтому клавиатура зависит
+    только от версии уроков и current_day. Версия — сам словарь уроков:
+    LessonLoader при перезагрузке подменяет его целиком, и тогда все
+    клавиатуры строятся заново (сразу для каждого дня курса).
+    """
+
+    def __init__(self):
+        self._lessons: Optional[Dict[str, Any]] = None
+        self._entries: List[Tuple[int, str]] = []
+        self._keyboards: Dict[int, InlineKeyboardMarkup] = {}
+
+    def _rebuild(self, all_lessons: Dict[str, Any]):
+        entries = _lesson_entries(all_lessons)
+        self._keyboards = {
+            day: _build_keyboard([e for e in entries if e[0] <= day], day) for day, _ in entries
+        }
+        self._entries = entries
+        self._lessons = all_lessons
+
+    def get(self, all_lessons: Dict[str, Any], current_day: int) -> InlineKeyboardMarkup:
+        """Клавиатура с уроками 0..current_day (уже доставленными), текущий отмечен 📍."""
+        if all_lessons is not self._lessons:
+            self._rebuild(all_lessons)
+        keyboard = self._keyboards.get(current_day)
+        if keyboard is None:
+            # День вне курса (например, после последнего урока)
+            keyboard = _build_keyboard([e for e in self._entries if e[0] <= current_day], current_day)
+            self._keyboards[current_day] = keyboard
+        return keyboard
+
+
 def format_navigator_message() -> str:
     """Форматирует текст сообщения для навигатора."""
     return (
@@ -12,8 +12,10 @@ from typing import List
 from core.database import Database
 from core.models import User
 from core.config import Config
+from core.cluster import get_membership
 from services.lesson_service import LessonService
 from services.user_service import UserService
+from utils.metrics import SCHEDULER_DUE, SCHEDULER_SENT, SCHEDULER_TICK_SECONDS, SCHEDULER_USERS
 
 
 class LessonScheduler:
@@ -52,10 +54,11 @@ class LessonScheduler:
         logger = logging.getLogger(__name__)
         logger.info(f"📚 Lesson Scheduler started (check interval: {check_interval_seconds}s)")
         while self.running:
-            try:
-                await self._check_and_deliver_lessons()
-            except Exception as e:
-                logger.error(f"Error in lesson scheduler: {e}", exc_info=True)
+            with SCHEDULER_TICK_SECONDS.time(scheduler="lessons"):
+                try:
+                    await self._check_and_deliver_lessons()
+                except Exception as e:
+                    logger.error(f"Error in lesson scheduler: {e}", exc_info=True)
             
             await asyncio.sleep(check_interval_seconds)
     
@@ -71,8 +74,13 @@ class LessonScheduler:
         # Avoid re-instantiating LessonLoader on every tick. Reuse the one created in LessonService if available.
         lesson_loader = getattr(self.lesson_service, "lesson_loader", None)
         
-        users = await self.db.get_users_with_access()
+        # In multi-process mode each worker only handles users of the shards it owns
+        membership = get_membership()
+        users = await self.db.get_users_with_access(
+            shards=membership.owned_shards, shard_count=membership.worker_count
+        )
         logger.debug(f"Checking {len(users)} users with access")
+        SCHEDULER_USERS.inc(len(users), scheduler="lessons")
         
         delivered_count = 0
         skipped_count = 0
@@ -104,6 +112,7 @@ class LessonScheduler:
                 # Check if lesson should be sent
                 if await self.lesson_service.should_send_lesson(user):
                     lesson = await self.lesson_service.get_user_current_lesson(user)
+                    SCHEDULER_DUE.inc(scheduler="lessons")
                     
                     if lesson:
                         logger.info(f"User {user.user_id}: Delivering lesson for day {user.current_day}")
@@ -116,6 +125,7 @@ class LessonScheduler:
                         )
                         await self.lesson_service.advance_user_to_next_day(user)
                         delivered_count += 1
+                        SCHEDULER_SENT.inc(scheduler="lessons")
                         logger.info(f"User {user.user_id}: Lesson delivered and advanced to day {user.current_day + 1}")
                     else:
                         logger.warning(f"User {user.user_id}: should_send_lesson returned True but no lesson found for day {user.current_day}")
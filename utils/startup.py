@@ -0,0 +1,68 @@
+"""
+Startup stages with timing instrumentation.
+
+run_all_bots boots in ordered stages (HTTP server first, then the heavy bot
+imports, then bot construction...). Each stage is timed and logged, and a
+summary with the time-to-ready is printed once all bots are started:
+
+    timeline = StartupTimeline()
+    with timeline.stage("http"):
+        ...
+    timeline.log_summary()
+
+The origin is the interpreter start when available (so module imports of
+run_all_bots itself are included), otherwise the creation of the timeline.
+See scripts/bench_startup.py for the import-time / time-to-ready benchmark.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _process_start_monotonic() -> Optional[float]:
+    """Monotonic timestamp of the process start (Linux only), None if unknown."""
+    try:
+        with open(f"/proc/{os.getpid()}/stat", "rb") as f:
+            # Field 22 = starttime in clock ticks since boot; the comm field (2) may contain spaces
+            fields = f.read().rsplit(b")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        started_ago = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(started_ago, 0.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimeline:
+    """Ordered, timed startup stages."""
+
+    def __init__(self):
+        self.origin = _process_start_monotonic() or time.monotonic()
+        self.stages: list[tuple[str, float]] = []
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.origin) * 1000
+
+    def mark(self, name: str, duration_ms: float = 0.0):
+        """Record an instant event (or a stage timed elsewhere)."""
+        self.stages.append((name, duration_ms))
+        logger.info(f"⏱️ [{self.elapsed_ms():7.0f} ms] {name}" + (f" ({duration_ms:.0f} ms)" if duration_ms else ""))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.mark(name, (time.monotonic() - started) * 1000)
+
+    def log_summary(self, title: str = "ready"):
+        slowest = sorted(self.stages, key=lambda item: item[1], reverse=True)[:3]
+        details = ", ".join(f"{name}={ms:.0f}ms" for name, ms in slowest if ms)
+        logger.info(f"⏱️ Startup {title} in {self.elapsed_ms():.0f} ms" + (f" (slowest: {details})" if details else ""))
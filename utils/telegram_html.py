@@ -0,0 +1,164 @@
+"""
+Telegram HTML sanitizer.
+
+Telegram HTML is a strict subset: editors type tags directly in Google Docs,
+and a single unknown tag or stray "<" makes Telegram reject the whole message
+("can't parse entities"). `sanitize()` keeps only the tags Telegram supports
+and escapes everything else.
+
+Used by the Drive content sync for every lesson / task / master document on
+every sync, and by CourseBot to repair a message Telegram refused to parse,
+so it is cheap to call repeatedly:
+
+- the parser class is defined once (not per call);
+- text with no "<" and no "&" has nothing to sanitize and is returned as is;
+- results are kept in an LRU cache keyed by a hash of the text, so unchanged
+  lessons are not parsed again on the next sync.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+# Allowed tags (Telegram HTML): b/strong, i/em, u/ins, s/strike/del, code, pre,
+# a (href only), tg-spoiler, blockquote, span class="tg-spoiler"
+ALLOWED_TAGS = frozenset({
+    "b", "strong",
+    "i", "em",
+    "u", "ins",
+    "s", "strike", "del",
+    "code", "pre",
+    "a",
+    "tg-spoiler",
+    "blockquote",
+    "span",
+})
+# Closing tags are written in their short form
+_END_TAG_ALIASES = {"strong": "b", "em": "i", "ins": "u", "strike": "s"}
+
+# If someone typed "1 < 2" it could be interpreted as a tag start; best-effort fix:
+# escape any remaining "<" that doesn't look like a tag start.
+_STRAY_LT_RE = re.compile(r"<(?!/?(?:b|strong|i|em|u|ins|s|strike|del|code|pre|a|tg-spoiler|blockquote|span)\b)")
+
+CACHE_MAX_ENTRIES = 4096
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.out: List[str] = []
+        self.warnings: List[str] = []
+
+    def handle_data(self, data: str) -> None:
+        # Сохраняем данные как есть (включая пробелы, отступы, эмодзи)
+        self.out.append(data)
+
+    def handle_entityref(self, name: str) -> None:
+        self.out.append(f"&{name};")
+
+    def handle_charref(self, name: str) -> None:
+        self.out.append(f"&#{name};")
+
+    @staticmethod
+    def _attr(attrs: List[Tuple[str, Optional[str]]], name: str) -> str:
+        for k, v in attrs:
+            if (k or "").lower() == name and v:
+                return v
+        return ""
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        tag_l = (tag or "").lower()
+        if tag_l not in ALLOWED_TAGS:
+            self.warnings.append(f"removed tag <{tag}>")
+            self.out.append(html.escape(f"<{tag}>"))
+            return
+
+        if tag_l == "a":
+            href = self._attr(attrs, "href")
+            if not href:
+                self.warnings.append("a tag without href removed")
+                self.out.append(html.escape("<a>"))
+                return
+            safe_href = href.replace("\"", "&quot;")
+            self.out.append(f"<a href=\"{safe_href}\">")
+            return
+
+        if tag_l == "span":
+            # allow only spoiler span
+            if self._attr(attrs, "class") != "tg-spoiler":
+                self.warnings.append("span tag without class=tg-spoiler removed")
+                self.out.append(html.escape("<span>"))
+                return
+            self.out.append("<span class=\"tg-spoiler\">")
+            return
+
+        # other allowed tags with no attrs
+        self.out.append(f"<{tag_l}>")
+
+    def handle_endtag(self, tag: str) -> None:
+        tag_l = (tag or "").lower()
+        if tag_l not in ALLOWED_TAGS:
+            self.out.append(html.escape(f"</{tag}>"))
+            return
+        self.out.append(f"</{_END_TAG_ALIASES.get(tag_l, tag_l)}>")
+
+
+def _sanitize(text: str) -> Tuple[str, List[str]]:
+    parser = _Sanitizer()
+    try:
+        parser.feed(text)
+        parser.close()
+    except Exception as e:
+        # If parsing fails, escape everything to avoid Telegram parse errors
+        return html.escape(text), [f"html parse error: {e}"]
+    return _STRAY_LT_RE.sub("&lt;", "".join(parser.out)), parser.warnings
+
+
+_cache: "OrderedDict[bytes, Tuple[str, Tuple[str, ...]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "fast_path": 0}
+
+
+def sanitize(text: str) -> Tuple[str, List[str]]:
+    """
+    (sanitized text, warnings). Keeps all other formatting (spaces, indents,
+    punctuation, emoji) untouched.
+    """
+    text = text or ""
+    if "<" not in text and "&" not in text:
+        # No tags and no entity references: the parser would return the text unchanged
+        _stats["fast_path"] += 1
+        return text, []
+
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return cached[0], list(cached[1])
+    sanitized, warnings = _sanitize(text)
+    with _cache_lock:
+        _stats["misses"] += 1
+        _cache[key] = (sanitized, tuple(warnings))
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return sanitized, list(warnings)
+
+
+def cache_info() -> Dict[str, int]:
+    with _cache_lock:
+        return dict(_stats, entries=len(_cache))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        for key in _stats:
+            _stats[key] = 0
@@ -0,0 +1,261 @@
+"""
+Webhook-mode update intake for the Telegram bots.
+
+By default every bot runs its own `dp.start_polling` loop. When
+TELEGRAM_UPDATE_MODE=webhook, run_all_bots mounts one secret-path route per bot
+on the aiohttp server that already serves /health and /payment/webhook, and the
+incoming updates are fed straight into the bot's Dispatcher.
+
+The aiohttp router is frozen as soon as the server starts (which happens before
+the bots are initialized, so healthchecks pass early). That's why a single
+parametrized route is installed up front and bots register themselves later
+via `WebhookIntake.serve()`.
+
+Also contains a tiny fake-update injector, so the intake can be exercised
+locally without Telegram (see scripts/inject_fake_update.py).
+"""
+
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+from core.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Path of the single route; {secret} is a per-bot value derived from the bot token.
+WEBHOOK_ROUTE = "/telegram/{bot_name}/{secret}"
+# Telegram sends this header when secret_token was passed to setWebhook.
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# How long stop() lets updates already being handled finish before cancelling them
+DRAIN_TIMEOUT_SECONDS = 15.0
+
+
+def is_webhook_mode() -> bool:
+    """Return True if bots should receive updates via webhook instead of polling."""
+    return (Config.TELEGRAM_UPDATE_MODE or "").strip().lower() == "webhook"
+
+
+def webhook_secret_for(bot_name: str, token: str) -> str:
+    """
+    Stable per-bot secret used both as the URL path segment and as Telegram's secret_token.
+
+    Derived from the bot token (already a secret) and optional TELEGRAM_WEBHOOK_SECRET,
+    so it survives restarts and is identical in every worker process.
+    Result only contains [0-9a-f], which Telegram accepts for secret_token.
+    """
+    material = f"{Config.TELEGRAM_WEBHOOK_SECRET}:{bot_name}:{token}".encode("utf-8")
+    return hashlib.sha256(material).hexdigest()[:48]
+
+
+def webhook_path_for(bot_name: str, token: str) -> str:
+    return WEBHOOK_ROUTE.format(bot_name=bot_name, secret=webhook_secret_for(bot_name, token))
+
+
+@dataclass
+class _BotEndpoint:
+    name: str
+    dp: Any
+    bot: Any
+    secret: str
+
+
+class WebhookIntake:
+    """Routes webhook POSTs to the registered Dispatcher of each bot."""
+
+    def __init__(self, base_url: Optional[str] = None, *, register_webhook: bool = True):
+        self.base_url = (base_url if base_url is not None else Config.TELEGRAM_WEBHOOK_BASE_URL or "").strip().rstrip("/")
+        # In multi-process mode only one worker calls setWebhook (the others just serve)
+        self.register_webhook = register_webhook
+        self._endpoints: dict[str, _BotEndpoint] = {}
+        # bot name -> tasks handling its updates
+        self._tasks: dict[str, set[asyncio.Task]] = {}
+        self._closing = False
+        self._stop_event = asyncio.Event()
+
+    def install(self, app: web.Application):
+        """Mount the webhook route. Must be called before the app runner is set up."""
+        app.router.add_post(WEBHOOK_ROUTE, self._handle_update)
+        app["webhook_intake"] = self
+
+    async def serve(self, bot_name: str, dp, bot, *, drop_pending_updates: bool = True):
+        """
+        Webhook counterpart of `dp.start_polling(bot)`.
+
+        Registers the bot, points Telegram at our URL and blocks until `stop()` is called
+        (or the task is cancelled), emitting the Dispatcher startup/shutdown events. The
+        shutdown event is emitted once the bot's updates in flight are handled.
+        """
+        secret = webhook_secret_for(bot_name, bot.token)
+        self._endpoints[bot_name] = _BotEndpoint(name=bot_name, dp=dp, bot=bot, secret=secret)
+        path = webhook_path_for(bot_name, bot.token)
+
+        if self.base_url and self.register_webhook:
+            await bot.set_webhook(
+                url=f"{self.base_url}{path}",
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=drop_pending_updates,
+            )
+            logger.info(f"🪝 Webhook set for {bot_name} bot: {self.base_url}/telegram/{bot_name}/***")
+        elif not self.base_url:
+            # Local mode: nothing tells Telegram about us, updates only come from the injector.
+            logger.warning(
+                f"⚠️ TELEGRAM_WEBHOOK_BASE_URL is empty: {bot_name} bot accepts only locally injected updates"
+            )
+
+        await dp.emit_startup(bot=bot)
+        try:
+            await self._stop_event.wait()
+        finally:
+            self._endpoints.pop(bot_name, None)
+            await self.drain(bot_name=bot_name)
+            await dp.emit_shutdown(bot=bot)
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT_SECONDS, bot_name: Optional[str] = None):
+        """Wait for the updates being handled (of one bot or all) to finish; cancel those still running after `timeout`."""
+        tasks = [task for name, running in self._tasks.items() if bot_name in (None, name) for task in running]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"⚠️ {len(pending)} webhook updates still running after {timeout:.0f}s, cancelling them")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT_SECONDS):
+        """Stop accepting updates, let those in flight finish (up to `timeout`), then release every `serve()` call."""
+        self._closing = True
+        await self.drain(timeout)
+        self._stop_event.set()
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        bot_name = request.match_info.get("bot_name", "")
+        endpoint = self._endpoints.get(bot_name)
+        if endpoint is None or self._closing:
+            # Bot not ready yet, unknown or shutting down: 503 makes Telegram retry later
+            return web.Response(status=503, text="Bot not ready")
+
+        if not hmac.compare_digest(request.match_info.get("secret", ""), endpoint.secret):
+            return web.Response(status=404)
+        header_secret = request.headers.get(SECRET_HEADER)
+        if header_secret is not None and not hmac.compare_digest(header_secret, endpoint.secret):
+            return web.Response(status=401)
+
+        try:
+            update = await request.json()
+        except Exception:
+            return web.Response(status=400, text="Invalid JSON")
+        if not isinstance(update, dict):
+            return web.Response(status=400, text="Invalid update")
+
+        # Answer Telegram immediately; handlers may take seconds (media uploads etc.)
+        task = asyncio.create_task(self._feed(endpoint, update))
+        running = self._tasks.setdefault(bot_name, set())
+        running.add(task)
+        task.add_done_callback(running.discard)
+        return web.Response(text="OK")
+
+    @staticmethod
+    async def _feed(endpoint: _BotEndpoint, update: dict):
+        try:
+            await endpoint.dp.feed_raw_update(endpoint.bot, update)
+        except Exception as e:
+            logger.error(
+                f"❌ Error handling webhook update {update.get('update_id')} for {endpoint.name} bot: {e}",
+                exc_info=True,
+            )
+
+
+# --- Fake update injector (local testing) ----------------------------------
+
+_fake_update_ids = itertools.count(int(time.time()))
+
+
+def fake_user(user_id: int, first_name: str = "Test", username: Optional[str] = None) -> dict:
+    user = {"id": int(user_id), "is_bot": False, "first_name": first_name}
+    if username:
+        user["username"] = username
+    return user
+
+
+def fake_message_update(chat_id: int, text: str, *, user_id: Optional[int] = None,
+                        message_id: int = 1, first_name: str = "Test") -> dict:
+    """Build a minimal, valid private-chat text message update."""
+    uid = int(user_id if user_id is not None else chat_id)
+    message = {
+        "message_id": int(message_id),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id), "type": "private", "first_name": first_name},
+        "from": fake_user(uid, first_name),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": next(_fake_update_ids), "message": message}
+
+
+def fake_callback_update(chat_id: int, data: str, *, user_id: Optional[int] = None,
+                         message_id: int = 1, first_name: str = "Test") -> dict:
+    """Build a minimal, valid callback_query update (button press on a bot message)."""
+    uid = int(user_id if user_id is not None else chat_id)
+    return {
+        "update_id": next(_fake_update_ids),
+        "callback_query": {
+            "id": str(next(_fake_update_ids)),
+            "from": fake_user(uid, first_name),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": int(message_id),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private", "first_name": first_name},
+                "text": "…",
+            },
+        },
+    }
+
+
+class FakeTelegramInjector:
+    """
+    Posts fake updates to a running webhook intake, exactly like Telegram would.
+
+    Usage:
+        async with FakeTelegramInjector("http://127.0.0.1:8080") as tg:
+            status = await tg.send("course", fake_message_update(123, "/start"))
+    """
+
+    def __init__(self, server_url: str, tokens: Optional[dict[str, str]] = None):
+        self.server_url = server_url.rstrip("/")
+        self.tokens = tokens or {
+            "sales": Config.SALES_BOT_TOKEN,
+            "course": Config.COURSE_BOT_TOKEN,
+            "admin": Config.ADMIN_BOT_TOKEN,
+        }
+        self._session: Optional[ClientSession] = None
+
+    async def __aenter__(self):
+        self._session = ClientSession(timeout=ClientTimeout(total=10))
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._session:
+            await self._session.close()
+        self._session = None
+
+    async def send(self, bot_name: str, update: dict) -> int:
+        """Send one update; returns the HTTP status returned by the intake."""
+        token = self.tokens.get(bot_name) or ""
+        secret = webhook_secret_for(bot_name, token)
+        url = f"{self.server_url}{webhook_path_for(bot_name, token)}"
+        async with self._session.post(url, json=update, headers={SECRET_HEADER: secret}) as resp:
+            return resp.status